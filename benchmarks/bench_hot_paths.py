@@ -0,0 +1,305 @@
+"""
+Microbenchmarks for the CellPyAbility analysis hot paths.
+
+Times dose ranges, well parsing and plate building, the GDA pivot/normalize path, the synergy
+Bliss computation, curve fitting on easy and pathological curves, and CSV/plot writing, at a
+realistic scale (one plate) and at 100x scale (100 plates, or 100x larger inputs). Results are saved as JSON
+and compared against a stored baseline; a benchmark whose median time grows beyond the
+threshold is reported as a regression and the script exits with status 1.
+
+Usage:
+    python benchmarks/bench_hot_paths.py                       # realistic scale vs baseline
+    python benchmarks/bench_hot_paths.py --scale all --output results.json
+    python benchmarks/bench_hot_paths.py --save-baseline       # refresh benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / 'src'))
+
+from cellpyability import plate
+from cellpyability import toolbox as tb
+from cellpyability.experiment import combine_plate_counts
+from cellpyability.gda_analysis import GDAExperiment
+from cellpyability.synergy_analysis import SynergyExperiment
+
+TEST_DATA_DIR = REPO_DIR / 'tests' / 'data'
+BASELINE_FILE = Path(__file__).resolve().parent / 'baseline.json'
+SCALES = {'realistic': 1, '100x': 100}
+DEFAULT_THRESHOLD = 1.5
+
+# Registered benchmarks: name -> setup(scale) returning the callable to time
+BENCHMARKS = {}
+
+# Scratch directory for the writing benchmarks, removed at exit
+_work_dir = tempfile.TemporaryDirectory(prefix='cpa_bench_')
+
+
+def _output_dir(name):
+    output_dir = Path(_work_dir.name) / name
+    output_dir.mkdir(exist_ok=True)
+    return output_dir
+
+
+def benchmark(name):
+    """Register a benchmark setup function under name."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _gda(counts, output_dir=None):
+    return GDAExperiment('bench', 'Cell Line A', 'Cell Line B', 0.000001, 3, counts=counts, output_dir=output_dir)
+
+
+def _synergy(counts, output_dir=None):
+    return SynergyExperiment('bench', 'Drug X', 0.0004, 4, 'Drug Y', 0.0001, 4, counts=counts, output_dir=output_dir)
+
+
+@benchmark('gen_dose_range')
+def setup_gen_dose_range(scale):
+    n_doses = 9 * scale
+    return lambda: tb.gen_dose_range(0.000001, 1.1, n_doses)
+
+
+@benchmark('parse_wells')
+def setup_parse_wells(scale):
+    file_names = pd.Series(pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')['FileName_images'].tolist() * scale)
+    return lambda: plate.parse_wells(file_names)
+
+
+@benchmark('plate_from_counts')
+def setup_plate_from_counts(scale):
+    # One plate, or a multi-plate experiment of scale plates
+    counts = combine_plate_counts([pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')] * scale)
+    return lambda: plate.Plate.from_counts(counts)
+
+
+@benchmark('read_counts_csv')
+def setup_read_counts(scale):
+    counts_file = TEST_DATA_DIR / 'test_gda_counts.csv'
+    return lambda: [pd.read_csv(counts_file) for _ in range(scale)]
+
+
+@benchmark('gda_pivot_normalize')
+def setup_gda_pivot(scale):
+    counts = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+
+    def run():
+        for _ in range(scale):
+            experiment = _gda(counts)
+            experiment.stats
+            experiment.viability_matrix
+    return run
+
+
+@benchmark('synergy_bliss')
+def setup_synergy_bliss(scale):
+    counts = pd.read_csv(TEST_DATA_DIR / 'test_synergy_counts.csv')
+
+    def run():
+        for _ in range(scale):
+            experiment = _synergy(counts)
+            experiment.stats
+            experiment.bliss_matrix
+    return run
+
+
+def _curve(model, rng):
+    x = tb.gen_dose_range(0.000001, 3, 9)
+    if model == 'easy':
+        y = tb.hill(x, 1.0, 1e-8, 1.2)
+    else:
+        # Flat, noisy response: 5PL and Hill both struggle to converge
+        y = 1.0 + rng.normal(0, 0.05, x.size)
+    return x, y
+
+
+@benchmark('fit_easy')
+def setup_fit_easy(scale):
+    rng = np.random.default_rng(0)
+    curves = [_curve('easy', rng) for _ in range(scale)]
+    return lambda: [tb.fit_response_curve(x, y, 'easy') for x, y in curves]
+
+
+@benchmark('fit_pathological')
+def setup_fit_pathological(scale):
+    rng = np.random.default_rng(0)
+    curves = [_curve('pathological', rng) for _ in range(scale)]
+    return lambda: [tb.fit_response_curve(x, y, 'pathological') for x, y in curves]
+
+
+@benchmark('gda_write_csv')
+def setup_gda_csv(scale):
+    counts = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+    experiments = [_gda(counts) for _ in range(scale)]
+    for experiment in experiments:
+        experiment.stats, experiment.viability_matrix
+    output_dir = _output_dir('gda_write_csv')
+
+    def run():
+        for index, experiment in enumerate(experiments):
+            experiment.stats.to_csv(output_dir / f'{index}_Stats.csv')
+            experiment.viability_matrix.to_csv(output_dir / f'{index}_ViabilityMatrix.csv')
+    return run
+
+
+@benchmark('gda_write_png')
+def setup_gda_png(scale):
+    counts = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+    experiments = [_gda(counts) for _ in range(scale)]
+    for experiment in experiments:
+        experiment.fits, experiment.ic50_ratio
+    output_dir = _output_dir('gda_write_png')
+    return lambda: [experiment.plot(output_dir / f'{index}_plot.png') for index, experiment in enumerate(experiments)]
+
+
+@benchmark('synergy_write_html')
+def setup_synergy_html(scale):
+    counts = pd.read_csv(TEST_DATA_DIR / 'test_synergy_counts.csv')
+    experiments = [_synergy(counts) for _ in range(scale)]
+    for experiment in experiments:
+        experiment.bliss_matrix
+    output_dir = _output_dir('synergy_write_html')
+    return lambda: [experiment.figure().write_html(output_dir / f'{index}_plot.html')
+                    for index, experiment in enumerate(experiments)]
+
+
+def time_benchmark(setup, scale, repeat):
+    """Time one benchmark; returns statistics of repeat timed runs after one warm-up run."""
+    func = setup(scale)
+    func()  # warm-up: imports, caches, first-figure overhead
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'max_s': max(times),
+        'repeat': repeat,
+    }
+
+
+def run_benchmarks(scales=('realistic',), names=None, repeat=5):
+    """
+    Run the selected benchmarks.
+
+    Returns:
+    --------
+    report : dict
+        Metadata and {'<name>@<scale>': timing statistics} results, ready to save as JSON
+    """
+    results = {}
+    for scale_name in scales:
+        for name, setup in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            key = f'{name}@{scale_name}'
+            results[key] = time_benchmark(setup, SCALES[scale_name], repeat)
+            print(f'{key:<32} median {results[key]["median_s"] * 1000:10.3f} ms')
+
+    return {
+        'metadata': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare median times against a baseline report.
+
+    Returns:
+    --------
+    df_compare : pandas.DataFrame
+        One row per benchmark present in both reports, with the time ratio
+    regressions : list of str
+        Benchmarks whose ratio exceeds threshold
+    """
+    rows = []
+    for key, timing in report['results'].items():
+        if key not in baseline.get('results', {}):
+            continue
+        base = baseline['results'][key]['median_s']
+        ratio = timing['median_s'] / base if base > 0 else float('inf')
+        rows.append({'benchmark': key, 'baseline_ms': base * 1000, 'current_ms': timing['median_s'] * 1000,
+                     'ratio': ratio, 'regression': ratio > threshold})
+    df_compare = pd.DataFrame(rows, columns=['benchmark', 'baseline_ms', 'current_ms', 'ratio', 'regression'])
+    return df_compare, df_compare.loc[df_compare['regression'], 'benchmark'].tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CellPyAbility hot path microbenchmarks')
+    parser.add_argument('--scale', choices=[*SCALES, 'all'], default='realistic',
+                        help='Input scale: realistic (one plate), 100x, or all (default: realistic)')
+    parser.add_argument('--bench', nargs='*', choices=list(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per benchmark (default: 5)')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=str(BASELINE_FILE),
+                        help='Baseline JSON to compare against (default: benchmarks/baseline.json)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Median time ratio counted as a regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results to the baseline file')
+    args = parser.parse_args(argv)
+
+    # Keep the console to benchmark output; the log file still records everything
+    warnings.simplefilter('ignore')  # fit warnings on pathological curves are expected
+    for handler in tb.logger.handlers:
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+            handler.setLevel(logging.WARNING)
+
+    scales = list(SCALES) if args.scale == 'all' else [args.scale]
+    report = run_benchmarks(scales, args.bench, args.repeat)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f'Results saved to {args.output}')
+    if args.save_baseline:
+        baseline = json.loads(Path(args.baseline).read_text()) if Path(args.baseline).exists() else {'results': {}}
+        baseline['metadata'] = report['metadata']
+        baseline['results'].update(report['results'])
+        Path(args.baseline).write_text(json.dumps(baseline, indent=2))
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    if not Path(args.baseline).exists():
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return 0
+    df_compare, regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.threshold)
+    print()
+    print(df_compare.to_string(index=False, float_format=lambda value: f'{value:.3f}'))
+    if regressions:
+        print(f'\n{len(regressions)} regressions (> {args.threshold}x baseline): {", ".join(regressions)}')
+        return 1
+    print(f'\nNo regressions (threshold {args.threshold}x baseline)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,6 +6,17 @@ via nuclei counting. It provides three modules:
 - GDA: dose-response analysis of two cell lines with one drug gradient
 - synergy: dose-response and synergy analysis with two drug gradients
 - simple: raw nuclei count matrix in 96-well format
+
+Each module also offers a lazy, in-memory Experiment class (GDAExperiment,
+SynergyExperiment, SimpleExperiment) that returns results without writing files,
+and the async_analysis module provides asyncio variants of each module.
+
+The kinetic module follows a live-cell GDA plate over time with growth rate (GR)
+metrics per timepoint. The plate_qc module scores the assay quality of many plates at once.
+The screen module fits an IC50 per compound from plate-mapped 96- or 384-well screening plates.
+The batch module runs many experiments from a config.csv file concurrently.
+The storage module reads images from and writes outputs to object stores (s3:// URLs), and the cache
+module stages plates from network shares on local disk before counting.
 """
 
 __version__ = "0.1.0"
@@ -14,8 +25,23 @@ __email__ = "james.elia@yale.edu"
 
 # Import analysis modules for programmatic access
 from . import toolbox
+from . import plate
+from . import plate_qc
+from . import screen
+from . import storage
+from . import cache
+from . import experiment
 from . import gda_analysis
 from . import synergy_analysis
 from . import simple_analysis
+from . import batch
+from . import async_analysis
+from .gda_analysis import GDAExperiment, GDAResult
+from .synergy_analysis import SynergyExperiment, SynergyResult
+from .simple_analysis import SimpleExperiment, SimpleResult
+from .screen import ScreenExperiment, ScreenResult
+from .plate import Plate
 
-__all__ = ['toolbox', 'gda_analysis', 'synergy_analysis', 'simple_analysis']
+__all__ = ['toolbox', 'plate', 'plate_qc', 'screen', 'storage', 'cache', 'experiment', 'gda_analysis', 'synergy_analysis', 'simple_analysis', 'batch', 'async_analysis',
+           'GDAExperiment', 'GDAResult', 'SynergyExperiment', 'SynergyResult', 'SimpleExperiment', 'SimpleResult',
+           'ScreenExperiment', 'ScreenResult', 'Plate']
@@ -0,0 +1,249 @@
+"""
+Accounting module records the resources used by every CellProfiler run, for capacity planning.
+
+Each run is reaped with os.wait4, which returns the child's own CPU time, peak RSS and block
+I/O (on Windows, where wait4 does not exist, only wall time and the exit code are recorded).
+One JSON line per run, with the number and total size of the images it counted, is appended
+to cellprofiler_runs.jsonl in the output directory. usage_report() gathers these records from
+any number of output directories and summarizes images per CPU-second and memory per image.
+"""
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+# Run records are appended to this file in the output base directory
+USAGE_FILE = 'cellprofiler_runs.jsonl'
+
+# Files counted as images in the image directory
+IMAGE_SUFFIXES = {'.tif', '.tiff', '.png', '.jpg', '.jpeg', '.bmp', '.gif', '.flex', '.c01', '.dib'}
+
+MB = 1024 * 1024
+BLOCK_BYTES = 512  # ru_inblock/ru_oublock count 512-byte blocks
+
+
+@dataclass
+class ProcessUsage:
+    """
+    Resources used by one child process.
+
+    Attributes:
+    -----------
+    returncode : int
+        Exit code (negative signal number if killed by a signal)
+    wall_seconds : float
+        Time from start to exit
+    user_cpu_seconds, system_cpu_seconds : float or None
+        CPU time of the process and its reaped descendants
+    peak_rss_mb : float or None
+        Peak resident memory of the largest of those processes
+    read_bytes, write_bytes : int or None
+        Block I/O (reads and writes that reached the disk, not the page cache)
+    """
+    returncode: int
+    wall_seconds: float
+    user_cpu_seconds: float = None
+    system_cpu_seconds: float = None
+    peak_rss_mb: float = None
+    read_bytes: int = None
+    write_bytes: int = None
+
+    @property
+    def cpu_seconds(self):
+        """User plus system CPU time, or None if unknown."""
+        if self.user_cpu_seconds is None:
+            return None
+        return self.user_cpu_seconds + self.system_cpu_seconds
+
+
+class AccountedProcess:
+    """
+    Child process whose resource usage is collected when it is reaped.
+
+    wait() blocks, so asyncio callers run it in a thread; terminate() and kill() are safe
+    to call from another thread while wait() is in progress.
+    """
+
+    def __init__(self, command, env=None):
+        self.start = time.perf_counter()
+        self.process = subprocess.Popen(command, env=env)
+        self.pid = self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def terminate(self):
+        self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+    def wait(self):
+        """Wait for the process to exit and return its ProcessUsage."""
+        if not hasattr(os, 'wait4'):
+            returncode = self.process.wait()
+            return ProcessUsage(returncode, round(time.perf_counter() - self.start, 3))
+
+        _, status, rusage = os.wait4(self.pid, 0)
+        wall_seconds = time.perf_counter() - self.start
+        # Negative signal number if killed by a signal, like Popen.returncode
+        if os.WIFSIGNALED(status):
+            self.process.returncode = -os.WTERMSIG(status)
+        else:
+            self.process.returncode = os.WEXITSTATUS(status)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        rss_scale = 1 if sys.platform == 'darwin' else 1024
+        return ProcessUsage(
+            returncode=self.process.returncode,
+            wall_seconds=round(wall_seconds, 3),
+            user_cpu_seconds=round(rusage.ru_utime, 3),
+            system_cpu_seconds=round(rusage.ru_stime, 3),
+            peak_rss_mb=round(rusage.ru_maxrss * rss_scale / MB, 1),
+            read_bytes=rusage.ru_inblock * BLOCK_BYTES,
+            write_bytes=rusage.ru_oublock * BLOCK_BYTES,
+        )
+
+
+def run_accounted(command, env=None):
+    """
+    Run command to completion like subprocess.run, returning its ProcessUsage.
+
+    If the caller is interrupted (e.g., Ctrl+C), the child is killed before the exception propagates.
+    """
+    child = AccountedProcess(command, env=env)
+    try:
+        return child.wait()
+    except BaseException:
+        if child.returncode is None:
+            child.kill()
+            child.process.wait()
+        raise
+
+
+def image_stats(image_dir):
+    """
+    Count the images CellProfiler will read from image_dir (recursively).
+
+    Returns:
+    --------
+    n_images : int
+    total_bytes : int
+    """
+    n_images, total_bytes = 0, 0
+    for root, _, files in os.walk(image_dir):
+        for name in files:
+            if Path(name).suffix.lower() in IMAGE_SUFFIXES:
+                n_images += 1
+                total_bytes += os.path.getsize(os.path.join(root, name))
+    return n_images, total_bytes
+
+
+def record_run(output_base, image_dir, usage):
+    """
+    Append the record of one CellProfiler run to <output_base>/cellprofiler_runs.jsonl.
+
+    Returns:
+    --------
+    record : dict
+        time, host, pid, image_dir, n_images, image_bytes and the ProcessUsage fields
+    """
+    n_images, image_bytes = image_stats(image_dir)
+    record = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'image_dir': str(Path(image_dir).resolve()),
+        'n_images': n_images,
+        'image_bytes': image_bytes,
+        **asdict(usage),
+    }
+    # One short O_APPEND write per record, so concurrent runs never interleave within a line
+    line = (json.dumps(record) + '\n').encode()
+    fd = os.open(Path(output_base) / USAGE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+    cpu = f'{usage.cpu_seconds:.1f} CPU s' if usage.cpu_seconds is not None else 'CPU time unavailable'
+    logger.info(f'CellProfiler run used {usage.wall_seconds:.1f} s wall, {cpu}, '
+                f'{usage.peak_rss_mb} MB peak RSS for {n_images} images ({image_bytes / MB:.1f} MB)')
+    return record
+
+
+def read_runs(paths):
+    """
+    Read run records from usage files, or from every usage file below directories.
+
+    Returns:
+    --------
+    df_runs : pandas.DataFrame
+        One row per CellProfiler run
+    """
+    records = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.rglob(USAGE_FILE)) if path.is_dir() else [path]
+        for usage_file in files:
+            with open(usage_file) as f:
+                records += [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records)
+
+
+def usage_report(df_runs):
+    """
+    Summarize CellProfiler runs for capacity planning.
+
+    Returns:
+    --------
+    summary : dict
+        runs, images, image_mb, wall_seconds, cpu_seconds, images_per_cpu_second,
+        mean and max peak RSS per image (MB), and max peak RSS of a run (MB)
+    """
+    if df_runs.empty:
+        return {'runs': 0}
+    accounted = df_runs.dropna(subset=['user_cpu_seconds'])
+    cpu_seconds = float((accounted['user_cpu_seconds'] + accounted['system_cpu_seconds']).sum())
+    images = int(df_runs['n_images'].sum())
+    with_images = accounted[accounted['n_images'] > 0]
+    rss_per_image = with_images['peak_rss_mb'] / with_images['n_images']
+    return {
+        'runs': len(df_runs),
+        'failed_runs': int((df_runs['returncode'] != 0).sum()),
+        'images': images,
+        'image_mb': round(df_runs['image_bytes'].sum() / MB, 1),
+        'wall_seconds': round(float(df_runs['wall_seconds'].sum()), 1),
+        'cpu_seconds': round(cpu_seconds, 1),
+        'images_per_cpu_second': round(int(accounted['n_images'].sum()) / cpu_seconds, 3) if cpu_seconds > 0 else None,
+        'mean_rss_mb_per_image': round(float(rss_per_image.mean()), 2) if len(rss_per_image) else None,
+        'max_rss_mb_per_image': round(float(rss_per_image.max()), 2) if len(rss_per_image) else None,
+        'max_rss_mb': float(accounted['peak_rss_mb'].max()) if len(accounted) else None,
+        'read_mb': round(accounted['read_bytes'].sum() / MB, 1) if len(accounted) else None,
+        'write_mb': round(accounted['write_bytes'].sum() / MB, 1) if len(accounted) else None,
+    }
+
+
+def format_report(df_runs):
+    """Format the per-run records and their summary for the console."""
+    if df_runs.empty:
+        return 'No CellProfiler runs recorded.'
+    columns = ['time', 'image_dir', 'n_images', 'returncode', 'wall_seconds', 'user_cpu_seconds',
+               'system_cpu_seconds', 'peak_rss_mb']
+    runs = df_runs[columns].assign(image_dir=df_runs['image_dir'].map(lambda p: Path(p).name))
+    summary = usage_report(df_runs)
+    width = max(len(key) for key in summary)
+    lines = [runs.to_string(index=False), ''] + [f'{key:<{width}}  {value}' for key, value in summary.items()]
+    return '\n'.join(lines)
@@ -0,0 +1,241 @@
+"""
+Async analysis module offers asyncio variants of run_gda, run_synergy and run_simple for
+embedding CellPyAbility in an event loop (e.g., a lab automation controller).
+
+CellProfiler is awaited in a helper thread, so counting never blocks the loop. The thread
+reaps the process with os.wait4 to record its resource usage, which asyncio's own subprocess
+reaping would discard; that costs one thread per running CellProfiler process, bounded by the
+scheduler's slots (queued plates hold no thread). The CPU-bound analysis (normalization, curve
+fitting, file writing) runs in an executor.
+Many plates can be awaited together with asyncio.gather. Cancelling a run, or exceeding
+its timeout, terminates its CellProfiler process and releases its scheduler slot.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+from pathlib import Path
+
+from . import toolbox as tb
+from . import accounting, cache, ingest, scheduler, storage
+from .experiment import combine_plate_counts
+from .gda_analysis import GDAExperiment
+from .synergy_analysis import SynergyExperiment
+from .simple_analysis import SimpleExperiment
+
+# Initialize toolbox
+logger = tb.logger
+
+# Seconds a cancelled CellProfiler process gets to exit before it is killed
+TERMINATE_GRACE = 10.0
+
+
+async def _to_thread(func, *args, **kwargs):
+    """Run func in the default executor with this task's context, like asyncio.to_thread (Python 3.9+)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+
+
+def _raise_on_exit(func, *args, **kwargs):
+    """Call a toolbox function, turning its exit(1) on bad input into an exception."""
+    try:
+        return func(*args, **kwargs)
+    except SystemExit:
+        raise RuntimeError(f'{func.__name__} failed; see cellpyability.log for details') from None
+
+
+async def _acquire_slot(sched, label):
+    """Wait for a CellProfiler slot without blocking the event loop."""
+    queued_since = None
+    last_reason = None
+    loop = asyncio.get_running_loop()
+    while True:
+        index, reason = sched.try_acquire(label, queued_since)
+        if index is not None:
+            return index
+        if queued_since is None:
+            queued_since = loop.time()
+        if reason != last_reason:
+            logger.info(f'Queued CellProfiler run {label}: {reason}')
+            last_reason = reason
+        await asyncio.sleep(sched.poll_interval)
+
+
+async def _stop_process(process, waiting):
+    """Terminate a CellProfiler process, killing it if it does not exit in time."""
+    if process.returncode is None:
+        process.terminate()
+    try:
+        await asyncio.wait_for(asyncio.shield(waiting), TERMINATE_GRACE)
+    except asyncio.TimeoutError:
+        process.kill()
+        await waiting
+
+
+async def _count_local_copy(local_plate, output_dir):
+    """
+    Count the local copy of a plate that a context manager yields (image cache or download),
+    entering and leaving it in a helper thread. Returns None if no copy was made.
+    """
+    stack = contextlib.ExitStack()
+    entering = asyncio.ensure_future(_to_thread(stack.enter_context, local_plate))
+    try:
+        local_dir = await asyncio.shield(entering)
+    except BaseException:
+        # Cancelled while copying: the copy finishes in its thread and is then released
+        entering.add_done_callback(lambda _: stack.close())
+        raise
+    try:
+        if local_dir is None:
+            return None
+        return await run_cellprofiler_async(local_dir, output_dir=output_dir)
+    finally:
+        await asyncio.shield(_to_thread(stack.close))
+
+
+async def run_cellprofiler_async(image_dir, counts_file=None, output_dir=None):
+    """
+    Asyncio variant of toolbox.run_cellprofiler.
+
+    Parameters and return values are the same. Raises RuntimeError where run_cellprofiler
+    would exit, so a bad plate does not stop the event loop.
+    """
+    if counts_file is not None:
+        return await _to_thread(_raise_on_exit, tb.run_cellprofiler, image_dir, counts_file=counts_file)
+
+    # As in run_cellprofiler, plates are counted from the image cache or downloaded from an object store
+    image_cache = cache.get_cache()
+    if image_cache.enabled and not image_cache.contains(image_dir):
+        counts = await _count_local_copy(image_cache.staged(image_dir), output_dir)
+        if counts is not None:
+            return counts
+    if storage.is_url(image_dir):
+        return await _count_local_copy(storage.fetched(image_dir), output_dir)
+
+    if ingest.is_plate_container(image_dir):
+        # Chunked runs over a plate container are counted in a helper thread (not cancellable mid-run)
+        return await _to_thread(_raise_on_exit, tb.run_cellprofiler, image_dir, output_dir=output_dir)
+
+    cp_command, cp_output_dir = await _to_thread(_raise_on_exit, tb.cellprofiler_command, image_dir, output_dir)
+
+    sched = scheduler.get_scheduler()
+    label = Path(image_dir).resolve().name
+    index = await _acquire_slot(sched, label)
+    try:
+        logger.debug('Starting CellProfiler as a subprocess ...')
+        process = accounting.AccountedProcess(cp_command, env=sched.process_env())
+        waiting = asyncio.ensure_future(_to_thread(process.wait))
+        try:
+            usage = await asyncio.shield(waiting)
+        except BaseException:
+            logger.warning(f'CellProfiler run {label} cancelled; stopping process {process.pid}')
+            await asyncio.shield(_stop_process(process, waiting))
+            tb.remove_scratch(cp_output_dir / 'CellPyAbilityImage.csv')
+            raise
+    finally:
+        sched.release(index)
+    logger.info('CellProfiler nuclei counting complete.')
+    await _to_thread(accounting.record_run, cp_output_dir.parent.parent, image_dir, usage)
+
+    return await _to_thread(_raise_on_exit, tb.load_cellprofiler_output, cp_output_dir)
+
+
+def _analyze(experiment, save, plot):
+    """Run the analysis stages of an experiment (in an executor) and return its result."""
+    if not save:
+        result = experiment.result
+        cp_csvs = experiment.cp_csv if isinstance(experiment.cp_csv, list) else [experiment.cp_csv]
+        for cp_csv in cp_csvs:
+            if cp_csv is not None:
+                tb.remove_scratch(cp_csv)  # counts are in memory; nothing else needs the file
+        return result
+    if plot is None:
+        return experiment.save()
+    return experiment.save(plot=plot)
+
+
+async def _run_experiment(experiment, image_dir, counts_file, output_dir, save, plot, executor):
+    if isinstance(image_dir, (list, tuple)) and counts_file is None:
+        # One replicate plate per directory, counted concurrently
+        results = await asyncio.gather(*[run_cellprofiler_async(plate_dir, output_dir=output_dir) for plate_dir in image_dir])
+        experiment.set_counts(combine_plate_counts([df_cp for df_cp, _ in results]), [cp_csv for _, cp_csv in results])
+    else:
+        df_cp, cp_csv = await run_cellprofiler_async(image_dir, counts_file=counts_file, output_dir=output_dir)
+        experiment.set_counts(df_cp, cp_csv)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_analyze, experiment, save, plot))
+
+
+async def _with_timeout(coroutine, timeout):
+    if timeout is None:
+        return await coroutine
+    return await asyncio.wait_for(coroutine, timeout)
+
+
+async def run_gda_async(title_name, upper_name, lower_name, top_conc, dilution, image_dir, counts_file=None,
+                        output_dir=None, save=True, plot=True, timeout=None, executor=None):
+    """
+    Asyncio variant of gda_analysis.run_gda. Plots are saved but never displayed.
+
+    Parameters:
+    -----------
+    title_name, upper_name, lower_name, top_conc, dilution, image_dir, counts_file, output_dir :
+        See gda_analysis.run_gda
+    save : bool
+        Whether to write the output files (default: True). If False, results are only returned.
+    plot : bool
+        Whether to save the plot when saving (default: True)
+    timeout : float, optional
+        Seconds before the run is cancelled and asyncio.TimeoutError is raised
+    executor : concurrent.futures.Executor, optional
+        Executor for the analysis stage. If None, uses the event loop's default thread pool.
+
+    Returns:
+    --------
+    result : GDAResult
+    """
+    experiment = GDAExperiment(title_name, upper_name, lower_name, top_conc, dilution,
+                               image_dir=image_dir, counts_file=counts_file, output_dir=output_dir)
+    return await _with_timeout(_run_experiment(experiment, image_dir, counts_file, output_dir, save, plot, executor), timeout)
+
+
+async def run_synergy_async(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution, image_dir,
+                            counts_file=None, output_dir=None, save=True, plot=True, timeout=None, executor=None):
+    """
+    Asyncio variant of synergy_analysis.run_synergy. Plots are saved but never displayed.
+
+    Parameters:
+    -----------
+    title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution, image_dir, counts_file, output_dir :
+        See synergy_analysis.run_synergy
+    save, plot, timeout, executor :
+        See run_gda_async
+
+    Returns:
+    --------
+    result : SynergyResult
+    """
+    experiment = SynergyExperiment(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution,
+                                   image_dir=image_dir, counts_file=counts_file, output_dir=output_dir)
+    return await _with_timeout(_run_experiment(experiment, image_dir, counts_file, output_dir, save, plot, executor), timeout)
+
+
+async def run_simple_async(title, image_dir, counts_file=None, output_dir=None, save=True, timeout=None, executor=None):
+    """
+    Asyncio variant of simple_analysis.run_simple.
+
+    Parameters:
+    -----------
+    title, image_dir, counts_file, output_dir :
+        See simple_analysis.run_simple
+    save, timeout, executor :
+        See run_gda_async
+
+    Returns:
+    --------
+    result : SimpleResult
+    """
+    experiment = SimpleExperiment(title, image_dir=image_dir, counts_file=counts_file, output_dir=output_dir)
+    return await _with_timeout(_run_experiment(experiment, image_dir, counts_file, output_dir, save, None, executor), timeout)
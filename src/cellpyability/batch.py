@@ -0,0 +1,577 @@
+"""
+Batch module runs many GDA, synergy, and simple experiments listed in a config.csv file.
+Experiments run concurrently in a process pool, each writing to its own output directory,
+or as a pipeline that overlaps CellProfiler counting with analysis of already counted plates.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from . import toolbox as tb
+from . import scheduler
+from . import qc
+from . import cache
+from . import journal
+from . import logs
+from . import storage
+from . import gda_analysis
+from . import synergy_analysis
+from . import simple_analysis
+
+# Initialize toolbox
+logger, base_dir = tb.logger, tb.base_dir
+
+# Config columns required by each module (column names match the README batch scripts)
+MODULE_COLUMNS = {
+    'gda': ['dir', 'title', 'upper', 'lower', 'conc', 'dil'],
+    'synergy': ['dir', 'title', 'xdrug', 'xconc', 'xdil', 'ydrug', 'yconc', 'ydil'],
+    'simple': ['dir', 'title'],
+}
+
+
+def read_config(config_file):
+    """
+    Read a batch config.csv file into a list of experiment dictionaries.
+
+    The optional 'module' column selects gda, synergy, or simple for each row
+    (rows without it default to gda, matching the original config.csv template).
+    The optional 'counts' column points to a pre-existing counts CSV file.
+
+    Parameters:
+    -----------
+    config_file : str or Path
+        Path to the config.csv file
+
+    Returns:
+    --------
+    experiments : list of dict
+        One dictionary per row with the keyword arguments of the analysis module
+    """
+    config_path = Path(config_file).resolve()
+    if not config_path.exists():
+        raise FileNotFoundError(f'Config file {config_path} does not exist.')
+
+    df_config = pd.read_csv(config_path, dtype=str, keep_default_na=False, skipinitialspace=True)
+    df_config.columns = [col.strip().lower() for col in df_config.columns]
+    if 'module' not in df_config.columns:
+        df_config['module'] = 'gda'
+
+    experiments = []
+    for line_number, row in enumerate(df_config.to_dict('records'), start=2):
+        experiments.append(parse_experiment(row, f'{config_path.name} line {line_number}: '))
+
+    titles = [exp['title'] for exp in experiments]
+    duplicates = sorted({title for title in titles if titles.count(title) > 1})
+    if duplicates:
+        raise ValueError(f'Experiment titles must be unique in a batch: {", ".join(duplicates)}')
+
+    logger.info(f'Read {len(experiments)} experiments from {config_path}')
+    return experiments
+
+
+def parse_experiment(row, context=''):
+    """
+    Build one experiment dictionary from config columns (see MODULE_COLUMNS).
+
+    Parameters:
+    -----------
+    row : dict
+        Config column names mapped to values, e.g. one config.csv row
+    context : str
+        Prefix for error messages (e.g., the config file line)
+
+    Returns:
+    --------
+    experiment : dict
+        Keyword arguments of the analysis module, plus 'module'
+    """
+    row = {key: str(value).strip() for key, value in row.items() if value is not None}
+    module = row.get('module', '').lower() or 'gda'
+    if module not in MODULE_COLUMNS:
+        raise ValueError(f'{context}unknown module "{module}"')
+
+    missing = [col for col in MODULE_COLUMNS[module] if not row.get(col)]
+    if missing:
+        raise ValueError(f'{context}missing {", ".join(missing)} for {module}')
+
+    experiment = {
+        'module': module,
+        'title': row['title'],
+        'image_dir': row['dir'],
+        'counts_file': row.get('counts') or None,
+    }
+    try:
+        if module == 'gda':
+            experiment.update(
+                upper_name=row['upper'],
+                lower_name=row['lower'],
+                top_conc=float(row['conc']),
+                dilution=float(row['dil']),
+            )
+        elif module == 'synergy':
+            experiment.update(
+                x_drug=row['xdrug'],
+                x_top_conc=float(row['xconc']),
+                x_dilution=float(row['xdil']),
+                y_drug=row['ydrug'],
+                y_top_conc=float(row['yconc']),
+                y_dilution=float(row['ydil']),
+            )
+    except ValueError as e:
+        raise ValueError(f'{context}{e}') from None
+    return experiment
+
+
+def _dispatch(experiment, output_dir, stage_callback=None):
+    """Call the analysis module named in the experiment dictionary."""
+    module = experiment['module']
+    counts_file = experiment.get('counts_file')
+
+    if module == 'gda':
+        gda_analysis.run_gda(
+            title_name=experiment['title'],
+            upper_name=experiment['upper_name'],
+            lower_name=experiment['lower_name'],
+            top_conc=experiment['top_conc'],
+            dilution=experiment['dilution'],
+            image_dir=experiment['image_dir'],
+            show_plot=False,
+            counts_file=counts_file,
+            output_dir=output_dir,
+            stage_callback=stage_callback
+        )
+    elif module == 'synergy':
+        synergy_analysis.run_synergy(
+            title_name=experiment['title'],
+            x_drug=experiment['x_drug'],
+            x_top_conc=experiment['x_top_conc'],
+            x_dilution=experiment['x_dilution'],
+            y_drug=experiment['y_drug'],
+            y_top_conc=experiment['y_top_conc'],
+            y_dilution=experiment['y_dilution'],
+            image_dir=experiment['image_dir'],
+            show_plot=False,
+            counts_file=counts_file,
+            output_dir=output_dir,
+            stage_callback=stage_callback
+        )
+    elif module == 'simple':
+        simple_analysis.run_simple(
+            title=experiment['title'],
+            image_dir=experiment['image_dir'],
+            counts_file=counts_file,
+            output_dir=output_dir,
+            stage_callback=stage_callback
+        )
+    else:
+        raise ValueError(f'Unknown module: {module}')
+
+
+def _new_result(experiment, output_root):
+    """Create the result record of an experiment (see run_experiment)."""
+    return {
+        'title': experiment['title'],
+        'module': experiment['module'],
+        'status': 'success',
+        'seconds': 0.0,
+        'error': '',
+        'resumed_from': '',
+        'output_dir': str(Path(output_root) / experiment['title']),
+    }
+
+
+def _prepare(experiment, output_root, resume):
+    """
+    Create the result record of an experiment and decide what is left to run.
+
+    Returns:
+    --------
+    result : dict
+        Result record (see run_experiment)
+    run_as : dict or None
+        Experiment to run, with counts_file pointing at the checkpoint when resuming,
+        or None if there is nothing to run (already done or image directory missing)
+    batch_journal : journal.BatchJournal
+    """
+    result = _new_result(experiment, output_root)
+    batch_journal = journal.BatchJournal(output_root)
+    last_stage, checkpoint = batch_journal.resume_point(experiment) if resume else (None, None)
+    if last_stage == 'done':
+        result['resumed_from'] = last_stage
+        logger.info(f'{experiment["title"]} already complete. Skipping.')
+        return result, None, batch_journal
+
+    run_as = experiment
+    if last_stage is not None:
+        # Counting already finished: analyze the checkpointed counts instead of recounting
+        result['resumed_from'] = last_stage
+        run_as = dict(experiment, counts_file=str(checkpoint))
+        logger.info(f'Resuming {experiment["title"]} after stage {last_stage} ...')
+    else:
+        batch_journal.start(experiment)
+
+    if run_as.get('counts_file') is None and not storage.exists(experiment['image_dir']):
+        result['status'] = 'skipped'
+        result['error'] = f'Directory {experiment["image_dir"]} not found'
+        logger.warning(f'{experiment["title"]}: directory {experiment["image_dir"]} not found. Skipping.')
+        return result, None, batch_journal
+
+    return result, run_as, batch_journal
+
+
+def _run_stage(result, func, *args):
+    """
+    Call func(*args), recording any failure in the result instead of raising.
+
+    Returns:
+    --------
+    value : object
+        Return value of func, or None if it failed
+    seconds : float
+        Time spent in func
+    """
+    start = time.perf_counter()
+    value = None
+    try:
+        value = func(*args)
+    except SystemExit as e:
+        # toolbox exits on fatal errors after logging them as CRITICAL
+        result['status'] = 'failed'
+        result['error'] = f'Exited with code {e.code} (see cellpyability.log)'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+    return value, time.perf_counter() - start
+
+
+def run_log_file(result):
+    """Per-run log file of an experiment, in its output directory."""
+    return Path(result['output_dir']) / f'{result["title"]}.log'
+
+
+def _log_outcome(result):
+    if result['status'] == 'success':
+        logger.info(f'{result["title"]} finished in {result["seconds"]} s')
+    else:
+        logger.error(f'{result["title"]} failed after {result["seconds"]} s: {result["error"]}')
+
+
+def run_experiment(experiment, output_root, resume=False):
+    """
+    Run one experiment in its own output directory and report the outcome.
+
+    Never raises: failures are returned in the result so one bad plate
+    does not take down the rest of the batch. Completed stages are recorded
+    in the batch journal (see journal module).
+
+    Parameters:
+    -----------
+    experiment : dict
+        Experiment dictionary from read_config()
+    output_root : str or Path
+        Batch output directory; the experiment writes to output_root/<title>/
+    resume : bool
+        Skip the experiment if the journal marks it done, or reuse its
+        checkpointed counts if counting already completed (default: False)
+
+    Returns:
+    --------
+    result : dict
+        title, module, status ('success', 'failed' or 'skipped'), seconds, error,
+        resumed_from (last stage completed by a previous run, or ''), output_dir
+    """
+    result, run_as, batch_journal = _prepare(experiment, output_root, resume)
+    if run_as is None:
+        return result
+
+    def run_all():
+        _dispatch(run_as, result['output_dir'], batch_journal.stage_callback(experiment))
+        batch_journal.record(experiment, 'done')
+
+    with logs.run_log(experiment['title'], run_log_file(result)):
+        logger.info(f'Processing: {experiment["title"]} ({experiment["module"]}) ...')
+        _, seconds = _run_stage(result, run_all)
+        result['seconds'] = round(seconds, 2)
+        _log_outcome(result)
+    return result
+
+
+def _init_worker(scheduler_options, qc_mode=None, cache_dir=None, log_options=None):
+    """Set up a batch worker process: logging, non-interactive plotting, the CellProfiler scheduler, image QC and the image cache."""
+    logs.attach(log_options)
+
+    # Batch workers never display plots
+    import matplotlib
+    matplotlib.use('Agg')
+
+    if scheduler_options:
+        scheduler.configure(**scheduler_options)
+    if qc_mode:
+        qc.configure(mode=qc_mode)
+    if cache_dir:
+        cache.configure(cache_dir=cache_dir)
+
+
+def run_batch(config_file, jobs=None, output_dir=None, max_cp_processes=None, cp_threads=None, resume=False,
+              qc_mode=None, cache_dir=None):
+    """
+    Run every experiment in a config.csv file concurrently in a process pool.
+
+    Parameters:
+    -----------
+    config_file : str or Path
+        Path to the batch config.csv file
+    jobs : int, optional
+        Number of worker processes. If None, uses one per CPU (up to the number of experiments).
+    output_dir : str, optional
+        Custom output directory or object-store URL. If None, uses current working directory.
+    max_cp_processes : int, optional
+        Cap on concurrent CellProfiler processes across all workers (see scheduler module)
+    cp_threads : int, optional
+        BLAS/OpenMP threads allowed per CellProfiler process
+    resume : bool
+        Continue an interrupted batch in the same output directory: finished experiments
+        are skipped and counted ones reuse their checkpointed counts (default: False)
+    qc_mode : str, optional
+        Image QC prepass in the workers: 'off', 'flag' or 'exclude' (see qc module)
+    cache_dir : str or Path, optional
+        Local directory to stage plates in before counting (see cache module). Workers
+        share it, and plates already cached by an earlier run are not copied again.
+
+    Returns:
+    --------
+    df_summary : pandas.DataFrame
+        One row per experiment with status and timing, in config order
+    """
+    experiments = read_config(config_file)
+    output_root = tb.get_output_base_dir(output_dir)
+    # Outputs for an object store are uploaded together once the batch finishes
+    before = storage.snapshot(output_root) if storage.is_url(output_dir) else {}
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(experiments) or 1))
+
+    # Resolve CellProfiler once in the parent so workers never prompt for it
+    batch_journal = journal.BatchJournal(output_root)
+    needs_counting = [
+        exp for exp in experiments
+        if exp.get('counts_file') is None and storage.exists(exp['image_dir'])
+        and not (resume and batch_journal.resume_point(exp)[0])
+    ]
+    if needs_counting:
+        tb._ensure_cellprofiler_path()
+
+    logger.info(f'Running {len(experiments)} experiments with {jobs} worker processes ...')
+    start = time.perf_counter()
+    results = {}
+    # Workers queue for CellProfiler slots, so --jobs may exceed the CellProfiler cap:
+    # extra workers wait for a slot while the others finish analysis
+    scheduler_options = {
+        key: value for key, value in
+        [('max_processes', max_cp_processes), ('threads_per_process', cp_threads)]
+        if value is not None
+    }
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(scheduler_options, qc_mode, cache_dir, logs.worker_options())) as executor:
+        futures = {
+            executor.submit(run_experiment, exp, output_root, resume): exp['title']
+            for exp in experiments
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    df_summary = pd.DataFrame([results[exp['title']] for exp in experiments])
+    wall_seconds = round(time.perf_counter() - start, 2)
+
+    with tb.atomic_output(output_root / 'batch_summary.csv') as tmp_path:
+        df_summary.to_csv(tmp_path, index=False)
+    n_success = int((df_summary['status'] == 'success').sum())
+    logger.info(f'Batch complete: {n_success}/{len(df_summary)} succeeded in {wall_seconds} s. '
+                f'Summary saved to {output_root / "batch_summary.csv"}')
+    storage.upload_changes(output_dir, before)
+    return df_summary
+
+
+class _StageMeter:
+    """Thread-safe accumulator of busy and blocked time for one pipeline stage."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, blocked=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.blocked += blocked
+            self.items += items
+
+    def row(self, wall_seconds):
+        capacity = max(wall_seconds * self.workers, 1e-9)
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 2),
+            'blocked_seconds': round(self.blocked, 2),
+            'utilization': round(self.busy / capacity, 3),
+        }
+
+
+def run_batch_pipelined(config_file, count_workers=None, queue_size=2, output_dir=None, resume=False):
+    """
+    Run every experiment in a config.csv file as a two-stage producer/consumer pipeline.
+
+    Counting threads run CellProfiler (each run still waits for a scheduler slot) and
+    hand each plate's counts to a bounded queue. The calling thread takes plates from
+    the queue and runs normalization, curve fitting, CSV writing and plotting, so plate
+    N is analyzed while plate N+1 is being counted. When the queue is full, counting
+    blocks until analysis catches up.
+
+    Parameters:
+    -----------
+    config_file : str or Path
+        Path to the batch config.csv file
+    count_workers : int, optional
+        Number of counting threads. If None, uses the scheduler's CellProfiler cap.
+    queue_size : int
+        Maximum number of counted plates waiting for analysis (default: 2)
+    output_dir : str, optional
+        Custom output directory or object-store URL. If None, uses current working directory.
+    resume : bool
+        Continue an interrupted batch (see run_batch)
+
+    Returns:
+    --------
+    df_summary : pandas.DataFrame
+        One row per experiment with status and timing, in config order
+    df_stages : pandas.DataFrame
+        One row per stage with items processed, busy and blocked time, and utilization
+        (busy time / (wall time x workers)); the stage closest to 1.0 is the bottleneck
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # pipelined batches never display plots
+
+    experiments = read_config(config_file)
+    output_root = tb.get_output_base_dir(output_dir)
+    # Outputs for an object store are uploaded together once the batch finishes
+    before = storage.snapshot(output_root) if storage.is_url(output_dir) else {}
+
+    if count_workers is None:
+        count_workers = scheduler.get_scheduler().max_processes
+    count_workers = max(1, min(count_workers, len(experiments) or 1))
+
+    counting = _StageMeter('counting', count_workers)
+    analysis = _StageMeter('analysis', 1)
+    counted = queue.Queue(maxsize=max(1, queue_size))
+
+    # With the image cache on, the plate after each one being counted is copied in the meantime
+    image_cache = cache.get_cache()
+    upcoming = {}
+    to_count = [exp for exp in experiments if exp.get('counts_file') is None]
+    for current, following in zip(to_count, to_count[1:]):
+        upcoming[current['title']] = following['image_dir']
+
+    def count(experiment):
+        result = _new_result(experiment, output_root)
+        run_as, batch_journal = None, None
+        try:
+            prepared, _ = _run_stage(result, _prepare, experiment, output_root, resume)
+            if prepared is not None:
+                result, run_as, batch_journal = prepared
+
+            if run_as is not None:
+                def count_plate():
+                    _, cp_csv = tb.run_cellprofiler(run_as['image_dir'], run_as.get('counts_file'), result['output_dir'])
+                    batch_journal.record(experiment, 'counted', cp_csv)
+                    return cp_csv
+
+                with logs.run_log(experiment['title'], run_log_file(result)):
+                    logger.info(f'Counting: {experiment["title"]} ...')
+                    if image_cache.enabled and experiment['title'] in upcoming:
+                        image_cache.prefetch([upcoming[experiment['title']]])
+                    cp_csv, seconds = _run_stage(result, count_plate)
+                result['seconds'] += seconds
+                counting.add(busy=seconds, items=1)
+                run_as = dict(run_as, counts_file=str(cp_csv)) if cp_csv is not None else None
+        except BaseException as e:
+            result.update(status='failed', error=f'{type(e).__name__}: {e}')
+            run_as = None
+            raise
+        finally:
+            # Every plate passes through the queue, skipped and failed ones too, so analysis
+            # sees every experiment and never waits for one that will not arrive
+            wait_start = time.perf_counter()
+            counted.put((experiment, result, run_as, batch_journal))
+            counting.add(blocked=time.perf_counter() - wait_start)
+
+    # Resolve CellProfiler once before the counting threads start
+    if any(exp.get('counts_file') is None and storage.exists(exp['image_dir'])
+           and not (resume and journal.BatchJournal(output_root).resume_point(exp)[0]) for exp in experiments):
+        tb._ensure_cellprofiler_path()
+
+    logger.info(f'Running {len(experiments)} experiments as a pipeline: {count_workers} counting threads, '
+                f'analysis queue of {queue_size}')
+    start = time.perf_counter()
+    results = {}
+    with ThreadPoolExecutor(max_workers=count_workers, thread_name_prefix='count') as executor:
+        futures = [executor.submit(count, exp) for exp in experiments]
+
+        for _ in experiments:
+            wait_start = time.perf_counter()
+            experiment, result, run_as, batch_journal = counted.get()
+            analysis.add(blocked=time.perf_counter() - wait_start)
+
+            ran = result['status'] != 'skipped' and result['resumed_from'] != 'done'
+            with logs.run_log(experiment['title'], run_log_file(result) if ran else None):
+                if run_as is not None:
+                    def analyze():
+                        _dispatch(run_as, result['output_dir'], batch_journal.stage_callback(experiment))
+                        batch_journal.record(experiment, 'done')
+
+                    logger.info(f'Analyzing: {experiment["title"]} ...')
+                    _, seconds = _run_stage(result, analyze)
+                    result['seconds'] += seconds
+                    analysis.add(busy=seconds, items=1)
+                result['seconds'] = round(result['seconds'], 2)
+                if ran:
+                    _log_outcome(result)
+            results[experiment['title']] = result
+
+        for future in futures:
+            future.result()
+
+    wall_seconds = time.perf_counter() - start
+    df_summary = pd.DataFrame([results[exp['title']] for exp in experiments])
+    df_stages = pd.DataFrame([counting.row(wall_seconds), analysis.row(wall_seconds)])
+
+    with tb.atomic_output(output_root / 'batch_summary.csv') as tmp_path:
+        df_summary.to_csv(tmp_path, index=False)
+    with tb.atomic_output(output_root / 'batch_stages.csv') as tmp_path:
+        df_stages.to_csv(tmp_path, index=False)
+    n_success = int((df_summary['status'] == 'success').sum())
+    logger.info(f'Pipelined batch complete: {n_success}/{len(df_summary)} succeeded in {wall_seconds:.2f} s. '
+                f'Summary and stage utilization saved to {output_root}')
+    storage.upload_changes(output_dir, before)
+    return df_summary, df_stages
+
+
+def format_summary(df_summary):
+    """Format a batch summary DataFrame as a plain-text table for the console."""
+    columns = ['title', 'module', 'status', 'seconds', 'resumed_from', 'error']
+    return df_summary[columns].to_string(index=False)
+
+
+def format_stages(df_stages):
+    """Format a pipeline stage utilization DataFrame as a plain-text table for the console."""
+    return df_stages.to_string(index=False)
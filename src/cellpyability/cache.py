@@ -0,0 +1,382 @@
+"""
+Cache module stages plates on local disk before CellProfiler counts them.
+
+CellProfiler reads every image of a plate several times, which is slow from a network share
+(SMB, NFS) or an object store. With the cache enabled, each plate is first copied to a local
+cache directory, its files in parallel, and CellProfiler reads the local copy. The plates of
+a multi-plate experiment are copied one after another ahead of counting, so the next plate
+is copied while the previous one is counted.
+
+Cached plates are kept for reruns: a plate whose files still have the same sizes and
+modification times is counted from the cache without copying, and only new or changed
+files are copied otherwise. The cache is bounded in size; the least recently used plates
+are evicted first, never while a run is counting them.
+
+Cache layout:
+    <cache_dir>/<key>/<plate>/       copy of the plate (directory, container file or URL)
+    <cache_dir>/<key>.json           manifest: source, file sizes and modification times;
+                                     its modification time is the plate's last use
+    <cache_dir>/<key>.use-<host>-<pid>-<id>   marks a plate in use by a running process
+
+The cache is off unless a cache directory is given (--cache-dir or CELLPYABILITY_CACHE_DIR).
+CELLPYABILITY_CACHE_MAX_GB bounds its size (default: 50) and CELLPYABILITY_CACHE_WORKERS
+sets the parallel copies per plate (default: 8).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+
+from . import profiling, scheduler, storage
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+DEFAULT_MAX_GB = 50
+DEFAULT_WORKERS = 8
+GB = 1024 ** 3
+MB = 1024 ** 2
+
+
+def _env_number(name, cast=float):
+    """Read a numeric CELLPYABILITY_CACHE_* environment variable, returning None if unset."""
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f'Ignoring invalid {name}={value!r}')
+        return None
+
+
+def list_source(source):
+    """
+    List the files of a plate.
+
+    Returns:
+    --------
+    files : dict
+        Relative path -> (size or None if unknown, modification time in ns or None for object stores).
+        A directory or prefix lists every file under it; a single file (plate container) or
+        object lists itself under its name.
+    single : bool
+        Whether source is a single file or object
+    """
+    if storage.is_url(source):
+        fs = storage.get_storage(source)
+        if fs.isfile(source):
+            return {PurePosixPath(source).name: (None, None)}, True
+        root = source.rstrip('/') + '/'
+        return {url[len(root):]: (size, None) for url, size in fs.find(source).items()}, False
+    source = Path(source)
+    if source.is_file():
+        stat = source.stat()
+        return {source.name: (stat.st_size, stat.st_mtime_ns)}, True
+    files = {}
+    for path in source.rglob('*'):
+        if path.is_file():
+            stat = path.stat()
+            files[path.relative_to(source).as_posix()] = (stat.st_size, stat.st_mtime_ns)
+    return files, False
+
+
+class ImageCache:
+    """
+    Local, size-bounded cache of plates.
+
+    Parameters:
+    -----------
+    cache_dir : str or Path, optional
+        Cache directory on local disk (default: CELLPYABILITY_CACHE_DIR; no directory disables the cache)
+    max_gb : float, optional
+        Size limit in GB (default: CELLPYABILITY_CACHE_MAX_GB, else 50)
+    workers : int, optional
+        Parallel file copies per plate (default: CELLPYABILITY_CACHE_WORKERS, else 8)
+    """
+
+    def __init__(self, cache_dir=None, max_gb=None, workers=None):
+        cache_dir = cache_dir or os.environ.get('CELLPYABILITY_CACHE_DIR', '').strip() or None
+        self.cache_dir = Path(cache_dir).resolve() if cache_dir else None
+        max_gb = max_gb if max_gb is not None else _env_number('CELLPYABILITY_CACHE_MAX_GB')
+        self.max_bytes = int((max_gb if max_gb is not None else DEFAULT_MAX_GB) * GB)
+        self.workers = max(1, workers or _env_number('CELLPYABILITY_CACHE_WORKERS', int) or DEFAULT_WORKERS)
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> Future of plates being staged or queued for prefetch
+        self._pins = {}  # key -> (use count, use file)
+        self._prefetched = set()  # keys pinned by prefetch until their run releases them
+        self._stager = None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.cache_dir is not None
+
+    def key(self, source):
+        """Cache key of a plate: hash of its absolute path or URL."""
+        source = source if storage.is_url(source) else str(Path(source).resolve())
+        return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+    def contains(self, path):
+        """Whether path is inside the cache directory (already a cached copy)."""
+        if not self.enabled or storage.is_url(path):
+            return False
+        return self.cache_dir in Path(path).resolve().parents
+
+    def _entry(self, source):
+        """Directory of a plate's copy; the plate keeps its name so outputs are named as usual."""
+        name = PurePosixPath(source.rstrip('/')).name if storage.is_url(source) else Path(source).resolve().name
+        return self.cache_dir / self.key(source) / name
+
+    def _manifest_file(self, key):
+        return self.cache_dir / f'{key}.json'
+
+    def _read_manifest(self, key):
+        try:
+            return json.loads(self._manifest_file(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    # In-use markers: a use file per process, so other processes never evict a plate being counted
+    def _pin(self, key):
+        with self._lock:
+            count, use_file = self._pins.get(key, (0, None))
+            if use_file is None:
+                use_file = self.cache_dir / f'{key}.use-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+                use_file.touch()
+            self._pins[key] = (count + 1, use_file)
+
+    def _unpin(self, key):
+        with self._lock:
+            count, use_file = self._pins[key]
+            if count > 1:
+                self._pins[key] = (count - 1, use_file)
+                return
+            del self._pins[key]
+        if use_file.exists():
+            use_file.unlink()
+
+    def _in_use(self, key):
+        """Whether a live process (this one included) is using the plate."""
+        if key in self._pins:
+            return True
+        host = socket.gethostname()
+        for use_file in self.cache_dir.glob(f'{key}.use-*'):
+            owner, _, _ = use_file.name.split('.use-', 1)[1].rpartition('-')
+            owner_host, _, pid = owner.rpartition('-')
+            if owner_host != host or not pid.isdigit() or scheduler._pid_alive(int(pid)):
+                return True
+            use_file.unlink()  # left by a dead process
+        return False
+
+    def usage(self):
+        """Bytes held by cached plates."""
+        return sum((self._read_manifest(f.stem) or {}).get('bytes', 0) for f in self.cache_dir.glob('*.json'))
+
+    def _evict(self, needed, keep):
+        """Remove least recently used plates not in use until needed more bytes fit within the limit."""
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name == keep:
+                continue
+            manifest_file = self._manifest_file(entry_dir.name)
+            last_used = manifest_file.stat().st_mtime if manifest_file.exists() else 0  # unfinished copies first
+            entries.append((last_used, entry_dir.name))
+
+        used = self.usage() - ((self._read_manifest(keep) or {}).get('bytes', 0))
+        for last_used, key in sorted(entries):
+            # Copies left unfinished by dead processes are always removed
+            if used + needed <= self.max_bytes and last_used:
+                break
+            if self._in_use(key):
+                continue
+            manifest = self._read_manifest(key) or {}
+            if self._manifest_file(key).exists():
+                self._manifest_file(key).unlink()
+            shutil.rmtree(self.cache_dir / key, ignore_errors=True)
+            used -= manifest.get('bytes', 0)
+            logger.info(f'Evicted {manifest.get("source", key)} ({manifest.get("bytes", 0) / MB:.1f} MB) from the image cache')
+        return used + needed <= self.max_bytes
+
+    @staticmethod
+    def _copy(source_file, target):
+        """Copy one file of a plate (path or URL) to the cache, renaming it into place when complete."""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f'.{target.name}.{uuid.uuid4().hex[:8]}.tmp')
+        try:
+            if storage.is_url(source_file):
+                storage.get_storage(source_file).get_file(source_file, tmp_path)
+            else:
+                shutil.copy2(source_file, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _stage(self, source):
+        """Copy the new and changed files of a plate into the cache; None if the plate is too big to cache."""
+        key, entry = self.key(source), self._entry(source)
+        files, single = list_source(source)
+        if not files:
+            raise FileNotFoundError(f'No files found in {source}')
+        manifest = self._read_manifest(key) or {}
+        cached = manifest.get('files', {})
+
+        def current(relative):
+            target = entry / relative
+            return (cached.get(relative) == list(files[relative]) and target.is_file()
+                    and (files[relative][0] is None or target.stat().st_size == files[relative][0]))
+
+        stale = [relative for relative in files if not current(relative)]
+        if not stale:
+            os.utime(self._manifest_file(key))  # most recently used
+            logger.info(f'Counting {entry.name} from the image cache ({len(files)} files, no copy needed)')
+            return entry
+
+        size = sum(s or 0 for s, _ in files.values())
+        with self._lock:
+            fits = self._evict(size, keep=key)
+        if not fits:
+            logger.warning(f'{entry.name} ({size / MB:.1f} MB) does not fit in the image cache '
+                           f'({self.max_bytes / MB:.1f} MB); counting it from {source}')
+            return None
+
+        start = time.perf_counter()
+        with profiling.span('cache'):
+            for relative in set(cached) - set(files):
+                removed = entry / relative
+                if removed.exists():
+                    removed.unlink()
+            if single:
+                pairs = [(source, entry / relative) for relative in stale]
+            elif storage.is_url(source):
+                pairs = [(f'{source.rstrip("/")}/{relative}', entry / relative) for relative in stale]
+            else:
+                pairs = [(Path(source) / relative, entry / relative) for relative in stale]
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pairs))) as pool:
+                list(pool.map(lambda pair: self._copy(*pair), pairs))
+        size = sum((entry / relative).stat().st_size for relative in files)
+        if any(s is None for s, _ in files.values()):
+            # Sizes of single objects are only known once copied
+            with self._lock:
+                self._evict(size, keep=key)
+
+        from . import toolbox as tb  # imported here because toolbox imports this module
+        manifest = {'source': str(source), 'bytes': size, 'files': {relative: list(state) for relative, state in files.items()}}
+        with tb.atomic_output(self._manifest_file(key)) as tmp_path:
+            tmp_path.write_text(json.dumps(manifest))
+        logger.info(f'Copied {len(stale)} of {len(files)} files ({size / MB:.1f} MB) of {entry.name} to the image cache '
+                    f'in {time.perf_counter() - start:.1f} s')
+        return entry
+
+    def stage(self, source):
+        """
+        Cached copy of a plate, copying it first unless it is cached and unchanged.
+
+        Waits for a copy of the same plate already under way (e.g., prefetched).
+
+        Returns:
+        --------
+        local_plate : Path or None
+            Cached copy, or None if the plate does not fit in the cache
+        """
+        key = self.key(source)
+        with self._lock:
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if owner:
+            self._run(key, source, future)
+        return future.result()
+
+    def _run(self, key, source, future):
+        """Stage a plate for everyone waiting on future, in use (not evictable) while it is copied."""
+        self._pin(key)
+        try:
+            future.set_result(self._stage(source))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._unpin(key)
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def prefetch(self, sources):
+        """
+        Queue plates to be copied in the background, one after another in the given order.
+
+        Each plate is in use from here until the staged() block that counts it exits,
+        so it cannot be evicted before it is counted.
+        """
+        for source in sources:
+            key = self.key(source)
+            self._pin(key)
+            with self._lock:
+                queued = key not in self._pending and key not in self._prefetched
+                if queued:
+                    future = self._pending[key] = Future()
+                    self._prefetched.add(key)
+                    if self._stager is None:
+                        self._stager = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache')
+            if queued:
+                self._stager.submit(self._prefetch_one, key, source, future)
+            else:
+                self._unpin(key)  # already being copied or queued
+
+    def _prefetch_one(self, key, source, future):
+        self._run(key, source, future)
+        if future.exception() is not None:
+            self._release_prefetch(key)  # the run will copy it again or fail on its own
+
+    def _release_prefetch(self, key):
+        """Drop the use a prefetch holds on a plate, if it still holds one."""
+        with self._lock:
+            prefetched = key in self._prefetched
+            self._prefetched.discard(key)
+        if prefetched:
+            self._unpin(key)
+
+    @contextmanager
+    def staged(self, source):
+        """Yield the cached copy of a plate (None if it does not fit), kept from eviction inside the block."""
+        key = self.key(source)
+        self._pin(key)
+        try:
+            yield self.stage(source)
+        finally:
+            self._unpin(key)
+            self._release_prefetch(key)
+
+
+# Cache shared by every CellProfiler run in this process (created on first use)
+_cache = None
+
+
+def configure(**kwargs):
+    """
+    Replace this process's image cache with an ImageCache built from the given options.
+
+    Options left as None fall back to CELLPYABILITY_CACHE_* environment variables, then defaults.
+    """
+    global _cache
+    _cache = ImageCache(**kwargs)
+    return _cache
+
+
+def get_cache():
+    """Return this process's image cache, creating it from environment variables if needed."""
+    global _cache
+    if _cache is None:
+        _cache = ImageCache()
+    return _cache
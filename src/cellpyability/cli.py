@@ -5,6 +5,13 @@ This module provides CLI commands to run the three main modules:
 - gda: dose-response analysis
 - synergy: drug combination synergy analysis
 - simple: nuclei count matrix
+- screen: compound screen on 96- or 384-well plates laid out by a plate map (batched IC50 fits)
+- kinetic: add a timepoint of a live-cell GDA plate to its time series (GR metrics per timepoint)
+- batch: run many experiments from a config.csv file concurrently
+- submit/worker: share experiments between machines through a queue directory
+- cp-report: summarize the CPU time, memory and I/O of recorded CellProfiler runs
+- plate-qc: score Z'-factor, vehicle CV, edge bias and replicate CV of archived plates
+- synthesize: generate synthetic plates with known curves for load and scale testing
 """
 
 import argparse
@@ -24,6 +31,12 @@ def create_parser():
         action='version',
         version='%(prog)s 0.1.0'
     )
+    parser.add_argument(
+        '--log-format',
+        choices=['text', 'json'],
+        help='Format of the log files: text, or one JSON object per line with the experiment ID '
+             '(default: text, or CELLPYABILITY_LOG_FORMAT)'
+    )
     
     subparsers = parser.add_subparsers(
         title='modules',
@@ -64,11 +77,18 @@ def create_parser():
         required=True,
         help='Dilution factor between columns (e.g., 3 for 3-fold dilution)'
     )
-    gda_parser.add_argument(
+    gda_images = gda_parser.add_mutually_exclusive_group(required=True)
+    gda_images.add_argument(
         '--image-dir',
-        required=True,
         type=str,
-        help='Directory containing the 60 well images'
+        nargs='+',
+        help='Directory containing the 60 well images, or a whole-plate multi-page TIFF, OME-TIFF or OME-Zarr; '
+             'give one per replicate plate to count the plates in parallel and keep them apart; each may be an s3:// URL'
+    )
+    gda_images.add_argument(
+        '--image-archive',
+        type=str,
+        help='Zip or tar(.gz) archive of the 60 well images; members are streamed to CellProfiler without extracting the archive'
     )
     gda_parser.add_argument(
         '--no-plot',
@@ -83,7 +103,31 @@ def create_parser():
     gda_parser.add_argument(
         '--output-dir',
         type=str,
-        help='Custom output directory (default: ./cellpyability_output/ in current working directory)'
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    gda_parser.add_argument(
+        '--normalize',
+        choices=['pooled', 'plate'],
+        default='pooled',
+        help='Vehicle normalization of replicate plates: pooled vehicle mean over all plates, '
+             'or each plate to its own vehicle (default: pooled)'
+    )
+    gda_parser.add_argument(
+        '--qc',
+        choices=['off', 'flag', 'exclude'],
+        help='Image QC prepass before counting: flag blank, saturated and out-of-focus wells (exclude also leaves out saturated and out-of-focus ones), '
+             'and reject plates where most wells fail (default: off, or CELLPYABILITY_QC)'
+    )
+    gda_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    gda_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage and write a JSON trace (durations, peak memory) to gda_output/ with a console summary'
     )
     
     # Synergy module parser
@@ -130,11 +174,18 @@ def create_parser():
         required=True,
         help='Vertical dilution factor'
     )
-    synergy_parser.add_argument(
+    synergy_images = synergy_parser.add_mutually_exclusive_group(required=True)
+    synergy_images.add_argument(
         '--image-dir',
-        required=True,
         type=str,
-        help='Directory containing the 180 well images'
+        nargs='+',
+        help='Directory containing the 180 well images, or a multi-page TIFF, OME-TIFF or OME-Zarr of the plates; '
+             'or one directory per replicate plate, counted in parallel and kept apart; each may be an s3:// URL'
+    )
+    synergy_images.add_argument(
+        '--image-archive',
+        type=str,
+        help='Zip or tar(.gz) archive of the 180 well images; members are streamed to CellProfiler without extracting the archive'
     )
     synergy_parser.add_argument(
         '--no-plot',
@@ -149,7 +200,31 @@ def create_parser():
     synergy_parser.add_argument(
         '--output-dir',
         type=str,
-        help='Custom output directory (default: ./cellpyability_output/ in current working directory)'
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    synergy_parser.add_argument(
+        '--normalize',
+        choices=['pooled', 'plate'],
+        default='pooled',
+        help='Vehicle normalization of replicate plates: pooled vehicle mean over all plates, '
+             'or each plate to its own vehicle (default: pooled)'
+    )
+    synergy_parser.add_argument(
+        '--qc',
+        choices=['off', 'flag', 'exclude'],
+        help='Image QC prepass before counting: flag blank, saturated and out-of-focus wells (exclude also leaves out saturated and out-of-focus ones), '
+             'and reject plates where most wells fail (default: off, or CELLPYABILITY_QC)'
+    )
+    synergy_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    synergy_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage and write a JSON trace (durations, peak memory) to synergy_output/ with a console summary'
     )
     
     # Simple module parser
@@ -162,11 +237,16 @@ def create_parser():
         required=True,
         help='Title of the experiment'
     )
-    simple_parser.add_argument(
+    simple_images = simple_parser.add_mutually_exclusive_group(required=True)
+    simple_images.add_argument(
         '--image-dir',
-        required=True,
         type=str,
-        help='Directory containing the well images'
+        help='Directory containing the well images, or a whole-plate multi-page TIFF, OME-TIFF or OME-Zarr (local or s3:// URL)'
+    )
+    simple_images.add_argument(
+        '--image-archive',
+        type=str,
+        help='Zip or tar(.gz) archive of the well images; members are streamed to CellProfiler without extracting the archive'
     )
     simple_parser.add_argument(
         '--counts-file',
@@ -176,12 +256,475 @@ def create_parser():
     simple_parser.add_argument(
         '--output-dir',
         type=str,
-        help='Custom output directory (default: ./cellpyability_output/ in current working directory)'
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    simple_parser.add_argument(
+        '--qc',
+        choices=['off', 'flag', 'exclude'],
+        help='Image QC prepass before counting: flag blank, saturated and out-of-focus wells (exclude also leaves out saturated and out-of-focus ones), '
+             'and reject plates where most wells fail (default: off, or CELLPYABILITY_QC)'
+    )
+    simple_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    simple_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage and write a JSON trace (durations, peak memory) to simple_output/ with a console summary'
+    )
+    
+    # Compound screen parser
+    screen_parser = subparsers.add_parser(
+        'screen',
+        help='Compound screen: many compounds per 96- or 384-well plate from a plate map, with batched IC50 fits'
+    )
+    screen_parser.add_argument(
+        '--title',
+        required=True,
+        help='Title of the screen (used for output file names)'
+    )
+    screen_parser.add_argument(
+        '--plate-map',
+        required=True,
+        help='Plate-map CSV with Well, Role (sample, vehicle, positive, empty), Compound and Concentration '
+             'columns, and optionally Plate (plate number or image directory name)'
+    )
+    screen_parser.add_argument(
+        '--image-dir',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Directory (or s3:// URL) containing the well images of each plate, in plate-number order (counted in parallel)'
+    )
+    screen_parser.add_argument(
+        '--plate-format',
+        type=int,
+        choices=[96, 384],
+        help='Plate format (default: inferred from the plate-map wells)'
+    )
+    screen_parser.add_argument(
+        '--counts-file',
+        type=str,
+        help='Path to pre-existing counts CSV file, with a Plate column for several plates (bypasses CellProfiler)'
+    )
+    screen_parser.add_argument(
+        '--output-dir',
+        type=str,
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    screen_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    screen_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage and write a JSON trace (durations, peak memory) to screen_output/ with a console summary'
+    )
+    
+    # Kinetic time-series parser
+    kinetic_parser = subparsers.add_parser(
+        'kinetic',
+        help='Kinetic GDA: add one timepoint of a live-cell plate to its time series and update GR metrics and IC50s'
+    )
+    kinetic_parser.add_argument(
+        '--title',
+        required=True,
+        help='Title of the plate series (the same for every timepoint)'
+    )
+    kinetic_parser.add_argument(
+        '--upper-name',
+        required=True,
+        help='Name for upper cell condition (rows B-D)'
+    )
+    kinetic_parser.add_argument(
+        '--lower-name',
+        required=True,
+        help='Name for lower cell condition (rows E-G)'
+    )
+    kinetic_parser.add_argument(
+        '--top-conc',
+        type=float,
+        required=True,
+        help='Top concentration in molar (e.g., 0.000001 for 1 µM)'
+    )
+    kinetic_parser.add_argument(
+        '--dilution',
+        type=float,
+        required=True,
+        help='Dilution factor between columns (e.g., 3 for 3-fold dilution)'
+    )
+    kinetic_parser.add_argument(
+        '--time',
+        type=float,
+        required=True,
+        help='Time of this imaging run in hours; the first timepoint is the GR baseline'
+    )
+    kinetic_images = kinetic_parser.add_mutually_exclusive_group(required=True)
+    kinetic_images.add_argument(
+        '--image-dir',
+        type=str,
+        help='Directory containing the 60 well images of this timepoint, or a whole-plate multi-page TIFF, OME-TIFF or OME-Zarr '
+             '(local or s3:// URL)'
+    )
+    kinetic_images.add_argument(
+        '--image-archive',
+        type=str,
+        help='Zip or tar(.gz) archive of the 60 well images of this timepoint'
+    )
+    kinetic_parser.add_argument(
+        '--no-plot',
+        action='store_true',
+        help='Skip redrawing the kinetic plot'
+    )
+    kinetic_parser.add_argument(
+        '--counts-file',
+        type=str,
+        help='Path to pre-existing counts CSV file (for testing, bypasses CellProfiler)'
+    )
+    kinetic_parser.add_argument(
+        '--output-dir',
+        type=str,
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    kinetic_parser.add_argument(
+        '--qc',
+        choices=['off', 'flag', 'exclude'],
+        help='Image QC prepass before counting: flag blank, saturated and out-of-focus wells (exclude also leaves out saturated and out-of-focus ones), '
+             'and reject plates where most wells fail (default: off, or CELLPYABILITY_QC)'
+    )
+    kinetic_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    kinetic_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage and write a JSON trace (durations, peak memory) to kinetic_output/ with a console summary'
+    )
+    
+    # Batch parser
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Batch processing: run every experiment in a config.csv file concurrently'
+    )
+    batch_parser.add_argument(
+        '--config',
+        required=True,
+        type=str,
+        help='Path to config.csv (columns: module, dir, title, and the module parameters)'
+    )
+    batch_parser.add_argument(
+        '--jobs',
+        type=int,
+        help='Number of experiments to run at once (default: number of CPUs)'
+    )
+    batch_parser.add_argument(
+        '--cp-processes',
+        type=int,
+        help='Maximum concurrent CellProfiler processes (default: CPU cores / --cp-threads, limited by free memory)'
+    )
+    batch_parser.add_argument(
+        '--cp-threads',
+        type=int,
+        help='BLAS/OpenMP threads per CellProfiler process (default: 1)'
+    )
+    batch_parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted batch in the same output directory, skipping completed work'
+    )
+    batch_parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Overlap counting and analysis: --jobs threads run CellProfiler while counted plates are analyzed'
+    )
+    batch_parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=2,
+        help='With --pipeline, maximum counted plates waiting for analysis (default: 2)'
+    )
+    batch_parser.add_argument(
+        '--qc',
+        choices=['off', 'flag', 'exclude'],
+        help='Image QC prepass before counting each plate (see gda --help; default: off, or CELLPYABILITY_QC)'
+    )
+    batch_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local image cache directory shared by all experiments (see gda --help; default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    batch_parser.add_argument(
+        '--output-dir',
+        type=str,
+        help='Custom output directory or object-store URL, e.g. s3://bucket/results (default: ./cellpyability_output/ in current working directory)'
+    )
+    
+    # Work queue parsers
+    submit_parser = subparsers.add_parser(
+        'submit',
+        help='Submit the experiments in a config.csv file as jobs to a shared queue directory'
+    )
+    submit_parser.add_argument(
+        '--queue',
+        required=True,
+        type=str,
+        help='Shared queue directory (visible at the same path on every worker node)'
+    )
+    submit_parser.add_argument(
+        '--config',
+        required=True,
+        type=str,
+        help='Path to config.csv (same format as the batch module)'
+    )
+    submit_parser.add_argument(
+        '--output-dir',
+        type=str,
+        help='Output directory or object-store URL for the experiments (default: results/ in the queue directory)'
+    )
+    submit_parser.add_argument(
+        '--priority',
+        type=int,
+        default=5,
+        help='Job priority from 0 (lowest) to 9 (most urgent); higher priority jobs run first (default: 5)'
+    )
+    
+    worker_parser = subparsers.add_parser(
+        'worker',
+        help='Claim and run jobs from a shared queue directory'
+    )
+    worker_parser.add_argument(
+        '--queue',
+        required=True,
+        type=str,
+        help='Shared queue directory'
+    )
+    worker_parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=5.0,
+        help='Seconds between checks when no job is pending (default: 5)'
+    )
+    worker_parser.add_argument(
+        '--stale-timeout',
+        type=float,
+        default=600.0,
+        help='Seconds without a heartbeat before a claimed job is recovered from its worker (default: 600)'
+    )
+    worker_parser.add_argument(
+        '--max-jobs',
+        type=int,
+        help='Stop after running this many jobs'
+    )
+    worker_parser.add_argument(
+        '--exit-when-empty',
+        action='store_true',
+        help='Stop when no job is pending instead of waiting for more'
+    )
+    worker_parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='Local directory to copy plates to before counting, kept for reruns; speeds up images on '
+             'network shares and object stores (default: off, or CELLPYABILITY_CACHE_DIR)'
+    )
+    
+    # Job service parser
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Run an HTTP job service for submitting, monitoring and downloading jobs'
+    )
+    serve_parser.add_argument(
+        '--queue',
+        required=True,
+        type=str,
+        help='Queue directory holding the jobs (persists across restarts)'
+    )
+    serve_parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='Address to listen on (default: 127.0.0.1, this machine only)'
+    )
+    serve_parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help='Port to listen on (default: 8000)'
+    )
+    serve_parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of worker processes (default: number of CPUs)'
+    )
+    serve_parser.add_argument(
+        '--output-dir',
+        type=str,
+        help='Output directory for job results (default: results/ in the queue directory)'
+    )
+    serve_parser.add_argument(
+        '--allow-dir',
+        action='append',
+        type=str,
+        help='Directory (or object-store URL prefix) that submitted image directories and counts files '
+             'must be inside; repeat for several (default: the current working directory)'
+    )
+    
+    # CellProfiler resource report parser
+    report_parser = subparsers.add_parser(
+        'cp-report',
+        help='Summarize CPU time, peak memory and I/O of recorded CellProfiler runs for capacity planning'
+    )
+    report_parser.add_argument(
+        '--dir',
+        nargs='+',
+        default=['cellpyability_output'],
+        help='Output directories (searched recursively) or cellprofiler_runs.jsonl files '
+             '(default: ./cellpyability_output)'
+    )
+    report_parser.add_argument(
+        '--output',
+        type=str,
+        help='Also save the per-run records to this CSV file'
+    )
+    
+    # Plate QC parser
+    plate_qc_parser = subparsers.add_parser(
+        'plate-qc',
+        help="Score Z'-factor, vehicle CV, edge bias and replicate CV of GDA or simple plates"
+    )
+    plate_qc_parser.add_argument(
+        '--dir',
+        nargs='+',
+        default=['cellpyability_output'],
+        help='Count CSVs, or output directories searched recursively for _gda_counts.csv and '
+             '_simple_CountMatrix.csv files (default: ./cellpyability_output)'
+    )
+    plate_qc_parser.add_argument(
+        '--output',
+        type=str,
+        help='QC summary CSV (default: ./cellpyability_output/plate_qc.csv)'
+    )
+    plate_qc_parser.add_argument(
+        '--min-z-prime',
+        type=float,
+        default=0.5,
+        help="Minimum Z'-factor of the vehicle against the positive control (default: 0.5)"
+    )
+    plate_qc_parser.add_argument(
+        '--positive-column',
+        type=str,
+        help="Layout column (2-11) holding a positive control, e.g. a lethal dose; without it the Z'-factor is not computed"
+    )
+    plate_qc_parser.add_argument(
+        '--max-vehicle-cv',
+        type=float,
+        default=0.2,
+        help='Maximum coefficient of variation of the vehicle wells (default: 0.2)'
+    )
+    plate_qc_parser.add_argument(
+        '--max-edge-bias',
+        type=float,
+        default=0.3,
+        help='Maximum absolute log2 ratio of the outer rows to the inner rows (default: 0.3)'
+    )
+    plate_qc_parser.add_argument(
+        '--max-replicate-cv',
+        type=float,
+        default=0.2,
+        help='Maximum SD of the replicate rows within each column, relative to the vehicle mean (default: 0.2)'
+    )
+    plate_qc_parser.add_argument(
+        '--ignore',
+        nargs='+',
+        choices=['z-prime', 'vehicle-cv', 'edge-bias', 'replicate-cv'],
+        default=[],
+        help='Report these metrics without passing or failing plates on them'
+    )
+    
+    # Synthetic plate generator parser
+    synthesize_parser = subparsers.add_parser(
+        'synthesize',
+        help='Generate synthetic plates with known dose-response curves for load and scale testing'
+    )
+    synthesize_parser.add_argument(
+        '--output-dir',
+        required=True,
+        type=str,
+        help='Directory for the counts files, config.csv (runnable with batch) and truth.csv'
+    )
+    synthesize_parser.add_argument(
+        '--plates',
+        type=int,
+        default=1,
+        help='Number of plates to generate (default: 1)'
+    )
+    synthesize_parser.add_argument(
+        '--module',
+        dest='plate_module',  # 'module' holds the subcommand
+        choices=['gda', 'synergy', 'simple'],
+        default='gda',
+        help='Plate layout to generate (default: gda)'
+    )
+    synthesize_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed; the same seed reproduces the same plates (default: 0)'
+    )
+    synthesize_parser.add_argument(
+        '--vehicle-count',
+        type=int,
+        default=10000,
+        help='Mean nuclei count of vehicle wells (default: 10000)'
+    )
+    synthesize_parser.add_argument(
+        '--noise',
+        type=float,
+        default=0.05,
+        help='Coefficient of variation of the count noise (default: 0.05)'
+    )
+    synthesize_parser.add_argument(
+        '--edge-effect',
+        type=float,
+        default=0.0,
+        help='Fraction of nuclei lost in the outer rows and columns (default: 0)'
+    )
+    synthesize_parser.add_argument(
+        '--interaction',
+        type=float,
+        default=0.0,
+        help='Synergy plates only: true Bliss interaction of the combination wells (default: 0)'
+    )
+    synthesize_parser.add_argument(
+        '--images',
+        action='store_true',
+        help='Also render synthetic nuclei TIFFs with exactly the written counts'
+    )
+    synthesize_parser.add_argument(
+        '--image-size',
+        type=int,
+        default=512,
+        help='Width and height of rendered images in pixels (default: 512)'
     )
     
     return parser
 
 
+def _image_dir(args):
+    """The image directory (or list of one directory per plate) or archive given on the command line."""
+    if isinstance(args.image_dir, list):
+        return args.image_dir[0] if len(args.image_dir) == 1 else args.image_dir
+    return args.image_dir or args.image_archive
+
+
 def run_gda(args):
     """Run the GDA module with CLI arguments."""
     # Import here to avoid circular imports and GUI loading
@@ -193,10 +736,11 @@ def run_gda(args):
         lower_name=args.lower_name,
         top_conc=args.top_conc,
         dilution=args.dilution,
-        image_dir=args.image_dir,
+        image_dir=_image_dir(args),
         show_plot=not args.no_plot,
         counts_file=getattr(args, 'counts_file', None),
-        output_dir=getattr(args, 'output_dir', None)
+        output_dir=getattr(args, 'output_dir', None),
+        normalize=args.normalize
     )
 
 
@@ -212,10 +756,11 @@ def run_synergy(args):
         y_drug=args.y_drug,
         y_top_conc=args.y_top_conc,
         y_dilution=args.y_dilution,
-        image_dir=args.image_dir,
+        image_dir=_image_dir(args),
         show_plot=not args.no_plot,
         counts_file=getattr(args, 'counts_file', None),
-        output_dir=getattr(args, 'output_dir', None)
+        output_dir=getattr(args, 'output_dir', None),
+        normalize=args.normalize
     )
 
 
@@ -225,24 +770,240 @@ def run_simple(args):
     
     simple_analysis.run_simple(
         title=args.title,
-        image_dir=args.image_dir,
+        image_dir=_image_dir(args),
         counts_file=getattr(args, 'counts_file', None),
         output_dir=getattr(args, 'output_dir', None)
     )
 
 
+def run_screen(args):
+    """Run the compound screen module with CLI arguments."""
+    from cellpyability import screen
+    
+    result = screen.run_screen(
+        title=args.title,
+        plate_map=args.plate_map,
+        image_dir=_image_dir(args),
+        counts_file=getattr(args, 'counts_file', None),
+        output_dir=getattr(args, 'output_dir', None),
+        plate_format=args.plate_format
+    )
+    df_ic50 = result.ic50
+    print(result.plates.to_string(index=False))
+    print()
+    print(f'{len(df_ic50)} compounds: {int(df_ic50["Converged"].sum())} fitted, '
+          f'{int(df_ic50["IC50"].notna().sum())} reach 50% viability')
+
+
+def run_kinetic(args):
+    """Add a timepoint to a kinetic series with CLI arguments."""
+    from cellpyability import kinetic
+    
+    series = kinetic.run_kinetic(
+        title_name=args.title,
+        upper_name=args.upper_name,
+        lower_name=args.lower_name,
+        top_conc=args.top_conc,
+        dilution=args.dilution,
+        time_h=args.time,
+        image_dir=_image_dir(args),
+        counts_file=getattr(args, 'counts_file', None),
+        output_dir=getattr(args, 'output_dir', None),
+        plot=not args.no_plot
+    )
+    print(series.metrics.to_string(index=False))
+
+
+def run_batch(args):
+    """Run the batch module with CLI arguments."""
+    from cellpyability import batch
+    
+    if args.pipeline:
+        from cellpyability import scheduler
+        if args.cp_processes is not None or args.cp_threads is not None:
+            scheduler.configure(max_processes=args.cp_processes, threads_per_process=args.cp_threads)
+        df_summary, df_stages = batch.run_batch_pipelined(
+            config_file=args.config,
+            count_workers=args.jobs,
+            queue_size=args.queue_size,
+            output_dir=getattr(args, 'output_dir', None),
+            resume=args.resume
+        )
+        print(batch.format_summary(df_summary))
+        print()
+        print(batch.format_stages(df_stages))
+    else:
+        df_summary = batch.run_batch(
+            config_file=args.config,
+            jobs=args.jobs,
+            output_dir=getattr(args, 'output_dir', None),
+            max_cp_processes=args.cp_processes,
+            cp_threads=args.cp_threads,
+            resume=args.resume,
+            qc_mode=args.qc,
+            cache_dir=args.cache_dir
+        )
+        print(batch.format_summary(df_summary))
+    
+    # Non-zero exit status if any experiment failed, so shell scripts can react
+    if (df_summary['status'] == 'failed').any():
+        sys.exit(1)
+
+
+def run_submit(args):
+    """Submit config.csv experiments to a shared queue with CLI arguments."""
+    from cellpyability import workqueue
+    
+    job_ids = workqueue.submit_config(args.queue, args.config, output_dir=getattr(args, 'output_dir', None),
+                                      priority=args.priority)
+    print(f'Submitted {len(job_ids)} jobs to {args.queue}')
+
+
+def run_worker(args):
+    """Run a queue worker with CLI arguments."""
+    from cellpyability import workqueue
+    
+    results = workqueue.run_worker(
+        args.queue,
+        poll_interval=args.poll_interval,
+        stale_timeout=args.stale_timeout,
+        max_jobs=args.max_jobs,
+        exit_when_empty=args.exit_when_empty
+    )
+    n_failed = sum(result['status'] == 'failed' for result in results)
+    print(f'Ran {len(results)} jobs ({n_failed} failed)')
+
+
+def run_serve(args):
+    """Run the HTTP job service with CLI arguments."""
+    from cellpyability import serve
+    
+    serve.serve(
+        args.queue,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        output_dir=getattr(args, 'output_dir', None),
+        allowed_roots=args.allow_dir
+    )
+
+
+def run_cp_report(args):
+    """Print the CellProfiler resource report with CLI arguments."""
+    from cellpyability import accounting
+    
+    df_runs = accounting.read_runs(args.dir)
+    print(accounting.format_report(df_runs))
+    if args.output:
+        df_runs.to_csv(args.output, index=False)
+        print(f'Run records saved to {args.output}')
+
+
+def run_plate_qc(args):
+    """Score archived plates and save the QC summary with CLI arguments."""
+    from cellpyability import plate_qc
+    
+    thresholds = {
+        'min_z_prime': args.min_z_prime,
+        'max_vehicle_cv': args.max_vehicle_cv,
+        'max_edge_bias': args.max_edge_bias,
+        'max_replicate_cv': args.max_replicate_cv,
+    }
+    ignored = {'z-prime': 'min_z_prime', 'vehicle-cv': 'max_vehicle_cv',
+               'edge-bias': 'max_edge_bias', 'replicate-cv': 'max_replicate_cv'}
+    for metric in args.ignore:
+        thresholds[ignored[metric]] = None
+    
+    df_qc = plate_qc.run_plate_qc(args.dir, output_file=args.output, positive_column=args.positive_column, **thresholds)
+    print(plate_qc.format_summary(df_qc))
+
+
+def run_synthesize(args):
+    """Generate synthetic plates with CLI arguments."""
+    from cellpyability import synthetic
+    
+    synthetic.generate_plates(
+        args.output_dir,
+        n_plates=args.plates,
+        module=args.plate_module,
+        seed=args.seed,
+        vehicle_count=args.vehicle_count,
+        noise_cv=args.noise,
+        edge_effect=args.edge_effect,
+        interaction=args.interaction,
+        images=args.images,
+        image_size=args.image_size
+    )
+    print(f'Generated {args.plates} synthetic {args.plate_module} plates in {args.output_dir}')
+
+
+def run_analysis(args, run):
+    """
+    Run a module with its own log file in the module output directory,
+    recording a stage profile if --profile was given.
+    """
+    from cellpyability import logs, profiling, storage, toolbox
+    
+    output_dir = getattr(args, 'output_dir', None)
+    # For an object-store URL, outputs (log and profile included) are uploaded once the run finishes
+    with storage.remote_outputs(output_dir):
+        module_output = toolbox.get_output_base_dir(output_dir) / f'{args.module}_output'
+        with logs.run_log(args.title, module_output / f'{args.title}_{args.module}.log'):
+            if not getattr(args, 'profile', False):
+                return run(args)
+            with profiling.profile(f'{args.title} {args.module}') as prof:
+                run(args)
+        prof.save(module_output / f'{args.title}_{args.module}_profile.json')
+        print(prof.format_summary())
+
+
 def main():
     """Main entry point for the CLI."""
     parser = create_parser()
     args = parser.parse_args()
     
+    if getattr(args, 'image_archive', None):
+        from cellpyability import ingest
+        if not ingest.is_archive(args.image_archive):
+            parser.error(f'--image-archive must be a {", ".join(ingest.ARCHIVE_SUFFIXES)} file')
+    
+    if getattr(args, 'qc', None):
+        from cellpyability import qc
+        qc.configure(mode=args.qc)
+    
+    if getattr(args, 'cache_dir', None):
+        from cellpyability import cache
+        cache.configure(cache_dir=args.cache_dir)
+    
+    if args.log_format:
+        from cellpyability import logs
+        logs.set_format(args.log_format)
+    
     try:
         if args.module == 'gda':
-            run_gda(args)
+            run_analysis(args, run_gda)
         elif args.module == 'synergy':
-            run_synergy(args)
+            run_analysis(args, run_synergy)
         elif args.module == 'simple':
-            run_simple(args)
+            run_analysis(args, run_simple)
+        elif args.module == 'screen':
+            run_analysis(args, run_screen)
+        elif args.module == 'kinetic':
+            run_analysis(args, run_kinetic)
+        elif args.module == 'batch':
+            run_batch(args)
+        elif args.module == 'submit':
+            run_submit(args)
+        elif args.module == 'worker':
+            run_worker(args)
+        elif args.module == 'serve':
+            run_serve(args)
+        elif args.module == 'cp-report':
+            run_cp_report(args)
+        elif args.module == 'plate-qc':
+            run_plate_qc(args)
+        elif args.module == 'synthesize':
+            run_synthesize(args)
         else:
             parser.print_help()
             sys.exit(1)
@@ -0,0 +1,142 @@
+"""
+Experiment module provides the lazy, in-memory base class behind the analysis modules.
+
+Each analysis stage is a cached property computed on first access, so a caller can ask for
+just the stats or just the fits without writing files or drawing plots. Writing outputs is
+a separate, optional save() step, which is what run_gda, run_synergy and run_simple call.
+"""
+
+import abc
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+import pandas as pd
+
+from . import cache, profiling
+from . import toolbox as tb
+from .plate import PLATE_COLUMN, Plate
+
+# Initialize toolbox
+logger = tb.logger
+
+NORMALIZE_MODES = ('pooled', 'plate')
+
+# Plates whose wells differ from the across-plate median by more than this (log2) are reported
+PLATE_OUTLIER_LOG2 = 1.0
+
+
+def combine_plate_counts(plate_counts):
+    """Stack the counts of several plates, numbered in a 1-based Plate column in the given order."""
+    return pd.concat([df_cp.assign(**{PLATE_COLUMN: number}) for number, df_cp in enumerate(plate_counts, start=1)],
+                     ignore_index=True)
+
+
+class Experiment(abc.ABC):
+    """
+    Base class for one plate experiment.
+
+    Counts come from, in order of preference, an in-memory DataFrame (counts), a pre-existing
+    counts CSV (counts_file), or CellProfiler run on image_dir when the counts are first needed.
+
+    Parameters:
+    -----------
+    title : str
+        Title of the experiment
+    image_dir : str or list of str, optional
+        Directory containing the well images, or one directory per replicate plate
+        (counted in parallel and kept apart as plates)
+    counts_file : str, optional
+        Path to pre-existing counts CSV file
+    counts : pandas.DataFrame, optional
+        Counts with the CellProfiler columns Count_nuclei, FileName_images and ImageNumber
+    output_dir : str, optional
+        Custom output directory for save(). If None, uses current working directory.
+    """
+
+    # Name of the module, used for the <module>_output/ directory
+    module = None
+
+    def __init__(self, title, image_dir=None, counts_file=None, counts=None, output_dir=None):
+        if image_dir is None and counts_file is None and counts is None:
+            raise ValueError('Experiment needs image_dir, counts_file or counts.')
+        self.title = title
+        self.image_dir = image_dir
+        self.counts_file = counts_file
+        self.output_dir = output_dir
+        self._counts = counts
+        self.cp_csv = None  # set once counts are loaded from a file or CellProfiler
+
+    @cached_property
+    def counts(self):
+        """Raw counts as returned by CellProfiler."""
+        if self._counts is not None:
+            return self._counts.copy()
+        if isinstance(self.image_dir, (list, tuple)) and self.counts_file is None:
+            # With the image cache on, plates are copied in order while earlier plates are counted
+            image_cache = cache.get_cache()
+            if image_cache.enabled:
+                image_cache.prefetch(self.image_dir)
+            # The scheduler caps how many of these CellProfiler runs execute at once
+            with ThreadPoolExecutor(max_workers=len(self.image_dir)) as pool:
+                results = list(pool.map(lambda image_dir: tb.run_cellprofiler(image_dir, output_dir=self.output_dir),
+                                        self.image_dir))
+            self.cp_csv = [cp_csv for _, cp_csv in results]
+            return combine_plate_counts([df_cp for df_cp, _ in results])
+        df_cp, self.cp_csv = tb.run_cellprofiler(self.image_dir, counts_file=self.counts_file, output_dir=self.output_dir)
+        return df_cp
+
+    def set_counts(self, df_cp, cp_csv=None):
+        """Provide counts obtained elsewhere (e.g., counted asynchronously) as the counts stage."""
+        self.__dict__['counts'] = df_cp
+        self.cp_csv = cp_csv
+
+    @cached_property
+    @profiling.timed('rename_wells')
+    def plate(self):
+        """Counts as a plate.Plate array over the 96-well geometry, replicates stacked in order."""
+        plate = Plate.from_counts(self.counts)
+        logger.debug(f'Counts placed on a {plate.replicates}-replicate plate array.')
+        return plate
+
+    def output_path(self):
+        """Define or create the <module>_output/ directory in the output directory."""
+        output_base = tb.get_output_base_dir(self.output_dir)
+        module_output_dir = output_base / f'{self.module}_output'
+        module_output_dir.mkdir(exist_ok=True)
+        logger.debug(f'{self.module}_output/ directory created at {module_output_dir}')
+        return module_output_dir
+
+    def save_counts(self, counts_csv):
+        """Save the raw counts under their final name (moving CellProfiler output into place)."""
+        with profiling.span('write_counts'):
+            if self.cp_csv is not None and not isinstance(self.cp_csv, list):
+                tb.rename_counts(self.cp_csv, counts_csv)
+            else:
+                with tb.atomic_output(counts_csv) as tmp_path:
+                    self.counts.to_csv(tmp_path, index=False)
+                for cp_csv in self.cp_csv or []:
+                    if cp_csv is not None:
+                        tb.remove_scratch(cp_csv)
+
+    def save_plate_summary(self, plates_csv, vehicle_rows, vehicle_columns):
+        """Save the per-plate summary of multi-plate experiments and report outlying plates."""
+        if self.plate.replicates < 2:
+            return
+        df_plates = self.plate.summary(vehicle_rows, vehicle_columns)
+        with profiling.span('write_csv'), tb.atomic_output(plates_csv) as tmp_path:
+            df_plates.to_csv(tmp_path, index=False)
+        for plate, ratio in zip(df_plates['Plate'], df_plates['Median Log2 Ratio']):
+            if abs(ratio) > PLATE_OUTLIER_LOG2:
+                logger.warning(f'{self.title}: plate {plate} counts differ from the other plates '
+                               f'{2 ** abs(ratio):.1f}-fold (median)')
+        logger.info(f'{self.title} summary of {len(df_plates)} plates saved to {plates_csv}')
+
+    def _count(self, stage_callback):
+        """Load or count nuclei and report the 'counted' stage."""
+        self.counts
+        if stage_callback is not None:
+            stage_callback('counted', self.cp_csv)
+
+    @abc.abstractmethod
+    def save(self, stage_callback=None, **kwargs):
+        """Write the experiment outputs to <output_dir>/<module>_output/ and return the result."""
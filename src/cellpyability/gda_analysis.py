@@ -3,17 +3,341 @@ GDA analysis module receives user input from CLI, then runs statistical and grap
 of the nuclei counts from CellProfiler.
 """
 
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
 
+from . import profiling
 from . import toolbox as tb
+from .experiment import NORMALIZE_MODES, Experiment
+from .plate import LAYOUT_COLUMNS, LAYOUT_ROWS, Plate, nanmean, nanstd
 
 # Initialize toolbox
 logger, base_dir = tb.logger, tb.base_dir
 
+# Plate layout: two conditions in triplicate, vehicle in column 2 and nine doses in columns 3-11
+UPPER_ROWS = LAYOUT_ROWS[:3]  # B-D
+LOWER_ROWS = LAYOUT_ROWS[3:]  # E-G
+COLUMN_LABELS = list(LAYOUT_COLUMNS)
+
+# pyplot keeps one global current figure, so experiments shown from threads plot one at a time
+_pyplot_lock = threading.Lock()
+
+
+@dataclass
+class GDAResult:
+    """
+    In-memory results of a GDA experiment.
+
+    Attributes:
+    -----------
+    title : str
+        Title of the experiment
+    doses : numpy.ndarray
+        Drug concentrations of columns 2-11 (vehicle first, as 0)
+    counts : pandas.DataFrame
+        Raw CellProfiler counts
+    count_matrix : pandas.DataFrame
+        Nuclei counts per well (rows B-G x columns 2-11)
+    stats : pandas.DataFrame
+        Concentrations, relative viability and relative SD per condition (as in _gda_Stats.csv)
+    viability_matrix : pandas.DataFrame
+        Relative viability per replicate and dose (as in _gda_ViabilityMatrix.csv)
+    fits : dict of str -> toolbox.CurveFit
+        Dose-response fit per condition, with the model parameters
+    ic50 : dict of str -> float
+        IC50 per condition
+    ic50_ratio : float
+        Upper IC50 / lower IC50
+    """
+    title: str
+    doses: np.ndarray
+    counts: pd.DataFrame
+    count_matrix: pd.DataFrame
+    stats: pd.DataFrame
+    viability_matrix: pd.DataFrame
+    fits: dict
+    ic50: dict
+    ic50_ratio: float
+
+
+class GDAExperiment(Experiment):
+    """
+    GDA (Growth Delay Assay) experiment for two cell lines (B-D, E-G) and one drug gradient (2-11).
+
+    Every stage is computed lazily on first access and cached; nothing is written to disk
+    until save() is called.
+
+    Parameters:
+    -----------
+    title : str
+        Title of the experiment
+    upper_name : str
+        Name for upper cell condition (rows B-D)
+    lower_name : str
+        Name for lower cell condition (rows E-G)
+    top_conc : float
+        Top concentration in molar
+    dilution : float
+        Dilution factor between columns
+    image_dir, counts_file, counts, output_dir :
+        See experiment.Experiment
+    normalize : str, optional
+        With several replicate plates, normalize each condition to its vehicle mean over all
+        plates ('pooled', default) or on each plate separately ('plate')
+    """
+
+    module = 'gda'
+
+    def __init__(self, title, upper_name, lower_name, top_conc, dilution, image_dir=None, counts_file=None, counts=None, output_dir=None, normalize='pooled'):
+        super().__init__(title, image_dir=image_dir, counts_file=counts_file, counts=counts, output_dir=output_dir)
+        if normalize not in NORMALIZE_MODES:
+            raise ValueError(f'Unknown normalization "{normalize}"; expected one of {", ".join(NORMALIZE_MODES)}')
+        self.upper_name = upper_name
+        self.lower_name = lower_name
+        self.top_conc = top_conc
+        self.dilution = dilution
+        self.normalize = normalize
+
+    @cached_property
+    def doses(self):
+        """Drug concentrations of columns 3-11."""
+        return tb.gen_dose_range(self.top_conc, self.dilution, 9) # 9 because 9 doses, excluding vehicle (columns 3-11)
+
+    @cached_property
+    def column_concentrations(self):
+        """Pair column number with drug dose."""
+        all_doses = np.insert(self.doses, 0, 0) # add zero to start of NumPy array for vehicle
+        return dict(zip(COLUMN_LABELS, all_doses))
+
+    @cached_property
+    @profiling.timed('pivot')
+    def count_matrix(self):
+        """Nuclei counts per well (rows B-G x columns 2-11, mean of any replicate plates)."""
+        count_matrix = Plate.frame(self.plate.mean(), LAYOUT_ROWS, COLUMN_LABELS)
+        logger.debug('Selected count_matrix from the plate array.')
+        return count_matrix
+
+    @cached_property
+    def conditions(self):
+        """Counts per plate and condition, shape (plates, 2 conditions, 3 replicate rows, 10 columns)."""
+        return self.plate.values(LAYOUT_ROWS, COLUMN_LABELS).reshape(
+            self.plate.replicates, 2, len(UPPER_ROWS), len(COLUMN_LABELS))
+
+    @cached_property
+    def plate_vehicles(self):
+        """Mean vehicle (column '2') nuclei count of each plate and condition, shape (plates, 2)."""
+        return nanmean(self.conditions[..., 0], axis=2)
+
+    @cached_property
+    def vehicles(self):
+        """Mean vehicle (column '2') nuclei count of the upper and lower conditions over all plates."""
+        upper_vehicle, lower_vehicle = nanmean(self.conditions[..., 0].transpose(1, 0, 2).reshape(2, -1), axis=1)
+        return float(upper_vehicle), float(lower_vehicle)
+
+    @cached_property
+    @profiling.timed('normalize')
+    def normalized(self):
+        """Each well normalized to its condition vehicle, shape (plates, 2, 3, 10)."""
+        vehicles = self.plate_vehicles if self.normalize == 'plate' else np.array(self.vehicles)[np.newaxis]
+        normalized = self.conditions / vehicles[..., np.newaxis, np.newaxis]
+        logger.debug(f'Each well normalized to its condition vehicle ({self.normalize}).')
+        return normalized
+
+    @property
+    def replicate_wells(self):
+        """Normalized wells per condition with plates and rows as one replicate axis, shape (2, plates x 3, 10)."""
+        return self.normalized.transpose(1, 0, 2, 3).reshape(2, -1, len(COLUMN_LABELS))
+
+    @cached_property
+    @profiling.timed('normalize')
+    def stats(self):
+        """Concentrations, normalized means and SDs of both conditions per column."""
+        # Mean and SD over the replicate rows (of every plate) of each condition
+        normalized_means = nanmean(self.replicate_wells, axis=1)
+        sds = nanstd(self.replicate_wells, axis=1)
+        logger.debug('Computed normalized means and standard deviations per condition.')
+
+        # Consolidate analytics into a DataFrame
+        df_stats = pd.DataFrame(columns=COLUMN_LABELS)
+        df_stats.index.name = '96-Well Column'
+        df_stats.loc['Drug Concentration'] = list(self.column_concentrations.values())
+        df_stats.loc[f'Relative Cell Viability {self.upper_name}'] = normalized_means[0].tolist()
+        df_stats.loc[f'Relative Cell Viability {self.lower_name}'] = normalized_means[1].tolist()
+        df_stats.loc[f'Relative Standard Deviation {self.upper_name}'] = sds[0].tolist()
+        df_stats.loc[f'Relative Standard Deviation {self.lower_name}'] = sds[1].tolist()
+        return df_stats
+
+    @cached_property
+    def viability_matrix(self):
+        """Each well normalized to its condition vehicle, replicates (of every plate) x doses."""
+        plates = range(1, self.plate.replicates + 1)
+        index = [f'{name} rep {i}' if len(plates) == 1 else f'{name} plate {plate} rep {i}'
+                 for name in (self.upper_name, self.lower_name) for plate in plates for i in range(1, len(UPPER_ROWS) + 1)]
+        return pd.DataFrame(
+            self.replicate_wells.reshape(-1, len(COLUMN_LABELS)),
+            index=index,
+            columns=list(self.column_concentrations.values()),
+        )
+
+    @cached_property
+    def fits(self):
+        """5PL (Hill as backup) fit of each condition's normalized means, vehicle excluded."""
+        x = np.array(self.doses)
+        fits = {}
+        for name in [self.upper_name, self.lower_name]:
+            y = np.array(self.stats.loc[f'Relative Cell Viability {name}'].tolist()[1:])
+            fits[name] = tb.fit_dose_response(x, y, name)
+            logger.debug(f'{name} curve fitting complete.')
+        return fits
+
+    @property
+    def ic50(self):
+        """IC50 per condition."""
+        return {name: fit.ic50 for name, fit in self.fits.items()}
+
+    @cached_property
+    def ic50_ratio(self):
+        """Upper IC50 / lower IC50 (NaN if either IC50 is NaN)."""
+        IC50_val_y1, IC50_val_y2 = self.ic50[self.upper_name], self.ic50[self.lower_name]
+        if np.isnan(IC50_val_y1) or np.isnan(IC50_val_y2):
+            IC50_ratio = np.nan
+        else:
+            IC50_ratio = IC50_val_y1 / IC50_val_y2
+        logger.info(f'{self.upper_name} IC50 / {self.lower_name} IC50 = {IC50_ratio}')
+        return IC50_ratio
+
+    @property
+    def result(self):
+        """All stages as a GDAResult."""
+        return GDAResult(
+            title=self.title,
+            doses=np.array(list(self.column_concentrations.values())),
+            counts=self.counts,
+            count_matrix=self.count_matrix,
+            stats=self.stats,
+            viability_matrix=self.viability_matrix,
+            fits=self.fits,
+            ic50=self.ic50,
+            ic50_ratio=self.ic50_ratio,
+        )
+
+    def plot(self, path=None, show_plot=False):
+        """Plot both dose-response curves with error bars, optionally saving to path."""
+        if show_plot:
+            # pyplot keeps one global current figure, so shown plots are drawn one at a time
+            with _pyplot_lock:
+                fig = plt.figure()
+                self._plot(fig, path)
+                plt.show()
+        else:
+            # A pyplot-free Figure, so experiments can be plotted from executor threads with any backend
+            self._plot(Figure(), path)
 
-def run_gda(title_name, upper_name, lower_name, top_conc, dilution, image_dir, show_plot=True, counts_file=None, output_dir=None):
+    def _plot(self, fig, path):
+        x = np.array(self.doses)
+        upper_fit, lower_fit = self.fits[self.upper_name], self.fits[self.lower_name]
+        y1 = np.array(self.stats.loc[f'Relative Cell Viability {self.upper_name}'].tolist()[1:])
+        y2 = np.array(self.stats.loc[f'Relative Cell Viability {self.lower_name}'].tolist()[1:])
+        upper_sd = self.stats.loc[f'Relative Standard Deviation {self.upper_name}'].tolist()
+        lower_sd = self.stats.loc[f'Relative Standard Deviation {self.lower_name}'].tolist()
+        IC50_ratio = self.ic50_ratio
+        ax = fig.subplots()
+
+        # Plot the curves
+        ax.plot(upper_fit.x_plot, upper_fit.y_plot, 'b-')
+        ax.plot(lower_fit.x_plot, lower_fit.y_plot, 'r-')
+        logger.debug('Plotted data.')
+
+        # Create scatter plot
+        # Create basic structure
+        ax.set_xscale('log')
+        ax.scatter(x, y1, color='blue', label=str(self.upper_name))
+        ax.scatter(x, y2, color='red', label=str(self.lower_name))
+        ax.errorbar(x, y1, yerr=upper_sd[1:], fmt='o', color='blue', capsize=3)
+        ax.errorbar(x, y2, yerr=lower_sd[1:], fmt='o', color='red', capsize=3)
+
+        # Annotate the plot
+        ax.set_xlabel('Concentration (M)')
+        ax.set_ylabel('Relative Cell Survival')
+        ax.set_title(str(self.title))
+        ax.text(0.05, 0.09, f'IC50 = {upper_fit.ic50:.2e}',
+            color='blue',
+            fontsize=10,
+            transform=ax.transAxes
+        )
+        ax.text(
+            0.05, 0.05, f'IC50 = {lower_fit.ic50:.2e}',
+            color='red',
+            fontsize=10,
+            transform=ax.transAxes
+        )
+        ax.text(
+            0.05, 0.01, f'IC50 ratio = {IC50_ratio:.1f}',
+            color='black',
+            fontsize=10,
+            transform=ax.transAxes
+        )
+        ax.legend()
+        if path is not None:
+            with profiling.span('plot_png'), tb.atomic_output(path) as tmp_path:
+                fig.savefig(tmp_path, dpi=200, bbox_inches='tight')
+            logger.info(f'{self.title} GDA plot saved to {path.parent}.')
+
+    def save(self, stage_callback=None, plot=True, show_plot=False):
+        """
+        Write stats, viability matrix, plot and raw counts to <output_dir>/gda_output/.
+
+        Parameters:
+        -----------
+        stage_callback : callable, optional
+            Called as stage_callback(stage, path) after each completed stage:
+            'counted' (counts CSV), 'stats' (output directory), 'plotted' (plot file)
+        plot : bool
+            Whether to draw and save the plot
+        show_plot : bool
+            Whether to display the plot
+
+        Returns:
+        --------
+        result : GDAResult
+        """
+        self._count(stage_callback)
+        gda_output_dir = self.output_path()
+
+        stats, viability_matrix = self.stats, self.viability_matrix
+        with profiling.span('write_csv'), tb.atomic_output(gda_output_dir / f'{self.title}_gda_Stats.csv') as tmp_path:
+            stats.to_csv(tmp_path)
+        logger.info(f'{self.title}_gda_Stats saved to {gda_output_dir}.')
+
+        # Save the viability matrix as a .csv
+        with profiling.span('write_csv'), tb.atomic_output(gda_output_dir / f'{self.title}_gda_ViabilityMatrix.csv') as tmp_path:
+            viability_matrix.to_csv(tmp_path)
+        logger.info(f'{self.title} viability matrix saved to {gda_output_dir}.')
+        if stage_callback is not None:
+            stage_callback('stats', gda_output_dir)
+
+        if plot:
+            plot_path = gda_output_dir / f'{self.title}_gda_plot.png'
+            self.plot(plot_path, show_plot=show_plot)
+            if stage_callback is not None:
+                stage_callback('plotted', plot_path)
+
+        # Per-plate vehicle and count summary of multi-plate experiments
+        self.save_plate_summary(gda_output_dir / f'{self.title}_gda_plates.csv', LAYOUT_ROWS, COLUMN_LABELS[:1])
+
+        # Rename the CellProfiler output using the provided title name
+        self.save_counts(gda_output_dir / f'{self.title}_gda_counts.csv')
+        logger.info(f'{self.title} raw counts saved to {gda_output_dir}.')
+        return self.result
+
+
+def run_gda(title_name, upper_name, lower_name, top_conc, dilution, image_dir, show_plot=True, counts_file=None, output_dir=None, stage_callback=None, normalize='pooled'):
     """
     Run GDA (Growth Delay Assay) analysis for two cell lines (B-D, E-G) and one drug gradient (2-11).
     
@@ -29,175 +353,25 @@ def run_gda(title_name, upper_name, lower_name, top_conc, dilution, image_dir, s
         Top concentration in molar
     dilution : float
         Dilution factor between columns
-    image_dir : str
-        Directory containing the 60 well images
+    image_dir : str or list of str
+        Directory containing the 60 well images, or one directory per replicate plate
     show_plot : bool
         Whether to display the plot (default: True)
     counts_file : str, optional
         Path to pre-existing counts CSV file (for testing)
     output_dir : str, optional
         Custom output directory. If None, uses current working directory.
+    stage_callback : callable, optional
+        Called as stage_callback(stage, path) after each completed stage:
+        'counted' (counts CSV), 'stats' (output directory), 'plotted' (plot file)
+    normalize : str, optional
+        'pooled' (default) or 'plate' vehicle normalization of replicate plates
+
+    Returns:
+    --------
+    result : GDAResult
+        Counts, stats, viability matrix, fits and IC50s in memory
     """
-    
-    # Create a concentration range array
-    doses = tb.gen_dose_range(top_conc, dilution, 9) # 9 because 9 doses, excluding vehicle (columns 3-11)
-    
-    # Run CellProfiler headless and return a DataFrame with the raw nuclei counts and the .csv path
-    df_cp, cp_csv = tb.run_cellprofiler(image_dir, counts_file=counts_file, output_dir=output_dir)
-    
-    # Load the CellProfiler counts into a DataFrame
-    df_cp.drop('ImageNumber', axis=1, inplace=True)
-    df_cp.columns = ['nuclei', 'well']
-    
-    # Rename rows from the TIFF file names to the corresponding well names
-    df_cp['well'] = df_cp['well'].apply(lambda x: tb.rename_wells(x))
-    logger.debug('CellProfiler output rows renamed to well names.')
-    
-    # Extract row/column designators for pivoting
-    df_cp[['Row','Column']] = df_cp['well'].str.extract(r'^([B-G])(\d+)$')
-    logger.debug('Extracted Row and Column from well names.')
-    
-    # Pivot nuclei counts into a matrix for fast group stats
-    count_matrix = df_cp.pivot(index='Row', columns='Column', values='nuclei')
-    logger.debug('Pivoted df_cp into count_matrix.')
-    
-    # Define upper and lower rows
-    upper_rows = ['B', 'C', 'D']
-    lower_rows = ['E', 'F', 'G']
-    
-    # Compute mean nuclei per column for upper and lower groups
-    upper_counts = count_matrix.loc[upper_rows]
-    lower_counts = count_matrix.loc[lower_rows]
-    
-    upper_means = upper_counts.mean(axis=0)
-    lower_means = lower_counts.mean(axis=0)
-    
-    # Normalize means to vehicle control (column '2')
-    upper_vehicle = upper_means['2']
-    lower_vehicle = lower_means['2']
-    upper_normalized_means = (upper_means / upper_vehicle).loc[[str(i) for i in range(2,12)]].tolist()
-    lower_normalized_means = (lower_means / lower_vehicle).loc[[str(i) for i in range(2,12)]].tolist()
-    logger.debug('Upper and lower mean nuclei counts normalized to vehicle.')
-    
-    # Compute standard deviations of normalized counts per condition
-    upper_sd = (upper_counts.div(upper_vehicle)).std(axis=0).loc[[str(i) for i in range(2,12)]].tolist()
-    lower_sd = (lower_counts.div(lower_vehicle)).std(axis=0).loc[[str(i) for i in range(2,12)]].tolist()
-    logger.debug('Computed standard deviations for normalized counts.')
-    
-    # Pair column number with drug dose
-    column_labels = [str(i) for i in range(2,12)]
-    
-    all_doses = np.insert(doses, 0, 0) # add zero to start of NumPy array for vehicle
-    column_concentrations = dict(zip(column_labels, all_doses))
-    
-    # Define file path to or create gda_output/ subfolder in output directory
-    output_base = tb.get_output_base_dir(output_dir)
-    gda_output_dir = output_base / 'gda_output'
-    gda_output_dir.mkdir(exist_ok=True)
-    logger.debug(f'gda_output/ directory created at {gda_output_dir}')
-    
-    # Consolidate analytics into a new .csv file
-    df_stats = pd.DataFrame(columns=column_labels)
-    df_stats.index.name = '96-Well Column'
-    df_stats.loc['Drug Concentration'] = list(column_concentrations.values())
-    df_stats.loc[f'Relative Cell Viability {upper_name}'] = upper_normalized_means
-    df_stats.loc[f'Relative Cell Viability {lower_name}'] = lower_normalized_means
-    df_stats.loc[f'Relative Standard Deviation {upper_name}'] = upper_sd
-    df_stats.loc[f'Relative Standard Deviation {lower_name}'] = lower_sd
-    df_stats.to_csv(gda_output_dir / f'{title_name}_gda_Stats.csv')
-    logger.info(f'{title_name}_gda_Stats saved to {gda_output_dir}.')
-    
-    # Normalize nuclei counts for each well individually
-    vehicle_map = {r: upper_vehicle for r in upper_rows}
-    vehicle_map.update({r: lower_vehicle for r in lower_rows})
-    df_cp['normalized_nuclei'] = df_cp['nuclei'] / df_cp['Row'].map(vehicle_map)
-    logger.debug('Each well normalized to its condition vehicle (Vectorized).')
-    
-    # Create viability matrix via pivot on normalized values
-    viability_matrix = df_cp.pivot(index='Row', columns='Column', values='normalized_nuclei')
-    
-    # Reindex to maintain plate order and replace column labels with doses
-    viability_matrix = viability_matrix.reindex(index=upper_rows+lower_rows, columns=column_labels)
-    viability_matrix.columns = [column_concentrations[col] for col in viability_matrix.columns]
-    
-    # Rename rows to replicates
-    viability_matrix.index = [f'{upper_name} rep {i}' for i in [1,2,3]] + [f'{lower_name} rep {i}' for i in [1,2,3]]
-    logger.debug('Created viability matrix via vectorized pivot.')
-    
-    # Save the viability matrix as a .csv
-    viability_matrix.to_csv(gda_output_dir / f'{title_name}_gda_ViabilityMatrix.csv')
-    logger.info(f'{title_name} viability matrix saved to {gda_output_dir}.')
-    
-    # Assign doses to the x-axis
-    x = np.array(doses)
-    
-    # Assign average normalized nuclei counts to the y-axis for each condition
-    # skip the vehicle at index 0
-    y1 = np.array(upper_normalized_means[1:])
-    y2 = np.array(lower_normalized_means[1:])
-    logger.debug('Assigned doses and normalized means to x and y values via NumPy, respectively.')
-    
-    # Use curve_fit to fit the data for y1 and y2 (5PL with Hill Slope as backup)\
-    # Solves algebraically for IC50 (if computable)
-    x_plot_fit_y1, y_plot_fit_y1, IC50_val_y1 = tb.fit_response_curve(x, y1, upper_name)
-    logger.debug('Upper condition curve fitting complete.')
-    x_plot_fit_y2, y_plot_fit_y2, IC50_val_y2 = tb.fit_response_curve(x, y2, lower_name)
-    logger.debug('Lower condition curve fitting complete.')
-    
-    # Calculate ratio (Handling potential NaNs safely)
-    if np.isnan(IC50_val_y1) or np.isnan(IC50_val_y2):
-        IC50_ratio = np.nan
-    else:
-        IC50_ratio = IC50_val_y1 / IC50_val_y2
-        
-    logger.info(f'{upper_name} IC50 / {lower_name} IC50 = {IC50_ratio}')
-    
-    # Plot the curves using the variables defined above
-    plt.plot(x_plot_fit_y1, y_plot_fit_y1, 'b-')
-    plt.plot(x_plot_fit_y2, y_plot_fit_y2, 'r-')
-    logger.debug('Plotted data.')
-    
-    # Create scatter plot
-    # Create basic structure
-    plt.style.use('default')
-    plt.xscale('log')
-    plt.scatter(x, y1, color='blue', label=str(upper_name))
-    plt.scatter(x, y2, color='red', label=str(lower_name))
-    plt.errorbar(x, y1, yerr=upper_sd[1:], fmt='o', color='blue', capsize=3)
-    plt.errorbar(x, y2, yerr=lower_sd[1:], fmt='o', color='red', capsize=3)
-    
-    # Annotate the plot
-    plt.xlabel('Concentration (M)')
-    plt.ylabel('Relative Cell Survival')
-    plt.title(str(title_name))
-    plt.text(0.05, 0.09, f'IC50 = {IC50_val_y1:.2e}',
-        color='blue',
-        fontsize=10,
-        transform=plt.gca().transAxes
-    )
-    plt.text(
-        0.05, 0.05, f'IC50 = {IC50_val_y2:.2e}',
-        color='red',
-        fontsize=10,
-        transform=plt.gca().transAxes
-    )
-    plt.text(
-        0.05, 0.01, f'IC50 ratio = {IC50_ratio:.1f}',
-        color='black',
-        fontsize=10,
-        transform=plt.gca().transAxes
-    )
-    plt.legend()
-    plt.savefig(gda_output_dir / f'{title_name}_gda_plot.png', dpi=200, bbox_inches='tight')
-    logger.info(f'{title_name} GDA plot saved to {gda_output_dir}.')
-    
-    if show_plot:
-        plt.show()
-    else:
-        plt.close()
-    
-    # Rename the CellProfiler output using the provided title name
-    counts_csv = gda_output_dir / f'{title_name}_gda_counts.csv'
-    
-    tb.rename_counts(cp_csv, counts_csv)
-    logger.info(f'{title_name} raw counts saved to {gda_output_dir}.')
+    experiment = GDAExperiment(title_name, upper_name, lower_name, top_conc, dilution,
+                               image_dir=image_dir, counts_file=counts_file, output_dir=output_dir, normalize=normalize)
+    return experiment.save(stage_callback=stage_callback, show_plot=show_plot)
@@ -0,0 +1,472 @@
+"""
+Ingest module counts whole-plate image containers and archives without extracting every well to disk.
+
+Some imagers export a plate as one multi-page TIFF or OME-TIFF, or as an OME-Zarr plate,
+instead of one TIFF per well, and acquisitions are often archived as one zip or tar.gz per
+plate. The readers here map pages, arrays or archive members to wells and read one well
+image at a time (TIFF pages are decoded on demand, Zarr chunks are read only for the
+requested plane, archive members are streamed). Wells are staged for CellProfiler in
+chunks: CellProfiler counts one chunk while the next is staged, and each chunk is deleted
+once counted, so at most two chunks are ever on disk.
+
+Supported containers:
+    *.tif / *.tiff    OME-TIFF (Plate/Well/WellSample metadata), or a plain multi-page TIFF
+                      whose pages are named by well (PageName or ImageDescription tag), or
+                      that has 60 pages (B2-G11) or 96 pages (A1-H12) in row-major order
+    OME-Zarr plate    directory whose .zattrs holds 'plate' metadata (NGFF 0.4, Zarr v2);
+                      uncompressed, zlib and gzip chunks are read natively, other
+                      compressors (e.g., blosc) need the numcodecs package
+    *.zip, *.tar,     archives of per-well images; only members that rename_wells maps to
+    *.tar.gz, ...     a plate well (B2-G11) are extracted
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path, PurePosixPath
+
+import numpy as np
+import pandas as pd
+
+from . import accounting, profiling
+from . import toolbox as tb
+
+# Initialize toolbox
+logger = tb.logger
+
+TIFF_SUFFIXES = ('.tif', '.tiff')
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+DEFAULT_CHUNK_WELLS = 12  # overridable with CELLPYABILITY_INGEST_CHUNK_WELLS
+COPY_BUFFER = 4 * 1024 * 1024
+
+# Wells of the plate layout (B2-G11) and of a full 96-well plate, in row-major order
+INNER_WELLS = [f'{row}{col}' for row, col in product('BCDEFG', range(2, 12))]
+ALL_WELLS = [f'{row}{col}' for row, col in product('ABCDEFGH', range(1, 13))]
+
+WELL_NAME = re.compile(r'^\s*([A-Ha-h])0*(\d{1,2})\s*$')
+
+
+def is_plate_container(path):
+    """Whether path is a whole-plate TIFF, OME-Zarr plate or image archive rather than a directory of well images."""
+    path = Path(path)
+    if path.is_file():
+        return path.suffix.lower() in TIFF_SUFFIXES or is_archive(path)
+    zattrs = path / '.zattrs'
+    if zattrs.is_file():
+        try:
+            return 'plate' in json.loads(zattrs.read_text())
+        except ValueError:
+            return False
+    return False
+
+
+def is_archive(path):
+    """Whether path names a zip or (compressed) tar archive."""
+    return Path(path).name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def open_plate(path):
+    """Open a plate container with the matching reader."""
+    path = Path(path)
+    if is_archive(path):
+        return ArchivePlate(path)
+    if path.is_file():
+        return TiffPlate(path)
+    return ZarrPlate(path)
+
+
+def _well_name(text):
+    """Normalized well name (B02 -> B2), or None if text is not a well name."""
+    match = WELL_NAME.match(text or '')
+    return f'{match.group(1).upper()}{match.group(2)}' if match else None
+
+
+def _plane_index(dimension_order, sizes, c=0, z=0, t=0):
+    """Index of plane (c, z, t) among the planes of an OME image with the given dimension order."""
+    index, stride = 0, 1
+    for dim in dimension_order[2:]:  # order always starts with XY
+        index += {'C': c, 'Z': z, 'T': t}[dim] * stride
+        stride *= sizes[dim]
+    return index
+
+
+class PlateContainer:
+    """
+    Base class of the plate readers, staging wells for CellProfiler and combining the counts.
+
+    Subclasses set fields (well label -> fields of view) and implement read(label, field).
+    """
+
+    fields = {}
+
+    def _chunk_dir(self, stage_root, index):
+        """Create the staging directory of one chunk, named after the container (e.g., for its QC table)."""
+        stage_dir = Path(stage_root) / f'{self.path.name.split(".")[0]}_chunk_{index:03d}'
+        stage_dir.mkdir()
+        return stage_dir
+
+    def stage_chunks(self, stage_root, chunk_wells):
+        """Stage chunk_wells wells at a time, yielding the directory of each chunk."""
+        labels = list(self.fields)
+        for index, start in enumerate(range(0, len(labels), chunk_wells)):
+            stage_dir = self._chunk_dir(stage_root, index)
+            stage_wells(self, labels[start:start + chunk_wells], stage_dir)
+            yield stage_dir
+
+    def combine(self, df_fields):
+        """Sum the counts of the fields of each well into one row per well, named <well>.tif."""
+        labels = list(self.fields)
+        df_fields = df_fields.assign(
+            label=df_fields['FileName_images'].str.extract(r'^([A-H]\d{1,2}(?:_p\d+)?)_f\d+', expand=False)
+        )
+        counts = df_fields.groupby('label')['Count_nuclei'].sum().reindex(labels)
+        return pd.DataFrame({
+            'Count_nuclei': counts.to_numpy(),
+            'FileName_images': [f'{label.split("_")[0]}.tif' for label in labels],
+            'ImageNumber': range(1, len(labels) + 1),
+        })
+
+    def close(self):
+        pass
+
+
+class TiffPlate(PlateContainer):
+    """
+    Multi-page TIFF or OME-TIFF plate, read one page at a time.
+
+    Attributes:
+    -----------
+    fields : dict
+        Well label (e.g., B2, or B2_p2 for the second plate) -> list of page indices (one per field of view)
+    """
+
+    def __init__(self, path, channel=0):
+        from PIL import Image  # Pillow is installed with matplotlib
+
+        self.path = Path(path)
+        self._image = Image.open(self.path)
+        self.n_pages = getattr(self._image, 'n_frames', 1)
+        description = self._image.tag_v2.get(270)
+        if description and '<OME' in description:
+            self.fields = self._ome_fields(description, channel)
+        else:
+            self.fields = self._page_fields()
+
+    def _ome_fields(self, description, channel):
+        """Map wells to pages from the OME-XML Plate/Well/WellSample and Image/Pixels/TiffData elements."""
+        root = ET.fromstring(description)
+        first_ifd, offset = {}, 0
+        for image in root.iterfind('.//{*}Image'):
+            pixels = image.find('{*}Pixels')
+            sizes = {dim: int(pixels.get(f'Size{dim}', 1)) for dim in 'CZT'}
+            tiff_data = pixels.find('{*}TiffData')
+            start = int(tiff_data.get('IFD', 0)) if tiff_data is not None else offset
+            order = pixels.get('DimensionOrder', 'XYZCT')
+            first_ifd[image.get('ID')] = start + _plane_index(order, sizes, c=min(channel, sizes['C'] - 1))
+            offset = start + sizes['C'] * sizes['Z'] * sizes['T']
+
+        plates = list(root.iterfind('.//{*}Plate'))
+        if not plates:
+            raise ValueError(f'{self.path.name} has OME metadata but no Plate element')
+
+        # Wells of later plates (e.g., synergy replicates) are labeled <well>_p<plate>
+        fields = {}
+        for number, plate in enumerate(plates, start=1):
+            for well in plate.iterfind('.//{*}Well'):
+                name = f'{chr(ord("A") + int(well.get("Row")))}{int(well.get("Column")) + 1}'
+                label = name if number == 1 else f'{name}_p{number}'
+                for sample in well.iterfind('.//{*}WellSample'):
+                    image_ref = sample.find('{*}ImageRef')
+                    if image_ref is not None and image_ref.get('ID') in first_ifd:
+                        fields.setdefault(label, []).append(first_ifd[image_ref.get('ID')])
+        return fields
+
+    def _page_fields(self):
+        """Map wells to pages from page names, or from page order for 60- and 96-page stacks."""
+        names = []
+        for page in range(self.n_pages):
+            self._image.seek(page)
+            names.append(_well_name(self._image.tag_v2.get(285)) or _well_name(self._image.tag_v2.get(270)))
+        if all(names) and len(set(names)) == len(names):
+            return {name: [page] for page, name in enumerate(names)}
+        if self.n_pages == len(INNER_WELLS):
+            return {name: [page] for page, name in enumerate(INNER_WELLS)}
+        if self.n_pages == len(ALL_WELLS):
+            return {name: [page] for page, name in enumerate(ALL_WELLS)}
+        raise ValueError(f'Cannot map the {self.n_pages} pages of {self.path.name} to wells: pages are not named '
+                         f'by well and the stack does not have {len(INNER_WELLS)} or {len(ALL_WELLS)} pages')
+
+    def read(self, well, field=0):
+        """Decode the page of one field of a well."""
+        self._image.seek(self.fields[well][field])
+        return np.array(self._image)
+
+    def close(self):
+        self._image.close()
+
+
+class ZarrArray:
+    """Minimal Zarr v2 array reader that loads only the chunks overlapping the requested plane."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / '.zarray').read_text())
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.order = meta.get('order', 'C')
+        self.fill_value = meta.get('fill_value') or 0
+        self.separator = meta.get('dimension_separator', '.')
+        self.compressor = meta.get('compressor')
+        if meta.get('filters'):
+            raise ValueError(f'Zarr filters are not supported ({self.path})')
+
+    def _decode(self, raw):
+        codec = (self.compressor or {}).get('id')
+        if codec is None:
+            return raw
+        if codec == 'zlib':
+            return zlib.decompress(raw)
+        if codec == 'gzip':
+            return gzip.decompress(raw)
+        try:
+            import numcodecs
+        except ImportError:
+            raise ValueError(f'Zarr chunks compressed with {codec} need the numcodecs package '
+                             f'(pip install numcodecs)') from None
+        return numcodecs.get_codec(self.compressor).decode(raw)
+
+    def _chunk(self, index):
+        chunk_file = self.path / self.separator.join(str(i) for i in index)
+        if not chunk_file.exists():
+            return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+        data = np.frombuffer(self._decode(chunk_file.read_bytes()), dtype=self.dtype)
+        return data.reshape(self.chunks, order=self.order)
+
+    def plane(self, leading):
+        """Return the 2D plane at the given indices of the leading (non-YX) dimensions."""
+        height, width = self.shape[-2:]
+        chunk_h, chunk_w = self.chunks[-2:]
+        lead_chunk = tuple(i // c for i, c in zip(leading, self.chunks))
+        lead_offset = tuple(i % c for i, c in zip(leading, self.chunks))
+        plane = np.empty((height, width), dtype=self.dtype)
+        for cy in range(-(-height // chunk_h)):
+            for cx in range(-(-width // chunk_w)):
+                block = self._chunk(lead_chunk + (cy, cx))[lead_offset]
+                y, x = cy * chunk_h, cx * chunk_w
+                plane[y:y + chunk_h, x:x + chunk_w] = block[:min(chunk_h, height - y), :min(chunk_w, width - x)]
+        return plane
+
+
+class ZarrPlate(PlateContainer):
+    """
+    OME-Zarr (NGFF) plate, reading the full-resolution plane of one field at a time.
+
+    Attributes:
+    -----------
+    fields : dict
+        Well name -> list of field image paths relative to the plate root
+    """
+
+    def __init__(self, path, channel=0):
+        self.path = Path(path)
+        self.channel = channel
+        plate = json.loads((self.path / '.zattrs').read_text())['plate']
+        rows = [row['name'] for row in plate['rows']]
+        columns = [column['name'] for column in plate['columns']]
+
+        self.fields = {}
+        for well in plate['wells']:
+            well_path = well['path']
+            if 'rowIndex' in well:
+                name = _well_name(f'{rows[well["rowIndex"]]}{columns[well["columnIndex"]]}')
+            else:
+                name = _well_name(''.join(well_path.split('/')))
+            well_attrs = json.loads((self.path / well_path / '.zattrs').read_text())['well']
+            self.fields[name] = [f'{well_path}/{image["path"]}' for image in well_attrs['images']]
+
+    def read(self, well, field=0):
+        """Read the first time point and z plane of the selected channel of one field of a well."""
+        image_path = self.path / self.fields[well][field]
+        multiscales = json.loads((image_path / '.zattrs').read_text())['multiscales'][0]
+        array = ZarrArray(image_path / multiscales['datasets'][0]['path'])
+        axes = [axis['name'] if isinstance(axis, dict) else axis for axis in multiscales.get('axes', [])]
+        leading = [0] * (len(array.shape) - 2)
+        if 'c' in axes[:-2]:
+            leading[axes.index('c')] = min(self.channel, array.shape[axes.index('c')] - 1)
+        return array.plane(tuple(leading))
+
+
+class ArchivePlate(PlateContainer):
+    """
+    Zip or tar archive of per-well images, streamed member by member.
+
+    Only image members whose file names rename_wells maps to a plate well (B2-G11) are
+    extracted. They keep their paths inside the archive, so the counts are the same as
+    for the extracted directory. Tar members are read in one pass, since compressed tar
+    streams cannot seek; zip members are read in path order.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.is_zip = zipfile.is_zipfile(self.path)
+        if not self.is_zip and not tarfile.is_tarfile(self.path):
+            raise ValueError(f'{self.path.name} is not a zip or tar archive')
+
+    @staticmethod
+    def _wanted(name):
+        """Relative path to extract a member to, or None if it is not a plate well image."""
+        member = PurePosixPath(name)
+        if member.is_absolute() or '..' in member.parts or any(part.startswith(('.', '__MACOSX')) for part in member.parts):
+            return None
+        if member.suffix.lower() not in accounting.IMAGE_SUFFIXES or tb.rename_wells(member.name) not in INNER_WELLS:
+            return None
+        return Path(*member.parts)
+
+    def _members(self):
+        """Yield (relative path, file object) of the wanted members."""
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                for info in sorted(archive.infolist(), key=lambda info: info.filename):
+                    relative = self._wanted(info.filename)
+                    if relative is not None and not info.is_dir():
+                        with archive.open(info) as member:
+                            yield relative, member
+        else:
+            with tarfile.open(self.path, 'r|*') as archive:
+                for info in archive:
+                    relative = self._wanted(info.name)
+                    if relative is not None and info.isfile():
+                        yield relative, archive.extractfile(info)
+
+    def stage_chunks(self, stage_root, chunk_wells):
+        """Extract chunk_wells well images at a time, yielding the directory of each chunk."""
+        stage_dir, staged, index = None, 0, 0
+        for relative, member in self._members():
+            if stage_dir is None:
+                stage_dir = self._chunk_dir(stage_root, index)
+            target = stage_dir / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with profiling.span('ingest'), open(target, 'wb') as f:
+                shutil.copyfileobj(member, f, COPY_BUFFER)
+            staged += 1
+            if staged == chunk_wells:
+                yield stage_dir
+                stage_dir, staged, index = None, 0, index + 1
+        if stage_dir is not None:
+            yield stage_dir
+
+    def combine(self, df_fields):
+        """Images are counted as they are, one row per image, numbered across chunks."""
+        return df_fields.assign(ImageNumber=range(1, len(df_fields) + 1))
+
+
+def stage_wells(plate, wells, stage_dir):
+    """
+    Write the fields of wells as TIFFs named <well label>_f<field>.tif in stage_dir.
+
+    Returns:
+    --------
+    total_bytes : int
+        Bytes written
+    """
+    from PIL import Image
+
+    total_bytes = 0
+    with profiling.span('ingest'):
+        for well in wells:
+            for field in range(len(plate.fields[well])):
+                image_file = Path(stage_dir) / f'{well}_f{field + 1:02d}.tif'
+                Image.fromarray(plate.read(well, field)).save(image_file)
+                total_bytes += image_file.stat().st_size
+    return total_bytes
+
+
+def _chunk_size():
+    value = os.environ.get('CELLPYABILITY_INGEST_CHUNK_WELLS', '').strip()
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    return DEFAULT_CHUNK_WELLS
+
+
+def count_plate(container, output_dir=None, chunk_wells=None):
+    """
+    Count nuclei in a whole-plate container, staging chunk_wells wells at a time for CellProfiler.
+
+    For TIFF and Zarr plates, fields of the same well are summed, so the counts have one row
+    per well, named <well>.tif, as if CellProfiler had been run on a directory of per-well
+    images. Wells of multi-plate OME-TIFFs follow plate by plate, like the replicate plates of
+    a synergy experiment. Archive members are counted under their own file names.
+
+    Parameters:
+    -----------
+    container : str or Path
+        Multi-page TIFF, OME-TIFF, OME-Zarr plate or archive of well images
+    output_dir : str, optional
+        Base directory for output files (as for run_cellprofiler)
+    chunk_wells : int, optional
+        Wells staged per CellProfiler run. If None, uses CELLPYABILITY_INGEST_CHUNK_WELLS (default: 12).
+
+    Returns:
+    --------
+    df_cp : pandas.DataFrame
+        DataFrame with nuclei counts
+    cp_csv : Path
+        Path to the combined counts CSV file (in the last run's scratch directory)
+    """
+    chunk_wells = chunk_wells or _chunk_size()
+    try:
+        plate = open_plate(container)
+    except (OSError, ValueError, KeyError) as e:
+        logger.critical(f'Cannot read plate container {container}: {e}')
+        exit(1)
+    logger.info(f'Counting {Path(container).name} in chunks of up to {chunk_wells} wells')
+
+    stage_root = tempfile.TemporaryDirectory(prefix='cellpyability-ingest-')
+    chunks = plate.stage_chunks(stage_root.name, chunk_wells)
+    frames, cp_csvs = [], []
+    try:
+        # One thread stages the next chunk while CellProfiler counts the current one
+        with ThreadPoolExecutor(max_workers=1) as stager:
+            pending = stager.submit(next, chunks, None)
+            while True:
+                stage_dir = pending.result()
+                if stage_dir is None:
+                    break
+                pending = stager.submit(next, chunks, None)
+                logger.debug(f'Chunk {len(frames) + 1} of {Path(container).name} staged')
+                df_chunk, cp_csv = tb.run_cellprofiler(stage_dir, output_dir=output_dir)
+                frames.append(df_chunk)
+                cp_csvs.append(cp_csv)
+                shutil.rmtree(stage_dir, ignore_errors=True)
+    except BaseException:
+        for chunk_csv in cp_csvs:
+            tb.remove_scratch(chunk_csv)
+        raise
+    finally:
+        chunks.close()
+        stage_root.cleanup()
+        plate.close()
+
+    if not frames:
+        logger.critical(f'No well images found in {container}')
+        exit(1)
+    df_cp = plate.combine(pd.concat(frames, ignore_index=True))
+    logger.info(f'Counted {len(df_cp)} wells of {Path(container).name} in {len(frames)} CellProfiler runs')
+
+    # Keep the combined counts in the last run's scratch directory, where save_counts expects them
+    cp_csv = cp_csvs[-1]
+    with tb.atomic_output(cp_csv) as tmp_path:
+        df_cp.to_csv(tmp_path, index=False)
+    for chunk_csv in cp_csvs[:-1]:
+        tb.remove_scratch(chunk_csv)
+    return df_cp, cp_csv
@@ -0,0 +1,145 @@
+"""
+Journal module records which stages of each batch experiment have completed.
+
+Each experiment has one JSON file in <output_root>/batch_journal/, rewritten atomically after
+every stage, so concurrent workers never share a file and a crash never leaves a torn record.
+The counts CSV is checkpointed next to it as soon as counting finishes (the per-plate CSVs of
+multi-plate experiments combined into one), which lets a resumed batch skip CellProfiler for
+any experiment that got past counting.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from . import toolbox as tb
+from .experiment import combine_plate_counts
+
+# Initialize toolbox
+logger = tb.logger
+
+# Stages in the order they complete ('done' is recorded once the whole experiment succeeds)
+STAGES = ('counted', 'stats', 'plotted', 'done')
+
+
+class BatchJournal:
+    """
+    Per-experiment stage records for one batch output directory.
+
+    Parameters:
+    -----------
+    output_root : str or Path
+        Batch output directory; the journal lives in output_root/batch_journal/
+    """
+
+    def __init__(self, output_root):
+        self.journal_dir = Path(output_root) / 'batch_journal'
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+
+    def _record_path(self, title):
+        return self.journal_dir / f'{title}.json'
+
+    def counts_checkpoint(self, title):
+        """Path where the counts CSV of an experiment is checkpointed."""
+        return self.journal_dir / f'{title}_counts.csv'
+
+    def load(self, title):
+        """Return the journal record of an experiment, or None if it has none."""
+        try:
+            with open(self._record_path(title)) as record_file:
+                return json.load(record_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, record):
+        """Write a record via a temporary file and rename, so readers never see a partial file."""
+        record_path = self._record_path(record['title'])
+        tmp_path = record_path.with_name(f'.{record_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as record_file:
+            json.dump(record, record_file, indent=2)
+        os.replace(tmp_path, record_path)
+
+    def start(self, experiment):
+        """Start a fresh record for an experiment, discarding any previous progress."""
+        self.counts_checkpoint(experiment['title']).unlink(missing_ok=True)
+        self._write({'title': experiment['title'], 'experiment': experiment, 'stages': {}})
+
+    def record(self, experiment, stage, path=None):
+        """
+        Mark a stage of an experiment complete.
+
+        Parameters:
+        -----------
+        experiment : dict
+            Experiment dictionary (see batch.parse_experiment)
+        stage : str
+            One of STAGES
+        path : str, Path or list, optional
+            Output of the stage; for 'counted', the counts CSV, or the per-plate counts CSVs
+            of a multi-plate experiment (checkpointed only if every plate has one)
+        """
+        record = self.load(experiment['title']) or {'title': experiment['title'], 'experiment': experiment, 'stages': {}}
+        entry = {'time': datetime.now().isoformat(timespec='seconds')}
+
+        if stage == 'counted' and isinstance(path, (list, tuple)):
+            if path and all(plate_csv is not None for plate_csv in path):
+                # One checkpoint of every plate, numbered in order as when the plates were counted
+                checkpoint = self.counts_checkpoint(experiment['title'])
+                with tb.atomic_output(checkpoint) as tmp_path:
+                    combine_plate_counts([pd.read_csv(plate_csv) for plate_csv in path]).to_csv(tmp_path, index=False)
+                entry['path'] = str(checkpoint)
+                entry['plates'] = [str(plate_csv) for plate_csv in path]
+        elif stage == 'counted' and path is not None:
+            # Keep a private copy: later stages move the CellProfiler output to its final name
+            checkpoint = self.counts_checkpoint(experiment['title'])
+            if Path(path).resolve() != checkpoint.resolve():
+                shutil.copy2(path, checkpoint)
+            entry['path'] = str(checkpoint)
+        elif path is not None:
+            entry['path'] = str(path)
+
+        record['stages'][stage] = entry
+        self._write(record)
+        logger.debug(f'Journal: {experiment["title"]} stage {stage} complete')
+
+    def stage_callback(self, experiment):
+        """Return a stage_callback for the analysis modules that records into this journal."""
+        return lambda stage, path: self.record(experiment, stage, path)
+
+    def resume_point(self, experiment):
+        """
+        Work out how far a previous run of this experiment got.
+
+        The record only counts if it was made for the same experiment parameters.
+
+        Returns:
+        --------
+        last_stage : str or None
+            Last completed stage, or None to start from scratch
+        counts_file : Path or None
+            Checkpointed counts CSV to resume from, if counting completed
+        """
+        record = self.load(experiment['title'])
+        if record is None or not record['stages']:
+            return None, None
+
+        if _comparable(record.get('experiment', {})) != _comparable(experiment):
+            logger.info(f'Journal: parameters of {experiment["title"]} changed since the last run. Starting over.')
+            return None, None
+
+        last_stage = max(record['stages'], key=STAGES.index)
+        counts_file = self.counts_checkpoint(experiment['title'])
+        if not counts_file.exists():
+            if last_stage == 'done':
+                return last_stage, None
+            return None, None
+        return last_stage, counts_file
+
+
+def _comparable(experiment):
+    """Experiment parameters that must match for a journal record to be reused."""
+    return {key: value for key, value in experiment.items() if key != 'counts_file'}
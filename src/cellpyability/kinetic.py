@@ -0,0 +1,296 @@
+"""
+Kinetic module follows one live-cell GDA plate over time, one timepoint at a time.
+
+Each imaging timepoint's counts are added to a per-plate (time x row x column) array kept in
+kinetic_output/<title>/. Adding a timepoint computes only that timepoint: relative viability and
+its IC50, and growth rate (GR) values relative to the first timepoint and their GR50 and GRmax
+(Hafner et al., Nat Methods 2016). Earlier timepoints are read back, not refit. GR uses each
+well's own first-timepoint count as its baseline, so uneven seeding does not bias it:
+
+    GR(c, t) = 2 ** (log2(x(c, t) / x(c, 0)) / log2(x_vehicle(t) / x_vehicle(0))) - 1
+
+GR is 1 for untreated growth, 0 for complete cytostasis and negative for cell killing.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from . import profiling
+from . import toolbox as tb
+from .gda_analysis import COLUMN_LABELS, UPPER_ROWS
+from .plate import COLUMNS, LAYOUT_ROWS, ROWS, SHAPE, Plate, nanmean, nanstd
+
+# Initialize toolbox
+logger = tb.logger
+
+WELLS = [row + column for row in ROWS for column in COLUMNS]
+TIME_COLUMN = 'Time (h)'
+GR_COLUMNS = [TIME_COLUMN, 'Condition', 'Drug Concentration', 'Relative Cell Viability', 'GR', 'GR SD']
+METRICS_COLUMNS = [TIME_COLUMN, 'Condition', 'Vehicle Doublings', 'IC50', 'GR50', 'GRmax']
+PARAMETERS = ('upper_name', 'lower_name', 'top_conc', 'dilution')
+
+
+def _fit_midpoint(x, y, name):
+    """Concentration where the fitted curve crosses 0.5, NaN if the values cannot be fit."""
+    if not np.isfinite(y).all():
+        return np.nan
+    return tb.fit_dose_response(x, y, name).ic50
+
+
+def _replace_rows(df, new_rows, times):
+    """Replace the rows of times in df with new_rows, ordered by time."""
+    kept = df[~np.isin(df[TIME_COLUMN].to_numpy(dtype=float), times)]
+    frames = [frame for frame in (kept, *new_rows) if not frame.empty]
+    return pd.concat(frames).sort_values(TIME_COLUMN, kind='stable').reset_index(drop=True)
+
+
+class KineticSeries:
+    """
+    Time series of one GDA plate (two conditions in rows B-D and E-G, doses in columns 2-11).
+
+    The series is loaded from kinetic_output/<title>/ if it exists, so each imaging run adds
+    its timepoint to the same series. Add one timepoint at a time per series.
+
+    Parameters:
+    -----------
+    title : str
+        Title of the plate series
+    upper_name : str
+        Name for upper cell condition (rows B-D)
+    lower_name : str
+        Name for lower cell condition (rows E-G)
+    top_conc : float
+        Top concentration in molar
+    dilution : float
+        Dilution factor between columns
+    output_dir : str, optional
+        Custom output directory. If None, uses current working directory.
+
+    Attributes:
+    -----------
+    times : numpy.ndarray
+        Timepoints in hours, ascending
+    counts : numpy.ndarray
+        Mean nuclei count of the replicate images per well, shape (timepoints, 8, 12)
+    gr : pandas.DataFrame
+        Relative viability and GR per timepoint, condition and dose (as in _kinetic_GR.csv)
+    metrics : pandas.DataFrame
+        Vehicle doublings, IC50, GR50 and GRmax per timepoint and condition (as in _kinetic_metrics.csv)
+    """
+
+    def __init__(self, title, upper_name, lower_name, top_conc, dilution, output_dir=None):
+        self.title = title
+        self.upper_name = upper_name
+        self.lower_name = lower_name
+        self.top_conc = float(top_conc)
+        self.dilution = float(dilution)
+        self.output_dir = output_dir
+        self.series_dir = tb.get_output_base_dir(output_dir) / 'kinetic_output' / title
+        self.doses = np.insert(tb.gen_dose_range(self.top_conc, self.dilution, 9), 0, 0)  # vehicle first
+
+        self.times = np.empty(0)
+        self.counts = np.empty((0, *SHAPE))
+        self.gr = pd.DataFrame(columns=GR_COLUMNS)
+        self.metrics = pd.DataFrame(columns=METRICS_COLUMNS)
+        self._load()
+
+    def _path(self, suffix):
+        return self.series_dir / f'{self.title}_kinetic{suffix}'
+
+    @property
+    def parameters(self):
+        return {name: getattr(self, name) for name in PARAMETERS}
+
+    def _load(self):
+        """Read an existing series; its plate parameters must match this one's."""
+        if not self._path('.json').exists():
+            return
+        saved = json.loads(self._path('.json').read_text())
+        if saved != self.parameters:
+            raise ValueError(f'Kinetic series {self.title} was started with {saved}, not {self.parameters}')
+        df_counts = pd.read_csv(self._path('_counts.csv'), index_col=0)
+        self.times = df_counts.index.to_numpy(dtype=float)
+        self.counts = df_counts.reindex(columns=WELLS).to_numpy(dtype=float).reshape(-1, *SHAPE)
+        self.gr = pd.read_csv(self._path('_GR.csv'))
+        self.metrics = pd.read_csv(self._path('_metrics.csv'))
+        logger.info(f'Loaded kinetic series {self.title} with {len(self.times)} timepoints.')
+
+    def conditions(self, index):
+        """Counts of timepoint index per condition, shape (2 conditions, 3 replicate rows, 10 columns)."""
+        row_index, column_index = Plate.index(LAYOUT_ROWS, COLUMN_LABELS)
+        return self.counts[index][row_index, column_index].reshape(2, len(UPPER_ROWS), len(COLUMN_LABELS))
+
+    def add_timepoint(self, time_h, image_dir=None, counts_file=None, counts=None):
+        """
+        Count a timepoint (or take its counts) and compute its metrics.
+
+        A timepoint already in the series is replaced. Only the new timepoint is computed,
+        unless it is (or replaces) the first timepoint, which every GR value is relative to.
+
+        Parameters:
+        -----------
+        time_h : float
+            Time of imaging in hours (e.g., since treatment)
+        image_dir, counts_file, counts :
+            Images to count with CellProfiler, a counts CSV, or counts as a DataFrame
+
+        Returns:
+        --------
+        metrics : pandas.DataFrame
+            Metrics rows of the new timepoint
+        """
+        time_h = float(time_h)
+        if counts is None:
+            if image_dir is None and counts_file is None:
+                raise ValueError('add_timepoint needs image_dir, counts_file or counts.')
+            counts, cp_csv = tb.run_cellprofiler(image_dir, counts_file=counts_file, output_dir=self.output_dir)
+            self.series_dir.mkdir(parents=True, exist_ok=True)
+            with profiling.span('write_counts'):
+                tb.rename_counts(cp_csv, self.series_dir / f'{self.title}_{time_h:g}h_counts.csv')
+
+        with profiling.span('pivot'):
+            matrix = Plate.from_counts(counts).mean(ROWS, COLUMNS)
+        existing = np.isclose(self.times, time_h)
+        if existing.any():
+            logger.info(f'Replacing timepoint {time_h:g} h of {self.title}.')
+            self.times, self.counts = self.times[~existing], self.counts[~existing]
+        position = int(np.searchsorted(self.times, time_h))
+        self.times = np.insert(self.times, position, time_h)
+        self.counts = np.insert(self.counts, position, matrix, axis=0)
+
+        # GR is relative to the first timepoint, so a new first timepoint changes every row
+        update = self.times if position == 0 else [time_h]
+        gr_rows, metrics_rows = zip(*(self._compute(np.flatnonzero(self.times == t)[0]) for t in update))
+        self.gr = _replace_rows(self.gr, gr_rows, update)
+        self.metrics = _replace_rows(self.metrics, metrics_rows, update)
+        logger.info(f'Timepoint {time_h:g} h added to {self.title} ({len(update)} timepoint(s) computed).')
+        return self.metrics[self.metrics[TIME_COLUMN] == time_h]
+
+    @profiling.timed('normalize')
+    def _compute(self, index):
+        """Relative viability, GR and their fits for timepoint index."""
+        time_h = self.times[index]
+        conditions = self.conditions(index)
+        vehicles = nanmean(conditions[:, :, 0], axis=1)
+        viability = nanmean(conditions / vehicles[:, np.newaxis, np.newaxis], axis=1)
+
+        if index == 0:
+            gr = gr_sd = np.full(viability.shape, np.nan)
+            doublings = np.zeros(len(vehicles))
+        else:
+            # Fold change of every well since the first timepoint, relative to that of its condition's vehicle
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fold = conditions / self.conditions(0)
+                doublings = np.log2(nanmean(fold[:, :, 0], axis=1))
+                per_well = 2 ** (np.log2(fold) / doublings[:, np.newaxis, np.newaxis]) - 1
+            per_well[~np.isfinite(per_well) | (doublings <= 0)[:, np.newaxis, np.newaxis]] = np.nan
+            gr, gr_sd = nanmean(per_well, axis=1), nanstd(per_well, axis=1)
+            for name, value in zip((self.upper_name, self.lower_name), doublings):
+                if not value > 0:
+                    logger.warning(f'{name} vehicle did not grow by {time_h:g} h; GR is undefined.')
+
+        gr_rows, metrics_rows = [], []
+        for i, name in enumerate((self.upper_name, self.lower_name)):
+            gr_rows.append(pd.DataFrame({
+                TIME_COLUMN: time_h, 'Condition': name, 'Drug Concentration': self.doses,
+                'Relative Cell Viability': viability[i], 'GR': gr[i], 'GR SD': gr_sd[i],
+            }))
+            metrics_rows.append(pd.DataFrame([{
+                TIME_COLUMN: time_h, 'Condition': name, 'Vehicle Doublings': doublings[i],
+                'IC50': _fit_midpoint(self.doses[1:], viability[i, 1:], name),
+                'GR50': _fit_midpoint(self.doses[1:], gr[i, 1:], f'{name} GR') if index else np.nan,
+                'GRmax': gr[i, -1],  # GR at the top concentration (column 11)
+            }]))
+        return pd.concat(gr_rows, ignore_index=True), pd.concat(metrics_rows, ignore_index=True)
+
+    def save(self, plot=True):
+        """Write the series, its GR values and metrics (and the kinetic plot) to kinetic_output/<title>/."""
+        self.series_dir.mkdir(parents=True, exist_ok=True)
+        with profiling.span('write_csv'):
+            with tb.atomic_output(self._path('.json')) as tmp_path:
+                Path(tmp_path).write_text(json.dumps(self.parameters))
+            df_counts = pd.DataFrame(self.counts.reshape(len(self.times), -1), index=self.times, columns=WELLS)
+            df_counts.index.name = TIME_COLUMN
+            with tb.atomic_output(self._path('_counts.csv')) as tmp_path:
+                df_counts.dropna(axis=1, how='all').to_csv(tmp_path)
+            with tb.atomic_output(self._path('_GR.csv')) as tmp_path:
+                self.gr.to_csv(tmp_path, index=False)
+            with tb.atomic_output(self._path('_metrics.csv')) as tmp_path:
+                self.metrics.to_csv(tmp_path, index=False)
+        logger.info(f'{self.title} kinetic series saved to {self.series_dir}.')
+        if plot:
+            self.plot(self._path('_plot.png'))
+
+    def plot(self, path):
+        """Growth curves of every dose per condition, and IC50 and GR50 over time."""
+        # A pyplot-free Figure, so series can be plotted from several threads
+        fig = Figure(figsize=(15, 4.5))
+        axes = fig.subplots(1, 3)
+        colors = [(0, 0, 0)] + [tuple(c) for c in np.linspace([0.2, 0.4, 1.0], [1.0, 0.1, 0.1], len(self.doses) - 1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth = np.log2(np.array([nanmean(self.conditions(i), axis=1) for i in range(len(self.times))])
+                             / nanmean(self.conditions(0), axis=1))
+        for i, (ax, name) in enumerate(zip(axes, (self.upper_name, self.lower_name))):
+            for j, dose in enumerate(self.doses):
+                ax.plot(self.times, growth[:, i, j], 'o-', color=colors[j], markersize=3,
+                        label='vehicle' if dose == 0 else f'{dose:.1e}')
+            ax.set_title(str(name))
+            ax.set_xlabel(TIME_COLUMN)
+            ax.set_ylabel('Population doublings')
+        axes[0].legend(fontsize=7, title='Concentration (M)', title_fontsize=7)
+
+        for name, color in ((self.upper_name, 'blue'), (self.lower_name, 'red')):
+            df_metrics = self.metrics[self.metrics['Condition'] == name]
+            axes[2].plot(df_metrics[TIME_COLUMN], df_metrics['IC50'], 'o-', color=color, label=f'{name} IC50')
+            axes[2].plot(df_metrics[TIME_COLUMN], df_metrics['GR50'], 's--', color=color, label=f'{name} GR50')
+        axes[2].set_yscale('log')
+        axes[2].set_xlabel(TIME_COLUMN)
+        axes[2].set_ylabel('Concentration (M)')
+        axes[2].legend(fontsize=7)
+        fig.suptitle(str(self.title))
+
+        with profiling.span('plot_png'), tb.atomic_output(path) as tmp_path:
+            fig.savefig(tmp_path, dpi=200, bbox_inches='tight')
+        logger.info(f'{self.title} kinetic plot saved to {path.parent}.')
+
+
+def run_kinetic(title_name, upper_name, lower_name, top_conc, dilution, time_h, image_dir, counts_file=None, output_dir=None, plot=True):
+    """
+    Add one timepoint of a live-cell GDA plate to its kinetic series and save the series.
+
+    Parameters:
+    -----------
+    title_name : str
+        Title of the plate series (the same for every timepoint)
+    upper_name : str
+        Name for upper cell condition (rows B-D)
+    lower_name : str
+        Name for lower cell condition (rows E-G)
+    top_conc : float
+        Top concentration in molar
+    dilution : float
+        Dilution factor between columns
+    time_h : float
+        Time of imaging in hours
+    image_dir : str
+        Directory containing the 60 well images of this timepoint
+    counts_file : str, optional
+        Path to pre-existing counts CSV file (for testing)
+    output_dir : str, optional
+        Custom output directory. If None, uses current working directory.
+    plot : bool
+        Whether to redraw the kinetic plot
+
+    Returns:
+    --------
+    series : KineticSeries
+        The updated series
+    """
+    series = KineticSeries(title_name, upper_name, lower_name, top_conc, dilution, output_dir=output_dir)
+    series.add_timepoint(time_h, image_dir=image_dir, counts_file=counts_file)
+    series.save(plot=plot)
+    return series
@@ -0,0 +1,284 @@
+"""
+Logs module moves CellPyAbility file logging off the calling thread.
+
+The CellPyAbility logger hands every record to a QueueHandler, and a QueueListener thread
+writes them to cellpyability.log in the current working directory. Records logged inside
+run_log() are tagged with the experiment ID and also copied to that run's own log file, so
+concurrent experiments each get a readable log. Log files are plain text by default, or one
+JSON object per line (with the experiment ID) when the format is set to 'json'.
+
+Only the main process writes cellpyability.log. Worker processes started with the options
+from worker_options() send their records to it through a multiprocessing queue instead, and
+write their per-run log files themselves.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(experiment_tag)s%(message)s'
+RUN_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Experiment ID of the run being logged in the current thread or task ('' outside runs)
+_experiment = contextvars.ContextVar('cellpyability_experiment', default='')
+
+# Queue, listener and handlers set up by setup()
+_state = {}
+
+
+class ExperimentFilter(logging.Filter):
+    """Stamp records with the experiment ID of the current run."""
+
+    def filter(self, record):
+        record.experiment = _experiment.get()
+        record.experiment_tag = f'[{record.experiment}] ' if record.experiment else ''
+        return True
+
+
+class ExperimentQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with their message and traceback rendered, but kept apart for the JSON format."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'experiment': getattr(record, 'experiment', ''),
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RunFileRouter(logging.Handler):
+    """Write each record to the log file of its experiment, if that run has one."""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self._handlers = {}
+
+    def add(self, experiment_id, log_file, formatter):
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(formatter)
+        with self.lock:
+            self._handlers[experiment_id] = handler
+
+    def remove(self, experiment_id):
+        with self.lock:
+            handler = self._handlers.pop(experiment_id, None)
+        if handler is not None:
+            handler.close()
+
+    def emit(self, record):
+        handler = self._handlers.get(getattr(record, 'experiment', ''))
+        if handler is not None:
+            handler.handle(record)
+
+
+class SharedLogHandler(logging.Handler):
+    """Pass records on to the shared log: the file in the main process, a queue to it in workers."""
+
+    def __init__(self, target=None):
+        super().__init__(logging.DEBUG)
+        self.target = target
+
+    def emit(self, record):
+        target = self.target
+        if target is not None:
+            target.handle(record)
+
+
+def _formatter(log_format, run_file=False):
+    if log_format == 'json':
+        return JsonFormatter()
+    return logging.Formatter(RUN_TEXT_FORMAT if run_file else TEXT_FORMAT)
+
+
+def _start_listener():
+    """Create the record queue and start the listener thread writing the log files."""
+    _state['queue'] = queue.Queue()
+    _state['queue_handler'].queue = _state['queue']
+    _state['listener'] = logging.handlers.QueueListener(
+        _state['queue'], _state['shared'], _state['router'], respect_handler_level=True
+    )
+    _state['listener'].start()
+
+
+def _restart_after_fork():
+    """
+    A forked child (e.g., a batch worker) does not inherit the listener thread; start its own.
+
+    The child leaves the shared log to the main process: its records reach it only once
+    attach() connects the child to the main process's worker queue.
+    """
+    if _state:
+        _state['router'].createLock()
+        _state['shared'].createLock()
+        _state['shared'].target = None
+        _state['file_handler'] = None
+        # The worker queue and its listener belong to the parent
+        _state.pop('worker_queue', None)
+        _state.pop('worker_listener', None)
+        _start_listener()
+
+
+def setup(logger, log_file, log_format=None):
+    """
+    Attach queued file logging to logger.
+
+    Parameters:
+    -----------
+    logger : logging.Logger
+        The CellPyAbility logger
+    log_file : Path
+        Shared log file written by the listener thread (only in the main process)
+    log_format : str, optional
+        'text' or 'json'. If None, uses CELLPYABILITY_LOG_FORMAT (default: text).
+    """
+    log_format = log_format or os.environ.get('CELLPYABILITY_LOG_FORMAT', 'text')
+    if log_format not in LOG_FORMATS:
+        log_format = 'text'
+
+    # A spawned worker process imports this module afresh; the main process writes the shared log
+    file_handler = None
+    if multiprocessing.parent_process() is None:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(_formatter(log_format))
+
+    queue_handler = ExperimentQueueHandler(None)
+    queue_handler.setLevel(logging.DEBUG)
+
+    _state.update(format=log_format, file_handler=file_handler, shared=SharedLogHandler(file_handler),
+                  router=RunFileRouter(), queue_handler=queue_handler)
+    _start_listener()
+
+    logger.addFilter(ExperimentFilter())
+    logger.addHandler(queue_handler)
+    atexit.register(stop)
+    # Windows has no fork, so there is no listener thread to restart there
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def configured():
+    """Whether queued file logging has been set up (it is skipped if the logger already had handlers)."""
+    return bool(_state)
+
+
+def set_format(log_format):
+    """Switch the log files to 'text' or 'json' format."""
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f'Unknown log format "{log_format}"; expected one of {", ".join(LOG_FORMATS)}')
+    _state['format'] = log_format
+    if _state.get('file_handler') is not None:
+        _state['file_handler'].setFormatter(_formatter(log_format))
+
+
+def worker_options():
+    """
+    Logging options to pass to worker processes, which hand them to attach().
+
+    The first call starts a listener that writes the workers' records to this process's
+    shared log.
+
+    Returns:
+    --------
+    options : dict or None
+        Log format and worker queue, or None if logging is not set up
+    """
+    if not _state:
+        return None
+    if 'worker_queue' not in _state:
+        _state['worker_queue'] = multiprocessing.Queue()
+        _state['worker_listener'] = logging.handlers.QueueListener(_state['worker_queue'], _state['shared'])
+        _state['worker_listener'].start()
+    return {'format': _state['format'], 'queue': _state['worker_queue']}
+
+
+def attach(options):
+    """
+    Set up logging in a worker process: the main process's log format, and its shared log.
+
+    Parameters:
+    -----------
+    options : dict or None
+        Options from worker_options() in the main process
+    """
+    if not _state or not options:
+        return
+    set_format(options['format'])
+    _state['shared'].target = ExperimentQueueHandler(options['queue'])
+    # Worker processes exit without running atexit handlers; send the remaining records
+    # before multiprocessing closes the queue (its own finalizer has exit priority 10)
+    multiprocessing.util.Finalize(None, stop, exitpriority=100)
+
+
+def flush():
+    """Wait until the listener has written every record queued so far."""
+    listener = _state.get('listener')
+    if listener is not None and listener._thread is not None and listener._thread.is_alive():
+        _state['queue'].join()
+
+
+def stop():
+    """Write the remaining records and stop the listener threads."""
+    for name in ('listener', 'worker_listener'):
+        listener = _state.get(name)
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+
+
+@contextmanager
+def run_log(experiment_id, log_file=None):
+    """
+    Tag records logged inside the block with experiment_id, copying them to log_file.
+
+    The ID follows the current thread and asyncio task; threads started inside the
+    block log without it unless they enter run_log themselves.
+
+    Parameters:
+    -----------
+    experiment_id : str
+        Experiment ID (e.g., the title), added to every record
+    log_file : str or Path, optional
+        Per-run log file, appended to if it exists
+    """
+    token = _experiment.set(str(experiment_id))
+    if log_file is not None and _state:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        _state['router'].add(str(experiment_id), log_file, _formatter(_state['format'], run_file=True))
+    try:
+        yield
+    finally:
+        _experiment.reset(token)
+        if log_file is not None and _state:
+            flush()
+            _state['router'].remove(str(experiment_id))
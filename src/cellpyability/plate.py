@@ -0,0 +1,183 @@
+"""
+Plate module holds nuclei counts as a NumPy array over the full 96-well plate geometry.
+
+Well names are parsed from the CellProfiler file names once, with one vectorized regex over
+the whole column, and every count lands at [replicate, row, column] of an (n, 8, 12) array.
+Replicates of a well are numbered in the order they occur in the counts. The analysis modules
+select their layout (e.g. rows B-G x columns 2-11) by index, so vehicle normalization, replicate
+means and SDs and dose labeling are array operations rather than pivots, reindexes and groupbys.
+"""
+
+import numpy as np
+import pandas as pd
+
+ROWS = tuple('ABCDEFGH')
+COLUMNS = tuple(str(i) for i in range(1, 13))
+SHAPE = (len(ROWS), len(COLUMNS))
+
+# Inner 60 wells used by the GDA, synergy and simple layouts (outer wells are edge-effect buffers)
+LAYOUT_ROWS = ROWS[1:7]         # B-G
+LAYOUT_COLUMNS = COLUMNS[1:11]  # 2-11
+
+# Column identifying the plate of each image when several plates' counts are combined
+PLATE_COLUMN = 'Plate'
+
+# Same well pattern as toolbox.rename_wells (B02, b2 and B2 are all B2)
+WELL_PATTERN = r'([A-Ha-h])0*(\d{1,2})'
+
+_ROW_INDEX = {row: i for i, row in enumerate(ROWS)}
+_COLUMN_INDEX = {column: i for i, column in enumerate(COLUMNS)}
+
+
+def parse_wells(file_names):
+    """
+    Parse 96-well positions from image file names.
+
+    Parameters:
+    -----------
+    file_names : pandas.Series
+        CellProfiler FileName_images
+
+    Returns:
+    --------
+    rows, columns : numpy.ndarray
+        Zero-based row and column index per file, -1 where the name holds no plate well
+    """
+    parts = pd.Series(file_names, dtype=object).astype(str).str.extract(WELL_PATTERN)
+    rows = parts[0].str.upper().map(_ROW_INDEX).fillna(-1).to_numpy(dtype=int)
+    columns = parts[1].map(_COLUMN_INDEX).fillna(-1).to_numpy(dtype=int)
+    invalid = (rows < 0) | (columns < 0)
+    rows[invalid], columns[invalid] = -1, -1
+    return rows, columns
+
+
+def nanmean(values, axis):
+    """Mean ignoring NaN, NaN (without a warning) where every value is NaN."""
+    n = np.sum(~np.isnan(values), axis=axis)
+    total = np.nansum(values, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, total / n, np.nan)
+
+
+def nanstd(values, axis, ddof=1):
+    """Standard deviation ignoring NaN (pandas' ddof=1 by default), NaN with too few values."""
+    n = np.sum(~np.isnan(values), axis=axis)
+    mean = np.expand_dims(nanmean(values, axis), axis)
+    squares = np.nansum((values - mean) ** 2, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > ddof, np.sqrt(squares / (n - ddof)), np.nan)
+
+
+class Plate:
+    """
+    Nuclei counts of one or more replicate plates over the 96-well geometry.
+
+    Parameters:
+    -----------
+    counts : numpy.ndarray
+        Counts of shape (replicates, 8, 12) (or (8, 12) for one plate), NaN where no image was counted
+
+    Attributes:
+    -----------
+    counts : numpy.ndarray
+        Counts of shape (replicates, 8, 12)
+    mask : numpy.ndarray
+        True where a well of a replicate was counted
+    """
+
+    def __init__(self, counts):
+        counts = np.asarray(counts, dtype=float)
+        if counts.ndim == 2:
+            counts = counts[np.newaxis]
+        if counts.shape[1:] != SHAPE:
+            raise ValueError(f'Plate counts must have shape (replicates, {SHAPE[0]}, {SHAPE[1]}), not {counts.shape}')
+        self.counts = counts
+        self.mask = ~np.isnan(counts)
+
+    @classmethod
+    def from_counts(cls, df_cp):
+        """
+        Build a Plate from CellProfiler counts (Count_nuclei and FileName_images).
+
+        Images whose names hold no plate well are ignored. With a Plate column (as written for
+        experiments counted from several image directories), each plate is one replicate and
+        repeated wells within a plate are averaged. Without it, a well seen again starts the
+        next replicate plate, so stacked replicate plates keep their order.
+        """
+        rows, columns = parse_wells(df_cp['FileName_images'])
+        nuclei = df_cp['Count_nuclei'].to_numpy(dtype=float)
+        valid = rows >= 0
+        flat = rows[valid] * SHAPE[1] + columns[valid]
+        nuclei = nuclei[valid]
+
+        if PLATE_COLUMN in df_cp:
+            replicate, _ = pd.factorize(df_cp[PLATE_COLUMN].to_numpy()[valid])
+            df_wells = pd.DataFrame({'replicate': replicate, 'flat': flat, 'nuclei': nuclei})
+            df_wells = df_wells.groupby(['replicate', 'flat'], sort=False, as_index=False)['nuclei'].mean()
+            replicate, flat, nuclei = (df_wells[column].to_numpy() for column in ('replicate', 'flat', 'nuclei'))
+        else:
+            replicate = pd.Series(flat).groupby(flat).cumcount().to_numpy()
+        counts = np.full((replicate.max() + 1 if len(replicate) else 1, *SHAPE), np.nan)
+        counts[replicate, flat // SHAPE[1], flat % SHAPE[1]] = nuclei
+        return cls(counts)
+
+    @property
+    def replicates(self):
+        """Number of replicate plates."""
+        return self.counts.shape[0]
+
+    @staticmethod
+    def index(rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """Layout (row letters x column labels) to an index selecting it from a (..., 8, 12) array."""
+        return np.ix_([_ROW_INDEX[row] for row in rows], [_COLUMN_INDEX[str(column)] for column in columns])
+
+    def values(self, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """Counts of the layout, shape (replicates, len(rows), len(columns))."""
+        row_index, column_index = self.index(rows, columns)
+        return self.counts[:, row_index, column_index]
+
+    def mean(self, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """Mean of the replicates per well of the layout, shape (len(rows), len(columns))."""
+        return nanmean(self.values(rows, columns), axis=0)
+
+    def std(self, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS, ddof=1):
+        """Standard deviation of the replicates per well of the layout."""
+        return nanstd(self.values(rows, columns), axis=0, ddof=ddof)
+
+    def counted(self, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """True for wells of the layout counted in at least one replicate."""
+        row_index, column_index = self.index(rows, columns)
+        return self.mask[:, row_index, column_index].any(axis=0)
+
+    @staticmethod
+    def frame(matrix, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """Label a layout matrix as a DataFrame with Row index and Column columns."""
+        return pd.DataFrame(
+            matrix,
+            index=pd.Index(list(rows), name='Row'),
+            columns=pd.Index([str(column) for column in columns], name='Column'),
+        )
+
+    def summary(self, vehicle_rows, vehicle_columns, rows=LAYOUT_ROWS, columns=LAYOUT_COLUMNS):
+        """
+        One row per replicate plate, to spot plate-level outliers.
+
+        Returns:
+        --------
+        df_plates : pandas.DataFrame
+            Plate (1-based), Wells (counted), Vehicle Count (mean of the vehicle wells),
+            Median Count and Median Log2 Ratio of its wells to the across-plate median
+        """
+        values = self.values(rows, columns).reshape(self.replicates, -1)
+        # pandas medians skip NaN without warning about wells no plate counted
+        median = pd.DataFrame(values).median(axis=0).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.log2(values / median)
+        ratios[~np.isfinite(ratios)] = np.nan
+        return pd.DataFrame({
+            'Plate': np.arange(1, self.replicates + 1),
+            'Wells': np.sum(~np.isnan(values), axis=1),
+            'Vehicle Count': nanmean(self.values(vehicle_rows, vehicle_columns).reshape(self.replicates, -1), axis=1),
+            'Median Count': pd.DataFrame(values).median(axis=1).to_numpy(),
+            'Median Log2 Ratio': pd.DataFrame(ratios).median(axis=1).to_numpy(),
+        })
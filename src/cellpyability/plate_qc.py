@@ -0,0 +1,292 @@
+"""
+Plate QC module scores the count matrices of many GDA or simple plates at once.
+
+Count matrices (rows B-G x columns 2-11) are stacked into one (plates, 6, 10) array, viewed as
+(plates, conditions, replicate rows, columns) with the GDA conditions in rows B-D and E-G, and
+every metric is computed for all plates in a handful of NumPy operations:
+
+- Z'-factor of the vehicle (column 2) against a positive-control column, if one is given
+  (a top dose is only a positive control for a compound that kills every cell)
+- Vehicle CV of the column 2 wells
+- Edge bias: mean log2 ratio of each outer row (B, G) to the inner rows of its condition,
+  paired by column so the dose gradient cancels out
+- Replicate CV: spread of the replicate rows around each column's mean, pooled over the
+  columns and relative to the vehicle mean, so flat (inactive drug, untreated) plates whose
+  replicates agree score as well as plates with a steep dose response
+
+Each metric is computed per condition and the worse condition is reported. Plates come from
+in-memory results or archived count CSVs, and one summary table with a pass/fail verdict
+per metric is written.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import toolbox as tb
+from .plate import LAYOUT_COLUMNS, LAYOUT_ROWS, Plate, nanmean, nanstd
+
+# Share the CellPyAbility logger (configured in toolbox)
+logger = logging.getLogger("CellPyAbility")
+
+# Conditions x replicate rows of the layout (B-D and E-G)
+CONDITIONS = 2
+REPLICATE_ROWS = 3
+
+# Default thresholds; a plate passes a metric within them
+DEFAULT_MIN_Z_PRIME = 0.5
+DEFAULT_MAX_VEHICLE_CV = 0.2
+DEFAULT_MAX_EDGE_BIAS = 0.3  # |log2 ratio|, about 23% fewer (or more) nuclei at the edge
+DEFAULT_MAX_REPLICATE_CV = 0.2
+
+# Archived outputs picked up from directories (other files can be listed explicitly)
+COUNT_PATTERNS = ('*_gda_counts.csv', '*_simple_CountMatrix.csv')
+_NAME_SUFFIXES = ('_gda_counts', '_simple_CountMatrix', '_simple_raw_counts', '_counts')
+
+METRICS = {
+    'z_prime': "Z' Factor",
+    'vehicle_cv': 'Vehicle CV',
+    'edge_bias': 'Edge Bias (log2)',
+    'replicate_cv': 'Replicate CV',
+}
+
+
+def _layout_matrix(count_matrix):
+    """One plate's count matrix (DataFrame, result or array) as a (6, 10) array."""
+    count_matrix = getattr(count_matrix, 'count_matrix', count_matrix)
+    if isinstance(count_matrix, pd.DataFrame):
+        count_matrix = count_matrix.rename(index=str, columns=str).reindex(
+            index=list(LAYOUT_ROWS), columns=list(LAYOUT_COLUMNS))
+    return np.asarray(count_matrix, dtype=float)
+
+
+def stack_count_matrices(count_matrices):
+    """
+    Stack count matrices into one array.
+
+    Parameters:
+    -----------
+    count_matrices : numpy.ndarray or iterable
+        An array of shape (plates, 6, 10), or count matrices (DataFrames with rows B-G and
+        columns 2-11, arrays, or results/experiments with a count_matrix attribute)
+
+    Returns:
+    --------
+    counts : numpy.ndarray
+        Counts of shape (plates, 6, 10)
+    """
+    if isinstance(count_matrices, np.ndarray):
+        counts = count_matrices.astype(float)
+    else:
+        counts = np.array([_layout_matrix(count_matrix) for count_matrix in count_matrices], dtype=float)
+    shape = (len(LAYOUT_ROWS), len(LAYOUT_COLUMNS))
+    if counts.ndim != 3 or counts.shape[1:] != shape:
+        raise ValueError(f'Count matrices must have shape (plates, {shape[0]}, {shape[1]}), not {counts.shape}')
+    return counts
+
+
+def _column_index(column):
+    """Index of a layout column label (e.g., 11 or '11') in the count matrices."""
+    if str(column) not in LAYOUT_COLUMNS:
+        raise ValueError(f'Positive-control column must be one of {", ".join(LAYOUT_COLUMNS)}, not {column}')
+    return list(LAYOUT_COLUMNS).index(str(column))
+
+
+def plate_metrics(counts, positive_column=None):
+    """
+    Compute the QC metrics of every plate.
+
+    Parameters:
+    -----------
+    counts : numpy.ndarray
+        Counts of shape (plates, 6, 10), NaN for wells that were not counted
+    positive_column : int or str, optional
+        Layout column (2-11) holding a positive control, e.g. a lethal dose. Without one,
+        z_prime is NaN.
+
+    Returns:
+    --------
+    metrics : dict of str -> numpy.ndarray
+        z_prime, vehicle_cv, edge_bias and replicate_cv, one value per plate
+        (NaN where too few wells were counted)
+    """
+    groups = counts.reshape(len(counts), CONDITIONS, REPLICATE_ROWS, -1)
+    vehicle = groups[..., 0]  # (plates, conditions, replicate rows)
+    vehicle_mean, vehicle_sd = nanmean(vehicle, 2), nanstd(vehicle, 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if positive_column is None:
+            z_prime = np.full(vehicle_mean.shape, np.nan)
+        else:
+            positive = groups[..., _column_index(positive_column)]
+            positive_mean, positive_sd = nanmean(positive, 2), nanstd(positive, 2)
+            z_prime = 1 - 3 * (vehicle_sd + positive_sd) / np.abs(vehicle_mean - positive_mean)
+        vehicle_cv = vehicle_sd / vehicle_mean
+
+        # SD of the replicate rows in each column, pooled over the columns, relative to the vehicle
+        column_sd = nanstd(groups, 2)  # (plates, conditions, columns)
+        replicate_cv = np.sqrt(nanmean(column_sd ** 2, 2)) / vehicle_mean
+
+        # Outer row of each condition (B, G) against the mean of its inner rows (C-D, E-F)
+        edge = np.stack([groups[:, 0, 0], groups[:, 1, -1]], axis=1)
+        inner = np.stack([nanmean(groups[:, 0, 1:], 1), nanmean(groups[:, 1, :-1], 1)], axis=1)
+        ratios = np.log2(edge / inner)
+    ratios[~np.isfinite(ratios)] = np.nan
+
+    # The worse condition decides; NaN (too few wells) propagates so the plate is not passed unseen
+    return {
+        'z_prime': np.min(z_prime, axis=1),
+        'vehicle_cv': np.max(vehicle_cv, axis=1),
+        'edge_bias': nanmean(ratios.reshape(len(counts), -1), axis=1),
+        'replicate_cv': np.max(replicate_cv, axis=1),
+    }
+
+
+def plate_qc(count_matrices, names=None, min_z_prime=DEFAULT_MIN_Z_PRIME, max_vehicle_cv=DEFAULT_MAX_VEHICLE_CV,
+             max_edge_bias=DEFAULT_MAX_EDGE_BIAS, max_replicate_cv=DEFAULT_MAX_REPLICATE_CV, positive_column=None):
+    """
+    Score plates and pass or fail them against thresholds.
+
+    Parameters:
+    -----------
+    count_matrices : numpy.ndarray, iterable or dict
+        See stack_count_matrices; a dict maps plate names to count matrices
+    names : list of str, optional
+        Plate names (default: the results' titles, else plate 1, 2, ...)
+    min_z_prime, max_vehicle_cv, max_edge_bias, max_replicate_cv : float or None
+        Pass thresholds (max_edge_bias applies to the absolute log2 ratio); None reports
+        the metric without using it to pass or fail plates
+    positive_column : int or str, optional
+        Layout column holding a positive control (see plate_metrics). Without one, the Z'
+        factor is reported as NaN and does not pass or fail plates.
+
+    Returns:
+    --------
+    df_qc : pandas.DataFrame
+        One row per plate: Plate, the metrics, a Pass column per thresholded metric and Pass
+    """
+    if isinstance(count_matrices, dict):
+        names = list(count_matrices) if names is None else names
+        count_matrices = list(count_matrices.values())
+    elif not isinstance(count_matrices, np.ndarray):
+        count_matrices = list(count_matrices)
+    counts = stack_count_matrices(count_matrices)
+    if names is None:
+        names = [getattr(result, 'title', None) or f'plate {i}' for i, result in enumerate(count_matrices, 1)]
+    if len(names) != len(counts):
+        raise ValueError(f'Got {len(names)} names for {len(counts)} plates')
+
+    metrics = plate_metrics(counts, positive_column)
+    df_qc = pd.DataFrame({'Plate': names, **{METRICS[key]: values for key, values in metrics.items()}})
+
+    # NaN compares False, so a metric that could not be computed fails its check
+    checks = {
+        'z_prime': (min_z_prime, lambda values, limit: values >= limit),
+        'vehicle_cv': (max_vehicle_cv, lambda values, limit: values <= limit),
+        'edge_bias': (max_edge_bias, lambda values, limit: np.abs(values) <= limit),
+        'replicate_cv': (max_replicate_cv, lambda values, limit: values <= limit),
+    }
+    if positive_column is None:
+        checks['z_prime'] = (None, None)  # no positive control: Z' is not applicable
+    passed = np.ones(len(counts), dtype=bool)
+    for key, (limit, check) in checks.items():
+        if limit is None:
+            continue
+        column_pass = check(metrics[key], limit)
+        df_qc[f'{METRICS[key]} Pass'] = column_pass
+        passed &= column_pass
+    df_qc['Pass'] = passed
+    logger.info(f'Plate QC: {int(passed.sum())} of {len(counts)} plates passed.')
+    return df_qc
+
+
+def read_count_matrix(counts_file):
+    """
+    Read one plate's count matrix from an archived CSV.
+
+    Raw CellProfiler counts (Count_nuclei, FileName_images, as in _gda_counts.csv) are placed on
+    the plate and averaged over replicate plates; other files are read as count matrices
+    (rows B-G x columns 2-11, as in _simple_CountMatrix.csv).
+    """
+    df = pd.read_csv(counts_file)
+    if {'Count_nuclei', 'FileName_images'} <= set(df.columns):
+        return Plate.frame(Plate.from_counts(df).mean())
+    return df.set_index(df.columns[0])
+
+
+def find_count_files(paths):
+    """Archived count CSVs: files as given, directories searched recursively for COUNT_PATTERNS."""
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files += sorted(f for pattern in COUNT_PATTERNS for f in path.rglob(pattern))
+        else:
+            files.append(path)
+    return files
+
+
+def _plate_name(counts_file):
+    """Plate name from a counts file name (its title)."""
+    stem = Path(counts_file).stem
+    for suffix in _NAME_SUFFIXES:
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+
+def read_plates(paths, workers=None):
+    """
+    Read the count matrices of archived plates in a thread pool.
+
+    Returns:
+    --------
+    files : list of pathlib.Path
+    count_matrices : list of pandas.DataFrame
+    """
+    files = find_count_files(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        count_matrices = list(executor.map(read_count_matrix, files))
+    logger.debug(f'Read {len(files)} count files for plate QC.')
+    return files, count_matrices
+
+
+def run_plate_qc(paths, output_file=None, **thresholds):
+    """
+    Score archived plates and write the QC summary table.
+
+    Parameters:
+    -----------
+    paths : list of str
+        Count CSVs, or output directories searched recursively for them
+    output_file : str, optional
+        Summary CSV (default: <output base>/plate_qc.csv)
+    **thresholds :
+        See plate_qc
+
+    Returns:
+    --------
+    df_qc : pandas.DataFrame
+        plate_qc summary with the Source file of each plate
+    """
+    files, count_matrices = read_plates(paths)
+    if not files:
+        raise ValueError(f'No count files found in {", ".join(str(path) for path in paths)}')
+    df_qc = plate_qc(count_matrices, names=[_plate_name(f) for f in files], **thresholds)
+    df_qc.insert(1, 'Source', [str(f) for f in files])
+
+    output_file = Path(output_file) if output_file else tb.get_output_base_dir() / 'plate_qc.csv'
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with tb.atomic_output(output_file) as tmp_path:
+        df_qc.to_csv(tmp_path, index=False)
+    logger.info(f'Plate QC summary saved to {output_file}')
+    return df_qc
+
+
+def format_summary(df_qc):
+    """Format the QC table (without source paths) and the pass count for the console."""
+    table = df_qc.drop(columns='Source', errors='ignore').to_string(index=False, float_format=lambda v: f'{v:.3f}')
+    return f'{table}\n\n{int(df_qc["Pass"].sum())} of {len(df_qc)} plates passed'
@@ -0,0 +1,236 @@
+"""
+Profiling module records lightweight timing spans around the analysis stages.
+
+The stages in toolbox and the analysis modules are wrapped in span() or the timed() decorator.
+While no profile is active a span only checks one module variable; inside profile(), every span
+records its wall time, its self time (excluding nested spans) and the peak Python memory
+allocated during it (via tracemalloc). The finished profile can be saved as a JSON trace and
+summarized on the console, to show where the time of a run goes.
+
+Stages: qc, cellprofiler, ingest, read_counts, rename_wells, pivot, normalize, bliss, fit, write_csv,
+plot_png, plot_html, write_counts.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+MB = 1024 * 1024
+
+# Per-stage peaks reset the tracemalloc peak at each span, which needs Python 3.9+
+_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+# Profile being recorded, if any
+_active = None
+
+
+class Profile:
+    """
+    Timing spans of one profiled run.
+
+    Attributes:
+    -----------
+    name : str
+        Name of the run (e.g., the experiment title and module)
+    spans : list of dict
+        One record per finished span: name, start_s (since the profile started), duration_s,
+        self_s, depth, thread and peak_mb (None if memory was not traced)
+    wall_s : float
+        Wall time of the whole run, set when the profile finishes
+    """
+
+    def __init__(self, name, trace_memory=True):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.spans = []
+        self.wall_s = None
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def record(self, name):
+        """Record one span; nested spans count towards their parent's duration but not its self time."""
+        stack = self._stack()
+        tracing = self.trace_memory and _RESET_PEAK and tracemalloc.is_tracing()
+        entry = {'name': name, 'children_s': 0.0, 'peak': 0, 'base': 0}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # Keep the parent's peak so far before resetting the peak for this span
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            entry['base'] = current
+        stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            peak_mb = None
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], entry['peak'])
+                peak_mb = round((peak - entry['base']) / MB, 3)
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            if stack:
+                stack[-1]['children_s'] += duration
+            with self._lock:
+                self.spans.append({
+                    'name': name,
+                    'start_s': round(start - self._start, 6),
+                    'duration_s': round(duration, 6),
+                    'self_s': round(duration - entry['children_s'], 6),
+                    'depth': len(stack),
+                    'thread': threading.current_thread().name,
+                    'peak_mb': peak_mb,
+                })
+
+    def summary(self):
+        """
+        Spans aggregated by stage, slowest self time first.
+
+        Returns:
+        --------
+        rows : list of dict
+            stage, calls, total_s, self_s, percent (self time of the run's wall time) and peak_mb
+        """
+        stages = {}
+        for span in self.spans:
+            row = stages.setdefault(span['name'], {'stage': span['name'], 'calls': 0, 'total_s': 0.0,
+                                                   'self_s': 0.0, 'peak_mb': None})
+            row['calls'] += 1
+            row['total_s'] += span['duration_s']
+            row['self_s'] += span['self_s']
+            if span['peak_mb'] is not None:
+                row['peak_mb'] = max(row['peak_mb'] or 0.0, span['peak_mb'])
+        wall_s = self.wall_s or (time.perf_counter() - self._start)
+        for row in stages.values():
+            row['percent'] = round(100 * row['self_s'] / wall_s, 2) if wall_s > 0 else 0.0
+            row['total_s'], row['self_s'] = round(row['total_s'], 6), round(row['self_s'], 6)
+        return sorted(stages.values(), key=lambda row: row['self_s'], reverse=True)
+
+    def format_summary(self):
+        """Format the stage summary as a console table."""
+        rows = self.summary()
+        lines = [f'Profile: {self.name} ({self.wall_s or 0:.3f} s wall)',
+                 f'{"stage":<14}{"calls":>7}{"total s":>11}{"self s":>11}{"% wall":>9}{"peak MB":>10}']
+        for row in rows:
+            peak = f'{row["peak_mb"]:10.2f}' if row['peak_mb'] is not None else f'{"-":>10}'
+            lines.append(f'{row["stage"]:<14}{row["calls"]:>7}{row["total_s"]:>11.4f}{row["self_s"]:>11.4f}'
+                         f'{row["percent"]:>9.1f}{peak}')
+        untracked = (self.wall_s or 0) - sum(row['self_s'] for row in rows)
+        lines.append(f'{"(other)":<14}{"":>7}{"":>11}{max(untracked, 0):>11.4f}')
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        """The profile as a JSON-serializable trace."""
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'wall_s': self.wall_s,
+            'peak_rss_mb': _peak_rss_mb('self'),
+            'peak_rss_children_mb': _peak_rss_mb('children'),
+            'stages': self.summary(),
+            'spans': sorted(self.spans, key=lambda span: span['start_s']),
+        }
+
+    def save(self, path):
+        """Write the JSON trace to path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+        logger.info(f'Profile saved to {path}')
+        return path
+
+
+def _peak_rss_mb(who):
+    """Peak resident memory of this process or of its finished children (e.g., CellProfiler)."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss * scale / MB, 1)
+
+
+@contextmanager
+def profile(name='run', trace_memory=True):
+    """
+    Record the spans of everything run inside the block.
+
+    Parameters:
+    -----------
+    name : str
+        Name of the run, stored in the trace
+    trace_memory : bool
+        Trace Python allocations with tracemalloc for per-stage peak memory (slows allocation-heavy stages;
+        not available before Python 3.9)
+
+    Yields:
+    -------
+    profile : Profile
+    """
+    global _active
+    if _active is not None:
+        raise RuntimeError('A profile is already being recorded')
+    if trace_memory and not _RESET_PEAK:
+        logger.info('Per-stage peak memory needs Python 3.9+; profiling timing only')
+        trace_memory = False
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    current = Profile(name, trace_memory)
+    _active = current
+    try:
+        yield current
+    finally:
+        current.wall_s = round(time.perf_counter() - current._start, 6)
+        _active = None
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def span(name):
+    """Time the block as stage name if a profile is active."""
+    if _active is None:
+        yield
+        return
+    with _active.record(name):
+        yield
+
+
+def timed(name):
+    """Decorator timing each call of the function as stage name."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.record(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
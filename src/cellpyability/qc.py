@@ -0,0 +1,274 @@
+"""
+QC module runs a fast image quality prepass before CellProfiler counts a plate.
+
+Every image is read in a thread pool (optionally downsampled) and scored for focus (variance
+of the Laplacian, relative to the median of the plate), saturation (fraction of pixels at the
+maximum value) and foreground (fraction of pixels well above the background). Wells failing a
+check are flagged in a per-well QC table and, in 'exclude' mode, saturated and out-of-focus
+wells are left out of counting so they cannot distort normalization. Blank wells are flagged
+but always counted: wells where the drug killed every cell are blank too, and their near-zero
+counts belong in the dose response. A plate where most wells are saturated or out of focus, or
+every well is blank, is rejected before CellProfiler starts, in seconds rather than after
+minutes of counting.
+"""
+
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import accounting, profiling
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+QC_MODES = ('off', 'flag', 'exclude')
+QC_DIR = 'qc'
+
+# Defaults, each overridable with the matching CELLPYABILITY_QC_* environment variable
+DEFAULT_DOWNSAMPLE = 2
+DEFAULT_MIN_FOCUS_RATIO = 0.2
+DEFAULT_MAX_SATURATION = 0.01
+DEFAULT_MIN_FOREGROUND = 0.001
+DEFAULT_MAX_FAILED_FRACTION = 0.5
+
+# Flags that exclude a well from counting (in 'exclude' mode) and count towards rejecting the plate
+DEFECT_FLAGS = ('saturated', 'out_of_focus')
+
+# Pixels brighter than background + FOREGROUND_SIGMA robust SDs count as foreground
+FOREGROUND_SIGMA = 5.0
+
+
+def _env_number(name, cast=float):
+    """Read a numeric CELLPYABILITY_QC_* environment variable, returning None if unset."""
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f'Ignoring invalid {name}={value!r}')
+        return None
+
+
+def _first(*values):
+    """First value that is not None (0 is a valid threshold)."""
+    return next(value for value in values if value is not None)
+
+
+def image_metrics(image_file, downsample=DEFAULT_DOWNSAMPLE):
+    """
+    Score one image for focus, saturation and foreground.
+
+    Parameters:
+    -----------
+    image_file : str or Path
+        Image to score
+    downsample : int
+        Use every downsample-th pixel in each direction (1 reads the full image)
+
+    Returns:
+    --------
+    metrics : dict
+        focus (variance of the Laplacian), saturation (fraction of pixels at the maximum
+        value of the image type) and foreground (fraction of pixels above background)
+    """
+    from PIL import Image  # Pillow is installed with matplotlib
+
+    with Image.open(image_file) as image:
+        pixels = np.asarray(image)
+    if pixels.ndim == 3:
+        pixels = pixels.max(axis=2)
+    sample = pixels[::downsample, ::downsample]
+
+    if np.issubdtype(sample.dtype, np.integer):
+        saturation = float(np.mean(sample >= np.iinfo(sample.dtype).max))
+    else:
+        saturation = 0.0
+    sample = sample.astype(np.float32)
+
+    laplacian = (4 * sample[1:-1, 1:-1] - sample[:-2, 1:-1] - sample[2:, 1:-1]
+                 - sample[1:-1, :-2] - sample[1:-1, 2:])
+    background = float(np.median(sample))
+    spread = 1.4826 * float(np.median(np.abs(sample - background))) or 1.0
+    foreground = float(np.mean(sample > background + FOREGROUND_SIGMA * spread))
+    return {'focus': float(laplacian.var()), 'saturation': saturation, 'foreground': foreground}
+
+
+class ImageQC:
+    """
+    Image QC prepass settings and checks.
+
+    Parameters:
+    -----------
+    mode : str, optional
+        'off' (default), 'flag' (write the QC table, count every well) or 'exclude'
+        (also leave saturated and out-of-focus wells out of counting)
+    downsample : int, optional
+        Pixel stride used when scoring images
+    workers : int, optional
+        Threads reading images (default: one per CPU, up to 16)
+    min_focus_ratio : float, optional
+        Wells whose focus is below this fraction of the plate median are out of focus
+    max_saturation : float, optional
+        Wells with a larger fraction of saturated pixels are saturated
+    min_foreground : float, optional
+        Wells with a smaller foreground fraction are blank (flagged only)
+    max_failed_fraction : float, optional
+        Plates with a larger fraction of saturated or out-of-focus wells are rejected
+    """
+
+    def __init__(self, mode=None, downsample=None, workers=None, min_focus_ratio=None, max_saturation=None,
+                 min_foreground=None, max_failed_fraction=None):
+        self.mode = mode or os.environ.get('CELLPYABILITY_QC', '').strip() or 'off'
+        if self.mode not in QC_MODES:
+            raise ValueError(f'Unknown QC mode "{self.mode}"; expected one of {", ".join(QC_MODES)}')
+        self.downsample = max(1, _first(downsample, _env_number('CELLPYABILITY_QC_DOWNSAMPLE', int), DEFAULT_DOWNSAMPLE))
+        self.workers = workers or min(16, os.cpu_count() or 1)
+        self.min_focus_ratio = _first(min_focus_ratio, _env_number('CELLPYABILITY_QC_MIN_FOCUS_RATIO'),
+                                      DEFAULT_MIN_FOCUS_RATIO)
+        self.max_saturation = _first(max_saturation, _env_number('CELLPYABILITY_QC_MAX_SATURATION'),
+                                     DEFAULT_MAX_SATURATION)
+        self.min_foreground = _first(min_foreground, _env_number('CELLPYABILITY_QC_MIN_FOREGROUND'),
+                                     DEFAULT_MIN_FOREGROUND)
+        self.max_failed_fraction = _first(max_failed_fraction, _env_number('CELLPYABILITY_QC_MAX_FAILED_FRACTION'),
+                                          DEFAULT_MAX_FAILED_FRACTION)
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def score_plate(self, image_dir):
+        """
+        Score every well image below image_dir and flag the failing wells.
+
+        Returns:
+        --------
+        df_qc : pandas.DataFrame
+            One row per image: well, file, focus, focus_ratio, saturation, foreground,
+            flags (semicolon-separated: blank, saturated, out_of_focus) and excluded
+            (saturated or out-of-focus wells in 'exclude' mode)
+        """
+        from . import toolbox as tb  # toolbox imports this module
+
+        image_dir = Path(image_dir)
+        image_files = sorted(
+            path for path in image_dir.rglob('*')
+            if path.is_file() and path.suffix.lower() in accounting.IMAGE_SUFFIXES
+            and not any(part.startswith('.') for part in path.relative_to(image_dir).parts)
+        )
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            metrics = list(pool.map(lambda path: image_metrics(path, self.downsample), image_files))
+
+        df_qc = pd.DataFrame(metrics, columns=['focus', 'saturation', 'foreground'])
+        df_qc.insert(0, 'well', [tb.rename_wells(path.name) for path in image_files])
+        df_qc.insert(1, 'file', [str(path.relative_to(image_dir)) for path in image_files])
+        if df_qc.empty:
+            return df_qc.assign(focus_ratio=[], flags=[], excluded=[])
+
+        blank = df_qc['foreground'] < self.min_foreground
+        saturated = df_qc['saturation'] > self.max_saturation
+        # Focus depends on the imager and stain, so it is judged against the plate's non-blank wells
+        median_focus = df_qc.loc[~blank, 'focus'].median() if (~blank).any() else np.nan
+        df_qc['focus_ratio'] = (df_qc['focus'] / median_focus).round(4) if median_focus > 0 else np.nan
+        out_of_focus = ~blank & (df_qc['focus_ratio'] < self.min_focus_ratio)
+
+        flags = pd.DataFrame({'blank': blank, 'saturated': saturated, 'out_of_focus': out_of_focus})
+        df_qc['flags'] = flags.apply(lambda row: ';'.join(name for name, failed in row.items() if failed), axis=1)
+        # Blank wells are counted: a well where the drug killed every cell is blank as well
+        df_qc['excluded'] = (self.mode == 'exclude') & (saturated | out_of_focus)
+        return df_qc
+
+    def verdict(self, df_qc):
+        """Reason to reject the plate, or None if it may be counted."""
+        if df_qc.empty:
+            return None
+        flags = df_qc['flags'].str.split(';')
+        if flags.apply(lambda well_flags: 'blank' in well_flags).all():
+            return 'every well is blank (no nuclei above background)'
+        failed = flags.apply(lambda well_flags: any(flag in DEFECT_FLAGS for flag in well_flags)).mean()
+        if failed > self.max_failed_fraction:
+            counts = flags.explode().value_counts().reindex(DEFECT_FLAGS).dropna()
+            details = ', '.join(f'{int(count)} {flag}' for flag, count in counts.items())
+            return f'{failed:.0%} of wells are saturated or out of focus ({details})'
+        return None
+
+    def prepare_input(self, image_dir, scratch_dir, output_base):
+        """
+        Run the prepass on a plate about to be counted.
+
+        Writes the QC table to <output_base>/qc/<plate>_qc.csv. In 'exclude' mode with failing
+        wells, the passing images are linked into <scratch_dir>/qc_input/ for CellProfiler.
+
+        Returns:
+        --------
+        input_dir : Path
+            Directory CellProfiler should read
+        rejection : str or None
+            Reason the plate was rejected, if it was
+        """
+        from . import toolbox as tb
+
+        image_dir = Path(image_dir)
+        with profiling.span('qc'):
+            df_qc = self.score_plate(image_dir)
+            qc_dir = Path(output_base) / QC_DIR
+            qc_dir.mkdir(exist_ok=True)
+            qc_csv = qc_dir / f'{image_dir.name}_qc.csv'
+            with tb.atomic_output(qc_csv) as tmp_path:
+                df_qc.to_csv(tmp_path, index=False)
+
+            failed = df_qc[df_qc['flags'] != '']
+            for row in failed.itertuples(index=False):
+                logger.warning(f'QC: {row.file} ({row.well}) flagged {row.flags}'
+                               + (' and excluded from counting' if row.excluded else ''))
+            logger.info(f'Image QC of {image_dir.name}: {len(failed)}/{len(df_qc)} wells flagged. '
+                        f'QC table saved to {qc_csv}')
+
+            rejection = self.verdict(df_qc)
+            if rejection or not df_qc['excluded'].any():
+                return image_dir, rejection
+
+            input_dir = Path(scratch_dir) / 'qc_input'
+            for row in df_qc[~df_qc['excluded']].itertuples(index=False):
+                _link(image_dir / row.file, input_dir / row.file)
+            return input_dir, None
+
+
+def _link(source, target):
+    """Make source available at target without copying where the platform allows it."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.symlink(source, target)
+    except OSError:
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+
+# QC settings shared by every CellProfiler run in this process (created on first use)
+_qc = None
+
+
+def configure(**kwargs):
+    """
+    Replace this process's QC settings with an ImageQC built from the given options.
+
+    Options left as None fall back to CELLPYABILITY_QC* environment variables, then defaults.
+    """
+    global _qc
+    _qc = ImageQC(**kwargs)
+    return _qc
+
+
+def get_qc():
+    """Return this process's QC settings, creating them from environment variables if needed."""
+    global _qc
+    if _qc is None:
+        _qc = ImageQC()
+    return _qc
@@ -0,0 +1,336 @@
+"""
+Scheduler module caps the number of CellProfiler processes running at once on this machine.
+
+Each CellProfiler run claims a slot (a lock file in a per-user slot directory) before it starts,
+so the cap holds across threads, batch worker processes, and separate cellpyability commands.
+A run is only admitted when a slot is free and enough memory is available; otherwise it waits
+in line. Admitted runs get thread-count environment variables and a JVM heap limit so that
+concurrent runs do not oversubscribe cores with multithreaded BLAS/OpenMP.
+"""
+
+import getpass
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+# Thread-count variables honored by OpenMP, OpenBLAS, MKL, numexpr and Accelerate
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+)
+
+# Defaults, each overridable with the matching CELLPYABILITY_* environment variable
+DEFAULT_THREADS_PER_PROCESS = 1
+DEFAULT_MEMORY_PER_PROCESS_MB = 3072
+DEFAULT_JVM_HEAP_MB = 1024
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Slot index of a run admitted without a slot because the slot directory is not writable
+UNSCHEDULED = -1
+
+
+def _env_number(name, cast=int):
+    """Read a numeric CELLPYABILITY_* environment variable, returning None if unset."""
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f'Ignoring invalid {name}={value!r}')
+        return None
+
+
+def default_slot_dir():
+    """
+    Slot directory of the current user: <tempdir>/cellpyability_slots-<user>.
+
+    Each user has their own directory, so one user's lock files never block another user's
+    runs. Users who want to share a cap set CELLPYABILITY_SLOT_DIR to a directory writable
+    by all of them (e.g., created with mode 1777).
+    """
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = str(os.getuid()) if hasattr(os, 'getuid') else 'user'
+    return Path(tempfile.gettempdir()) / f'cellpyability_slots-{user}'
+
+
+def available_memory_mb():
+    """
+    Return the memory available for new processes in megabytes, or None if unknown.
+
+    Uses MemAvailable on Linux, GlobalMemoryStatusEx on Windows and free pages elsewhere.
+    """
+    try:
+        if sys.platform.startswith('linux'):
+            with open('/proc/meminfo') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) // 1024
+        elif sys.platform == 'win32':
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ('dwLength', ctypes.c_ulong),
+                    ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong),
+                    ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong),
+                    ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong),
+                    ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+                ]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys // (1024 * 1024)
+        else:
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES') // (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def _pid_alive(pid):
+    """Return True if a process with this PID is still running on this machine."""
+    if pid <= 0:
+        return False
+    if sys.platform == 'win32':
+        import ctypes
+        process = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not process:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(process, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(process)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CellProfilerScheduler:
+    """
+    Admits CellProfiler runs into a fixed number of machine-wide slots.
+
+    Parameters:
+    -----------
+    max_processes : int, optional
+        Hard cap on concurrent CellProfiler processes. If None, derived from cores.
+    threads_per_process : int, optional
+        Threads each CellProfiler process may use (BLAS/OpenMP thread variables)
+    memory_per_process_mb : int, optional
+        Memory that must be available before another process is admitted
+    jvm_heap_mb : int, optional
+        JVM maximum heap size passed to each process via JAVA_TOOL_OPTIONS
+    slot_dir : str or Path, optional
+        Directory holding the slot lock files (default: <tempdir>/cellpyability_slots-<user>)
+    poll_interval : float, optional
+        Seconds between admission attempts while queued
+    """
+
+    def __init__(self, max_processes=None, threads_per_process=None, memory_per_process_mb=None,
+                 jvm_heap_mb=None, slot_dir=None, poll_interval=None):
+        cores = os.cpu_count() or 1
+        self.threads_per_process = max(1, threads_per_process
+                                       or _env_number('CELLPYABILITY_CP_THREADS')
+                                       or DEFAULT_THREADS_PER_PROCESS)
+        self.memory_per_process_mb = (memory_per_process_mb
+                                      or _env_number('CELLPYABILITY_CP_MEMORY_MB')
+                                      or DEFAULT_MEMORY_PER_PROCESS_MB)
+        self.jvm_heap_mb = jvm_heap_mb or _env_number('CELLPYABILITY_JVM_HEAP_MB') or DEFAULT_JVM_HEAP_MB
+        self.poll_interval = (poll_interval
+                              or _env_number('CELLPYABILITY_CP_POLL_INTERVAL', float)
+                              or DEFAULT_POLL_INTERVAL)
+
+        self.max_processes = max(1, cores // self.threads_per_process)
+        cap = max_processes or _env_number('CELLPYABILITY_MAX_CP_PROCESSES')
+        if cap:
+            self.max_processes = max(1, min(self.max_processes, cap))
+
+        slot_dir = slot_dir or os.environ.get('CELLPYABILITY_SLOT_DIR') or default_slot_dir()
+        self.slot_dir = Path(slot_dir)
+        try:
+            self.slot_dir.mkdir(parents=True, exist_ok=True)
+        except PermissionError:
+            pass  # reported when the first run tries to claim a slot
+        self._warned_unwritable = False
+
+        logger.info(f'CellProfiler scheduler: up to {self.max_processes} concurrent processes '
+                    f'({cores} cores / {self.threads_per_process} threads each), '
+                    f'{self.memory_per_process_mb} MB required per process, JVM heap {self.jvm_heap_mb} MB')
+
+    def process_env(self, base_env=None):
+        """Return the environment for one CellProfiler process with thread and heap limits applied."""
+        env = dict(os.environ if base_env is None else base_env)
+        for name in THREAD_ENV_VARS:
+            env[name] = str(self.threads_per_process)
+        java_options = env.get('JAVA_TOOL_OPTIONS', '')
+        env['JAVA_TOOL_OPTIONS'] = f'{java_options} -Xmx{self.jvm_heap_mb}m'.strip()
+        return env
+
+    def _slot_path(self, index):
+        return self.slot_dir / f'slot-{index}.lock'
+
+    def _reclaim_if_stale(self, slot_path):
+        """Remove a slot lock left behind by a process on this host that no longer exists."""
+        try:
+            host, pid = slot_path.read_text().split()[:2]
+        except (OSError, ValueError):
+            return
+        if host == socket.gethostname() and not _pid_alive(int(pid)):
+            try:
+                slot_path.unlink()
+                logger.warning(f'Reclaimed stale CellProfiler slot {slot_path.name} from dead process {pid}')
+            except OSError:
+                pass
+
+    def busy_slots(self):
+        """Return the number of slots currently held on this machine, reclaiming stale ones."""
+        busy = 0
+        for index in range(self.max_processes):
+            slot_path = self._slot_path(index)
+            if slot_path.exists():
+                self._reclaim_if_stale(slot_path)
+                busy += slot_path.exists()
+        return busy
+
+    def _try_claim(self):
+        """
+        Claim the first free slot and return its index, or None if all slots are taken.
+
+        Returns UNSCHEDULED if the slot directory is not writable (e.g., a shared directory
+        created by another user), so the run goes ahead without a slot instead of failing.
+        """
+        for index in range(self.max_processes):
+            slot_path = self._slot_path(index)
+            try:
+                fd = os.open(slot_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            except PermissionError:
+                if not self._warned_unwritable:
+                    logger.warning(f'CellProfiler slot directory {self.slot_dir} is not writable; running CellProfiler '
+                                   f'without the machine-wide cap. Set CELLPYABILITY_SLOT_DIR to a writable directory.')
+                    self._warned_unwritable = True
+                return UNSCHEDULED
+            with os.fdopen(fd, 'w') as lock_file:
+                lock_file.write(f'{socket.gethostname()} {os.getpid()}\n')
+            return index
+        return None
+
+    def try_acquire(self, label='', queued_since=None):
+        """
+        Claim a slot if a run can be admitted right now, without waiting.
+
+        A run is admitted when a slot is free and either no other slot is busy or at least
+        memory_per_process_mb is available, so one run can always make progress.
+
+        Returns:
+        --------
+        index : int or None
+            Claimed slot index, or None if the run must wait
+        reason : str or None
+            Why the run must wait
+        """
+        busy = self.busy_slots()
+        available_mb = available_memory_mb()
+        if busy >= self.max_processes:
+            return None, f'all {self.max_processes} slots busy'
+        if busy > 0 and available_mb is not None and available_mb < self.memory_per_process_mb:
+            return None, f'{available_mb} MB available, {self.memory_per_process_mb} MB required'
+
+        index = self._try_claim()
+        if index is None:
+            return None, f'all {self.max_processes} slots busy'
+        if index == UNSCHEDULED:
+            return index, None
+        waited = '' if queued_since is None else f' after {time.monotonic() - queued_since:.1f} s queued'
+        memory = 'unknown' if available_mb is None else f'{available_mb} MB'
+        logger.info(f'Admitted CellProfiler run {label} to slot {index + 1}/{self.max_processes} '
+                    f'({busy} busy, {memory} available){waited}')
+        return index, None
+
+    def acquire(self, label=''):
+        """Block until a CellProfiler slot is admitted (see try_acquire) and return its index."""
+        queued_since = None
+        last_reason = None
+        while True:
+            index, reason = self.try_acquire(label, queued_since)
+            if index is not None:
+                return index
+
+            if queued_since is None:
+                queued_since = time.monotonic()
+            if reason != last_reason:
+                logger.info(f'Queued CellProfiler run {label}: {reason}')
+                last_reason = reason
+            time.sleep(self.poll_interval)
+
+    def release(self, index):
+        """Release a slot claimed by acquire()."""
+        if index == UNSCHEDULED:
+            return
+        try:
+            self._slot_path(index).unlink()
+        except FileNotFoundError:
+            pass
+        logger.debug(f'Released CellProfiler slot {index + 1}/{self.max_processes}')
+
+    @contextmanager
+    def slot(self, label=''):
+        """
+        Context manager that holds a slot for one CellProfiler process.
+
+        Yields:
+        -------
+        env : dict
+            Environment to pass to the CellProfiler subprocess
+        """
+        index = self.acquire(label)
+        try:
+            yield self.process_env()
+        finally:
+            self.release(index)
+
+
+# Scheduler shared by every run_cellprofiler call in this process (created on first use)
+_scheduler = None
+
+
+def configure(**kwargs):
+    """
+    Replace this process's scheduler with one built from the given CellProfilerScheduler options.
+
+    Options left as None fall back to CELLPYABILITY_* environment variables, then defaults.
+    """
+    global _scheduler
+    _scheduler = CellProfilerScheduler(**kwargs)
+    return _scheduler
+
+
+def get_scheduler():
+    """Return this process's scheduler, creating it from environment variables if needed."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = CellProfilerScheduler()
+    return _scheduler
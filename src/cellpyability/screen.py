@@ -0,0 +1,469 @@
+"""
+Screen module analyzes compound screens laid out by a plate map on 96- or 384-well plates.
+
+A plate-map CSV assigns every well a role (sample, vehicle, positive or empty) and, for samples,
+a compound and concentration, so a plate can hold many compounds at a few concentrations each.
+Counts are normalized to the controls of their own plate: the vehicle mean is 100% viability and,
+where a plate has positive (kill) controls, their mean is 0%. Every compound's dose-response
+curve is then fitted in one batched pass: the points of all compounds are padded into one
+(compounds, points) array and a 4-parameter log-logistic is fitted to all of them together by
+Levenberg-Marquardt, so tens of thousands of compounds are fitted in well under a second
+instead of one curve_fit call each.
+"""
+
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+
+from . import profiling
+from . import toolbox as tb
+from .experiment import Experiment
+from .plate import PLATE_COLUMN
+
+# Initialize toolbox
+logger = tb.logger
+
+# Plate formats: row letters and column numbers
+PLATE_FORMATS = {
+    96: (tuple('ABCDEFGH'), tuple(str(i) for i in range(1, 13))),
+    384: (tuple('ABCDEFGHIJKLMNOP'), tuple(str(i) for i in range(1, 25))),
+}
+
+# Roles of plate-map wells, and accepted alternative names
+ROLES = ('sample', 'vehicle', 'positive', 'empty')
+ROLE_ALIASES = {'compound': 'sample', 'negative': 'vehicle', 'blank': 'empty'}
+
+# A compound needs at least this many counted points at two or more concentrations to be fitted
+MIN_POINTS = 4
+
+# Levenberg-Marquardt settings of the batched fit
+MAX_ITERATIONS = 200
+TOLERANCE = 1e-8
+
+
+def well_pattern(plate_format):
+    """Well name pattern of a plate format (B02, b2 and B2 are all B2, as in toolbox.rename_wells)."""
+    rows, _ = PLATE_FORMATS[plate_format]
+    return rf'([{rows[0]}-{rows[-1]}{rows[0].lower()}-{rows[-1].lower()}])0*(\d{{1,2}})'
+
+
+def parse_well_names(names, plate_format):
+    """Normalize well names (e.g. 'b02' to 'B2'); NaN where a name holds no well of the format."""
+    rows, columns = PLATE_FORMATS[plate_format]
+    parts = pd.Series(names, dtype=object).astype(str).str.extract(well_pattern(plate_format))
+    wells = parts[0].str.upper() + parts[1]
+    return wells.where(parts[1].isin(columns))
+
+
+def read_plate_map(plate_map, plate_format=None):
+    """
+    Read and validate a plate map.
+
+    Parameters:
+    -----------
+    plate_map : str or pandas.DataFrame
+        CSV (or DataFrame) with columns Well and Role, Compound and Concentration (for samples)
+        and optionally Plate (plate number, or image directory name); without a Plate column
+        the map applies to every plate
+    plate_format : int, optional
+        96 or 384; inferred from the wells if None
+
+    Returns:
+    --------
+    df_map : pandas.DataFrame
+        Well (normalized), Role, Compound, Concentration and Plate (if given)
+    plate_format : int
+    """
+    df_map = pd.read_csv(plate_map) if not isinstance(plate_map, pd.DataFrame) else plate_map.copy()
+    df_map.columns = [str(column).strip().title() for column in df_map.columns]
+    missing = {'Well', 'Role'} - set(df_map.columns)
+    if missing:
+        raise ValueError(f'Plate map needs the columns Well and Role (missing: {", ".join(sorted(missing))})')
+
+    if plate_format is None:
+        in_96 = parse_well_names(df_map['Well'], 96).notna()
+        plate_format = 96 if in_96.all() else 384
+    if plate_format not in PLATE_FORMATS:
+        raise ValueError(f'Plate format must be one of {", ".join(map(str, PLATE_FORMATS))}, not {plate_format}')
+    wells = parse_well_names(df_map['Well'], plate_format)
+    if wells.isna().any():
+        bad = ', '.join(df_map.loc[wells.isna(), 'Well'].astype(str).head(5))
+        raise ValueError(f'Plate map wells are not wells of a {plate_format}-well plate: {bad}')
+    df_map['Well'] = wells
+
+    roles = df_map['Role'].fillna('empty').astype(str).str.strip().str.lower().replace(ROLE_ALIASES)
+    unknown = sorted(set(roles) - set(ROLES))
+    if unknown:
+        raise ValueError(f'Unknown plate map roles: {", ".join(unknown)} (use {", ".join(ROLES)})')
+    df_map['Role'] = roles
+
+    samples = df_map['Role'] == 'sample'
+    if samples.any():
+        if not {'Compound', 'Concentration'} <= set(df_map.columns):
+            raise ValueError('Plate map samples need Compound and Concentration columns')
+        df_map['Concentration'] = pd.to_numeric(df_map['Concentration'], errors='coerce')
+        if df_map.loc[samples, 'Compound'].isna().any() or df_map.loc[samples, 'Concentration'].isna().any():
+            raise ValueError('Every sample well needs a compound and a numeric concentration')
+    if not (df_map['Role'] == 'vehicle').any():
+        raise ValueError('Plate map needs vehicle wells to normalize to')
+
+    keys = [column for column in (PLATE_COLUMN, 'Well') if column in df_map]
+    duplicated = df_map.duplicated(keys)
+    if duplicated.any():
+        raise ValueError(f'Plate map lists wells more than once: {", ".join(df_map.loc[duplicated, "Well"].head(5))}')
+    return df_map, plate_format
+
+
+def _log_logistic(log_doses, params):
+    """4-parameter log-logistic, with s the fraction of the way from bottom to top (for the Jacobian)."""
+    top, slope, log_ec50, bottom = (params[:, i:i + 1] for i in range(4))
+    s = expit(-slope * (log_doses - log_ec50) * np.log(10))
+    return bottom + (top - bottom) * s, s
+
+
+def fit_curves(doses, viability):
+    """
+    Fit a 4-parameter log-logistic to many dose-response curves at once.
+
+    viability = bottom + (top - bottom) / (1 + (dose / EC50) ** slope), fitted to every curve
+    together by Levenberg-Marquardt with one damping factor per curve.
+
+    Parameters:
+    -----------
+    doses, viability : numpy.ndarray
+        Arrays of shape (curves, points), NaN-padded; points with a dose <= 0 are ignored
+
+    Returns:
+    --------
+    fits : dict of str -> numpy.ndarray
+        top, bottom, hill_slope, ec50, ic50 (dose at 0.5 viability, NaN if the curve does not
+        cross 0.5), r2 and converged, one value per curve (NaN where there were too few points)
+    """
+    doses, viability = np.asarray(doses, dtype=float), np.asarray(viability, dtype=float)
+    valid = (doses > 0) & np.isfinite(viability)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_doses = np.where(valid, np.log10(np.where(valid, doses, 1)), 0.0)
+    y = np.where(valid, viability, 0.0)
+    n_points = valid.sum(axis=1)
+    log_min = np.where(valid, log_doses, np.inf).min(axis=1, initial=np.inf)
+    log_max = np.where(valid, log_doses, -np.inf).max(axis=1, initial=-np.inf)
+    fittable = (n_points >= MIN_POINTS) & (log_max > log_min)
+
+    # Initial guesses: top at 1 (vehicle), bottom at the lowest point, EC50 nearest the midpoint
+    lowest = np.where(valid, y, np.inf).min(axis=1, initial=np.inf)
+    bottom = np.clip(np.where(np.isfinite(lowest), lowest, 0.0), -0.5, 0.9)
+    nearest = np.abs(np.where(valid, y, np.inf) - ((1 + bottom) / 2)[:, None]).argmin(axis=1)
+    params = np.column_stack([np.ones(len(y)), np.ones(len(y)), log_doses[np.arange(len(y)), nearest], bottom])
+
+    # Keep EC50 within two decades of the tested doses, and the curve within plausible viability
+    lower = np.column_stack([np.zeros(len(y)), np.full(len(y), 0.1), log_min - 2, np.full(len(y), -1.0)])
+    upper = np.column_stack([np.full(len(y), 2.0), np.full(len(y), 10.0), log_max + 2, np.full(len(y), 2.0)])
+    lower, upper = np.where(fittable[:, None], lower, -np.inf), np.where(fittable[:, None], upper, np.inf)
+
+    def sse(index, candidate):
+        predicted, _ = _log_logistic(log_doses[index], candidate)
+        return np.sum(np.where(valid[index], y[index] - predicted, 0.0) ** 2, axis=1)
+
+    error = np.full(len(y), np.nan)
+    error[fittable] = sse(fittable, params[fittable])
+    damping = np.full(len(y), 1e-3)
+    converged = np.zeros(len(y), dtype=bool)
+    active = fittable.copy()
+    for _ in range(MAX_ITERATIONS):
+        index = np.flatnonzero(active)
+        if not len(index):
+            break
+        p, x, mask = params[index], log_doses[index], valid[index]
+        predicted, s = _log_logistic(x, p)
+        residual = np.where(mask, y[index] - predicted, 0.0)
+
+        # Jacobian of the model with respect to (top, slope, log EC50, bottom)
+        top, slope, log_ec50, bottom = (p[:, i:i + 1] for i in range(4))
+        ds = (top - bottom) * s * (1 - s) * np.log(10)
+        jacobian = np.stack([s, -ds * (x - log_ec50), ds * slope, 1 - s], axis=-1) * mask[..., None]
+
+        jtj = np.einsum('cpi,cpj->cij', jacobian, jacobian)
+        gradient = np.einsum('cpi,cp->ci', jacobian, residual)
+        diagonal = np.einsum('cii->ci', jtj)
+        system = jtj + (damping[index, None] * (diagonal + 1e-12))[:, :, None] * np.eye(4)
+        step = np.linalg.solve(system, gradient[..., None])[..., 0]
+        candidate = np.clip(p + step, lower[index], upper[index])
+
+        new_error = sse(index, candidate)
+        improved = new_error < error[index]
+        params[index[improved]] = candidate[improved]
+        small = np.abs(error[index] - new_error) <= TOLERANCE * (error[index] + TOLERANCE)
+        error[index[improved]] = new_error[improved]
+        damping[index] = np.where(improved, damping[index] / 10, damping[index] * 10)
+
+        # Done when the error stops changing, or when no step in any direction helps
+        done = (improved & small) | (damping[index] > 1e10)
+        converged[index[done]] = True
+        active[index[done]] = False
+
+    top, slope, log_ec50, bottom = params.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = (bottom < 0.5) & (top > 0.5)
+        log_ic50 = log_ec50 + np.log10((top - 0.5) / (0.5 - bottom)) / slope
+        mean = np.sum(y, axis=1) / n_points
+        total = np.sum(np.where(valid, y - mean[:, None], 0.0) ** 2, axis=1)
+        r2 = 1 - error / total
+
+    def fitted(values):
+        return np.where(fittable, values, np.nan)
+
+    return {
+        'top': fitted(top),
+        'bottom': fitted(bottom),
+        'hill_slope': fitted(slope),
+        'ec50': fitted(10 ** log_ec50),
+        'ic50': fitted(np.where(crosses, 10 ** log_ic50, np.nan)),
+        'r2': fitted(r2),
+        'converged': converged,
+    }
+
+
+@dataclass
+class ScreenResult:
+    """
+    In-memory results of a compound screen.
+
+    Attributes:
+    -----------
+    title : str
+        Title of the screen
+    plate_format : int
+        96 or 384
+    counts : pandas.DataFrame
+        Raw CellProfiler counts (with a Plate column for several plates)
+    viability : pandas.DataFrame
+        One row per mapped well: Plate, Well, Role, Compound, Concentration, Count, Viability
+    plates : pandas.DataFrame
+        Control statistics per plate: vehicle and positive control means, vehicle CV and Z'-factor
+    ic50 : pandas.DataFrame
+        One row per compound with its fit (as in _screen_IC50.csv)
+    """
+    title: str
+    plate_format: int
+    counts: pd.DataFrame
+    viability: pd.DataFrame
+    plates: pd.DataFrame
+    ic50: pd.DataFrame
+
+
+class ScreenExperiment(Experiment):
+    """
+    Compound screen of one or more plates laid out by a plate map.
+    Every stage is computed lazily on first access and cached; nothing is written until save().
+
+    Parameters:
+    -----------
+    title : str
+        Title of the screen
+    plate_map : str or pandas.DataFrame
+        Plate map (see read_plate_map)
+    plate_format : int, optional
+        96 or 384 (default: inferred from the plate map)
+    image_dir, counts_file, counts, output_dir :
+        See experiment.Experiment; give one image directory per plate, in the order of the
+        plate numbers in the plate map
+    """
+
+    module = 'screen'
+
+    def __init__(self, title, plate_map, image_dir=None, counts_file=None, counts=None, output_dir=None,
+                 plate_format=None):
+        super().__init__(title, image_dir, counts_file, counts, output_dir)
+        self.plate_map, self.plate_format = read_plate_map(plate_map, plate_format)
+
+    def _plate_numbers(self, plates):
+        """Plate-map Plate values (numbers, or image directory names) as 1-based plate numbers."""
+        names = {}
+        if isinstance(self.image_dir, (list, tuple)):
+            names = {Path(image_dir).name: number for number, image_dir in enumerate(self.image_dir, start=1)}
+        numbers = plates.astype(str).map(names).fillna(pd.to_numeric(plates, errors='coerce'))
+        if numbers.isna().any():
+            unknown = ', '.join(sorted(set(plates[numbers.isna()].astype(str))))
+            raise ValueError(f'Plate map plates are neither plate numbers nor image directory names: {unknown}')
+        return numbers.astype(int)
+
+    @cached_property
+    @profiling.timed('rename_wells')
+    def well_counts(self):
+        """Mean nuclei count per plate and well (Plate, Well, Count)."""
+        df_cp = self.counts
+        df_wells = pd.DataFrame({
+            PLATE_COLUMN: df_cp[PLATE_COLUMN].to_numpy() if PLATE_COLUMN in df_cp else 1,
+            'Well': parse_well_names(df_cp['FileName_images'], self.plate_format).to_numpy(),
+            'Count': df_cp['Count_nuclei'].to_numpy(dtype=float),
+        }).dropna(subset=['Well'])
+        return df_wells.groupby([PLATE_COLUMN, 'Well'], as_index=False, sort=False)['Count'].mean()
+
+    @cached_property
+    @profiling.timed('normalize')
+    def viability(self):
+        """Mapped wells with their count and viability relative to the controls of their plate."""
+        df_map = self.plate_map[self.plate_map['Role'] != 'empty']
+        if PLATE_COLUMN in df_map:
+            df_map = df_map.assign(**{PLATE_COLUMN: self._plate_numbers(df_map[PLATE_COLUMN])})
+        else:
+            # One map for every plate
+            plates = pd.DataFrame({PLATE_COLUMN: self.well_counts[PLATE_COLUMN].unique()})
+            df_map = plates.merge(df_map, how='cross')
+        df = df_map.merge(self.well_counts, on=[PLATE_COLUMN, 'Well'], how='left')
+
+        missing = df['Count'].isna()
+        if missing.any():
+            logger.warning(f'{self.title}: {int(missing.sum())} mapped wells have no counts and are skipped')
+
+        vehicle = df['Count'].where(df['Role'] == 'vehicle').groupby(df[PLATE_COLUMN]).transform('mean')
+        positive = df['Count'].where(df['Role'] == 'positive').groupby(df[PLATE_COLUMN]).transform('mean')
+        if vehicle.isna().any():
+            plates = ', '.join(map(str, sorted(df.loc[vehicle.isna(), PLATE_COLUMN].unique())))
+            raise ValueError(f'Plates without counted vehicle wells: {plates}')
+        floor = positive.fillna(0.0)
+        df['Viability'] = (df['Count'] - floor) / (vehicle - floor)
+        logger.debug(f'Normalized {len(df)} wells of {df[PLATE_COLUMN].nunique()} plates to their controls.')
+        return df
+
+    @cached_property
+    def plates(self):
+        """Control statistics per plate: vehicle mean and CV, positive mean and Z'-factor."""
+        df = self.viability
+        rows = []
+        for plate, df_plate in df.groupby(PLATE_COLUMN):
+            vehicle = df_plate.loc[df_plate['Role'] == 'vehicle', 'Count']
+            positive = df_plate.loc[df_plate['Role'] == 'positive', 'Count']
+            z_prime = np.nan
+            if len(positive) > 1 and len(vehicle) > 1 and vehicle.mean() != positive.mean():
+                z_prime = 1 - 3 * (vehicle.std() + positive.std()) / abs(vehicle.mean() - positive.mean())
+            rows.append({
+                PLATE_COLUMN: plate,
+                'Samples': int((df_plate['Role'] == 'sample').sum()),
+                'Vehicle Mean': vehicle.mean(),
+                'Vehicle CV': vehicle.std() / vehicle.mean(),
+                'Positive Mean': positive.mean() if len(positive) else np.nan,
+                "Z' Factor": z_prime,
+            })
+        return pd.DataFrame(rows)
+
+    @cached_property
+    @profiling.timed('fit')
+    def ic50(self):
+        """Batched 4-parameter fit of every compound, one row per compound."""
+        df = self.viability
+        df = df[(df['Role'] == 'sample') & df['Count'].notna()]
+
+        # Pad the points of every compound into one (compounds, points) array
+        codes, compounds = pd.factorize(df['Compound'], sort=True)
+        position = df.groupby(codes).cumcount().to_numpy()
+        shape = (len(compounds), position.max() + 1 if len(position) else 0)
+        doses, viability = np.full(shape, np.nan), np.full(shape, np.nan)
+        doses[codes, position] = df['Concentration'].to_numpy(dtype=float)
+        viability[codes, position] = df['Viability'].to_numpy(dtype=float)
+
+        fits = fit_curves(doses, viability)
+        top_dose = np.where(doses > 0, doses, -np.inf).max(axis=1, initial=-np.inf)
+        top_dose[~np.isfinite(top_dose)] = np.nan
+        at_top = np.where(doses == top_dose[:, None], viability, np.nan)
+        counted = np.isfinite(at_top).sum(axis=1)
+        df_ic50 = pd.DataFrame({
+            'Compound': compounds,
+            'Points': np.isfinite(viability).sum(axis=1),
+            'Top Concentration': top_dose,
+            'Viability at Top Concentration': np.nansum(at_top, axis=1) / np.where(counted, counted, np.nan),
+            'IC50': fits['ic50'],
+            'EC50': fits['ec50'],
+            'Hill Slope': fits['hill_slope'],
+            'Top': fits['top'],
+            'Bottom': fits['bottom'],
+            'R2': fits['r2'],
+            'Converged': fits['converged'],
+        })
+        logger.info(f'{self.title}: fitted {int(df_ic50["Converged"].sum())} of {len(df_ic50)} compounds; '
+                    f'{int(df_ic50["IC50"].notna().sum())} reach 50% viability')
+        return df_ic50
+
+    @property
+    def result(self):
+        """All results as a ScreenResult."""
+        return ScreenResult(
+            title=self.title,
+            plate_format=self.plate_format,
+            counts=self.counts,
+            viability=self.viability,
+            plates=self.plates,
+            ic50=self.ic50,
+        )
+
+    def save(self, stage_callback=None):
+        """
+        Write the IC50 table, per-well viability, plate controls and raw counts to
+        <output_dir>/screen_output/.
+
+        Parameters:
+        -----------
+        stage_callback : callable, optional
+            Called as stage_callback(stage, path) after each completed stage:
+            'counted' (counts CSV), 'stats' (IC50 CSV)
+
+        Returns:
+        --------
+        result : ScreenResult
+        """
+        self._count(stage_callback)
+        screen_output_dir = self.output_path()
+
+        outputs = [
+            (self.ic50, f'{self.title}_screen_IC50.csv'),
+            (self.viability, f'{self.title}_screen_viability.csv'),
+            (self.plates, f'{self.title}_screen_plates.csv'),
+        ]
+        for df, name in outputs:
+            with profiling.span('write_csv'), tb.atomic_output(screen_output_dir / name) as tmp_path:
+                df.to_csv(tmp_path, index=False)
+        logger.info(f'{self.title} IC50 table, viability and plate controls saved to {screen_output_dir}')
+        if stage_callback is not None:
+            stage_callback('stats', screen_output_dir / f'{self.title}_screen_IC50.csv')
+
+        for plate, z_prime in zip(self.plates[PLATE_COLUMN], self.plates["Z' Factor"]):
+            if z_prime < 0.5:
+                logger.warning(f"{self.title}: plate {plate} Z'-factor is {z_prime:.2f} (below 0.5)")
+
+        self.save_counts(screen_output_dir / f'{self.title}_screen_counts.csv')
+        logger.info(f'{self.title} raw counts saved to {screen_output_dir}')
+        return self.result
+
+
+def run_screen(title, plate_map, image_dir, counts_file=None, output_dir=None, plate_format=None, stage_callback=None):
+    """
+    Run a compound screen analysis.
+
+    Parameters:
+    -----------
+    title : str
+        Title of the screen
+    plate_map : str
+        Path to the plate-map CSV
+    image_dir : str or list of str
+        Image directory of each plate, in plate-number order
+    counts_file : str, optional
+        Path to pre-existing counts CSV file (with a Plate column for several plates)
+    output_dir : str, optional
+        Custom output directory. If None, uses current working directory.
+    plate_format : int, optional
+        96 or 384 (default: inferred from the plate map)
+    stage_callback : callable, optional
+        See ScreenExperiment.save
+
+    Returns:
+    --------
+    result : ScreenResult
+    """
+    experiment = ScreenExperiment(title, plate_map, image_dir=image_dir, counts_file=counts_file,
+                                  output_dir=output_dir, plate_format=plate_format)
+    return experiment.save(stage_callback=stage_callback)
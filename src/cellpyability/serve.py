@@ -0,0 +1,304 @@
+"""
+Serve module runs a small HTTP job service on top of the work queue, so several people can
+submit plates from their own machines, poll their status and download the results.
+
+Jobs are stored in a work queue directory (see workqueue), which makes the queue persistent
+across restarts and lets extra `cellpyability worker` processes on other machines help out.
+The service starts its own pool of local worker processes.
+
+API (JSON unless noted):
+    POST   /jobs                 submit a job: config.csv columns (module, dir, title, ...),
+                                 optional counts and priority (0-9, higher runs first);
+                                 dir and counts must be inside the service's allowed roots
+    GET    /jobs                 list all jobs
+    GET    /jobs/<id>            status and result of one job
+    GET    /jobs/<id>/results    zip archive of the job's output directory
+    DELETE /jobs/<id>            cancel a job that has not started
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import re
+import zipfile
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from . import toolbox as tb
+from . import batch
+from . import logs
+from . import storage
+from . import workqueue
+
+# Initialize toolbox
+logger = tb.logger
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+MAX_REQUEST_BYTES = 1024 * 1024
+JOB_ID_PATTERN = re.compile(r'^[\w-]+$')  # no path separators or glob characters
+
+
+def _worker_main(queue_dir, poll_interval, stale_timeout, stop_event, log_options=None):
+    """Entry point of a service worker process."""
+    logs.attach(log_options)
+    import matplotlib
+    matplotlib.use('Agg')  # worker processes never display plots
+    workqueue.run_worker(queue_dir, poll_interval=poll_interval, stale_timeout=stale_timeout, stop_event=stop_event)
+
+
+class JobService:
+    """
+    Job queue and local worker pool behind the HTTP API.
+
+    Parameters:
+    -----------
+    queue_dir : str or Path
+        Work queue directory holding the jobs and, by default, their results
+    workers : int, optional
+        Number of local worker processes (default: number of CPUs)
+    output_dir : str, optional
+        Output root for job results. If None, uses <queue_dir>/results/.
+    poll_interval : float
+        Seconds an idle worker waits before checking the queue again
+    stale_timeout : float
+        Seconds without a heartbeat after which a claimed job is retried
+    allowed_roots : list of str or Path, optional
+        Directories (or object-store URL prefixes) that submitted image directories and
+        counts files must be inside. If None, uses the current working directory.
+    """
+
+    def __init__(self, queue_dir, workers=None, output_dir=None, poll_interval=1.0,
+                 stale_timeout=workqueue.DEFAULT_STALE_TIMEOUT, allowed_roots=None):
+        self.queue_path = workqueue.init_queue(queue_dir)
+        roots = [str(root) for root in (allowed_roots or [Path.cwd()])]
+        self.allowed_urls = [root.rstrip('/') + '/' for root in roots if storage.is_url(root)]
+        self.allowed_dirs = [storage.local_path(root).resolve() for root in roots if not storage.is_url(root)]
+        self.workers = workers or os.cpu_count() or 1
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        self._stop_event = multiprocessing.Event()
+        self._processes = []
+
+    def start_workers(self):
+        """Start the local worker processes."""
+        self._stop_event.clear()
+        for _ in range(self.workers):
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(str(self.queue_path), self.poll_interval, self.stale_timeout, self._stop_event,
+                      logs.worker_options()),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info(f'Job service started {self.workers} workers on {self.queue_path}')
+
+    def stop_workers(self, timeout=None):
+        """Ask the workers to stop after their current job and wait for them."""
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+        self._processes = []
+
+    def is_allowed(self, path):
+        """Whether a submitted path resolves inside one of the allowed roots."""
+        if storage.is_url(path):
+            if '..' in urlsplit(path).path.split('/'):
+                return False
+            return any((path.rstrip('/') + '/').startswith(root) for root in self.allowed_urls)
+        resolved = storage.local_path(path).resolve()
+        return any(resolved == root or root in resolved.parents for root in self.allowed_dirs)
+
+    def submit(self, request):
+        """
+        Validate a job request and add it to the queue.
+
+        Parameters:
+        -----------
+        request : dict
+            Config columns of one experiment (see batch.MODULE_COLUMNS), plus optional
+            'counts' and 'priority'
+
+        Returns:
+        --------
+        job_id : str
+        """
+        request = dict(request)
+        priority = request.pop('priority', workqueue.DEFAULT_PRIORITY)
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            raise ValueError(f'Priority must be an integer, got {priority!r}') from None
+        experiment = batch.parse_experiment(request)
+        if Path(experiment['title']).name != experiment['title'] or experiment['title'] in ('.', '..'):
+            raise ValueError(f'Title must be a plain file name, got {experiment["title"]!r}')
+        # Clients name paths on the server, and the counts file is copied into the results
+        for key, column in (('image_dir', 'dir'), ('counts_file', 'counts')):
+            if experiment[key] and not self.is_allowed(experiment[key]):
+                raise ValueError(f'{column} {experiment[key]!r} is outside the directories this service serves')
+        job_ids = workqueue.submit_experiments(self.queue_path, [experiment], output_dir=self.output_dir,
+                                               priority=priority, isolate=True)
+        return job_ids[0]
+
+    def job_view(self, state, job):
+        """JSON view of a job returned by the API."""
+        view = {'id': job['id'], 'state': state}
+        for key in ('priority', 'submitted', 'started', 'finished', 'worker', 'attempts', 'experiment', 'result'):
+            if key in job:
+                view[key] = job[key]
+        return view
+
+    def results_archive(self, job):
+        """
+        Return the job's output directory as zip archive bytes, or None if it has no outputs.
+
+        Raises ValueError if the results were written to an object store.
+        """
+        if storage.is_url(job['output_dir']):
+            raise ValueError(f'Results of job {job["id"]} are in {job["output_dir"]}/{job["experiment"]["title"]}; '
+                             f'download them from there')
+        result_dir = Path(job['output_dir']) / job['experiment']['title']
+        if not result_dir.is_dir():
+            return None
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for path in sorted(result_dir.rglob('*')):
+                if path.is_file():
+                    archive.write(path, path.relative_to(result_dir.parent))
+        return buffer.getvalue()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler for the job API. The server's service attribute is the JobService."""
+
+    server_version = 'CellPyAbility'
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.client_address[0]} {format % args}')
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def _route(self):
+        """Split the path into ('jobs', job_id or None, 'results' or None), or None if unknown."""
+        parts = [part for part in self.path.split('?', 1)[0].split('/') if part]
+        if not parts or parts[0] != 'jobs' or len(parts) > 3:
+            return None
+        if len(parts) == 3 and parts[2] != 'results':
+            return None
+        if len(parts) > 1 and not JOB_ID_PATTERN.match(parts[1]):
+            return None
+        return parts[0], (parts[1] if len(parts) > 1 else None), (parts[2] if len(parts) > 2 else None)
+
+    def do_POST(self):
+        route = self._route()
+        if route != ('jobs', None, None):
+            return self._send_error(HTTPStatus.NOT_FOUND, f'No such endpoint: POST {self.path}')
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            return self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request too large')
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('Request body must be a JSON object')
+            job_id = self.server.service.submit(request)
+        except (ValueError, json.JSONDecodeError) as e:
+            return self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+
+        self._send_json(HTTPStatus.CREATED, {'id': job_id, 'state': 'pending'})
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, f'No such endpoint: GET {self.path}')
+        service = self.server.service
+        _, job_id, results = route
+
+        if job_id is None:
+            jobs = workqueue.list_jobs(service.queue_path)
+            return self._send_json(HTTPStatus.OK, {'jobs': [service.job_view(state, job) for state, job in jobs]})
+
+        state, job = workqueue.find_job(service.queue_path, job_id)
+        if job is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, f'Unknown job {job_id}')
+        if results is None:
+            return self._send_json(HTTPStatus.OK, service.job_view(state, job))
+
+        if state not in ('done', 'failed'):
+            return self._send_error(HTTPStatus.CONFLICT, f'Job {job_id} is {state}')
+        try:
+            archive = service.results_archive(job)
+        except ValueError as e:
+            return self._send_error(HTTPStatus.CONFLICT, str(e))
+        if archive is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, f'Job {job_id} has no results')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{job["experiment"]["title"]}.zip"')
+        self.send_header('Content-Length', str(len(archive)))
+        self.end_headers()
+        self.wfile.write(archive)
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None or route[1] is None or route[2] is not None:
+            return self._send_error(HTTPStatus.NOT_FOUND, f'No such endpoint: DELETE {self.path}')
+        service = self.server.service
+        job_id = route[1]
+        if workqueue.cancel_job(service.queue_path, job_id):
+            return self._send_json(HTTPStatus.OK, {'id': job_id, 'state': 'failed', 'result': {'status': 'cancelled'}})
+        state, _ = workqueue.find_job(service.queue_path, job_id)
+        if state is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, f'Unknown job {job_id}')
+        self._send_error(HTTPStatus.CONFLICT, f'Job {job_id} is {state} and cannot be cancelled')
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Create (but do not start) the HTTP server for a JobService. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(queue_dir, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, output_dir=None,
+          poll_interval=1.0, stale_timeout=workqueue.DEFAULT_STALE_TIMEOUT, allowed_roots=None):
+    """
+    Run the job service until interrupted (Ctrl+C).
+
+    Parameters:
+    -----------
+    queue_dir : str or Path
+        Work queue directory holding the jobs
+    host : str
+        Address to listen on (default: localhost only)
+    port : int
+        Port to listen on
+    workers, output_dir, poll_interval, stale_timeout, allowed_roots :
+        See JobService
+    """
+    service = JobService(queue_dir, workers=workers, output_dir=output_dir,
+                         poll_interval=poll_interval, stale_timeout=stale_timeout, allowed_roots=allowed_roots)
+    server = make_server(service, host, port)
+    service.start_workers()
+    logger.info(f'Serving CellPyAbility jobs on http://{host}:{server.server_address[1]}/jobs')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping job service; running jobs finish first ...')
+    finally:
+        server.server_close()
+        service.stop_workers()
@@ -3,13 +3,97 @@ Simple analysis module that returns a nuclei count matrix without further analys
 Offers maximum flexibility for plate mapping.
 """
 
+from dataclasses import dataclass
+from functools import cached_property
+
+import pandas as pd
+
+from . import profiling
 from . import toolbox as tb
+from .experiment import Experiment
+from .plate import LAYOUT_COLUMNS, LAYOUT_ROWS, Plate
 
 # Initialize toolbox
 logger, base_dir = tb.logger, tb.base_dir
 
+ROW_LABELS = list(LAYOUT_ROWS)
+COLUMN_LABELS = list(LAYOUT_COLUMNS)
+
+
+@dataclass
+class SimpleResult:
+    """
+    In-memory results of a simple experiment.
+
+    Attributes:
+    -----------
+    title : str
+        Title of the experiment
+    counts : pandas.DataFrame
+        Raw CellProfiler counts
+    count_matrix : pandas.DataFrame
+        Nuclei counts in 96-well layout (rows B-G x columns 2-11)
+    """
+    title: str
+    counts: pd.DataFrame
+    count_matrix: pd.DataFrame
+
+
+class SimpleExperiment(Experiment):
+    """
+    Nuclei counting without further analysis. The count matrix is computed lazily and cached.
+
+    Parameters:
+    -----------
+    title, image_dir, counts_file, counts, output_dir :
+        See experiment.Experiment
+    """
+
+    module = 'simple'
 
-def run_simple(title, image_dir, counts_file=None, output_dir=None):
+    @cached_property
+    @profiling.timed('pivot')
+    def count_matrix(self):
+        """Nuclei counts in a 96-well layout (mean of any replicate plates)."""
+        return Plate.frame(self.plate.mean(ROW_LABELS, COLUMN_LABELS), ROW_LABELS, COLUMN_LABELS)
+
+    @property
+    def result(self):
+        """All stages as a SimpleResult."""
+        return SimpleResult(title=self.title, counts=self.counts, count_matrix=self.count_matrix)
+
+    def save(self, stage_callback=None):
+        """
+        Write the count matrix and raw counts to <output_dir>/simple_output/.
+
+        Parameters:
+        -----------
+        stage_callback : callable, optional
+            Called as stage_callback(stage, path) after each completed stage:
+            'counted' (counts CSV), 'stats' (output directory)
+
+        Returns:
+        --------
+        result : SimpleResult
+        """
+        self._count(stage_callback)
+        outdir = self.output_path()
+
+        # Save the count matrix to the simple_output directory
+        count_matrix = self.count_matrix
+        with profiling.span('write_csv'), tb.atomic_output(outdir / f'{self.title}_simple_CountMatrix.csv') as tmp_path:
+            count_matrix.to_csv(tmp_path)
+        logger.info(f"Saved count matrix for '{self.title}' to {outdir}")
+        if stage_callback is not None:
+            stage_callback('stats', outdir)
+
+        # Rename the original CellProfiler output for traceability
+        self.save_counts(outdir / f'{self.title}_simple_raw_counts.csv')
+        logger.info(f"Saved raw counts for '{self.title}' to {outdir}")
+        return self.result
+
+
+def run_simple(title, image_dir, counts_file=None, output_dir=None, stage_callback=None):
     """
     Run simple nuclei counting analysis.
     
@@ -23,40 +107,14 @@ def run_simple(title, image_dir, counts_file=None, output_dir=None):
         Path to pre-existing counts CSV file (for testing)
     output_dir : str, optional
         Custom output directory. If None, uses current working directory.
+    stage_callback : callable, optional
+        Called as stage_callback(stage, path) after each completed stage:
+        'counted' (counts CSV), 'stats' (output directory)
+
+    Returns:
+    --------
+    result : SimpleResult
+        Raw counts and count matrix in memory
     """
-    
-    # Run CellProfiler via the command line
-    df_cp, cp_csv = tb.run_cellprofiler(image_dir, counts_file=counts_file, output_dir=output_dir)
-    
-    # Clean up DataFrame columns
-    df_cp.drop(columns='ImageNumber', inplace=True)
-    df_cp.columns = ['nuclei', 'well']
-    
-    # Rename wells to e.g. B10 format
-    df_cp['well'] = df_cp['well'].apply(lambda x: tb.rename_wells(x))
-    
-    # Extract row/column
-    df_cp[['Row','Column']] = df_cp['well'].str.extract(r'^([B-G])(\d+)$')
-    
-    # Pivot df_cp so it matches a 96-well layout (nuclei count matrix)
-    row_labels = ['B','C','D','E','F','G']
-    column_labels = [str(i) for i in range(2,12)]
-    
-    count_matrix = (
-        df_cp
-        .pivot(index='Row', columns='Column', values='nuclei')
-        .reindex(index=row_labels, columns=column_labels)
-    )
-    
-    # Define or create simple_output/ directory in output directory
-    output_base = tb.get_output_base_dir(output_dir)
-    outdir = output_base / 'simple_output'
-    outdir.mkdir(exist_ok=True)
-    
-    # Save the count matrix to the simple_output directory
-    count_matrix.to_csv(outdir / f'{title}_simple_CountMatrix.csv')
-    logger.info(f"Saved count matrix for '{title}' to {outdir}")
-    
-    # Rename the original CellProfiler output for traceability
-    tb.rename_counts(cp_csv, outdir / f'{title}_simple_raw_counts.csv')
-    logger.info(f"Saved raw counts for '{title}' to {outdir}")
+    experiment = SimpleExperiment(title, image_dir=image_dir, counts_file=counts_file, output_dir=output_dir)
+    return experiment.save(stage_callback=stage_callback)
@@ -0,0 +1,445 @@
+"""
+Storage module lets image directories and output directories be object-store URLs as well as local paths.
+
+CellProfiler only reads local files, so a plate at a URL (e.g., s3://bucket/plates/plate1) is
+fetched to a temporary directory first, all of its objects downloaded in parallel, and removed
+once it is counted. Outputs for a URL are written to a local mirror directory as usual and
+uploaded together, in parallel, when the run finishes; only files the run created or changed
+are uploaded.
+
+Backends follow the fsspec file system interface (find, isfile, get_file, put_file):
+    s3://         built in (standard library only): AWS S3 or any S3-compatible store, signed
+                  with AWS Signature Version 4. Settings come from the usual AWS variables:
+                  AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_SESSION_TOKEN (else
+                  ~/.aws/credentials, else unsigned requests), AWS_REGION or
+                  AWS_DEFAULT_REGION, and AWS_ENDPOINT_URL_S3 or AWS_ENDPOINT_URL for
+                  stores other than AWS (e.g., MinIO, Ceph)
+    other schemes through fsspec if it is installed (e.g., gs:// with gcsfs, az:// with adlfs)
+register_backend() adds or replaces the backend of a scheme.
+
+Environment variables:
+    CELLPYABILITY_STORAGE_WORKERS    parallel transfers per plate or upload (default: 16)
+    CELLPYABILITY_STORAGE_MIRROR     local mirror of URL output directories
+                                     (default: <temp dir>/cellpyability-mirror)
+"""
+
+import configparser
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+from urllib.parse import quote, urlsplit
+from urllib.request import url2pathname
+
+from . import profiling
+
+# Share the CellPyAbility logger (configured in toolbox, which imports this module)
+logger = logging.getLogger("CellPyAbility")
+
+DEFAULT_WORKERS = 16
+COPY_BUFFER = 4 * 1024 * 1024
+MB = 1024 * 1024
+
+# Requests that fail with a connection error or a 5xx status are retried with backoff
+RETRIES = 3
+RETRY_DELAY = 0.5
+TIMEOUT = 60
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+_backends = {}
+
+
+def is_url(path):
+    """Whether path is an object-store URL rather than a local path (file:// URLs are local)."""
+    if path is None or isinstance(path, Path):
+        return False
+    scheme = urlsplit(str(path)).scheme
+    # A one-letter scheme is a Windows drive (C:\images)
+    return len(scheme) > 1 and scheme != 'file' and '://' in str(path)
+
+
+def local_path(path):
+    """Path of a local path or file:// URL."""
+    if isinstance(path, str) and path.startswith('file://'):
+        return Path(url2pathname(urlsplit(path).path))
+    return Path(path)
+
+
+def exists(path):
+    """Whether a local path or the object (or any object under the prefix) at a URL exists."""
+    if not is_url(path):
+        return local_path(path).exists()
+    fs = get_storage(path)
+    return fs.isfile(path) or bool(fs.find(path))
+
+
+def _workers(workers=None):
+    if workers:
+        return workers
+    value = os.environ.get('CELLPYABILITY_STORAGE_WORKERS', '').strip()
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    return DEFAULT_WORKERS
+
+
+def _basename(url):
+    """Last path segment of a URL (the plate name), ignoring a trailing slash."""
+    parts = urlsplit(url)
+    return PurePosixPath(parts.path).name or parts.netloc
+
+
+def register_backend(scheme, factory):
+    """
+    Use factory() as the storage of URLs with the given scheme.
+
+    The storage must provide the fsspec-style methods find(url) (dict of object URL -> size
+    for every object under url), isfile(url), get_file(url, local_path) and
+    put_file(local_path, url).
+    """
+    _backends[scheme] = factory
+    get_storage.cache = {}
+
+
+def get_storage(url):
+    """Storage backend for the scheme of url (one shared instance per scheme)."""
+    scheme = urlsplit(url).scheme
+    if scheme not in get_storage.cache:
+        if scheme in _backends:
+            get_storage.cache[scheme] = _backends[scheme]()
+        else:
+            get_storage.cache[scheme] = FsspecStorage(scheme)
+    return get_storage.cache[scheme]
+
+
+get_storage.cache = {}
+
+
+def sign_v4(method, host, canonical_uri, query, headers, payload_hash, amz_date, region, access_key, secret_key,
+            service='s3'):
+    """
+    AWS Signature Version 4 Authorization header of one request.
+
+    Parameters:
+    -----------
+    canonical_uri : str
+        URI-encoded path of the request
+    query : dict
+        Query parameters (not yet encoded)
+    headers : dict
+        Headers to sign besides host (names in any case)
+    payload_hash : str
+        Hex SHA-256 of the request body (also sent as x-amz-content-sha256)
+    amz_date : str
+        Request time as YYYYMMDDTHHMMSSZ
+    """
+    signed = {'host': host, **{name.lower(): str(value).strip() for name, value in headers.items()}}
+    names = sorted(signed)
+    canonical_query = '&'.join(f'{quote(key, safe="-_.~")}={quote(str(value), safe="-_.~")}'
+                               for key, value in sorted(query.items()))
+    canonical_request = '\n'.join([
+        method, canonical_uri, canonical_query,
+        ''.join(f'{name}:{signed[name]}\n' for name in names),
+        ';'.join(names), payload_hash,
+    ])
+    scope = f'{amz_date[:8]}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+
+    key = f'AWS4{secret_key}'.encode()
+    for part in (amz_date[:8], region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={";".join(names)}, Signature={signature}'
+
+
+def _aws_credentials():
+    """Access key, secret key and session token from the environment or ~/.aws/credentials."""
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    if access_key:
+        return access_key, os.environ.get('AWS_SECRET_ACCESS_KEY', ''), os.environ.get('AWS_SESSION_TOKEN')
+    credentials_file = Path(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', Path.home() / '.aws' / 'credentials'))
+    config = configparser.ConfigParser()
+    config.read(credentials_file)
+    profile = os.environ.get('AWS_PROFILE', 'default')
+    if config.has_option(profile, 'aws_access_key_id'):
+        section = config[profile]
+        return section['aws_access_key_id'], section.get('aws_secret_access_key', ''), section.get('aws_session_token')
+    return None, None, None
+
+
+class S3Storage:
+    """
+    S3 (or S3-compatible) object store, using the REST API directly.
+
+    Custom endpoints are addressed path-style (<endpoint>/<bucket>/<key>), AWS itself
+    virtual-hosted (<bucket>.s3.<region>.amazonaws.com/<key>). Without credentials,
+    requests are unsigned (public buckets).
+
+    Parameters:
+    -----------
+    endpoint, region, access_key, secret_key, session_token : str, optional
+        Override the settings read from the environment
+    """
+
+    def __init__(self, endpoint=None, region=None, access_key=None, secret_key=None, session_token=None):
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+        self.endpoint = (endpoint or os.environ.get('AWS_ENDPOINT_URL_S3') or os.environ.get('AWS_ENDPOINT_URL') or '')
+        self.endpoint = self.endpoint.rstrip('/')
+        if access_key is None:
+            access_key, env_secret, env_token = _aws_credentials()
+            secret_key = secret_key if secret_key is not None else env_secret
+            session_token = session_token if session_token is not None else env_token
+        self.access_key, self.secret_key, self.session_token = access_key, secret_key, session_token
+
+    @staticmethod
+    def _split(url):
+        parts = urlsplit(url)
+        return parts.netloc, parts.path.lstrip('/')
+
+    def _address(self, bucket, key):
+        """Request base URL (scheme://host) and URI-encoded path of an object."""
+        encoded_key = quote(key, safe='-_.~/')
+        if self.endpoint:
+            return self.endpoint, f'/{bucket}/{encoded_key}'
+        return f'https://{bucket}.s3.{self.region}.amazonaws.com', f'/{encoded_key}'
+
+    def _request(self, method, bucket, key='', query=None, data=None, headers=None):
+        """Send a signed request, retrying connection errors and 5xx responses, and return the response."""
+        query = query or {}
+        base, path = self._address(bucket, key)
+        url = base + path
+        if query:
+            url += '?' + '&'.join(f'{quote(k, safe="-_.~")}={quote(str(v), safe="-_.~")}' for k, v in sorted(query.items()))
+        headers = dict(headers or {})
+
+        for attempt in range(RETRIES):
+            request_headers = dict(headers)
+            if self.access_key:
+                payload_hash = hashlib.sha256(data).hexdigest() if data else EMPTY_SHA256
+                amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+                signed = {'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+                if self.session_token:
+                    signed['x-amz-security-token'] = self.session_token
+                request_headers.update(signed)
+                request_headers['Authorization'] = sign_v4(
+                    method, urlsplit(base).netloc, path, query, signed, payload_hash, amz_date,
+                    self.region, self.access_key, self.secret_key)
+            request = urllib.request.Request(url, data=data, method=method, headers=request_headers)
+            try:
+                return urllib.request.urlopen(request, timeout=TIMEOUT)
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    raise FileNotFoundError(f's3://{bucket}/{key} not found') from None
+                if e.code < 500 or attempt == RETRIES - 1:
+                    raise OSError(f'{method} s3://{bucket}/{key} failed: HTTP {e.code} {e.read()[:200]!r}') from None
+            except urllib.error.URLError as e:
+                if attempt == RETRIES - 1:
+                    raise OSError(f'{method} s3://{bucket}/{key} failed: {e.reason}') from None
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    def find(self, url):
+        """Every object under the prefix url/ as a dict of s3:// URL -> size in bytes."""
+        bucket, prefix = self._split(url)
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        objects, token = {}, None
+        while True:
+            query = {'list-type': '2', 'prefix': prefix}
+            if token:
+                query['continuation-token'] = token
+            with self._request('GET', bucket, query=query) as response:
+                root = ET.fromstring(response.read())
+            for contents in root.iterfind('{*}Contents'):
+                key = contents.findtext('{*}Key')
+                if not key.endswith('/'):
+                    objects[f's3://{bucket}/{key}'] = int(contents.findtext('{*}Size') or 0)
+            token = root.findtext('{*}NextContinuationToken')
+            if root.findtext('{*}IsTruncated') != 'true' or not token:
+                return objects
+
+    def isfile(self, url):
+        bucket, key = self._split(url)
+        if not key or key.endswith('/'):
+            return False
+        try:
+            self._request('HEAD', bucket, key).close()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def get_file(self, url, local_file):
+        bucket, key = self._split(url)
+        with self._request('GET', bucket, key) as response, open(local_file, 'wb') as f:
+            shutil.copyfileobj(response, f, COPY_BUFFER)
+
+    def put_file(self, local_file, url):
+        bucket, key = self._split(url)
+        data = Path(local_file).read_bytes()
+        content_type = mimetypes.guess_type(str(local_file))[0] or 'application/octet-stream'
+        self._request('PUT', bucket, key, data=data, headers={'Content-Type': content_type}).close()
+
+
+class FsspecStorage:
+    """Storage of any scheme fsspec supports (the matching fsspec implementation must be installed)."""
+
+    def __init__(self, scheme):
+        try:
+            import fsspec
+        except ImportError:
+            raise ValueError(f'{scheme}:// URLs need the fsspec package (pip install fsspec); '
+                             f'only s3:// is built in') from None
+        self.fs = fsspec.filesystem(scheme)
+
+    def find(self, url):
+        return {self.fs.unstrip_protocol(path): info.get('size', 0)
+                for path, info in self.fs.find(url.rstrip('/'), detail=True).items()}
+
+    def isfile(self, url):
+        return self.fs.isfile(url)
+
+    def get_file(self, url, local_file):
+        self.fs.get_file(url, str(local_file))
+
+    def put_file(self, local_file, url):
+        self.fs.put_file(str(local_file), url)
+
+
+register_backend('s3', S3Storage)
+
+
+def _transfer(function, pairs, workers):
+    """Run function(source, target) for every pair in a thread pool and return the number of pairs."""
+    with ThreadPoolExecutor(max_workers=min(_workers(workers), max(len(pairs), 1))) as pool:
+        for _ in pool.map(lambda pair: function(*pair), pairs):
+            pass
+    return len(pairs)
+
+
+def download(url, local_dir, workers=None):
+    """
+    Download a plate from a URL into local_dir, all objects in parallel.
+
+    A prefix (image directory, OME-Zarr plate) becomes local_dir/<name>/ with the relative
+    paths of its objects; a single object (plate TIFF or archive) becomes local_dir/<name>.
+
+    Returns:
+    --------
+    local_plate : Path
+        Local copy of the plate
+    """
+    fs = get_storage(url)
+    local_plate = Path(local_dir) / _basename(url)
+    start = time.perf_counter()
+    with profiling.span('fetch'):
+        if fs.isfile(url):
+            objects = {url: None}
+            pairs = [(url, local_plate)]
+        else:
+            objects = fs.find(url)
+            if not objects:
+                raise FileNotFoundError(f'No objects found at {url}')
+            root = url.rstrip('/') + '/'
+            pairs = []
+            for object_url in objects:
+                target = local_plate.joinpath(*PurePosixPath(object_url[len(root):]).parts)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                pairs.append((object_url, target))
+        _transfer(fs.get_file, pairs, workers)
+    total = sum(target.stat().st_size for _, target in pairs)
+    logger.info(f'Fetched {len(pairs)} files ({total / MB:.1f} MB) from {url} '
+                f'in {time.perf_counter() - start:.1f} s')
+    return local_plate
+
+
+@contextmanager
+def fetched(image_dir, workers=None):
+    """
+    Yield a local path for image_dir: local paths as they are, URLs downloaded to a
+    temporary directory that is removed when the block exits.
+    """
+    if not is_url(image_dir):
+        yield local_path(image_dir)
+        return
+    with tempfile.TemporaryDirectory(prefix='cellpyability-fetch-') as tmp:
+        yield download(image_dir, tmp, workers=workers)
+
+
+def local_mirror(output_dir):
+    """Local directory standing in for an output URL, under CELLPYABILITY_STORAGE_MIRROR."""
+    root = os.environ.get('CELLPYABILITY_STORAGE_MIRROR') or Path(tempfile.gettempdir()) / 'cellpyability-mirror'
+    parts = urlsplit(output_dir)
+    return Path(root).resolve() / parts.scheme / parts.netloc / Path(*PurePosixPath(parts.path).parts[1:])
+
+
+def snapshot(local_dir):
+    """Size and modification time of every file under local_dir."""
+    files = {}
+    for path in Path(local_dir).rglob('*'):
+        if path.is_file():
+            stat = path.stat()
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def upload(local_dir, url, files=None, workers=None):
+    """
+    Upload files (default: all files) under local_dir to the same relative paths under url, in parallel.
+
+    Returns:
+    --------
+    uploaded : int
+        Number of files uploaded
+    """
+    local_dir = Path(local_dir)
+    files = sorted(snapshot(local_dir) if files is None else files)
+    fs = get_storage(url)
+    root = url.rstrip('/')
+    pairs = [(path, f'{root}/{path.relative_to(local_dir).as_posix()}') for path in files]
+    start = time.perf_counter()
+    with profiling.span('upload'):
+        _transfer(fs.put_file, pairs, workers)
+    if pairs:
+        logger.info(f'Uploaded {len(pairs)} output files to {url} in {time.perf_counter() - start:.1f} s')
+    return len(pairs)
+
+
+def upload_changes(output_dir, before, workers=None):
+    """Upload the files of output_dir's local mirror that are new or changed since snapshot before."""
+    if not is_url(output_dir):
+        return 0
+    local_dir = local_mirror(output_dir)
+    changed = [path for path, state in snapshot(local_dir).items() if before.get(path) != state]
+    return upload(local_dir, output_dir, files=changed, workers=workers)
+
+
+@contextmanager
+def remote_outputs(output_dir, workers=None):
+    """
+    Yield the directory to write outputs to: output_dir itself, or for a URL its local mirror,
+    whose new and changed files are uploaded when the block completes.
+    """
+    if not is_url(output_dir):
+        yield output_dir
+        return
+    local_dir = local_mirror(output_dir)
+    local_dir.mkdir(parents=True, exist_ok=True)
+    before = snapshot(local_dir)
+    try:
+        yield str(local_dir)
+    except BaseException:
+        logger.error(f'Run failed; outputs for {output_dir} were not uploaded and remain in {local_dir}')
+        raise
+    upload_changes(output_dir, before, workers=workers)
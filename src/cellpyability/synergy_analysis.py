@@ -3,17 +3,321 @@ Synergy analysis module for dose response analysis of one cell line and two drug
 Calculates relative viability matrices and surface map with Bliss independence as heat.
 """
 
+from dataclasses import dataclass
+from functools import cached_property
+
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+from . import profiling
 from . import toolbox as tb
+from .experiment import NORMALIZE_MODES, Experiment
+from .plate import LAYOUT_COLUMNS, LAYOUT_ROWS, Plate, nanmean
 
 # Initialize toolbox
 logger, base_dir = tb.logger, tb.base_dir
 
+# Plate layout: drug Y down rows B-G, drug X across columns 2-11, vehicle in B2
+ROW_ORDER = list(LAYOUT_ROWS)
+COL_ORDER = list(LAYOUT_COLUMNS)
+STATS_COLUMNS = ['Well', 'Mean', 'Standard Deviation', 'Normalized Mean', 'Row Drug Concentration', 'Column Drug Concentration']
+
+
+@dataclass
+class SynergyResult:
+    """
+    In-memory results of a synergy experiment.
+
+    Attributes:
+    -----------
+    title : str
+        Title of the experiment
+    x_doses, y_doses : numpy.ndarray
+        Concentrations of columns 2-11 and rows B-G (vehicle first, as 0)
+    counts : pandas.DataFrame
+        Raw CellProfiler counts
+    count_matrix : pandas.DataFrame
+        Mean nuclei count of the replicates per well (rows B-G x columns 2-11)
+    stats : pandas.DataFrame
+        Mean, SD and normalized mean per well (as in _synergy_stats.csv)
+    viability_matrix : pandas.DataFrame
+        Relative viability labeled by concentrations (drug Y rows x drug X columns)
+    bliss_matrix : pandas.DataFrame
+        Expected minus observed viability, labeled like viability_matrix
+    """
+    title: str
+    x_doses: np.ndarray
+    y_doses: np.ndarray
+    counts: pd.DataFrame
+    count_matrix: pd.DataFrame
+    stats: pd.DataFrame
+    viability_matrix: pd.DataFrame
+    bliss_matrix: pd.DataFrame
+
+
+class SynergyExperiment(Experiment):
+    """
+    Synergy experiment for one cell line and two drug gradients.
+
+    Every stage is computed lazily on first access and cached; nothing is written to disk
+    until save() is called.
+
+    Parameters:
+    -----------
+    title : str
+        Title of the experiment
+    x_drug : str
+        Drug name for horizontal gradient (Columns)
+    x_top_conc : float
+        Horizontal top concentration in molar
+    x_dilution : float
+        Horizontal dilution factor
+    y_drug : str
+        Drug name for vertical gradient (Rows)
+    y_top_conc : float
+        Vertical top concentration in molar
+    y_dilution : float
+        Vertical dilution factor
+    image_dir, counts_file, counts, output_dir :
+        See experiment.Experiment
+    normalize : str, optional
+        Normalize replicate plates to the vehicle (B2) mean over all plates ('pooled', default)
+        or each plate to its own vehicle, averaging viability and Bliss over plates ('plate')
+    """
+
+    module = 'synergy'
+
+    def __init__(self, title, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution, image_dir=None, counts_file=None, counts=None, output_dir=None, normalize='pooled'):
+        super().__init__(title, image_dir=image_dir, counts_file=counts_file, counts=counts, output_dir=output_dir)
+        if normalize not in NORMALIZE_MODES:
+            raise ValueError(f'Unknown normalization "{normalize}"; expected one of {", ".join(NORMALIZE_MODES)}')
+        self.normalize = normalize
+        self.x_drug = x_drug
+        self.x_top_conc = x_top_conc
+        self.x_dilution = x_dilution
+        self.y_drug = y_drug
+        self.y_top_conc = y_top_conc
+        self.y_dilution = y_dilution
+
+    @cached_property
+    def x_doses(self):
+        """Drug X concentrations of columns 2-11, vehicle (0) first."""
+        return np.insert(tb.gen_dose_range(self.x_top_conc, self.x_dilution, 9), 0, 0) # 9 doses without vehicle (cols 3-11)
+
+    @cached_property
+    def y_doses(self):
+        """Drug Y concentrations of rows B-G, vehicle (0) first."""
+        return np.insert(tb.gen_dose_range(self.y_top_conc, self.y_dilution, 5), 0, 0) # 5 doses without vehicle (rows C-G)
+
+    @cached_property
+    @profiling.timed('pivot')
+    def count_matrix(self):
+        """Mean nuclei count of the technical replicates per well (rows B-G x cols 2-11)."""
+        # Replicate plates are stacked on the first axis of the plate array
+        return Plate.frame(self.plate.mean(ROW_ORDER, COL_ORDER), ROW_ORDER, COL_ORDER)
+
+    @cached_property
+    @profiling.timed('normalize')
+    def plate_viabilities(self):
+        """Relative viability of each replicate plate, shape (plates, 6 rows, 10 columns)."""
+        values = self.plate.values(ROW_ORDER, COL_ORDER)
+        if self.normalize == 'plate':
+            return values / values[:, :1, :1]
+        return values / self.count_matrix.iat[0, 0]
+
+    @cached_property
+    @profiling.timed('normalize')
+    def plate_viability(self):
+        """Count matrix normalized to the vehicle (B2), labeled by wells."""
+        if self.normalize == 'plate':
+            viability_matrix = Plate.frame(nanmean(self.plate_viabilities, axis=0), ROW_ORDER, COL_ORDER)
+        else:
+            viability_matrix = self.count_matrix / self.count_matrix.iat[0, 0]
+        logger.debug(f'Viability matrix calculated and normalized to B2 ({self.normalize}).')
+        return viability_matrix
+
+    @cached_property
+    @profiling.timed('bliss')
+    def plate_bliss(self):
+        """Bliss independence scores, labeled by wells."""
+        # One viability matrix, or one per plate when plates are normalized separately
+        viability = self.plate_viabilities if self.normalize == 'plate' else self.plate_viability.to_numpy()[np.newaxis]
+
+        # Row B is "Drug X Alone" (Drug Y is 0 in row B), column 2 is "Drug Y Alone"
+        # If P(A) is prob survival with drug A, and P(B) is prob survival with drug B
+        # Expected survival = P(A) * P(B)
+        expected = viability[:, :, :1] * viability[:, :1, :]
+
+        # Bliss = Expected Survival - Observed Survival
+        # Positive Bliss score = Synergy (more killing than independence expects)
+        bliss_matrix = Plate.frame(nanmean(expected - viability, axis=0), ROW_ORDER, COL_ORDER)
+        logger.debug('Bliss scores calculated via vectorized outer product.')
+        return bliss_matrix
+
+    def _label_concentrations(self, matrix):
+        """Replace well rows/columns with drug concentrations."""
+        return pd.DataFrame(
+            matrix.to_numpy(),
+            index=pd.Index(self.y_doses, name=f'{self.y_drug} (M)'),
+            columns=pd.Index(self.x_doses, name=f'{self.x_drug} (M)'),
+        )
+
+    @cached_property
+    def viability_matrix(self):
+        """Relative viability labeled by drug concentrations."""
+        return self._label_concentrations(self.plate_viability)
+
+    @cached_property
+    def bliss_matrix(self):
+        """Bliss independence scores labeled by drug concentrations."""
+        return self._label_concentrations(self.plate_bliss)
+
+    @cached_property
+    @profiling.timed('normalize')
+    def stats(self):
+        """Mean, SD and normalized mean of every counted well with its drug concentrations."""
+        # Replicate mean and SD per well, flattened row-major over the layout
+        rows, columns = np.meshgrid(np.arange(len(ROW_ORDER)), np.arange(len(COL_ORDER)), indexing='ij')
+        wells = np.char.add(np.array(ROW_ORDER)[rows], np.array(COL_ORDER)[columns]).ravel()
+        means = self.plate.mean(ROW_ORDER, COL_ORDER).ravel()
+        df_stats = pd.DataFrame({
+            'Well': wells,
+            'Mean': means,
+            'Standard Deviation': self.plate.std(ROW_ORDER, COL_ORDER).ravel(),
+            'Normalized Mean': nanmean(self.plate_viabilities, axis=0).ravel(),
+            'Row Drug Concentration': self.y_doses[rows.ravel()],
+            'Column Drug Concentration': self.x_doses[columns.ravel()],
+        })
+
+        # Counted wells only, in well-name order (B10, B11, B2, ...) as in earlier stats files
+        counted = self.plate.counted(ROW_ORDER, COL_ORDER).ravel()
+        order = np.argsort(wells[counted], kind='stable')
+        return df_stats[counted].iloc[order].reset_index(drop=True)[STATS_COLUMNS]
+
+    @property
+    def result(self):
+        """All stages as a SynergyResult."""
+        return SynergyResult(
+            title=self.title,
+            x_doses=self.x_doses,
+            y_doses=self.y_doses,
+            counts=self.counts,
+            count_matrix=self.count_matrix,
+            stats=self.stats,
+            viability_matrix=self.viability_matrix,
+            bliss_matrix=self.bliss_matrix,
+        )
+
+    def figure(self):
+        """3D surface of relative viability colored by Bliss independence (plotly Figure)."""
+        # Convert dataframe to NumPy for Plotly
+        z_viability = self.plate_viability.values
+        z_bliss = self.plate_bliss.values
+
+        x_vals = self.x_doses
+        y_vals = self.y_doses
 
-def run_synergy(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution, image_dir, show_plot=True, counts_file=None, output_dir=None):
+        # Calculate (min / dilution) for x and y since we cannot plot 0 on log scale
+        # This places the vehicle "one step down" on the log axis
+        x_min_nonzero = np.min(x_vals[x_vals > 0])
+        y_min_nonzero = np.min(y_vals[y_vals > 0])
+
+        # Take the bigger of the two dilution factors to unify visual zero    
+        visual_dilution = max(self.x_dilution, self.y_dilution) 
+
+        # Apply this shared factor to calculate the artificial zero location
+        x_vals_plot = np.where(x_vals == 0, x_min_nonzero / visual_dilution, x_vals)
+        y_vals_plot = np.where(y_vals == 0, y_min_nonzero / visual_dilution, y_vals)
+
+        # Format tick text
+        x_ticktext = ['0'] + [f'{val:.1e}' for val in x_vals[1:]]
+        y_ticktext = ['0'] + [f'{val:.1e}' for val in y_vals[1:]]
+
+        # Create 3D surface plot
+        fig = go.Figure(data=[
+            go.Surface(
+                z=z_viability, 
+                x=x_vals_plot, 
+                y=y_vals_plot, 
+                surfacecolor=z_bliss, 
+                colorscale='jet_r', 
+                cmin=-0.3, 
+                cmax=0.3, 
+                colorbar=dict(title='Bliss Independence')
+            )
+        ])
+
+        fig.update_layout(
+            title=str(self.title), 
+            scene=dict(
+                xaxis=dict(title=self.x_drug, type='log', tickvals=x_vals_plot, ticktext=x_ticktext),
+                yaxis=dict(title=self.y_drug, type='log', tickvals=y_vals_plot, ticktext=y_ticktext),
+                zaxis=dict(title='Relative Cell Survival', range=[0, 1.1])
+            )
+        )
+        return fig
+
+    def save(self, stage_callback=None, plot=True, show_plot=False):
+        """
+        Write stats, viability and Bliss matrices, plot and raw counts to <output_dir>/synergy_output/.
+
+        Parameters:
+        -----------
+        stage_callback : callable, optional
+            Called as stage_callback(stage, path) after each completed stage:
+            'counted' (counts CSV), 'stats' (output directory), 'plotted' (plot file)
+        plot : bool
+            Whether to draw and save the plot
+        show_plot : bool
+            Whether to display the plot
+
+        Returns:
+        --------
+        result : SynergyResult
+        """
+        self._count(stage_callback)
+        synergy_output_dir = self.output_path()
+
+        # Save the detailed stats file
+        stats = self.stats
+        with profiling.span('write_csv'), tb.atomic_output(synergy_output_dir / f'{self.title}_synergy_stats.csv') as tmp_path:
+            stats.to_csv(tmp_path, index=False)
+        logger.info(f'{self.title} synergy stats saved to {synergy_output_dir}')
+
+        # Save the matrices with experiment labels
+        viability_matrix, bliss_matrix = self.viability_matrix, self.bliss_matrix
+        with profiling.span('write_csv'):
+            with tb.atomic_output(synergy_output_dir / f'{self.title}_synergy_ViabilityMatrix.csv') as tmp_path:
+                viability_matrix.to_csv(tmp_path)
+            with tb.atomic_output(synergy_output_dir / f'{self.title}_synergy_BlissMatrix.csv') as tmp_path:
+                bliss_matrix.to_csv(tmp_path)
+        logger.info(f'{self.title} matrices saved.')
+        if stage_callback is not None:
+            stage_callback('stats', synergy_output_dir)
+
+        fig = None
+        if plot:
+            with profiling.span('plot_html'):
+                fig = self.figure()
+                with tb.atomic_output(synergy_output_dir / f'{self.title}_synergy_plot.html') as tmp_path:
+                    fig.write_html(tmp_path)
+            logger.info(f'{self.title} plot saved.')
+            if stage_callback is not None:
+                stage_callback('plotted', synergy_output_dir / f'{self.title}_synergy_plot.html')
+
+        # Per-plate vehicle and count summary of multi-plate experiments
+        self.save_plate_summary(synergy_output_dir / f'{self.title}_synergy_plates.csv', ROW_ORDER[:1], COL_ORDER[:1])
+
+        # Rename raw counts for easier tracking
+        self.save_counts(synergy_output_dir / f'{self.title}_synergy_counts.csv')
+
+        if fig is not None and show_plot:
+            fig.show()
+        return self.result
+
+
+def run_synergy(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution, image_dir, show_plot=True, counts_file=None, output_dir=None, stage_callback=None, normalize='pooled'):
     """
     Run synergy analysis for drug combination experiments.
     
@@ -33,172 +337,26 @@ def run_synergy(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc,
         Vertical top concentration in molar
     y_dilution : float
         Vertical dilution factor
-    image_dir : str
-        Directory containing the 60 well images
+    image_dir : str or list of str
+        Directory containing the 60 well images, or one directory per replicate plate
     show_plot : bool
         Whether to display the plot (default: True)
     counts_file : str, optional
         Path to pre-existing counts CSV file (for testing)
     output_dir : str, optional
         Custom output directory. If None, uses current working directory.
-    """
-    
-    # Calculate concentration gradients (NumPy arrays)
-    x_doses = tb.gen_dose_range(x_top_conc, x_dilution, 9) # 9 doses without vehicle (cols 3-11)
-    y_doses = tb.gen_dose_range(y_top_conc, y_dilution, 5) # 5 doses without vehicle (rows C-G)
-    
-    # Run CellProfiler
-    df_cp, cp_csv = tb.run_cellprofiler(image_dir, counts_file=counts_file, output_dir=output_dir)
-    
-    # Clean CellProfiler output and map it to our 96-well plate
-    df_cp.drop(columns='ImageNumber', inplace=True)
-    df_cp.columns = ['nuclei', 'well']
-    df_cp['well'] = df_cp['well'].apply(lambda x: tb.rename_wells(x))
-    
-    # Extract rows and columns
-    df_cp[['Row','Column']] = df_cp['well'].str.extract(r'^([B-G])(\d+)$')
-    
-    # Create viability matrix so each cell in the 2D array represents a well
-    # Pivot all replicates into a wide format (rows B-G x cols 2-11)
-    # We take the mean of technical replicates automatically via pivot_table
-    viability_matrix_raw = df_cp.pivot_table(index='Row', columns='Column', values='nuclei', aggfunc='mean')
-    
-    # Ensure standard sorting (rows B-G, cols 2-11 as strings)
-    row_order = ['B','C','D','E','F','G']
-    col_order = [str(i) for i in range(2,12)]
-    viability_matrix_raw = viability_matrix_raw.reindex(index=row_order, columns=col_order)
-    
-    # Normalize entire matrix to the vehicle (B2)
-    vehicle_val = viability_matrix_raw.loc['B', '2']
-    viability_matrix = viability_matrix_raw / vehicle_val
-    logger.debug('Viability matrix calculated and normalized to B2.')
-    
-    # Map concentrations to cols and rows (for labels)
-    all_x_doses = np.insert(x_doses, 0, 0) # Add 0 for vehicle
-    all_y_doses = np.insert(y_doses, 0, 0) # Add 0 for vehicle
-    
-    # Map index/columns to concentrations
-    conc_map_x = dict(zip(col_order, all_x_doses))
-    conc_map_y = dict(zip(row_order, all_y_doses))
-    
-    # Create detailed statistics DataFrame for CSV export
-    # We use groupby to get mean and std for every well, identifying replicates by 'well' name
-    df_stats = df_cp.groupby('well')['nuclei'].agg(['mean', 'std']).reset_index()
-    df_stats['normalized_mean'] = df_stats['mean'] / vehicle_val
-    
-    # Map concentrations to the stats dataframe
-    df_stats['Row Drug Concentration'] = df_stats['well'].str[0].map(conc_map_y)
-    df_stats['Column Drug Concentration'] = df_stats['well'].str[1:].map(conc_map_x)
-    
-    # Rename columns for final output
-    df_stats = df_stats.rename(columns={
-        'well': 'Well', 
-        'mean': 'Mean', 
-        'std': 'Standard Deviation',
-        'normalized_mean': 'Normalized Mean'
-    })
-    
-    # Bliss Independence calculation
-    # Row B represents "Drug X Alone" (since Drug Y is 0 in row B)
-    drug_x_alone = viability_matrix.loc['B'].values # Shape (10,)
-    
-    # Column 2 represents "Drug Y Alone" (since Drug X is 0 in col 2)
-    drug_y_alone = viability_matrix['2'].values     # Shape (6,)
-    
-    # Calculate expected independent effect by taking outer product
-    # If P(A) is prob survival with drug A, and P(B) is prob survival with drug B
-    # Expected survival = P(A) * P(B)
-    expected_matrix = pd.DataFrame(
-        np.outer(drug_y_alone, drug_x_alone),
-        index=viability_matrix.index,
-        columns=viability_matrix.columns
-    )
-    
-    # Bliss = Expected Survival - Observed Survival
-    # Positive Bliss score = Synergy (more killing than independence expects)
-    bliss_matrix = expected_matrix - viability_matrix
-    logger.debug('Bliss scores calculated via vectorized outer product.')
-
-    # Setup output directories
-    output_base = tb.get_output_base_dir(output_dir)
-    synergy_output_dir = output_base / 'synergy_output'
-    synergy_output_dir.mkdir(exist_ok=True)
-    
-    # --- INSERTED STATS SAVE START ---
-    # Save the detailed stats file
-    stats_cols = ['Well', 'Mean', 'Standard Deviation', 'Normalized Mean', 'Row Drug Concentration', 'Column Drug Concentration']
-    df_stats[stats_cols].to_csv(synergy_output_dir / f'{title_name}_synergy_stats.csv', index=False)
-    logger.info(f'{title_name} synergy stats saved to {synergy_output_dir}')
-    # --- INSERTED STATS SAVE END ---
-    
-    # Save the matrices with experiment labels
-    viability_out = viability_matrix.copy()
-    viability_out.index = viability_out.index.map(conc_map_y)
-    viability_out.columns = viability_out.columns.map(conc_map_x)
-    viability_out.index.name = f'{y_drug} (M)'
-    viability_out.columns.name = f'{x_drug} (M)'
-    
-    bliss_out = bliss_matrix.copy()
-    bliss_out.index = viability_out.index
-    bliss_out.columns = viability_out.columns
-    
-    viability_out.to_csv(synergy_output_dir / f'{title_name}_synergy_ViabilityMatrix.csv')
-    bliss_out.to_csv(synergy_output_dir / f'{title_name}_synergy_BlissMatrix.csv')
-    logger.info(f'{title_name} matrices saved.')
-
-    # Prepare data for plotting
-    # Convert dataframe to NumPy for Plotly
-    z_viability = viability_matrix.values
-    z_bliss = bliss_matrix.values
-    
-    x_vals = all_x_doses
-    y_vals = all_y_doses
-    
-    # Calculate (min / dilution) for x and y since we cannot plot 0 on log scale
-    # This places the vehicle "one step down" on the log axis
-    x_min_nonzero = np.min(x_vals[x_vals > 0])
-    y_min_nonzero = np.min(y_vals[y_vals > 0])
-
-    # Take the bigger of the two dilution factors to unify visual zero    
-    visual_dilution = max(x_dilution, y_dilution) 
-    
-    # Apply this shared factor to calculate the artificial zero location
-    x_vals_plot = np.where(x_vals == 0, x_min_nonzero / visual_dilution, x_vals)
-    y_vals_plot = np.where(y_vals == 0, y_min_nonzero / visual_dilution, y_vals)
-    
-    # Format tick text
-    x_ticktext = ['0'] + [f'{val:.1e}' for val in x_vals[1:]]
-    y_ticktext = ['0'] + [f'{val:.1e}' for val in y_vals[1:]]
-
-    # Create 3D surface plot
-    fig = go.Figure(data=[
-        go.Surface(
-            z=z_viability, 
-            x=x_vals_plot, 
-            y=y_vals_plot, 
-            surfacecolor=z_bliss, 
-            colorscale='jet_r', 
-            cmin=-0.3, 
-            cmax=0.3, 
-            colorbar=dict(title='Bliss Independence')
-        )
-    ])
-    
-    fig.update_layout(
-        title=str(title_name), 
-        scene=dict(
-            xaxis=dict(title=x_drug, type='log', tickvals=x_vals_plot, ticktext=x_ticktext),
-            yaxis=dict(title=y_drug, type='log', tickvals=y_vals_plot, ticktext=y_ticktext),
-            zaxis=dict(title='Relative Cell Survival', range=[0, 1.1])
-        )
-    )
-    
-    # Save plot
-    fig.write_html(synergy_output_dir / f'{title_name}_synergy_plot.html')
-    logger.info(f'{title_name} plot saved.')
-    
-    # Rename raw counts for easier tracking
-    tb.rename_counts(cp_csv, synergy_output_dir / f'{title_name}_synergy_counts.csv')
+    stage_callback : callable, optional
+        Called as stage_callback(stage, path) after each completed stage:
+        'counted' (counts CSV), 'stats' (output directory), 'plotted' (plot file)
+    normalize : str, optional
+        'pooled' (default) or 'plate' vehicle normalization of replicate plates
 
-    if show_plot:
-        fig.show()
+    Returns:
+    --------
+    result : SynergyResult
+        Counts, stats, viability and Bliss matrices in memory
+    """
+    experiment = SynergyExperiment(title_name, x_drug, x_top_conc, x_dilution, y_drug, y_top_conc, y_dilution,
+                                   image_dir=image_dir, counts_file=counts_file, output_dir=output_dir,
+                                   normalize=normalize)
+    return experiment.save(stage_callback=stage_callback, show_plot=show_plot)
@@ -0,0 +1,296 @@
+"""
+Synthetic module generates plates with known dose-response curves for load and scale testing.
+
+Counts are written in the CellProfiler format (Count_nuclei, FileName_images, ImageNumber)
+from 5PL or Hill parameters, with multiplicative noise and an optional edge effect on the
+outer wells of the used area. A config.csv lists every plate with its counts file, so the
+output can be fed straight to the batch module, and truth.csv records the true parameters
+and IC50s so fitting can be checked against them. Optionally, synthetic nuclei TIFFs with
+exactly the written counts are rendered for exercising CellProfiler itself.
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import toolbox as tb
+
+# Initialize toolbox
+logger = tb.logger
+
+ROWS = ['B', 'C', 'D', 'E', 'F', 'G']
+COLUMNS = [str(i) for i in range(2, 12)]
+FILE_NAME = '{well}_-1_1_1_Stitched[DAPI 377,447]_001.tif'  # same pattern as the example images
+
+# Plate layouts of the generated experiments (doses as in the test data)
+GDA_DEFAULTS = {'upper_name': 'Line A', 'lower_name': 'Line B', 'top_conc': 0.000001, 'dilution': 3.0}
+SYNERGY_DEFAULTS = {'x_drug': 'Drug X', 'x_top_conc': 0.0004, 'x_dilution': 4.0,
+                    'y_drug': 'Drug Y', 'y_top_conc': 0.0001, 'y_dilution': 4.0}
+
+
+@dataclass
+class Curve:
+    """
+    Relative viability curve with known parameters.
+
+    Attributes:
+    -----------
+    model : str
+        '5PL' (params A, B, C, D, G of toolbox.fivePL) or 'Hill' (params Emax, EC50, HillSlope
+        of toolbox.hill, with a negative HillSlope for a decreasing curve)
+    params : tuple of float
+    """
+    model: str
+    params: tuple
+
+    def viability(self, doses):
+        """Relative viability at each dose (the top of the curve at dose 0)."""
+        doses = np.asarray(doses, dtype=float)
+        top = self.params[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.model == '5PL':
+                values = tb.fivePL(doses, *self.params)
+            else:
+                values = tb.hill(doses, *self.params)
+        return np.where(doses > 0, values, top)
+
+    @property
+    def ic50(self):
+        """Dose at 0.5 relative viability, solved like toolbox.fit_dose_response."""
+        if self.model == '5PL':
+            A, B, C, D, G = self.params
+            term = (A - D) / (0.5 - D)
+            if term <= 0 or term ** (1 / G) <= 1:
+                return np.nan
+            return C * ((term ** (1 / G)) - 1) ** (1 / B)
+        Emax, EC50, HillSlope = self.params
+        if Emax <= 0.5:
+            return np.nan
+        return EC50 * (2 * Emax - 1) ** (1 / -HillSlope)
+
+
+def random_curve(rng, doses, model=None):
+    """
+    Draw a decreasing viability curve whose IC50 lies within the inner doses, so it is recoverable.
+
+    Parameters:
+    -----------
+    rng : numpy.random.Generator
+    doses : array-like
+        Non-zero doses of the plate
+    model : str, optional
+        '5PL' or 'Hill'; drawn at random if None
+    """
+    doses = np.sort(np.asarray(doses, dtype=float))
+    model = model or rng.choice(['5PL', 'Hill'])
+    ic50 = 10 ** rng.uniform(np.log10(doses[2]), np.log10(doses[-3]))
+    slope = rng.uniform(0.8, 2.5)
+    if model == 'Hill':
+        return Curve('Hill', (1.0, ic50, -slope))
+
+    bottom = rng.uniform(0.0, 0.2)
+    asymmetry = rng.uniform(0.7, 1.5)
+    # Choose the inflection point C so that the curve crosses 0.5 exactly at ic50
+    term = (1.0 - bottom) / (0.5 - bottom)
+    inflection = ic50 / ((term ** (1 / asymmetry)) - 1) ** (1 / slope)
+    return Curve('5PL', (1.0, slope, inflection, bottom, asymmetry))
+
+
+def _edge_factor(well, edge_effect):
+    """Count multiplier of a well: outer rows/columns of the used area lose edge_effect."""
+    is_edge = well[0] in (ROWS[0], ROWS[-1]) or well[1:] in (COLUMNS[0], COLUMNS[-1])
+    return 1.0 - edge_effect if is_edge else 1.0
+
+
+def _counts_frame(wells, expected, rng, noise_cv, edge_effect, replicates=1):
+    """Draw noisy counts for wells and return them in the CellProfiler format."""
+    records = []
+    for _ in range(replicates):
+        for well, mean in zip(wells, expected):
+            count = mean * _edge_factor(well, edge_effect) * (1 + noise_cv * rng.standard_normal())
+            records.append((float(max(0, round(count))), FILE_NAME.format(well=well)))
+
+    # CellProfiler numbers images in file name order within each replicate plate
+    df_counts = pd.DataFrame(records, columns=['Count_nuclei', 'FileName_images'])
+    df_counts['replicate'] = np.repeat(np.arange(replicates), len(wells))
+    df_counts = df_counts.sort_values(['replicate', 'FileName_images'], kind='stable').drop(columns='replicate')
+    df_counts['ImageNumber'] = np.arange(1, len(df_counts) + 1)
+    return df_counts.reset_index(drop=True)
+
+
+def gda_plate(upper, lower, top_conc, dilution, vehicle_count=10000, noise_cv=0.05, edge_effect=0.0, rng=None):
+    """
+    Counts of a synthetic GDA plate: upper curve in rows B-D, lower curve in rows E-G,
+    vehicle in column 2 and nine doses in columns 3-11.
+
+    Returns:
+    --------
+    df_counts : pandas.DataFrame
+        Count_nuclei, FileName_images, ImageNumber
+    """
+    rng = rng or np.random.default_rng()
+    doses = np.insert(tb.gen_dose_range(top_conc, dilution, 9), 0, 0)
+    wells, expected = [], []
+    for row in ROWS:
+        curve = upper if row in ROWS[:3] else lower
+        wells += [f'{row}{col}' for col in COLUMNS]
+        expected += list(vehicle_count * curve.viability(doses))
+    return _counts_frame(wells, expected, rng, noise_cv, edge_effect)
+
+
+def synergy_plate(x_curve, y_curve, x_top_conc, x_dilution, y_top_conc, y_dilution, interaction=0.0,
+                  replicates=3, vehicle_count=10000, noise_cv=0.05, edge_effect=0.0, rng=None):
+    """
+    Counts of a synthetic synergy plate: drug X across columns 2-11, drug Y down rows B-G.
+
+    Combination wells have viability x * y * (1 - interaction), so their true Bliss score is
+    interaction * x * y (0 for independent drugs, positive for synergy).
+
+    Returns:
+    --------
+    df_counts : pandas.DataFrame
+        Count_nuclei, FileName_images, ImageNumber; one block of 60 images per replicate
+    """
+    rng = rng or np.random.default_rng()
+    x_viability = x_curve.viability(np.insert(tb.gen_dose_range(x_top_conc, x_dilution, 9), 0, 0))
+    y_viability = y_curve.viability(np.insert(tb.gen_dose_range(y_top_conc, y_dilution, 5), 0, 0))
+    viability = np.outer(y_viability, x_viability)
+    viability[1:, 1:] *= 1 - interaction
+
+    wells = [f'{row}{col}' for row in ROWS for col in COLUMNS]
+    return _counts_frame(wells, vehicle_count * viability.ravel(), rng, noise_cv, edge_effect, replicates)
+
+
+def render_nuclei_image(count, size=512, radius=3, rng=None):
+    """
+    Render a 16-bit fluorescence image with exactly count non-touching Gaussian nuclei.
+
+    Nuclei sit in random cells of a grid with spacing 2 * radius + 4 pixels, so they never
+    overlap; a ValueError is raised if count does not fit in the image.
+    """
+    rng = rng or np.random.default_rng()
+    spacing = 2 * radius + 4
+    cells_per_side = size // spacing
+    if count > cells_per_side ** 2:
+        raise ValueError(f'{count} nuclei do not fit in a {size} px image (max {cells_per_side ** 2}); '
+                         f'use a larger image size or a smaller vehicle count')
+
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(offsets[:, None] ** 2 + offsets[None, :] ** 2) / (2 * (radius / 2) ** 2))
+    kernel = np.where(kernel > 0.05, kernel, 0)
+
+    image = rng.normal(200, 20, (size, size)).clip(0)
+    cells = rng.choice(cells_per_side ** 2, size=int(count), replace=False)
+    jitter = rng.integers(0, spacing - kernel.shape[0], size=(len(cells), 2))  # keeps a 1 px gap
+    for cell, (dy, dx) in zip(cells, jitter):
+        y = (cell // cells_per_side) * spacing + dy
+        x = (cell % cells_per_side) * spacing + dx
+        image[y:y + kernel.shape[0], x:x + kernel.shape[1]] += 20000 * kernel * rng.uniform(0.7, 1.3)
+    return image.clip(0, 65535).astype(np.uint16)
+
+
+def write_images(df_counts, image_dir, replicates=1, image_size=512, rng=None):
+    """Render one TIFF per counts row; replicate plates go to numbered subdirectories."""
+    from PIL import Image  # Pillow is installed with matplotlib
+
+    rng = rng or np.random.default_rng()
+    image_dir = Path(image_dir)
+    per_plate = len(df_counts) // replicates
+    for index, row in enumerate(df_counts.itertuples(index=False)):
+        plate_dir = image_dir if replicates == 1 else image_dir / f'{image_dir.name}_{index // per_plate + 1}'
+        plate_dir.mkdir(parents=True, exist_ok=True)
+        image = render_nuclei_image(int(row.Count_nuclei), image_size, rng=rng)
+        Image.fromarray(image).save(plate_dir / row.FileName_images)
+
+
+def generate_plates(output_dir, n_plates=1, module='gda', seed=0, vehicle_count=10000, noise_cv=0.05,
+                    edge_effect=0.0, interaction=0.0, images=False, image_size=512):
+    """
+    Generate synthetic plates with known curves.
+
+    Writes, in output_dir:
+        counts/<title>_counts.csv   counts of each plate in the CellProfiler format
+        images/<title>/             synthetic TIFFs (only if images is True)
+        config.csv                  batch config listing every plate with its counts file
+        truth.csv                   true model, parameters and IC50 of every curve
+
+    Parameters:
+    -----------
+    output_dir : str or Path
+        Directory for the generated files
+    n_plates : int
+        Number of plates
+    module : str
+        'gda', 'synergy' or 'simple' (simple plates use the GDA layout)
+    seed : int
+        Random seed; the same seed reproduces the same plates
+    vehicle_count : int
+        Mean nuclei count of vehicle wells
+    noise_cv : float
+        Coefficient of variation of the multiplicative count noise
+    edge_effect : float
+        Fraction of nuclei lost in the outer rows and columns of the used area (B, G, 2, 11)
+    interaction : float
+        Synergy plates only: true Bliss score is interaction * x * y in combination wells
+    images : bool
+        Also render synthetic nuclei TIFFs with exactly the written counts
+    image_size : int
+        Width and height of the rendered images in pixels
+
+    Returns:
+    --------
+    df_truth : pandas.DataFrame
+        One row per curve with title, condition, model, params and ic50
+    """
+    if module not in ('gda', 'synergy', 'simple'):
+        raise ValueError(f'Unknown module "{module}"')
+    output_path = Path(output_dir).resolve()
+    (output_path / 'counts').mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    config_rows, truth_rows = [], []
+    for plate in range(1, n_plates + 1):
+        title = f'synthetic_{module}_{plate:04d}'
+        image_dir = output_path / 'images' / title
+        config = {'module': module, 'dir': str(image_dir), 'title': title}
+
+        if module == 'synergy':
+            p = SYNERGY_DEFAULTS
+            x_curve = random_curve(rng, tb.gen_dose_range(p['x_top_conc'], p['x_dilution'], 9))
+            y_curve = random_curve(rng, tb.gen_dose_range(p['y_top_conc'], p['y_dilution'], 5))
+            df_counts = synergy_plate(x_curve, y_curve, p['x_top_conc'], p['x_dilution'], p['y_top_conc'],
+                                      p['y_dilution'], interaction, 3, vehicle_count, noise_cv, edge_effect, rng)
+            replicates = 3
+            curves = {p['x_drug']: x_curve, p['y_drug']: y_curve}
+            config.update(xdrug=p['x_drug'], xconc=p['x_top_conc'], xdil=p['x_dilution'],
+                          ydrug=p['y_drug'], yconc=p['y_top_conc'], ydil=p['y_dilution'])
+        else:
+            p = GDA_DEFAULTS
+            doses = tb.gen_dose_range(p['top_conc'], p['dilution'], 9)
+            upper, lower = random_curve(rng, doses), random_curve(rng, doses)
+            df_counts = gda_plate(upper, lower, p['top_conc'], p['dilution'], vehicle_count, noise_cv, edge_effect, rng)
+            replicates = 1
+            curves = {p['upper_name']: upper, p['lower_name']: lower}
+            if module == 'gda':
+                config.update(upper=p['upper_name'], lower=p['lower_name'], conc=p['top_conc'], dil=p['dilution'])
+
+        counts_file = output_path / 'counts' / f'{title}_counts.csv'
+        df_counts.to_csv(counts_file, index=False)
+        config['counts'] = str(counts_file)
+        config_rows.append(config)
+        if images:
+            write_images(df_counts, image_dir, replicates, image_size, rng)
+
+        for condition, curve in curves.items():
+            truth_rows.append({'title': title, 'condition': condition, 'model': curve.model,
+                               'params': json.dumps([float(value) for value in curve.params]),
+                               'ic50': curve.ic50, 'interaction': interaction if module == 'synergy' else np.nan})
+
+    pd.DataFrame(config_rows).to_csv(output_path / 'config.csv', index=False)
+    df_truth = pd.DataFrame(truth_rows)
+    df_truth.to_csv(output_path / 'truth.csv', index=False)
+    logger.info(f'Generated {n_plates} synthetic {module} plates in {output_path}')
+    return df_truth
@@ -7,7 +7,10 @@ For more information, please see the README at https://github.com/bindralab/Cell
 import logging
 import os
 import re
-import subprocess
+import socket
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
 import pandas as pd
@@ -15,11 +18,17 @@ import numpy as np
 from scipy.optimize import curve_fit
 import shutil
 
+from . import accounting, cache, logs, profiling, qc, scheduler, storage
+
+# Prefix of the per-run CellProfiler scratch directories in cp_output/
+SCRATCH_PREFIX = 'run-'
+
 def cellpyability_logger():
     """
     Creates and configures the CellPyAbility logger.
     
-    Logs all messages (DEBUG and above) to cellpyability.log in current working directory.
+    Logs all messages (DEBUG and above) to cellpyability.log in current working directory,
+    through a queue so the file is written by a background thread (see logs module).
     Logs INFO and above to console output.
     
     Returns:
@@ -34,24 +43,18 @@ def cellpyability_logger():
     if logger.hasHandlers():
         return logger
 
-    # Create a cellpyability.log file in current working directory (PyPI-compatible)
-    log_file = Path.cwd() / "cellpyability.log"
-    fh = logging.FileHandler(log_file)
-    fh.setLevel(logging.DEBUG)
-
     # Only log >= INFO messages in the terminal
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
 
-    # Format the log messages to include time and level
-    fmt = '%(asctime)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(fmt)
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    logger.addHandler(fh)
+    # Format the log messages to include time, level and the experiment of the current run
+    ch.setFormatter(logging.Formatter(logs.TEXT_FORMAT))
     logger.addHandler(ch)
 
+    # Create a cellpyability.log file in current working directory (PyPI-compatible)
+    log_file = Path.cwd() / "cellpyability.log"
+    logs.setup(logger, log_file)
+
     logger.debug('Logger setup complete.')
     return logger
 
@@ -79,14 +82,17 @@ def get_output_base_dir(output_dir=None):
     Get the base directory for output files.
     
     Args:
-        output_dir: Optional custom output directory path. If None, uses current working directory.
+        output_dir: Optional custom output directory path or object-store URL. If None, uses current working directory.
     
     Returns:
-        Path object to the output base directory
+        Path object to the output base directory (for a URL, its local mirror; see storage module)
     """
     if output_dir is None:
         # Use current working directory for PyPI compatibility
         output_base = Path.cwd() / 'cellpyability_output'
+    elif storage.is_url(output_dir):
+        # Outputs for an object store are written to a local mirror and uploaded when the run finishes
+        output_base = storage.local_mirror(output_dir)
     else:
         # Resolve converts relative paths (../results) to absolute (C:\Users\...\results)
         output_base = Path(output_dir).resolve() 
@@ -235,7 +241,9 @@ def run_cellprofiler(image_dir, counts_file=None, output_dir=None):
     Parameters:
     -----------
     image_dir : str
-        Directory containing images to analyze
+        Directory containing images to analyze, or a whole-plate multi-page TIFF,
+        OME-TIFF or OME-Zarr container (see the ingest module); local or an
+        object-store URL (see the storage module)
     counts_file : str, optional
         Path to pre-existing counts CSV file (for testing). If provided,
         CellProfiler is not run and this file is used instead.
@@ -258,9 +266,51 @@ def run_cellprofiler(image_dir, counts_file=None, output_dir=None):
             logger.critical(f'Counts file {counts_file} does not exist.')
             exit(1)
         logger.info(f'Using pre-existing counts file: {counts_file}')
-        df_cp = pd.read_csv(counts_path)
+        with profiling.span('read_counts'):
+            df_cp = pd.read_csv(counts_path)
         return df_cp, counts_path
     
+    # With the image cache on, plates are counted from a local copy kept for reruns (see cache module)
+    image_cache = cache.get_cache()
+    if image_cache.enabled and not image_cache.contains(image_dir):
+        with image_cache.staged(image_dir) as local_dir:
+            if local_dir is not None:
+                return run_cellprofiler(local_dir, output_dir=output_dir)
+    
+    # Plates in an object store are downloaded in parallel to a temporary directory and counted there
+    if storage.is_url(image_dir):
+        with storage.fetched(image_dir) as local_dir:
+            return run_cellprofiler(local_dir, output_dir=output_dir)
+    
+    # Whole-plate containers (multi-page TIFF, OME-TIFF, OME-Zarr) are staged and counted in chunks of wells
+    from . import ingest  # imported here because ingest imports toolbox
+    if ingest.is_plate_container(image_dir):
+        return ingest.count_plate(image_dir, output_dir=output_dir)
+    
+    cp_command, cp_output_dir = cellprofiler_command(image_dir, output_dir)
+    
+    # Wait for a CellProfiler slot so concurrent runs do not oversubscribe cores or memory
+    with profiling.span('cellprofiler'), scheduler.get_scheduler().slot(Path(image_dir).resolve().name) as cp_env:
+        logger.debug('Starting CellProfiler from command line ...')
+        usage = accounting.run_accounted(cp_command, env=cp_env)
+    logger.info('CellProfiler nuclei counting complete.')
+
+    # Record CPU time, peak memory and I/O of the run in <output_base>/cellprofiler_runs.jsonl
+    accounting.record_run(cp_output_dir.parent.parent, image_dir, usage)
+
+    return load_cellprofiler_output(cp_output_dir)
+
+def cellprofiler_command(image_dir, output_dir=None):
+    """
+    Validate the pipeline and image directory and build the headless CellProfiler command.
+    
+    Returns:
+    --------
+    cp_command : list of str
+        Command line to run CellProfiler
+    cp_output_dir : Path
+        Unique scratch directory (in cp_output/) where this run writes CellPyAbilityImage.csv
+    """
     # Define the path to the CellProfiler pipeline (.cppipe) in the package directory
     cppipe_path = base_dir / 'CellPyAbility.cppipe'
     if cppipe_path.exists():
@@ -276,6 +326,7 @@ def run_cellprofiler(image_dir, counts_file=None, output_dir=None):
     cp_output_dir = output_base / 'cp_output'
     cp_output_dir.mkdir(exist_ok=True)
     logger.debug(f'cp_output/ directory identified or created at {cp_output_dir}')
+    remove_stale_scratch(cp_output_dir)
 
     # Convert image_dir to a Path object and resolve it to an absolute path
     # Handles OS-specific separators and converts relative paths (./images) to absolute paths (C:\Users\...)
@@ -285,36 +336,63 @@ def run_cellprofiler(image_dir, counts_file=None, output_dir=None):
         logger.critical(f"Image directory does not exist: {image_path_obj}")
         exit(1)
         
-    # We also ensure the pipeline path and output dir are absolute resolved paths
-    cppipe_path_obj = cppipe_path.resolve()
-    cp_output_obj = cp_output_dir.resolve()
-
     # Run CellProfiler from the command line
-    logger.debug('Starting CellProfiler from command line ...')
     cp_exe = _ensure_cellprofiler_path()
+
+    # Each run writes to its own scratch directory, so concurrent runs sharing an output
+    # directory never overwrite or move each other's CellPyAbilityImage.csv
+    scratch_dir = cp_output_dir / f'{SCRATCH_PREFIX}{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    scratch_dir.mkdir()
+    logger.debug(f'CellProfiler scratch directory created at {scratch_dir}')
+
+    # Optional image QC prepass: reject broken plates and leave out failing wells before counting
+    image_qc = qc.get_qc()
+    if image_qc.enabled:
+        image_path_obj, rejection = image_qc.prepare_input(image_path_obj, scratch_dir, output_base)
+        if rejection:
+            logger.critical(f'Plate {Path(image_dir).name} rejected by image QC: {rejection}')
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            exit(1)
+
+    # We also ensure the pipeline path and output dir are absolute resolved paths
+    cppipe_path_obj = cppipe_path.resolve()
+    cp_output_obj = scratch_dir.resolve()
     
     # We explicitly convert paths to str() here
     # Subprocess command receives clean string paths formatted for host OS
-    subprocess.run([
+    cp_command = [
         cp_exe, 
         '-c', '-r', 
         '-p', str(cppipe_path_obj), 
         '-i', str(image_path_obj), 
         '-o', str(cp_output_obj)
-    ])
-    logger.info('CellProfiler nuclei counting complete.')
+    ]
+    return cp_command, scratch_dir
 
+def load_cellprofiler_output(cp_output_dir):
+    """
+    Load the counts CellProfiler wrote to cp_output_dir.
+    
+    Returns:
+    --------
+    df_cp : pandas.DataFrame
+        DataFrame with nuclei counts
+    cp_csv : Path
+        Path to the counts CSV file
+    """
     # Define the path to the CellProfiler counting output
-    cp_csv = cp_output_dir / 'CellPyAbilityImage.csv'
+    cp_csv = Path(cp_output_dir) / 'CellPyAbilityImage.csv'
     if cp_csv.exists():
         logger.debug('CellPyAbilityImage.csv exists in /cp_output/ ...')
     else:
         logger.critical('CellProfiler output CellPyAbilityImage.csv does not exist in /cp_output/')
         logger.info('If CellPyAbility.cppipe is modified, make sure the output is still named CellPyAbilityImage.csv')
+        remove_scratch(cp_csv)
         exit(1)
 
     # Load the CellProfiler counts into a DataFrame
-    df_cp = pd.read_csv(cp_csv)
+    with profiling.span('read_counts'):
+        df_cp = pd.read_csv(cp_csv)
     
     return df_cp, cp_csv
 
@@ -336,7 +414,8 @@ def rename_wells(tiff_name):
 def rename_counts(cp_csv, counts_csv):
     """
     Rename or copy CellProfiler counts file to final output location.
-    Uses copy if source is not in cp_output (e.g., test data), otherwise renames.
+    Uses copy if source is not in cp_output (e.g., test data), otherwise renames
+    and removes the run's scratch directory. Either way the final file appears atomically.
     """
     try:
         # Resolve both paths to absolute to ensure safe string comparison
@@ -346,11 +425,13 @@ def rename_counts(cp_csv, counts_csv):
         # Check if source is NOT in cp_output directory (e.g. external test data)
         # Using .resolve() makes this check robust regardless of relative path usage
         if 'cp_output' not in str(cp_csv_path):
-            shutil.copy2(cp_csv_path, counts_csv_path)
+            with atomic_output(counts_csv_path) as tmp_path:
+                shutil.copy2(cp_csv_path, tmp_path)
             logger.debug(f'{cp_csv_path} successfully copied to {counts_csv_path}')
         else:
-            os.rename(cp_csv_path, counts_csv_path)
+            os.replace(cp_csv_path, counts_csv_path)
             logger.debug(f'{cp_csv_path} successfully renamed to {counts_csv_path}')
+            remove_scratch(cp_csv_path)
             
     except FileNotFoundError:
         logger.debug(f'{cp_csv} not found')
@@ -359,7 +440,40 @@ def rename_counts(cp_csv, counts_csv):
     except Exception as e:
         logger.debug(f'While renaming {cp_csv}, an error occurred: {e}')
 
-# Define models at module level so they are accessible
+@contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path next to path and rename it into place when the block succeeds.
+    Readers (and concurrent runs) never see a partially written output file.
+    The temporary file keeps the suffix, so writers that infer the format from it still work.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.stem}.{uuid.uuid4().hex[:8]}.tmp{path.suffix}')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+def remove_scratch(cp_csv):
+    """Remove the scratch directory of a CellProfiler run, given a file in it."""
+    scratch_dir = Path(cp_csv).parent
+    if scratch_dir.name.startswith(SCRATCH_PREFIX) and scratch_dir.parent.name == 'cp_output':
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        logger.debug(f'Removed CellProfiler scratch directory {scratch_dir}')
+
+def remove_stale_scratch(cp_output_dir):
+    """Remove scratch directories left behind by CellProfiler runs of dead processes on this host."""
+    host = socket.gethostname()
+    for scratch_dir in Path(cp_output_dir).glob(f'{SCRATCH_PREFIX}*'):
+        # Name is run-<host>-<pid>-<id>; the host itself may contain dashes
+        owner, _, _ = scratch_dir.name[len(SCRATCH_PREFIX):].rpartition('-')
+        owner_host, _, pid = owner.rpartition('-')
+        if owner_host == host and pid.isdigit() and not scheduler._pid_alive(int(pid)):
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            logger.info(f'Removed stale CellProfiler scratch directory {scratch_dir.name}')
+
 def fivePL(x, A, B, C, D, G):
     """
     Five-parameter logistic (5PL) dose-response model.
@@ -408,10 +522,36 @@ def hill(x, Emax, EC50, HillSlope):
     """
     return Emax * (x**HillSlope) / (EC50**HillSlope + x**HillSlope)
 
-def fit_response_curve(x, y, name):
+@dataclass
+class CurveFit:
     """
-    Fits 5PL, falls back to Hill, returns (x_plot, y_plot, IC50, params).
-    Solves for IC50 algebraically. Returns NaN if IC50 is unsolvable.
+    Dose-response fit of one condition, as returned by fit_dose_response().
+
+    Attributes:
+    -----------
+    name : str
+        Condition name
+    model : str
+        '5PL', 'Hill', or 'none' if both fits failed
+    params : numpy.ndarray
+        Fitted parameters of the model (A, B, C, D, G for 5PL; Emax, EC50, HillSlope for Hill)
+    ic50 : float
+        Concentration at 0.5 relative viability (NaN if unsolvable)
+    x_plot, y_plot : numpy.ndarray
+        Smooth curve for plotting (the raw points if both fits failed)
+    """
+    name: str
+    model: str
+    params: np.ndarray
+    ic50: float
+    x_plot: np.ndarray
+    y_plot: np.ndarray
+
+@profiling.timed('fit')
+def fit_dose_response(x, y, name):
+    """
+    Fits 5PL, falls back to Hill, returns a CurveFit with the model parameters.
+    Solves for IC50 algebraically. IC50 is NaN if unsolvable.
     Input x and y should be numpy arrays.
     """
     # Create smooth x-axis for plotting
@@ -452,7 +592,7 @@ def fit_response_curve(x, y, name):
         except (ValueError, ArithmeticError):
              ic50 = np.nan
 
-        return x_plot, fivePL(x_plot, *popt), ic50
+        return CurveFit(name, '5PL', popt, ic50, x_plot, fivePL(x_plot, *popt))
         
     except (RuntimeError, ValueError):
         # Fallback to Hill
@@ -460,8 +600,17 @@ def fit_response_curve(x, y, name):
              popt, _ = curve_fit(hill, x, y, p0=p0_Hill, maxfev=10000)
              # Hill parameter index 1 is EC50
              ic50 = popt[1] 
-             return x_plot, hill(x_plot, *popt), ic50
+             return CurveFit(name, 'Hill', popt, ic50, x_plot, hill(x_plot, *popt))
         except:
              logger.warning(f"Could not fit {name}. Returning connect-the-dots")
              # Return straight lines between points if fit fails
-             return x, y, np.nan
+             return CurveFit(name, 'none', np.array([]), np.nan, x, y)
+
+def fit_response_curve(x, y, name):
+    """
+    Fits 5PL, falls back to Hill, returns (x_plot, y_plot, IC50).
+    Solves for IC50 algebraically. Returns NaN if IC50 is unsolvable.
+    Input x and y should be numpy arrays. Use fit_dose_response() for the fitted parameters.
+    """
+    fit = fit_dose_response(x, y, name)
+    return fit.x_plot, fit.y_plot, fit.ic50
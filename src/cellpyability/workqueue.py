@@ -0,0 +1,366 @@
+"""
+Work queue module lets workers on several machines share experiments through a directory
+on a shared filesystem (e.g., a NAS mounted on every workstation). No external services needed.
+
+Queue directory layout:
+    pending/<job>.json             submitted jobs waiting for a worker (taken in job ID order)
+    claimed/<job>@<host>-<pid>.json  jobs being run (claimed by an atomic rename out of pending/)
+    done/<job>.json                finished jobs with their result
+    failed/<job>.json              jobs that failed or exceeded the retry limit
+    results/<title>/               default output location of each experiment
+
+Job IDs start with the inverted priority, then the submission time, so workers take
+urgent jobs first and jobs of equal priority in submission order.
+
+A worker refreshes the modification time of its claim file while the job runs. Claims whose
+modification time is older than the stale timeout (crashed worker, lost node) are moved back
+to pending/ by any worker, so the job is retried elsewhere.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from . import toolbox as tb
+from . import batch
+from . import storage
+
+# Initialize toolbox
+logger = tb.logger
+
+QUEUE_SUBDIRS = ('pending', 'claimed', 'done', 'failed', 'results')
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_STALE_TIMEOUT = 600.0
+DEFAULT_MAX_ATTEMPTS = 3
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+JOB_STATES = ('pending', 'claimed', 'done', 'failed')
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _write_json(path, data):
+    """Write JSON via a temporary file in the same directory and rename it into place."""
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{socket.gethostname()}-{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def init_queue(queue_dir):
+    """Create the queue directory layout if needed and return the queue directory as a Path."""
+    queue_path = Path(queue_dir).resolve()
+    for subdir in QUEUE_SUBDIRS:
+        (queue_path / subdir).mkdir(parents=True, exist_ok=True)
+    return queue_path
+
+
+def _join(output_root, name):
+    """Output root of one job inside output_root (a directory or URL)."""
+    return f'{output_root}/{name}' if storage.is_url(output_root) else str(Path(output_root) / name)
+
+
+def submit_experiments(queue_dir, experiments, output_dir=None, priority=DEFAULT_PRIORITY, isolate=False):
+    """
+    Submit experiments to the queue as job files.
+
+    Image directories and counts files are stored as absolute paths, so they must be
+    visible at the same path on every worker node (object-store URLs are kept as they are).
+
+    Parameters:
+    -----------
+    queue_dir : str or Path
+        Shared queue directory
+    experiments : list of dict
+        Experiment dictionaries (see batch.read_config)
+    output_dir : str, optional
+        Output root (directory or object-store URL) for the experiments. If None, uses <queue_dir>/results/.
+    priority : int
+        0 (lowest) to 9 (most urgent); higher priority jobs are claimed first
+    isolate : bool
+        Give each job its own output root, <output_dir>/<job id>/, so equal titles never collide
+
+    Returns:
+    --------
+    job_ids : list of str
+    """
+    if not 0 <= int(priority) <= MAX_PRIORITY:
+        raise ValueError(f'Priority must be between 0 and {MAX_PRIORITY}, got {priority}')
+    queue_path = init_queue(queue_dir)
+    if storage.is_url(output_dir):
+        output_root = output_dir.rstrip('/')
+    else:
+        output_root = str(Path(output_dir).resolve()) if output_dir else str(queue_path / 'results')
+
+    job_ids = []
+    for experiment in experiments:
+        experiment = dict(experiment)  # never change the caller's experiments
+        if not storage.is_url(experiment['image_dir']):
+            experiment['image_dir'] = str(Path(experiment['image_dir']).resolve())
+        if experiment.get('counts_file'):
+            experiment['counts_file'] = str(Path(experiment['counts_file']).resolve())
+
+        # Inverted priority, then millisecond timestamp, so workers take urgent jobs first
+        job_id = f'{MAX_PRIORITY - int(priority)}-{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}'
+        job = {
+            'id': job_id,
+            'experiment': experiment,
+            'output_dir': _join(output_root, job_id) if isolate else output_root,
+            'priority': int(priority),
+            'submitted': _now(),
+            'attempts': 0,
+        }
+        _write_json(queue_path / 'pending' / f'{job_id}.json', job)
+        job_ids.append(job_id)
+        logger.info(f'Submitted {experiment["title"]} as job {job_id}')
+    return job_ids
+
+
+def submit_config(queue_dir, config_file, output_dir=None, priority=DEFAULT_PRIORITY):
+    """Submit every experiment in a batch config.csv file to the queue."""
+    return submit_experiments(queue_dir, batch.read_config(config_file), output_dir=output_dir, priority=priority)
+
+
+def recover_stale_claims(queue_dir, stale_timeout=DEFAULT_STALE_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Move claims not refreshed within stale_timeout seconds back to pending/.
+
+    Jobs that have already been attempted max_attempts times are moved to failed/ instead.
+
+    Returns:
+    --------
+    recovered : list of str
+        IDs of the recovered jobs
+    """
+    queue_path = init_queue(queue_dir)
+    recovered = []
+    for claim_path in sorted((queue_path / 'claimed').glob('*.json')):
+        try:
+            # rename() updates st_ctime on POSIX, which covers the moment between claim and first heartbeat
+            stat = claim_path.stat()
+            age = time.time() - max(stat.st_mtime, stat.st_ctime)
+            if age < stale_timeout:
+                continue
+            job = _read_json(claim_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue  # finished or recovered by someone else meanwhile
+
+        job['attempts'] = job.get('attempts', 0) + 1
+        owner = claim_path.stem.split('@', 1)[-1]
+        if job['attempts'] >= max_attempts:
+            job['result'] = {'status': 'failed', 'error': f'Abandoned by {owner} {job["attempts"]} times'}
+            destination = queue_path / 'failed' / f'{job["id"]}.json'
+        else:
+            destination = queue_path / 'pending' / f'{job["id"]}.json'
+
+        # Claim the stale file ourselves first, so only one worker recovers it
+        recovering = claim_path.with_name(f'.{claim_path.name}.recovering')
+        try:
+            os.rename(claim_path, recovering)
+        except FileNotFoundError:
+            continue
+        _write_json(destination, job)
+        recovering.unlink(missing_ok=True)
+        recovered.append(job['id'])
+        logger.warning(f'Recovered stale job {job["id"]} from {owner} (idle {age:.0f} s, attempt {job["attempts"]})')
+    return recovered
+
+
+def claim_next_job(queue_dir, worker_name=None):
+    """
+    Atomically claim the oldest pending job.
+
+    Returns:
+    --------
+    job : dict or None
+        The claimed job, or None if no job is pending
+    claim_path : Path or None
+        Claim file to heartbeat and remove when finished
+    """
+    queue_path = init_queue(queue_dir)
+    worker_name = worker_name or f'{socket.gethostname()}-{os.getpid()}'
+    for pending_path in sorted((queue_path / 'pending').glob('*.json')):
+        claim_path = queue_path / 'claimed' / f'{pending_path.stem}@{worker_name}.json'
+        try:
+            # rename() is atomic: exactly one worker wins each job
+            os.rename(pending_path, claim_path)
+        except (FileNotFoundError, PermissionError):
+            continue
+        os.utime(claim_path)  # the claim's age starts now, not at submission
+        return _read_json(claim_path), claim_path
+    return None, None
+
+
+def _heartbeat(claim_path, interval, stop):
+    """Refresh the claim file's modification time until stop is set."""
+    while not stop.wait(interval):
+        try:
+            os.utime(claim_path)
+        except FileNotFoundError:
+            logger.warning(f'Claim {claim_path.name} disappeared; another worker may have recovered it')
+            return
+
+
+def run_job(queue_dir, job, claim_path, stale_timeout=DEFAULT_STALE_TIMEOUT):
+    """
+    Run a claimed job and move it to done/ or failed/ with its result.
+
+    Returns:
+    --------
+    result : dict
+        Result record from batch.run_experiment
+    """
+    queue_path = Path(queue_dir).resolve()
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(claim_path, max(stale_timeout / 4, 0.1), stop), daemon=True
+    )
+    heartbeat.start()
+
+    worker_name = claim_path.stem.split('@', 1)[-1]
+    logger.info(f'{worker_name} running job {job["id"]} ({job["experiment"]["title"]}) ...')
+    started = _now()
+    try:
+        # Outputs for an object store are written locally and uploaded once the job finishes
+        with storage.remote_outputs(job['output_dir']) as output_root:
+            result = batch.run_experiment(job['experiment'], output_root)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    job.update(worker=worker_name, started=started, finished=_now(), result=result)
+    status_dir = 'done' if result['status'] != 'failed' else 'failed'
+    _write_json(queue_path / status_dir / f'{job["id"]}.json', job)
+    try:
+        claim_path.unlink()
+    except FileNotFoundError:
+        logger.warning(f'Job {job["id"]} finished after its claim was recovered as stale')
+    return result
+
+
+def queue_status(queue_dir):
+    """Return the number of jobs in each state as a dictionary."""
+    queue_path = init_queue(queue_dir)
+    return {state: len(list((queue_path / state).glob('*.json'))) for state in JOB_STATES}
+
+
+def find_job(queue_dir, job_id):
+    """
+    Look up a job by ID in every state directory.
+
+    Returns:
+    --------
+    state : str or None
+        'pending', 'claimed', 'done' or 'failed', or None if the job is unknown
+    job : dict or None
+    """
+    queue_path = Path(queue_dir)
+    # A job can move between directories while we look, so check in the order it moves
+    for state in JOB_STATES:
+        pattern = f'{job_id}@*.json' if state == 'claimed' else f'{job_id}.json'
+        for job_path in (queue_path / state).glob(pattern):
+            try:
+                return state, _read_json(job_path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+    return None, None
+
+
+def list_jobs(queue_dir):
+    """Return (state, job) for every job in the queue, in job ID order."""
+    queue_path = init_queue(queue_dir)
+    jobs = []
+    for state in JOB_STATES:
+        for job_path in (queue_path / state).glob('*.json'):
+            try:
+                jobs.append((state, _read_json(job_path)))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+    return sorted(jobs, key=lambda item: item[1]['id'])
+
+
+def cancel_job(queue_dir, job_id):
+    """
+    Cancel a pending job by moving it to failed/. Running jobs cannot be cancelled.
+
+    Returns:
+    --------
+    cancelled : bool
+    """
+    queue_path = Path(queue_dir)
+    pending_path = queue_path / 'pending' / f'{job_id}.json'
+    cancelling = pending_path.with_name(f'.{pending_path.name}.cancelling')
+    try:
+        os.rename(pending_path, cancelling)  # atomic, so a worker cannot claim it meanwhile
+    except FileNotFoundError:
+        return False
+    job = _read_json(cancelling)
+    job['result'] = {'status': 'cancelled', 'error': 'Cancelled before it started'}
+    _write_json(queue_path / 'failed' / f'{job_id}.json', job)
+    cancelling.unlink()
+    logger.info(f'Cancelled job {job_id}')
+    return True
+
+
+def run_worker(queue_dir, poll_interval=DEFAULT_POLL_INTERVAL, stale_timeout=DEFAULT_STALE_TIMEOUT,
+               max_jobs=None, exit_when_empty=False, max_attempts=DEFAULT_MAX_ATTEMPTS, stop_event=None):
+    """
+    Claim and run jobs from a shared queue directory until stopped.
+
+    Parameters:
+    -----------
+    queue_dir : str or Path
+        Shared queue directory
+    poll_interval : float
+        Seconds to wait before checking again when no job is pending
+    stale_timeout : float
+        Seconds without a heartbeat after which another worker's claim is recovered
+    max_jobs : int, optional
+        Stop after running this many jobs
+    exit_when_empty : bool
+        Stop as soon as no job is pending instead of waiting for more
+    max_attempts : int
+        Number of times a job may be abandoned before it is marked failed
+    stop_event : threading.Event or multiprocessing.Event, optional
+        Stop after the current job once this event is set
+
+    Returns:
+    --------
+    results : list of dict
+        Results of the jobs this worker ran
+    """
+    queue_path = init_queue(queue_dir)
+    worker_name = f'{socket.gethostname()}-{os.getpid()}'
+    logger.info(f'Worker {worker_name} watching {queue_path}')
+
+    results = []
+    while max_jobs is None or len(results) < max_jobs:
+        if stop_event is not None and stop_event.is_set():
+            break
+        recover_stale_claims(queue_path, stale_timeout, max_attempts)
+        job, claim_path = claim_next_job(queue_path, worker_name)
+        if job is None:
+            if exit_when_empty:
+                break
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        results.append(run_job(queue_path, job, claim_path, stale_timeout))
+
+    logger.info(f'Worker {worker_name} stopping after {len(results)} jobs. Queue: {queue_status(queue_path)}')
+    return results
@@ -0,0 +1,99 @@
+"""
+Test resource accounting of CellProfiler runs and the capacity planning report.
+"""
+
+import json
+import os
+import signal
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import accounting, scheduler
+from cellpyability import toolbox as tb
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class TestAccounting(unittest.TestCase):
+    """Test per-process usage, run records and the usage report."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        scheduler._scheduler = None
+        self.tmpdir.cleanup()
+
+    @unittest.skipUnless(hasattr(os, 'wait4'), 'per-process rusage needs os.wait4')
+    def test_child_usage(self):
+        # A child that holds 60 MB and burns some CPU before exiting with code 3
+        code = 'import sys, time\nb = bytearray(60 * 2**20)\nt = time.process_time()\n' \
+               'while time.process_time() - t < 0.2: pass\nsys.exit(3)'
+        usage = accounting.run_accounted([sys.executable, '-c', code])
+        self.assertEqual(usage.returncode, 3)
+        self.assertGreaterEqual(usage.cpu_seconds, 0.2)
+        self.assertGreaterEqual(usage.peak_rss_mb, 60)
+        self.assertGreaterEqual(usage.wall_seconds, usage.user_cpu_seconds)
+
+        # Killed by a signal: negative signal number, like Popen
+        child = accounting.AccountedProcess([sys.executable, '-c', 'import time; time.sleep(30)'])
+        child.terminate()
+        self.assertEqual(child.wait().returncode, -signal.SIGTERM)
+
+    def test_report(self):
+        image_dir = self.tmp / 'plate'
+        image_dir.mkdir()
+        for well in ('B2', 'B3', 'B4', 'B5'):
+            (image_dir / f'{well}.tif').write_bytes(b'\0' * 1000)
+        (image_dir / 'notes.txt').write_text('not an image')
+
+        accounting.record_run(self.tmp, image_dir, accounting.ProcessUsage(0, 10.0, 6.0, 2.0, 400.0, 4096, 512))
+        accounting.record_run(self.tmp, image_dir, accounting.ProcessUsage(1, 5.0, 1.0, 1.0, 200.0, 0, 0))
+        df_runs = accounting.read_runs([self.tmp])
+        self.assertEqual(list(df_runs['n_images']), [4, 4])
+        self.assertEqual(list(df_runs['image_bytes']), [4000, 4000])
+
+        summary = accounting.usage_report(df_runs)
+        self.assertEqual(summary['runs'], 2)
+        self.assertEqual(summary['failed_runs'], 1)
+        self.assertEqual(summary['cpu_seconds'], 10.0)
+        self.assertEqual(summary['images_per_cpu_second'], 0.8)
+        self.assertEqual(summary['mean_rss_mb_per_image'], 75.0)
+        self.assertEqual(summary['max_rss_mb_per_image'], 100.0)
+        self.assertIn('images_per_cpu_second', accounting.format_report(df_runs))
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a shell script')
+    def test_cellprofiler_run_is_recorded(self):
+        scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01)
+        image_dir = self.tmp / 'images'
+        image_dir.mkdir()
+        for i in range(3):
+            (image_dir / f'B{i + 2}_image.tiff').write_bytes(b'\0' * 2048)
+        fake_cp = self.tmp / 'fake_cellprofiler'
+        fake_cp.write_text(f'#!/bin/sh\ncp "{TEST_DATA_DIR / "test_gda_counts.csv"}" "$8/CellPyAbilityImage.csv"\n')
+        fake_cp.chmod(0o755)
+
+        with patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(fake_cp)):
+            tb.run_cellprofiler(str(image_dir), output_dir=str(self.tmp / 'out'))
+
+        records = [json.loads(line) for line in (self.tmp / 'out' / accounting.USAGE_FILE).read_text().splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['n_images'], 3)
+        self.assertEqual(records[0]['image_bytes'], 3 * 2048)
+        self.assertEqual(records[0]['returncode'], 0)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Test the asyncio analysis API.
+
+Counting uses pre-counted test files or a stand-in CellProfiler shell script, so the real
+CellProfiler is never launched.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import async_analysis, cache, scheduler, storage
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class MemoryStorage:
+    """Object store held in a dict of URL -> bytes."""
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def find(self, url):
+        root = url.rstrip('/') + '/'
+        return {key: len(data) for key, data in self.objects.items() if key.startswith(root)}
+
+    def isfile(self, url):
+        return url in self.objects
+
+    def get_file(self, url, local_path):
+        Path(local_path).write_bytes(self.objects[url])
+
+
+class TestAsyncAnalysis(unittest.TestCase):
+    """Test concurrent plates, asyncio subprocess counting, and timeouts."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        self.image_dir = self.tmp / 'images'
+        self.image_dir.mkdir()
+        self.sched = scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01, max_processes=1)
+
+    def tearDown(self):
+        scheduler._scheduler = None
+        cache._cache = None
+        storage._backends.pop('mem', None)
+        storage.get_storage.cache = {}
+        self.tmpdir.cleanup()
+
+    def fake_cellprofiler(self, body):
+        """Write a stand-in CellProfiler executable; $8 is the -o output directory."""
+        script = self.tmp / 'fake_cellprofiler'
+        script.write_text(f'#!/bin/sh\n{body}\n')
+        script.chmod(0o755)
+        return patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(script))
+
+    def test_plates_awaited_concurrently(self):
+        gda_counts = str(TEST_DATA_DIR / 'test_gda_counts.csv')
+        synergy_counts = str(TEST_DATA_DIR / 'test_synergy_counts.csv')
+
+        async def main():
+            return await asyncio.gather(
+                async_analysis.run_gda_async('plate1', 'Cell Line A', 'Cell Line B', 0.000001, 3, '/tmp/dummy',
+                                             counts_file=gda_counts, save=False),
+                async_analysis.run_gda_async('plate2', 'Cell Line A', 'Cell Line B', 0.000001, 3, '/tmp/dummy',
+                                             counts_file=gda_counts, output_dir=str(self.tmp / 'out')),
+                async_analysis.run_synergy_async('combo', 'Drug X', 0.0004, 4, 'Drug Y', 0.0001, 4, '/tmp/dummy',
+                                                 counts_file=synergy_counts, save=False),
+            )
+
+        gda1, gda2, synergy = asyncio.run(main())
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_gda_Stats.csv', index_col=0)
+        np.testing.assert_allclose(gda1.stats.values.astype(float), expected.values, rtol=1e-6)
+        self.assertEqual(gda1.ic50, gda2.ic50)
+        self.assertTrue((self.tmp / 'out' / 'gda_output' / 'plate2_gda_plot.png').exists())
+
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_synergy_BlissMatrix.csv', index_col=0)
+        np.testing.assert_allclose(synergy.bliss_matrix.values, expected.values, rtol=1e-6)
+
+    def test_plots_without_pyplot(self):
+        """Plots are rendered in executor threads without pyplot, which GUI backends reject off the main thread."""
+        import matplotlib.pyplot as plt
+        gda_counts = str(TEST_DATA_DIR / 'test_gda_counts.csv')
+
+        async def main():
+            return await asyncio.gather(*[
+                async_analysis.run_gda_async(f'plate{i}', 'Cell Line A', 'Cell Line B', 0.000001, 3, '/tmp/dummy',
+                                             counts_file=gda_counts, output_dir=str(self.tmp / 'out'))
+                for i in range(4)
+            ])
+
+        with patch('matplotlib.pyplot.new_figure_manager', side_effect=RuntimeError('pyplot used off the main thread')):
+            asyncio.run(main())
+        for i in range(4):
+            self.assertGreater((self.tmp / 'out' / 'gda_output' / f'plate{i}_gda_plot.png').stat().st_size, 0)
+        self.assertEqual(plt.get_fignums(), [])
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a shell script')
+    def test_counting_subprocess(self):
+        with self.fake_cellprofiler(f'cp "{TEST_DATA_DIR / "test_gda_counts.csv"}" "$8/CellPyAbilityImage.csv"'):
+            result = asyncio.run(async_analysis.run_simple_async(
+                'plate', str(self.image_dir), output_dir=str(self.tmp / 'out')))
+
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_simple_CountMatrix.csv', index_col=0)
+        np.testing.assert_array_equal(result.count_matrix.values, expected.values)
+        self.assertTrue((self.tmp / 'out' / 'simple_output' / 'plate_simple_raw_counts.csv').exists())
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a shell script')
+    def test_counting_local_copies(self):
+        """Plates are counted from the image cache and object-store plates from a download, as in run_cellprofiler."""
+        seen = self.tmp / 'image_dirs.txt'
+        body = f'ls "$6" >> "{seen}"\necho "$6" >> "{seen}"\n' \
+               f'cp "{TEST_DATA_DIR / "test_gda_counts.csv"}" "$8/CellPyAbilityImage.csv"'
+        (self.image_dir / 'B2.tif').write_bytes(b'local')
+        storage.register_backend('mem', lambda: MemoryStorage({'mem://plates/remote/B2.tif': b'remote'}))
+
+        with self.fake_cellprofiler(body):
+            asyncio.run(async_analysis.run_simple_async('remote', 'mem://plates/remote', output_dir=str(self.tmp / 'out')))
+            cache_dir = self.tmp / 'cache'
+            cache.configure(cache_dir=cache_dir)
+            asyncio.run(async_analysis.run_simple_async('cached', str(self.image_dir), output_dir=str(self.tmp / 'out')))
+
+        remote_listing, remote_dir, cached_listing, cached_dir = seen.read_text().split()
+        self.assertEqual((remote_listing, Path(remote_dir).name), ('B2.tif', 'remote'))
+        self.assertFalse(Path(remote_dir).exists())  # the download is removed after counting
+        self.assertEqual(cached_listing, 'B2.tif')
+        self.assertIn(cache_dir.resolve(), Path(cached_dir).parents)
+        self.assertEqual(list(cache_dir.glob('*.use-*')), [])
+        self.assertEqual(self.sched.busy_slots(), 0)
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a shell script')
+    def test_timeout_stops_cellprofiler(self):
+        started = time.monotonic()
+        with self.fake_cellprofiler('exec sleep 30'):
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(async_analysis.run_simple_async(
+                    'slow', str(self.image_dir), output_dir=str(self.tmp / 'out'), timeout=0.5))
+
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(self.sched.busy_slots(), 0)
+
+    def test_missing_counts_file_raises(self):
+        with self.assertRaises(RuntimeError):
+            asyncio.run(async_analysis.run_simple_async('missing', '/tmp/dummy', counts_file=str(self.tmp / 'none.csv')))
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
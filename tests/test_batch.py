@@ -0,0 +1,208 @@
+"""
+Test the batch module that runs experiments from a config.csv file in a process pool
+or as a counting/analysis pipeline, and the journal that lets an interrupted batch resume.
+
+Every experiment uses a pre-counted test file, so CellProfiler is never launched.
+"""
+
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import batch, journal
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+def write_config(path, rows):
+    """Write a batch config.csv with the union of all row columns."""
+    pd.DataFrame(rows).fillna('').to_csv(path, index=False)
+
+
+class TestBatch(unittest.TestCase):
+    """Test config parsing and concurrent batch execution."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        gda_counts = str(TEST_DATA_DIR / 'test_gda_counts.csv')
+        synergy_counts = str(TEST_DATA_DIR / 'test_synergy_counts.csv')
+        self.rows = [
+            {'module': 'gda', 'dir': '/tmp/dummy', 'title': 'plate1', 'upper': 'Cell Line A',
+             'lower': 'Cell Line B', 'conc': 0.000001, 'dil': 3, 'counts': gda_counts},
+            {'module': 'gda', 'dir': '/tmp/dummy', 'title': 'plate2', 'upper': 'Cell Line A',
+             'lower': 'Cell Line B', 'conc': 0.000001, 'dil': 3, 'counts': gda_counts},
+            {'module': 'synergy', 'dir': '/tmp/dummy', 'title': 'combo', 'xdrug': 'Drug X',
+             'xconc': 0.0004, 'xdil': 4, 'ydrug': 'Drug Y', 'yconc': 0.0001, 'ydil': 4,
+             'counts': synergy_counts},
+            {'module': 'simple', 'dir': '/tmp/dummy', 'title': 'counts_only', 'counts': gda_counts},
+            {'module': 'gda', 'dir': str(self.tmp / 'missing'), 'title': 'no_images', 'upper': 'A',
+             'lower': 'B', 'conc': 0.000001, 'dil': 3},
+        ]
+        self.config = self.tmp / 'config.csv'
+        write_config(self.config, self.rows)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_config_legacy_columns(self):
+        """A config without a module column is read as GDA rows."""
+        legacy = self.tmp / 'legacy.csv'
+        legacy.write_text('dir,title,upper,lower,conc,dil\n'
+                          'path/to/image_dir/,20260101_CellLineA_DrugX,Cell Line A,Cell Line B,0.000001,3\n')
+        experiments = batch.read_config(legacy)
+        self.assertEqual(len(experiments), 1)
+        self.assertEqual(experiments[0]['module'], 'gda')
+        self.assertEqual(experiments[0]['top_conc'], 0.000001)
+        self.assertIsNone(experiments[0]['counts_file'])
+
+    def test_read_config_rejects_duplicate_titles(self):
+        write_config(self.config, self.rows + [self.rows[0]])
+        with self.assertRaises(ValueError):
+            batch.read_config(self.config)
+
+    def test_run_batch(self):
+        """Each experiment succeeds in isolated output and the summary reports every row."""
+        output_root = self.tmp / 'out'
+        df_summary = batch.run_batch(self.config, jobs=2, output_dir=str(output_root))
+
+        self.assertEqual(df_summary['title'].tolist(), [row['title'] for row in self.rows])
+        status = dict(zip(df_summary['title'], df_summary['status']))
+        self.assertEqual(status, {'plate1': 'success', 'plate2': 'success', 'combo': 'success',
+                                  'counts_only': 'success', 'no_images': 'skipped'})
+        self.assertTrue((output_root / 'batch_summary.csv').exists())
+
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_gda_Stats.csv', index_col=0)
+        for title in ['plate1', 'plate2']:
+            stats = pd.read_csv(output_root / title / 'gda_output' / f'{title}_gda_Stats.csv', index_col=0)
+            pd.testing.assert_frame_equal(stats, expected, check_exact=False, rtol=1e-6)
+        self.assertTrue((output_root / 'combo' / 'synergy_output' / 'combo_synergy_BlissMatrix.csv').exists())
+        self.assertTrue((output_root / 'counts_only' / 'simple_output' / 'counts_only_simple_CountMatrix.csv').exists())
+
+    def test_run_batch_pipelined(self):
+        """The pipeline produces the same outputs and reports utilization for both stages."""
+        output_root = self.tmp / 'out'
+        df_summary, df_stages = batch.run_batch_pipelined(
+            self.config, count_workers=2, queue_size=1, output_dir=str(output_root)
+        )
+
+        status = dict(zip(df_summary['title'], df_summary['status']))
+        self.assertEqual(status['no_images'], 'skipped')
+        self.assertTrue(all(status[row['title']] == 'success' for row in self.rows[:4]))
+
+        self.assertEqual(df_stages['stage'].tolist(), ['counting', 'analysis'])
+        self.assertEqual(df_stages['items'].tolist(), [4, 4])
+        self.assertTrue(df_stages['utilization'].between(0, 1).all())
+        self.assertTrue((output_root / 'batch_stages.csv').exists())
+
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_gda_Stats.csv', index_col=0)
+        stats = pd.read_csv(output_root / 'plate1' / 'gda_output' / 'plate1_gda_Stats.csv', index_col=0)
+        pd.testing.assert_frame_equal(stats, expected, check_exact=False, rtol=1e-6)
+
+    def test_pipelined_journal_failure(self):
+        """A plate whose counts cannot be journaled fails instead of stalling the analysis stage."""
+        record = journal.BatchJournal.record
+
+        def failing_record(self, experiment, stage, *args):
+            if stage == 'counted':
+                raise OSError('No space left on device')
+            return record(self, experiment, stage, *args)
+
+        outcome = {}
+        with patch.object(journal.BatchJournal, 'record', failing_record):
+            worker = threading.Thread(target=lambda: outcome.update(summary=batch.run_batch_pipelined(
+                self.config, count_workers=2, queue_size=1, output_dir=str(self.tmp / 'out'))[0]))
+            worker.start()
+            worker.join(timeout=60)
+        self.assertFalse(worker.is_alive(), 'pipeline stalled')
+        status = dict(zip(outcome['summary']['title'], outcome['summary']['status']))
+        self.assertTrue(all(status[row['title']] == 'failed' for row in self.rows[:4]))
+        self.assertIn('No space left', outcome['summary']['error'].iloc[0])
+
+
+class TestBatchResume(unittest.TestCase):
+    """Test the batch journal and resuming interrupted experiments."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        image_dir = self.tmp / 'images'
+        image_dir.mkdir()
+        self.experiment = {
+            'module': 'gda', 'title': 'overnight', 'image_dir': str(image_dir), 'counts_file': None,
+            'upper_name': 'Cell Line A', 'lower_name': 'Cell Line B', 'top_conc': 0.000001, 'dilution': 3.0,
+        }
+        self.output_root = self.tmp / 'out'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_resume_after_counting_skips_cellprofiler(self):
+        """An experiment that crashed after counting resumes from its checkpointed counts."""
+        batch_journal = journal.BatchJournal(self.output_root)
+        batch_journal.start(self.experiment)
+        batch_journal.record(self.experiment, 'counted', TEST_DATA_DIR / 'test_gda_counts.csv')
+
+        with patch('cellpyability.toolbox.accounting.run_accounted', side_effect=AssertionError('recounted')):
+            result = batch.run_experiment(self.experiment, self.output_root, resume=True)
+
+        self.assertEqual(result['status'], 'success', result['error'])
+        self.assertEqual(result['resumed_from'], 'counted')
+        self.assertTrue((self.output_root / 'overnight' / 'gda_output' / 'overnight_gda_plot.png').exists())
+        self.assertEqual(set(batch_journal.load('overnight')['stages']), set(journal.STAGES))
+
+        # A second resume finds the experiment done and does nothing
+        result = batch.run_experiment(self.experiment, self.output_root, resume=True)
+        self.assertEqual(result['resumed_from'], 'done')
+
+    def test_resume_multi_plate_experiment(self):
+        """Multi-plate experiments journal the counts of every plate and resume from them."""
+        plate_csvs = []
+        for plate in (1, 2):
+            df_cp = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+            plate_csvs.append(self.tmp / f'plate{plate}_CellPyAbilityImage.csv')
+            df_cp.assign(Count_nuclei=df_cp['Count_nuclei'] * plate).to_csv(plate_csvs[-1], index=False)
+        experiment = dict(self.experiment, image_dir=[str(self.tmp / 'plate1'), str(self.tmp / 'plate2')])
+
+        batch_journal = journal.BatchJournal(self.output_root)
+        batch_journal.start(experiment)
+        batch_journal.record(experiment, 'counted', plate_csvs)
+        entry = batch_journal.load('overnight')['stages']['counted']
+        self.assertEqual(entry['plates'], [str(plate_csv) for plate_csv in plate_csvs])
+        df_checkpoint = pd.read_csv(entry['path'])
+        self.assertEqual(df_checkpoint['Plate'].value_counts().to_dict(), {1: 60, 2: 60})
+        self.assertEqual(df_checkpoint.loc[df_checkpoint['Plate'] == 2, 'Count_nuclei'].sum(),
+                         2 * df_checkpoint.loc[df_checkpoint['Plate'] == 1, 'Count_nuclei'].sum())
+
+        for plate_csv in plate_csvs:
+            plate_csv.unlink()  # moved or removed by later stages; the checkpoint is self-contained
+        with patch('cellpyability.toolbox.accounting.run_accounted', side_effect=AssertionError('recounted')):
+            result = batch.run_experiment(experiment, self.output_root, resume=True)
+        self.assertEqual(result['status'], 'success', result['error'])
+        self.assertEqual(result['resumed_from'], 'counted')
+
+    def test_changed_parameters_start_over(self):
+        batch_journal = journal.BatchJournal(self.output_root)
+        batch_journal.start(self.experiment)
+        batch_journal.record(self.experiment, 'counted', TEST_DATA_DIR / 'test_gda_counts.csv')
+
+        changed = dict(self.experiment, dilution=4.0)
+        self.assertEqual(batch_journal.resume_point(changed), (None, None))
+        self.assertEqual(batch_journal.resume_point(self.experiment)[0], 'counted')
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Test the microbenchmark runner and its baseline comparison on a few fast benchmarks.
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# Add benchmarks to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+
+import bench_hot_paths
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Test benchmark timing, JSON report layout and regression detection."""
+
+    def test_run_and_compare(self):
+        report = bench_hot_paths.run_benchmarks(['realistic'], ['gen_dose_range', 'gda_pivot_normalize'], repeat=1)
+        self.assertEqual(set(report['results']), {'gen_dose_range@realistic', 'gda_pivot_normalize@realistic'})
+        self.assertIn('python', report['metadata'])
+
+        # Against a much faster baseline every benchmark is a regression, against a slower one none is
+        fast = {'results': {key: dict(timing, median_s=timing['median_s'] / 10) for key, timing in report['results'].items()}}
+        slow = {'results': {key: dict(timing, median_s=timing['median_s'] * 10) for key, timing in report['results'].items()}}
+        _, regressions = bench_hot_paths.compare(report, fast, threshold=1.5)
+        self.assertEqual(sorted(regressions), sorted(report['results']))
+        df_compare, regressions = bench_hot_paths.compare(report, slow, threshold=1.5)
+        self.assertEqual(regressions, [])
+        self.assertEqual(len(df_compare), 2)
+
+    def test_stored_baseline_covers_every_benchmark(self):
+        import json
+        baseline = json.loads(bench_hot_paths.BASELINE_FILE.read_text())
+        for name in bench_hot_paths.BENCHMARKS:
+            for scale in bench_hot_paths.SCALES:
+                self.assertIn(f'{name}@{scale}', baseline['results'])
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Test the local image cache: staging, reuse on reruns, eviction and prefetch.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import cache, scheduler, simple_analysis
+
+# Stand-in for CellProfiler: "counts" each image as the value of its first pixel
+FAKE_CELLPROFILER = '''#!{python}
+import csv, sys
+from pathlib import Path
+import numpy as np
+from PIL import Image
+image_dir, output_dir = Path(sys.argv[6]), Path(sys.argv[8])
+with open(output_dir / 'CellPyAbilityImage.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Count_nuclei', 'FileName_images', 'ImageNumber'])
+    for number, image in enumerate(sorted(image_dir.rglob('*.tif')), start=1):
+        writer.writerow([float(np.array(Image.open(image))[0, 0]), image.name, number])
+'''
+
+PLATE_BYTES = 1000
+
+
+class TestImageCache(unittest.TestCase):
+    """Test staging, reuse, eviction and prefetch of plates."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        self.share = self.tmp / 'share'  # stands in for a network share
+        self.cache_dir = self.tmp / 'cache'
+
+    def tearDown(self):
+        cache._cache = None
+        scheduler._scheduler = None
+        self.tmpdir.cleanup()
+
+    def make_plate(self, name, wells=('B2', 'B3', 'C2', 'C3')):
+        """A plate directory of PLATE_BYTES bytes, split evenly over one file per well."""
+        plate_dir = self.share / name
+        plate_dir.mkdir(parents=True)
+        for well in wells:
+            plate_dir.joinpath(f'{well}_-1_1_1_Stitched[DAPI 377,447]_001.tif').write_bytes(
+                b'x' * (PLATE_BYTES // len(wells)))
+        return plate_dir
+
+    def new_cache(self, plates=10):
+        """An ImageCache with room for the given number of plates."""
+        return cache.ImageCache(cache_dir=self.cache_dir, max_gb=plates * PLATE_BYTES / cache.GB, workers=4)
+
+    def set_last_used(self, image_cache, plate_dir, seconds):
+        manifest_file = image_cache._manifest_file(image_cache.key(plate_dir))
+        os.utime(manifest_file, (seconds, seconds))
+
+    def test_disabled_without_directory(self):
+        with patch.dict(os.environ, {'CELLPYABILITY_CACHE_DIR': ''}):
+            self.assertFalse(cache.ImageCache().enabled)
+        with patch.dict(os.environ, {'CELLPYABILITY_CACHE_DIR': str(self.cache_dir), 'CELLPYABILITY_CACHE_MAX_GB': '2'}):
+            image_cache = cache.ImageCache()
+        self.assertTrue(image_cache.enabled)
+        self.assertEqual(image_cache.max_bytes, 2 * cache.GB)
+
+    def test_rerun_copies_only_changes(self):
+        plate_dir = self.make_plate('plate1')
+        image_cache = self.new_cache()
+        with patch.object(cache.ImageCache, '_copy', wraps=cache.ImageCache._copy) as copy:
+            local_dir = image_cache.stage(plate_dir)
+            self.assertEqual(copy.call_count, 4)
+            self.assertEqual(local_dir.name, 'plate1')
+            self.assertTrue(image_cache.contains(local_dir))
+            self.assertEqual(sorted(p.name for p in local_dir.iterdir()), sorted(p.name for p in plate_dir.iterdir()))
+
+            # A rerun, even from a new process, counts the cached copy without copying
+            self.assertEqual(self.new_cache().stage(plate_dir), local_dir)
+            self.assertEqual(copy.call_count, 4)
+
+            # A re-exported well is copied again; a deleted one disappears from the copy
+            changed = plate_dir / 'B2_-1_1_1_Stitched[DAPI 377,447]_001.tif'
+            changed.write_bytes(b'y' * 250)
+            os.utime(changed, ns=(changed.stat().st_atime_ns, changed.stat().st_mtime_ns + 10 ** 9))
+            (plate_dir / 'C3_-1_1_1_Stitched[DAPI 377,447]_001.tif').unlink()
+            self.assertEqual(image_cache.stage(plate_dir), local_dir)
+            self.assertEqual(copy.call_count, 5)
+        self.assertEqual((local_dir / changed.name).read_bytes(), b'y' * 250)
+        self.assertEqual(len(list(local_dir.iterdir())), 3)
+        self.assertEqual(image_cache.usage(), 750)
+
+    def test_evicts_least_recently_used(self):
+        plates = [self.make_plate(f'plate{i}') for i in range(4)]
+        image_cache = self.new_cache(plates=2)
+        image_cache.stage(plates[0])
+        image_cache.stage(plates[1])
+        self.set_last_used(image_cache, plates[0], 1000)
+        self.set_last_used(image_cache, plates[1], 2000)
+        image_cache.stage(plates[0])  # reused, so plate1 is now least recently used
+
+        image_cache.stage(plates[2])
+        cached = {manifest['source'] for manifest in map(image_cache._read_manifest,
+                                                         (f.stem for f in self.cache_dir.glob('*.json')))}
+        self.assertEqual(cached, {str(plates[0]), str(plates[2])})
+        self.assertLessEqual(image_cache.usage(), image_cache.max_bytes)
+
+        # A plate being counted elsewhere is never evicted, even if least recently used
+        other_process = self.new_cache(plates=2)
+        with other_process.staged(plates[2]):
+            self.set_last_used(image_cache, plates[2], 1000)
+            self.set_last_used(image_cache, plates[0], 2000)
+            image_cache.stage(plates[3])
+            self.assertIsNotNone(image_cache._read_manifest(image_cache.key(plates[2])))
+            self.assertIsNone(image_cache._read_manifest(image_cache.key(plates[0])))
+        self.assertEqual(list(self.cache_dir.glob('*.use-*')), [])
+
+    def test_plate_too_big(self):
+        plate_dir = self.make_plate('plate1')
+        image_cache = self.new_cache(plates=0.5)
+        with image_cache.staged(plate_dir) as local_dir:
+            self.assertIsNone(local_dir)
+        self.assertEqual(image_cache.usage(), 0)
+        self.assertFalse((self.cache_dir / image_cache.key(plate_dir)).exists())
+
+    def test_prefetch(self):
+        plates = [self.make_plate(f'plate{i}') for i in range(3)]
+        image_cache = self.new_cache()
+        with patch.object(cache.ImageCache, '_copy', wraps=cache.ImageCache._copy) as copy:
+            image_cache.prefetch(plates + plates[:1])  # queued once each
+            for plate_dir in plates:
+                with image_cache.staged(plate_dir) as local_dir:
+                    self.assertEqual(len(list(local_dir.iterdir())), 4)
+            self.assertEqual(copy.call_count, 12)
+        self.assertEqual(image_cache._pins, {})
+        self.assertEqual(list(self.cache_dir.glob('*.use-*')), [])
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a script with a shebang')
+    def test_count_from_cache(self):
+        scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01)
+        fake_cp = self.tmp / 'fake_cellprofiler'
+        fake_cp.write_text(FAKE_CELLPROFILER.format(python=sys.executable))
+        fake_cp.chmod(0o755)
+        plate_dir = self.share / 'plate1'
+        plate_dir.mkdir(parents=True)
+        for well, value in {'B2': 120, 'B3': 80, 'C2': 100}.items():
+            Image.fromarray(np.full((8, 8), value, dtype=np.uint16)).save(
+                plate_dir / f'{well}_-1_1_1_Stitched[DAPI 377,447]_001.tif')
+
+        image_cache = cache.configure(cache_dir=self.cache_dir)
+        with patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(fake_cp)), \
+                patch.object(cache.ImageCache, 'stage', wraps=image_cache.stage) as stage:
+            result = simple_analysis.run_simple('exp', str(plate_dir), output_dir=str(self.tmp / 'out'))
+        self.assertEqual(result.count_matrix.loc['B', '2'], 120)
+        stage.assert_called_once()
+        self.assertEqual(image_cache.usage(), sum(p.stat().st_size for p in plate_dir.iterdir()))
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
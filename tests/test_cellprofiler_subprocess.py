@@ -1,11 +1,14 @@
 """
 Test CellProfiler subprocess calls without actually running CellProfiler.
 
-This test verifies that the subprocess.run call is made with the correct
+This test verifies that the CellProfiler process is started with the correct
 command structure when running CellProfiler headless mode.
 """
 
+import os
 import sys
+import tempfile
+import threading
 import unittest
 from pathlib import Path
 from unittest.mock import Mock, patch, MagicMock
@@ -13,12 +16,14 @@ from unittest.mock import Mock, patch, MagicMock
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
 
+from cellpyability.accounting import ProcessUsage
+
 
 class TestCellProfilerSubprocess(unittest.TestCase):
     """Test that CellProfiler subprocess calls are structured correctly."""
     
     @patch('cellpyability.toolbox._ensure_cellprofiler_path')
-    @patch('cellpyability.toolbox.subprocess.run')
+    @patch('cellpyability.toolbox.accounting.run_accounted')
     @patch('cellpyability.toolbox.pd.read_csv')
     @patch('cellpyability.toolbox.exit')  # Prevent exit() from terminating the test
     def test_cellprofiler_subprocess_command_structure(self, mock_exit, mock_read_csv, mock_subprocess_run, mock_cp_path):
@@ -30,7 +35,7 @@ class TestCellProfilerSubprocess(unittest.TestCase):
         """
         # Setup mocks
         mock_cp_path.return_value = '/usr/bin/cellprofiler'
-        mock_subprocess_run.return_value = Mock(returncode=0)
+        mock_subprocess_run.return_value = ProcessUsage(returncode=0, wall_seconds=0.0)
         mock_read_csv.return_value = MagicMock()
         
         # Import toolbox after patching
@@ -54,10 +59,10 @@ class TestCellProfilerSubprocess(unittest.TestCase):
                 # Call run_cellprofiler
                 tb.run_cellprofiler(str(image_dir))
             
-            # Verify subprocess.run was called
-            self.assertTrue(mock_subprocess_run.called, "subprocess.run was not called")
+            # Verify CellProfiler was started
+            self.assertTrue(mock_subprocess_run.called, "CellProfiler was not started")
             
-            # Get the command that was passed to subprocess.run
+            # Get the command that CellProfiler was started with
             call_args = mock_subprocess_run.call_args
             command_list = call_args[0][0]
             
@@ -98,7 +103,7 @@ class TestCellProfilerSubprocess(unittest.TestCase):
             print(f"\n All required flags present in correct order")
     
     @patch('cellpyability.toolbox._ensure_cellprofiler_path')
-    @patch('cellpyability.toolbox.subprocess.run')
+    @patch('cellpyability.toolbox.accounting.run_accounted')
     @patch('cellpyability.toolbox.pd.read_csv')
     @patch('cellpyability.toolbox.exit')  # Prevent exit() from terminating the test
     def test_cellprofiler_has_required_flags(self, mock_exit, mock_read_csv, mock_subprocess_run, mock_cp_path):
@@ -109,7 +114,7 @@ class TestCellProfilerSubprocess(unittest.TestCase):
         """
         # Setup mocks
         mock_cp_path.return_value = '/bin/cellprofiler'
-        mock_subprocess_run.return_value = Mock(returncode=0)
+        mock_subprocess_run.return_value = ProcessUsage(returncode=0, wall_seconds=0.0)
         mock_read_csv.return_value = MagicMock()
         
         import cellpyability.toolbox as tb
@@ -140,6 +145,56 @@ class TestCellProfilerSubprocess(unittest.TestCase):
             print(f"\n All CellProfiler flags verified: -c, -r, -p, -i, -o")
 
 
+@unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a shell script')
+class TestConcurrentRuns(unittest.TestCase):
+    """Test that concurrent runs sharing one output directory keep their own counts."""
+
+    def setUp(self):
+        from cellpyability import scheduler
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01, max_processes=2)
+
+        # Stand-in CellProfiler: copy the counts.csv of the image directory ($6) to the output directory ($8)
+        self.fake_cp = self.tmp / 'fake_cellprofiler'
+        self.fake_cp.write_text('#!/bin/sh\nsleep 0.2\ncp "$6/counts.csv" "$8/CellPyAbilityImage.csv"\n')
+        self.fake_cp.chmod(0o755)
+
+    def tearDown(self):
+        from cellpyability import scheduler
+        scheduler._scheduler = None
+        self.tmpdir.cleanup()
+
+    def test_runs_do_not_share_counts(self):
+        from cellpyability import simple_analysis
+        data_dir = Path(__file__).parent / 'data'
+        output_dir = self.tmp / 'out'
+        # Two plates with different counts
+        import pandas as pd
+        df_counts = pd.read_csv(data_dir / 'test_gda_counts.csv')
+        plates = {}
+        for title, factor in [('plate1', 1), ('plate2', 2)]:
+            (self.tmp / title).mkdir()
+            plates[title] = self.tmp / title / 'counts.csv'
+            df_counts.assign(Count_nuclei=df_counts['Count_nuclei'] * factor).to_csv(plates[title], index=False)
+
+        with patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(self.fake_cp)):
+            threads = [threading.Thread(target=simple_analysis.run_simple,
+                                        args=(title, str(self.tmp / title)), kwargs={'output_dir': str(output_dir)})
+                       for title in plates]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for title, counts in plates.items():
+            raw = output_dir / 'simple_output' / f'{title}_simple_raw_counts.csv'
+            self.assertEqual(raw.read_bytes(), counts.read_bytes())
+        # Scratch directories are removed and no temporary files are left behind
+        self.assertEqual(list((output_dir / 'cp_output').iterdir()), [])
+        self.assertEqual([p.name for p in (output_dir / 'simple_output').iterdir() if p.name.startswith('.')], [])
+
+
 def main():
     """Run the tests."""
     unittest.main(verbosity=2)
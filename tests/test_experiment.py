@@ -0,0 +1,98 @@
+"""
+Test the lazy Experiment API: results are computed in memory and nothing is written
+until save() is called.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import gda_analysis, synergy_analysis, simple_analysis
+from cellpyability.experiment import Experiment
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class TestExperiment(unittest.TestCase):
+    """Test in-memory results against the expected output files."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmpdir.name) / 'out'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_gda_in_memory(self):
+        experiment = gda_analysis.GDAExperiment(
+            'test', 'Cell Line A', 'Cell Line B', 0.000001, 3,
+            counts=pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv'), output_dir=str(self.output_dir)
+        )
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_gda_Stats.csv', index_col=0)
+        stats = experiment.stats.astype(float)
+        stats.columns = stats.columns.astype(int)
+        expected.columns = expected.columns.astype(int)
+        pd.testing.assert_frame_equal(stats, expected, check_exact=False, rtol=1e-6)
+
+        result = experiment.result
+        self.assertEqual(result.count_matrix.shape, (6, 10))
+        self.assertEqual(result.viability_matrix.shape, (6, 10))
+        self.assertIn(result.fits['Cell Line A'].model, ('5PL', 'Hill', 'none'))
+        self.assertEqual(result.ic50['Cell Line A'], result.fits['Cell Line A'].ic50)
+        self.assertEqual(result.doses[0], 0)
+
+        # Stages are cached and nothing has been written
+        self.assertIs(experiment.stats, experiment.stats)
+        self.assertFalse(self.output_dir.exists())
+
+    def test_synergy_in_memory(self):
+        experiment = synergy_analysis.SynergyExperiment(
+            'test', 'Drug X', 0.0004, 4, 'Drug Y', 0.0001, 4,
+            counts_file=str(TEST_DATA_DIR / 'test_synergy_counts.csv'), output_dir=str(self.output_dir)
+        )
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_synergy_BlissMatrix.csv', index_col=0)
+        np.testing.assert_allclose(experiment.bliss_matrix.values, expected.values, rtol=1e-6)
+        self.assertEqual(experiment.bliss_matrix.index.name, 'Drug Y (M)')
+        self.assertFalse(self.output_dir.exists())
+
+    def test_save_without_plot(self):
+        experiment = simple_analysis.SimpleExperiment(
+            'test', counts=pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv'), output_dir=str(self.output_dir)
+        )
+        stages = []
+        result = experiment.save(stage_callback=lambda stage, path: stages.append(stage))
+
+        self.assertEqual(stages, ['counted', 'stats'])
+        expected = pd.read_csv(TEST_DATA_DIR / 'test_simple_CountMatrix.csv', index_col=0)
+        np.testing.assert_array_equal(result.count_matrix.values, expected.values)
+        self.assertTrue((self.output_dir / 'simple_output' / 'test_simple_raw_counts.csv').exists())
+
+        gda = gda_analysis.GDAExperiment('test', 'A', 'B', 0.000001, 3,
+                                         counts=experiment.counts, output_dir=str(self.output_dir))
+        gda.save(plot=False)
+        self.assertTrue((self.output_dir / 'gda_output' / 'test_gda_Stats.csv').exists())
+        self.assertFalse((self.output_dir / 'gda_output' / 'test_gda_plot.png').exists())
+
+    def test_subclass_must_implement_save(self):
+        class Unsaved(Experiment):
+            module = 'unsaved'
+
+        # Fails on construction, before any plate is counted
+        with self.assertRaises(TypeError):
+            Unsaved('test', counts=pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv'))
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Test reading whole-plate TIFF, OME-TIFF and OME-Zarr containers and image archives and counting them in chunks.
+"""
+
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+import zlib
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import accounting, ingest, scheduler
+from cellpyability import toolbox as tb
+
+# Stand-in for CellProfiler: "counts" each image as the value of its first pixel
+FAKE_CELLPROFILER = '''#!{python}
+import csv, sys
+from pathlib import Path
+import numpy as np
+from PIL import Image
+image_dir, output_dir = Path(sys.argv[6]), Path(sys.argv[8])
+with open(output_dir / 'CellPyAbilityImage.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Count_nuclei', 'FileName_images', 'ImageNumber'])
+    for number, image in enumerate(sorted(image_dir.rglob('*.tif')), start=1):
+        writer.writerow([float(np.array(Image.open(image))[0, 0]), image.name, number])
+'''
+
+
+def write_stack(path, values, description=None):
+    """Write a multi-page 16-bit TIFF whose pages are filled with values."""
+    pages = [Image.fromarray(np.full((16, 16), value, dtype=np.uint16)) for value in values]
+    info = {270: description} if description else {}
+    pages[0].save(path, save_all=True, append_images=pages[1:], tiffinfo=info)
+
+
+def ome_xml(plates, fields, channels):
+    """OME-XML for plates of (row, column) wells with fields per well, each image with channels planes."""
+    images, plate_elements, image_id = [], [], 0
+    for plate_wells in plates:
+        wells = []
+        for row, column in plate_wells:
+            samples = []
+            for _ in range(fields):
+                images.append(f'<Image ID="Image:{image_id}"><Pixels DimensionOrder="XYCZT" SizeC="{channels}" '
+                              f'SizeZ="1" SizeT="1"><TiffData IFD="{image_id * channels}" '
+                              f'PlaneCount="{channels}"/></Pixels></Image>')
+                samples.append(f'<WellSample><ImageRef ID="Image:{image_id}"/></WellSample>')
+                image_id += 1
+            wells.append(f'<Well Row="{row}" Column="{column}">{"".join(samples)}</Well>')
+        plate_elements.append(f'<Plate>{"".join(wells)}</Plate>')
+    return ('<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">'
+            + ''.join(plate_elements) + ''.join(images) + '</OME>')
+
+
+class TestIngest(unittest.TestCase):
+    """Test the plate container readers and chunked counting."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        scheduler._scheduler = None
+        self.tmpdir.cleanup()
+
+    def test_plain_stack_page_order(self):
+        stack = self.tmp / 'plate.tif'
+        write_stack(stack, range(60))
+        self.assertTrue(ingest.is_plate_container(stack))
+        self.assertFalse(ingest.is_plate_container(self.tmp))
+
+        plate = ingest.open_plate(stack)
+        self.assertEqual(list(plate.fields)[:2], ['B2', 'B3'])
+        self.assertEqual(plate.fields['G11'], [59])
+        self.assertEqual(plate.read('C2')[0, 0], 10)
+        plate.close()
+
+        write_stack(stack, range(7))
+        with self.assertRaises(ValueError):
+            ingest.open_plate(stack)
+
+    def test_ome_tiff_wells_and_fields(self):
+        stack = self.tmp / 'plate.ome.tif'
+        # Two channels per image; the nuclei channel (0) is every other page
+        write_stack(stack, range(8), ome_xml([[(1, 1), (1, 2)]], fields=2, channels=2))
+        plate = ingest.open_plate(stack)
+        self.assertEqual(plate.fields, {'B2': [0, 2], 'B3': [4, 6]})
+        self.assertEqual(plate.read('B3', field=1)[0, 0], 6)
+        plate.close()
+
+    def test_ome_zarr_chunked_read(self):
+        root = self.tmp / 'plate.zarr'
+        data = np.arange(2 * 10 * 12, dtype=np.uint16).reshape(1, 2, 1, 10, 12)
+        (root / 'B' / '2' / '0' / '0').mkdir(parents=True)
+        (root / '.zattrs').write_text(json.dumps({'plate': {
+            'rows': [{'name': 'A'}, {'name': 'B'}], 'columns': [{'name': '1'}, {'name': '2'}],
+            'wells': [{'path': 'B/2', 'rowIndex': 1, 'columnIndex': 1}]}}))
+        (root / 'B' / '2' / '.zattrs').write_text(json.dumps({'well': {'images': [{'path': '0'}]}}))
+        (root / 'B' / '2' / '0' / '.zattrs').write_text(json.dumps({'multiscales': [{
+            'axes': [{'name': axis} for axis in 'tczyx'], 'datasets': [{'path': '0'}]}]}))
+        array_dir = root / 'B' / '2' / '0' / '0'
+        chunks = (1, 1, 1, 4, 5)
+        (array_dir / '.zarray').write_text(json.dumps({
+            'zarr_format': 2, 'shape': data.shape, 'chunks': chunks, 'dtype': '<u2', 'order': 'C',
+            'compressor': {'id': 'zlib', 'level': 1}, 'fill_value': 0, 'filters': None}))
+        for index in np.ndindex(*(-(-s // c) for s, c in zip(data.shape, chunks))):
+            block = np.zeros(chunks, dtype=np.uint16)
+            part = data[tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, chunks))]
+            block[tuple(slice(0, s) for s in part.shape)] = part
+            (array_dir / '.'.join(map(str, index))).write_bytes(zlib.compress(block.tobytes()))
+
+        self.assertTrue(ingest.is_plate_container(root))
+        plate = ingest.open_plate(root)
+        self.assertEqual(list(plate.fields), ['B2'])
+        np.testing.assert_array_equal(plate.read('B2'), data[0, 0, 0])
+        plate.channel = 1
+        np.testing.assert_array_equal(plate.read('B2'), data[0, 1, 0])
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a script with a shebang')
+    def test_count_plate_in_chunks(self):
+        scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01)
+        fake_cp = self.tmp / 'fake_cellprofiler'
+        fake_cp.write_text(FAKE_CELLPROFILER.format(python=sys.executable))
+        fake_cp.chmod(0o755)
+
+        # Two replicate plates of wells B2 and B3 with two fields each; page values are the "counts"
+        stack = self.tmp / 'plates.ome.tif'
+        write_stack(stack, [10, 1, 20, 2, 30, 3, 40, 4], ome_xml([[(1, 1), (1, 2)]] * 2, fields=2, channels=1))
+        output_dir = self.tmp / 'out'
+
+        with patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(fake_cp)):
+            df_cp, cp_csv = tb.run_cellprofiler(str(stack), output_dir=str(output_dir))
+
+        self.assertEqual(list(df_cp['FileName_images']), ['B2.tif', 'B3.tif', 'B2.tif', 'B3.tif'])
+        self.assertEqual(list(df_cp['Count_nuclei']), [11, 22, 33, 44])
+        self.assertEqual(list(df_cp['ImageNumber']), [1, 2, 3, 4])
+        self.assertEqual(df_cp['FileName_images'].map(tb.rename_wells).tolist(), ['B2', 'B3', 'B2', 'B3'])
+
+        # Four wells in chunks of 12 is one CellProfiler run; chunks of 3 wells are two
+        self.assertTrue(cp_csv.exists())
+        with patch.dict(os.environ, {'CELLPYABILITY_INGEST_CHUNK_WELLS': '3'}), \
+                patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(fake_cp)):
+            df_chunked, _ = tb.run_cellprofiler(str(stack), output_dir=str(output_dir))
+        self.assertEqual(list(df_chunked['Count_nuclei']), [11, 22, 33, 44])
+
+        runs = accounting.read_runs([output_dir])
+        self.assertEqual(list(runs['n_images']), [8, 6, 2])
+        # Only the scratch directories holding the two combined counts files are left
+        self.assertEqual(len(list((output_dir / 'cp_output').glob(f'{tb.SCRATCH_PREFIX}*'))), 2)
+
+    @unittest.skipUnless(os.name == 'posix', 'stand-in CellProfiler is a script with a shebang')
+    def test_count_archives(self):
+        scheduler.configure(slot_dir=self.tmp / 'slots', poll_interval=0.01)
+        fake_cp = self.tmp / 'fake_cellprofiler'
+        fake_cp.write_text(FAKE_CELLPROFILER.format(python=sys.executable))
+        fake_cp.chmod(0o755)
+
+        # Two replicate plates in subdirectories, plus members that are not plate well images
+        members = {f'plate_{rep}/{well}_-1_1_1_Stitched[DAPI 377,447]_001.tif': 10 * rep + i
+                   for rep in (1, 2) for i, well in enumerate(['B2', 'B3', 'G11'])}
+        source = self.tmp / 'source'
+        for name, value in members.items():
+            (source / name).parent.mkdir(parents=True, exist_ok=True)
+            Image.fromarray(np.full((8, 8), value, dtype=np.uint16)).save(source / name)
+        (source / 'plate_1' / 'A1_overview.tif').write_bytes((source / list(members)[0]).read_bytes())
+        (source / 'plate_1' / '._B2_resource.tif').write_bytes(b'AppleDouble')
+        (source / 'notes.txt').write_text('B2 looked dim')
+
+        zip_path = self.tmp / 'plates.zip'
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            for path in sorted(source.rglob('*')):
+                archive.write(path, path.relative_to(source).as_posix())
+        tar_path = self.tmp / 'plates.tar.gz'
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            archive.add(source, arcname='.')
+
+        expected = [value for name, value in sorted(members.items())]
+        for path in (zip_path, tar_path):
+            output_dir = self.tmp / f'out_{path.name}'
+            with patch.dict(os.environ, {'CELLPYABILITY_INGEST_CHUNK_WELLS': '4'}), \
+                    patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value=str(fake_cp)):
+                df_cp, _ = tb.run_cellprofiler(str(path), output_dir=str(output_dir))
+            self.assertEqual(sorted(df_cp['Count_nuclei']), sorted(expected))
+            self.assertEqual(sorted(df_cp['FileName_images'].map(tb.rename_wells)), ['B2', 'B2', 'B3', 'B3', 'G11', 'G11'])
+            self.assertEqual(list(df_cp['ImageNumber']), list(range(1, 7)))
+            # Only the six well images were extracted, four and then two at a time
+            self.assertEqual(list(accounting.read_runs([output_dir])['n_images']), [4, 2])
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Test the kinetic time-series mode: GR values, incremental timepoints and reloading a series.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import kinetic
+from cellpyability import toolbox as tb
+
+# Growth rate of columns 2-11 relative to the vehicle: untreated, slowed, cytostatic, killed
+RATES = np.array([1.0, 1.0, 0.95, 0.9, 0.75, 0.5, 0.25, 0.0, -0.25, -0.5])
+DOUBLING_TIME = 24.0
+
+
+def counts_at(time_h, seeding):
+    """CellProfiler-style counts of a plate whose wells grow at RATES from their seeding counts."""
+    rows = [(f'{row}{column}', seeding[i, j] * 2 ** (RATES[j] * time_h / DOUBLING_TIME))
+            for i, row in enumerate('BCDEFG') for j, column in enumerate(range(2, 12))]
+    return pd.DataFrame({
+        'Count_nuclei': [count for _, count in rows],
+        'FileName_images': [f'{well}_-1_1_1_Stitched[DAPI 377,447]_001.tif' for well, _ in rows],
+        'ImageNumber': range(1, len(rows) + 1),
+    })
+
+
+class TestKineticSeries(unittest.TestCase):
+    """Test GR metrics and incremental updates of a kinetic series."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_dir = str(Path(self.tmpdir.name) / 'out')
+        # Uneven seeding: GR is relative to each well's own first count, so it does not matter
+        self.seeding = np.random.default_rng(0).uniform(800, 1200, (6, 10))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def series(self):
+        return kinetic.KineticSeries('live', 'WT', 'KO', 1e-6, 3, output_dir=self.output_dir)
+
+    def test_gr_values(self):
+        series = self.series()
+        for time_h in (0, 24, 48):
+            series.add_timepoint(time_h, counts=counts_at(time_h, self.seeding))
+
+        df_gr = series.gr[(series.gr['Time (h)'] == 48) & (series.gr['Condition'] == 'WT')]
+        np.testing.assert_allclose(df_gr['GR'], 2 ** RATES - 1, atol=1e-9)
+        self.assertTrue(series.gr.loc[series.gr['Time (h)'] == 0, 'GR'].isna().all())
+
+        metrics = series.metrics.set_index(['Time (h)', 'Condition'])
+        self.assertAlmostEqual(metrics.loc[(48, 'KO'), 'Vehicle Doublings'], 2.0)
+        self.assertAlmostEqual(metrics.loc[(48, 'KO'), 'GRmax'], 2 ** -0.5 - 1)
+        # GR = 0.5 lies between the columns growing at 0.75 and 0.5 of the vehicle rate
+        self.assertTrue(series.doses[4] < metrics.loc[(48, 'WT'), 'GR50'] < series.doses[5])
+
+    def test_incremental_and_reload(self):
+        series = self.series()
+        for time_h in (0, 24):
+            series.add_timepoint(time_h, counts=counts_at(time_h, self.seeding))
+        series.save(plot=False)
+        metrics_24 = series.metrics[series.metrics['Time (h)'] == 24].reset_index(drop=True)
+
+        # A new process picks the series up from disk and fits only the new timepoint
+        series = self.series()
+        np.testing.assert_array_equal(series.times, [0, 24])
+        with patch.object(tb, 'fit_dose_response', wraps=tb.fit_dose_response) as fit:
+            series.add_timepoint(48, counts=counts_at(48, self.seeding))
+        self.assertEqual(fit.call_count, 4)  # IC50 and GR50 of two conditions
+        pd.testing.assert_frame_equal(series.metrics[series.metrics['Time (h)'] == 24].reset_index(drop=True),
+                                      metrics_24, check_dtype=False)
+
+        series.save()
+        series_dir = Path(self.output_dir) / 'kinetic_output' / 'live'
+        for suffix in ('_counts.csv', '_GR.csv', '_metrics.csv', '_plot.png'):
+            self.assertTrue((series_dir / f'live_kinetic{suffix}').exists())
+        self.assertEqual(len(pd.read_csv(series_dir / 'live_kinetic_counts.csv')), 3)
+
+        # A series can't be continued with a different plate layout
+        with self.assertRaises(ValueError):
+            kinetic.KineticSeries('live', 'WT', 'KO', 1e-5, 3, output_dir=self.output_dir)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
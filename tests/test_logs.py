@@ -0,0 +1,123 @@
+"""
+Test queued logging: per-run log files, experiment IDs, JSON format and batch worker logs.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import batch, logs, synthetic
+from cellpyability import toolbox as tb
+
+
+def log_in_worker(log_file, message):
+    """Log a record in a worker process; return whether the worker opened the shared log."""
+    with logs.run_log('worker-run', log_file):
+        tb.logger.info(message)
+    logs.flush()
+    return logs._state['file_handler'] is not None
+
+
+class TestRunLogs(unittest.TestCase):
+    """Test that concurrent runs each get a complete log file of their own records."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Test runners that configure logging themselves keep toolbox from setting up file logging
+        if not logs.configured():
+            logs.setup(tb.logger, Path(tempfile.gettempdir()) / 'cellpyability_test.log')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        logs.set_format('text')
+        self.tmpdir.cleanup()
+
+    def test_concurrent_run_logs(self):
+        def run(experiment_id):
+            with logs.run_log(experiment_id, self.tmp_path / f'{experiment_id}.log'):
+                for i in range(200):
+                    tb.logger.debug(f'{experiment_id} message {i}')
+
+        threads = [threading.Thread(target=run, args=(f'exp{n}',)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tb.logger.info('outside any run')
+        logs.flush()
+
+        for n in range(4):
+            lines = (self.tmp_path / f'exp{n}.log').read_text().splitlines()
+            self.assertEqual(len(lines), 200)
+            self.assertTrue(all(f'exp{n} message' in line for line in lines))
+            self.assertTrue(lines[-1].endswith(f'exp{n} message 199'))
+
+    def test_json_format(self):
+        logs.set_format('json')
+        with logs.run_log('plate-7', self.tmp_path / 'plate-7.log'):
+            tb.logger.info('counting')
+            try:
+                raise ValueError('bad plate')
+            except ValueError:
+                tb.logger.exception('failed')
+
+        entries = [json.loads(line) for line in (self.tmp_path / 'plate-7.log').read_text().splitlines()]
+        self.assertEqual([entry['message'] for entry in entries], ['counting', 'failed'])
+        self.assertEqual({entry['experiment'] for entry in entries}, {'plate-7'})
+        self.assertIn('ValueError: bad plate', entries[1]['exception'])
+        with self.assertRaises(ValueError):
+            logs.set_format('xml')
+
+    def test_batch_worker_logs(self):
+        synthetic.generate_plates(self.tmp_path / 'plates', n_plates=3, module='simple')
+        df_summary = batch.run_batch(self.tmp_path / 'plates' / 'config.csv', jobs=2, output_dir=self.tmp_path / 'out')
+        self.assertTrue((df_summary['status'] == 'success').all())
+        for title in df_summary['title']:
+            text = (self.tmp_path / 'out' / title / f'{title}.log').read_text()
+            self.assertIn(f'Processing: {title}', text)
+            self.assertIn(f'{title} finished', text)
+            others = set(df_summary['title']) - {title}
+            self.assertFalse(any(other in text for other in others))
+
+    def test_workers_log_through_main_process(self):
+        logs.set_format('json')
+        message = f'logged by worker of {self.tmp_path.name}'  # the shared log outlives the test
+        with ProcessPoolExecutor(max_workers=1, initializer=logs.attach,
+                                 initargs=(logs.worker_options(),)) as executor:
+            opened_shared_log = executor.submit(log_in_worker, self.tmp_path / 'worker-run.log', message).result()
+        self.assertFalse(opened_shared_log)
+
+        # The worker writes its run log in the main process's format...
+        entry = json.loads((self.tmp_path / 'worker-run.log').read_text())
+        self.assertEqual((entry['experiment'], entry['message']), ('worker-run', message))
+        self.assertNotEqual(entry['process'], os.getpid())
+
+        # ...and the main process copies its records to the shared log
+        shared_log = Path(logs._state['file_handler'].baseFilename)
+        deadline = time.monotonic() + 10
+        while message not in shared_log.read_text() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        worker_lines = [line for line in shared_log.read_text().splitlines() if message in line]
+        self.assertEqual(len(worker_lines), 1)
+        self.assertEqual(json.loads(worker_lines[0])['experiment'], 'worker-run')
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
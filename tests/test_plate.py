@@ -0,0 +1,136 @@
+"""
+Test the plate array: well parsing, replicate stacking, layout indexing and NaN-aware stats.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import plate
+from cellpyability import toolbox as tb
+from cellpyability.experiment import combine_plate_counts
+from cellpyability.gda_analysis import GDAExperiment
+from cellpyability.synergy_analysis import SynergyExperiment
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class TestPlate(unittest.TestCase):
+    """Test Plate against the pandas pivot/groupby results it replaces."""
+
+    def test_parse_wells_matches_rename_wells(self):
+        names = pd.Series(['B02_-1_1_1_Stitched.tif', 'g11.tif', 'H12_x.tif', 'overview.tif', 'B13.tif'])
+        rows, columns = plate.parse_wells(names)
+        self.assertEqual(rows.tolist(), [1, 6, 7, -1, -1])
+        self.assertEqual(columns.tolist(), [1, 10, 11, -1, -1])
+        self.assertEqual([tb.rename_wells(name) for name in names[:3]],
+                         [plate.ROWS[r] + plate.COLUMNS[c] for r, c in zip(rows[:3], columns[:3])])
+
+    def test_replicates_in_order_of_occurrence(self):
+        df_cp = pd.DataFrame({
+            'Count_nuclei': [10.0, 20.0, 12.0, 22.0, 14.0],
+            'FileName_images': ['B2.tif', 'B3.tif', 'B2.tif', 'B3.tif', 'B2.tif'],
+            'ImageNumber': range(1, 6),
+        })
+        counts = plate.Plate.from_counts(df_cp)
+        self.assertEqual(counts.counts.shape, (3, 8, 12))
+        np.testing.assert_array_equal(counts.values(['B'], ['2', '3'])[:, 0], [[10, 20], [12, 22], [14, np.nan]])
+        np.testing.assert_allclose(counts.mean(['B'], ['2', '3']), [[12, 21]])
+        np.testing.assert_allclose(counts.std(['B'], ['2', '3']), [[2, np.std([20, 22], ddof=1)]])
+        self.assertEqual(counts.counted(['B', 'C'], ['2']).tolist(), [[True], [False]])
+        # A well with no counts has a NaN mean and SD, without warnings
+        self.assertTrue(np.isnan(counts.mean(['C'], ['2'])).all())
+
+    def test_matches_pandas_on_synergy_counts(self):
+        df_cp = pd.read_csv(TEST_DATA_DIR / 'test_synergy_counts.csv')
+        experiment = SynergyExperiment('test', 'X', 1e-4, 4, 'Y', 1e-4, 4, counts=df_cp)
+        # The per-image table the pandas implementation built with tb.rename_wells
+        df_wells = pd.DataFrame({'nuclei': df_cp['Count_nuclei'], 'well': df_cp['FileName_images'].map(tb.rename_wells)})
+        df_wells['Row'], df_wells['Column'] = df_wells['well'].str[0], df_wells['well'].str[1:]
+        expected = df_wells.groupby('well')['nuclei'].agg(['mean', 'std'])
+
+        stats = experiment.stats.set_index('Well')
+        self.assertEqual(list(stats.index), sorted(expected.index))
+        np.testing.assert_allclose(stats['Mean'], expected['mean'], rtol=1e-12)
+        np.testing.assert_allclose(stats['Standard Deviation'], expected['std'], rtol=1e-12)
+        pd.testing.assert_frame_equal(
+            experiment.count_matrix,
+            df_wells.pivot_table(index='Row', columns='Column', values='nuclei', aggfunc='mean')
+            .reindex(index=list(plate.LAYOUT_ROWS), columns=list(plate.LAYOUT_COLUMNS)),
+            check_names=False,
+        )
+
+
+class TestReplicatePlates(unittest.TestCase):
+    """Test the plate axis: per-plate counting, normalization and the plate summary."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmpdir.name) / 'out'
+        df_cp = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+        # Three plates of the same layout; the third has twice the cells everywhere but column 2
+        scale = np.where(df_cp['FileName_images'].map(tb.rename_wells).str[1:] == '2', 1.0, 2.0)
+        self.plates = [df_cp, df_cp.assign(Count_nuclei=df_cp['Count_nuclei'] * 1.1),
+                       df_cp.assign(Count_nuclei=df_cp['Count_nuclei'] * scale)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_plate_column(self):
+        counts = combine_plate_counts(self.plates)
+        self.assertEqual(list(counts['Plate'].unique()), [1, 2, 3])
+        stacked = plate.Plate.from_counts(counts)
+        self.assertEqual(stacked.replicates, 3)
+        np.testing.assert_allclose(stacked.counts[1], stacked.counts[0] * 1.1)
+
+    def test_per_plate_normalization(self):
+        counts = combine_plate_counts(self.plates)
+        pooled = GDAExperiment('test', 'A', 'B', 1e-6, 3, counts=counts)
+        per_plate = GDAExperiment('test', 'A', 'B', 1e-6, 3, counts=counts, normalize='plate')
+        self.assertEqual(pooled.viability_matrix.shape, (18, 10))
+        self.assertEqual(pooled.viability_matrix.index[3], 'A plate 2 rep 1')
+
+        # Plates 1 and 2 normalize to the same viability on their own; plate 3 stands out
+        viability = per_plate.normalized
+        np.testing.assert_allclose(viability[1], viability[0])
+        np.testing.assert_allclose(viability[2][..., 1:], 2 * viability[0][..., 1:])
+        self.assertFalse(np.allclose(pooled.normalized[1], pooled.normalized[0]))
+
+        with self.assertRaises(ValueError):
+            GDAExperiment('test', 'A', 'B', 1e-6, 3, counts=counts, normalize='median')
+
+    def test_count_plates_in_parallel(self):
+        counted = []
+
+        def fake_run_cellprofiler(image_dir, counts_file=None, output_dir=None):
+            counted.append(image_dir)
+            return self.plates[int(image_dir[-1]) - 1], None
+
+        experiment = GDAExperiment('test', 'A', 'B', 1e-6, 3, image_dir=['plate1', 'plate2', 'plate3'],
+                                   output_dir=str(self.output_dir))
+        with patch.object(tb, 'run_cellprofiler', side_effect=fake_run_cellprofiler):
+            experiment.save(plot=False)
+        self.assertEqual(sorted(counted), ['plate1', 'plate2', 'plate3'])
+
+        df_plates = pd.read_csv(self.output_dir / 'gda_output' / 'test_gda_plates.csv')
+        self.assertEqual(list(df_plates['Plate']), [1, 2, 3])
+        self.assertGreater(df_plates['Median Log2 Ratio'].iloc[2], 0.5)
+        df_counts = pd.read_csv(self.output_dir / 'gda_output' / 'test_gda_counts.csv')
+        self.assertEqual(len(df_counts), 180)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Test plate QC: vectorized metrics against a per-plate computation, pass/fail and archived count CSVs.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import plate_qc, synthetic
+from cellpyability import toolbox as tb
+from cellpyability.plate import Plate
+from cellpyability.simple_analysis import SimpleExperiment
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+def gda_matrix(rng, noise_cv=0.05, edge_effect=0.0):
+    """Count matrix of a synthetic GDA plate with two Hill curves."""
+    doses = tb.gen_dose_range(1e-6, 3, 9)
+    upper, lower = (synthetic.random_curve(rng, doses, 'Hill') for _ in range(2))
+    df_counts = synthetic.gda_plate(upper, lower, 1e-6, 3, noise_cv=noise_cv, edge_effect=edge_effect, rng=rng)
+    return Plate.frame(Plate.from_counts(df_counts).mean())
+
+
+class TestPlateQC(unittest.TestCase):
+    """Test the metrics, thresholds and inputs of plate QC."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_metrics_match_per_plate_computation(self):
+        matrices = [gda_matrix(self.rng) for _ in range(5)]
+        matrices[0].loc['C', '5'] = np.nan  # a well excluded from counting
+        metrics = plate_qc.plate_metrics(plate_qc.stack_count_matrices(matrices), positive_column=11)
+
+        for i, matrix in enumerate(matrices):
+            conditions = [matrix.loc[['B', 'C', 'D']], matrix.loc[['E', 'F', 'G']]]
+            z_prime = [1 - 3 * (c['2'].std() + c['11'].std()) / abs(c['2'].mean() - c['11'].mean()) for c in conditions]
+            cv = [c['2'].std() / c['2'].mean() for c in conditions]
+            edge = pd.concat([np.log2(matrix.loc['B'] / matrix.loc[['C', 'D']].mean()),
+                              np.log2(matrix.loc['G'] / matrix.loc[['E', 'F']].mean())])
+            replicate_cv = [np.sqrt((c.std() ** 2).mean()) / c['2'].mean() for c in conditions]
+
+            self.assertAlmostEqual(metrics['z_prime'][i], min(z_prime))
+            self.assertAlmostEqual(metrics['vehicle_cv'][i], max(cv))
+            self.assertAlmostEqual(metrics['edge_bias'][i], edge.mean())
+            self.assertAlmostEqual(metrics['replicate_cv'][i], max(replicate_cv))
+
+        # Without a positive control there is no Z'-factor
+        self.assertTrue(np.isnan(plate_qc.plate_metrics(plate_qc.stack_count_matrices(matrices))['z_prime']).all())
+        with self.assertRaises(ValueError):
+            plate_qc.plate_metrics(plate_qc.stack_count_matrices(matrices), positive_column=12)
+
+    def test_pass_fail(self):
+        plates = {'clean': gda_matrix(self.rng), 'noisy': gda_matrix(self.rng, noise_cv=0.4),
+                  'edge': gda_matrix(self.rng, edge_effect=0.4)}
+        df_qc = plate_qc.plate_qc(plates).set_index('Plate')
+
+        self.assertEqual(df_qc['Pass'].to_dict(), {'clean': True, 'noisy': False, 'edge': False})
+        self.assertNotIn("Z' Factor Pass", df_qc)  # no positive control given
+        self.assertTrue(df_qc["Z' Factor"].isna().all())
+        self.assertFalse(df_qc.loc['noisy', 'Vehicle CV Pass'])
+        self.assertTrue(df_qc.loc['edge', 'Vehicle CV Pass'])
+        self.assertFalse(df_qc.loc['edge', 'Edge Bias (log2) Pass'])
+        self.assertLess(df_qc.loc['edge', 'Edge Bias (log2)'], -0.3)
+
+        # The dim outer rows also spread the replicates
+        self.assertFalse(df_qc.loc['edge', 'Replicate CV Pass'])
+
+        # An ignored metric is still reported but no longer decides
+        df_qc = plate_qc.plate_qc(plates, max_edge_bias=None, max_replicate_cv=None).set_index('Plate')
+        self.assertNotIn('Edge Bias (log2) Pass', df_qc)
+        self.assertTrue(df_qc.loc['edge', 'Pass'])
+
+    def test_flat_plates_pass(self):
+        """Plates without a dose response (inactive drug, untreated) pass when their replicates agree."""
+        flat = pd.DataFrame(1000 * (1 + 0.03 * self.rng.standard_normal((6, 10))),
+                            index=list('BCDEFG'), columns=[str(c) for c in range(2, 12)])
+        scattered = flat.copy()
+        scattered.loc[['B', 'E']] *= 0.6  # one replicate row far off in each condition
+        df_qc = plate_qc.plate_qc({'flat': flat, 'scattered': scattered}).set_index('Plate')
+
+        self.assertLess(df_qc.loc['flat', 'Replicate CV'], 0.05)
+        self.assertTrue(df_qc.loc['flat', 'Pass'])
+        self.assertFalse(df_qc.loc['scattered', 'Replicate CV Pass'])
+
+        # Z' of an inactive drug's top dose is meaningless, so it only counts with a real positive control
+        df_qc = plate_qc.plate_qc({'flat': flat}, positive_column=11).set_index('Plate')
+        self.assertFalse(df_qc.loc['flat', "Z' Factor Pass"])
+
+    def test_archived_counts(self):
+        df_gda = pd.read_csv(TEST_DATA_DIR / 'test_gda_counts.csv')
+        (self.tmp / 'gda_output').mkdir()
+        df_gda.to_csv(self.tmp / 'gda_output' / 'plate1_gda_counts.csv', index=False)
+        simple = SimpleExperiment('plate2', counts=df_gda, output_dir=str(self.tmp))
+        simple.save()
+
+        output_file = self.tmp / 'plate_qc.csv'
+        df_qc = plate_qc.run_plate_qc([self.tmp], output_file=output_file)
+        self.assertEqual(list(df_qc['Plate']), ['plate1', 'plate2'])
+        pd.testing.assert_frame_equal(pd.read_csv(output_file), df_qc)
+
+        # Raw counts and the count matrix of the same plate score the same as the in-memory result
+        in_memory = plate_qc.plate_qc([simple.result])
+        self.assertEqual(in_memory['Plate'].iloc[0], 'plate2')
+        metrics = [name for name in plate_qc.METRICS.values() if name != "Z' Factor"]
+        np.testing.assert_allclose(df_qc[metrics].to_numpy(), np.repeat(in_memory[metrics].to_numpy(), 2, axis=0))
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
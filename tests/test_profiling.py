@@ -0,0 +1,100 @@
+"""
+Test stage timing spans and the --profile trace of an analysis run.
+"""
+
+import json
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import matplotlib
+matplotlib.use('Agg')
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import gda_analysis, profiling, synergy_analysis
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class TestProfiling(unittest.TestCase):
+    """Test span nesting, self times and the stages recorded by the analysis modules."""
+
+    def test_nested_spans(self):
+        with profiling.profile('nested') as prof:
+            with profiling.span('outer'):
+                time.sleep(0.02)
+                with profiling.span('inner'):
+                    buffer = bytearray(5 * profiling.MB)
+                    time.sleep(0.02)
+                del buffer
+        spans = {span['name']: span for span in prof.spans}
+        self.assertEqual(spans['inner']['depth'], 1)
+        self.assertGreaterEqual(spans['outer']['duration_s'], spans['inner']['duration_s'])
+        self.assertAlmostEqual(spans['outer']['self_s'], spans['outer']['duration_s'] - spans['inner']['duration_s'], places=5)
+        self.assertGreaterEqual(prof.wall_s, spans['outer']['duration_s'])
+
+    @unittest.skipUnless(profiling._RESET_PEAK, 'per-stage peak memory needs Python 3.9+')
+    def test_peak_memory(self):
+        with profiling.profile('memory') as prof:
+            with profiling.span('outer'):
+                with profiling.span('inner'):
+                    buffer = bytearray(5 * profiling.MB)
+                del buffer
+        spans = {span['name']: span for span in prof.spans}
+        # The inner allocation counts towards the peak of both spans
+        self.assertGreaterEqual(spans['inner']['peak_mb'], 5)
+        self.assertGreaterEqual(spans['outer']['peak_mb'], 5)
+
+    def test_without_peak_reset(self):
+        # Python 3.8 has no tracemalloc.reset_peak: spans are timed, without peak memory
+        with patch.object(profiling, '_RESET_PEAK', False), profiling.profile('timing only') as prof:
+            with profiling.span('stage'):
+                buffer = bytearray(profiling.MB)
+            del buffer
+        self.assertEqual(len(prof.spans), 1)
+        self.assertIsNone(prof.spans[0]['peak_mb'])
+        self.assertIsNone(prof.summary()[0]['peak_mb'])
+
+    def test_inactive_spans_record_nothing(self):
+        @profiling.timed('noop')
+        def add(a, b):
+            return a + b
+
+        self.assertEqual(add(1, 2), 3)
+        with profiling.span('noop'):
+            pass
+        self.assertIsNone(profiling._active)
+
+    def test_analysis_stages(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with profiling.profile('gda and synergy') as prof:
+                gda_analysis.run_gda('profiled', 'Cell Line A', 'Cell Line B', 0.000001, 3, image_dir='/tmp/dummy',
+                                     show_plot=False, counts_file=TEST_DATA_DIR / 'test_gda_counts.csv', output_dir=tmpdir)
+                synergy_analysis.run_synergy('profiled', 'Drug X', 0.0004, 4, 'Drug Y', 0.0001, 4, image_dir='/tmp/dummy',
+                                             show_plot=False, counts_file=TEST_DATA_DIR / 'test_synergy_counts.csv',
+                                             output_dir=tmpdir)
+            trace_path = prof.save(Path(tmpdir) / 'profile.json')
+            trace = json.loads(trace_path.read_text())
+
+        stages = {row['stage']: row for row in trace['stages']}
+        for stage in ('read_counts', 'rename_wells', 'pivot', 'normalize', 'bliss', 'fit', 'write_csv', 'plot_png',
+                      'plot_html', 'write_counts'):
+            self.assertIn(stage, stages)
+        self.assertEqual(stages['fit']['calls'], 2)
+        self.assertEqual(stages['read_counts']['calls'], 2)
+        self.assertLessEqual(sum(row['self_s'] for row in trace['stages']), trace['wall_s'])
+        self.assertIn('Profile: gda and synergy', prof.format_summary())
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Test the image QC prepass: per-well metrics and flags, exclusion of failing wells and plate rejection.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import qc, synthetic
+from cellpyability import toolbox as tb
+
+
+class TestImageQC(unittest.TestCase):
+    """Test scoring, flagging, exclusion and rejection of plates."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        qc._qc = None
+        self.tmpdir.cleanup()
+
+    def write_plate(self, name, good_wells, bad_wells=()):
+        """Write 128 px nuclei images for good wells and blurred, blank or saturated images for bad ones."""
+        plate_dir = self.tmp / name
+        plate_dir.mkdir()
+        for well in good_wells:
+            image = synthetic.render_nuclei_image(int(self.rng.integers(30, 80)), 128, rng=self.rng)
+            Image.fromarray(image).save(plate_dir / synthetic.FILE_NAME.format(well=well))
+        for well, defect in bad_wells:
+            image = synthetic.render_nuclei_image(50, 128, rng=self.rng)
+            if defect == 'out_of_focus':
+                image = gaussian_filter(image.astype(float), 3).astype(np.uint16)
+            elif defect == 'blank':
+                image = self.rng.normal(200, 20, (128, 128)).clip(0).astype(np.uint16)
+            elif defect == 'saturated':
+                image[:40, :40] = 65535
+            Image.fromarray(image).save(plate_dir / synthetic.FILE_NAME.format(well=well))
+        return plate_dir
+
+    def test_flags(self):
+        bad = [('C2', 'out_of_focus'), ('C3', 'blank'), ('C4', 'saturated')]
+        plate_dir = self.write_plate('plate', ['B2', 'B3', 'B4', 'B5', 'B6'], bad)
+        df_qc = qc.ImageQC(mode='flag').score_plate(plate_dir)
+
+        flags = dict(zip(df_qc['well'], df_qc['flags']))
+        self.assertEqual({well: flags[well] for well, _ in bad}, dict(bad))
+        self.assertTrue(all(flags[well] == '' for well in ['B2', 'B3', 'B4', 'B5', 'B6']))
+        self.assertFalse(df_qc['excluded'].any())  # flag mode counts every well
+        self.assertIsNone(qc.ImageQC(mode='flag').verdict(df_qc))
+
+    @patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value='cellprofiler')
+    def test_exclude_failing_wells(self, _):
+        plate_dir = self.write_plate('plate', ['B2', 'B3', 'B4', 'B5'], [('C2', 'blank'), ('C3', 'saturated')])
+        qc.configure(mode='exclude')
+        cp_command, scratch_dir = tb.cellprofiler_command(plate_dir, output_dir=str(self.tmp / 'out'))
+
+        # CellProfiler reads a directory without the saturated image; the blank well is still counted
+        input_dir = Path(cp_command[cp_command.index('-i') + 1])
+        self.assertEqual(input_dir, (scratch_dir / 'qc_input').resolve())
+        self.assertEqual(sorted(tb.rename_wells(path.name) for path in input_dir.iterdir()),
+                         ['B2', 'B3', 'B4', 'B5', 'C2'])
+
+        df_qc = pd.read_csv(self.tmp / 'out' / 'qc' / 'plate_qc.csv')
+        self.assertEqual(df_qc.loc[df_qc['excluded'], 'well'].tolist(), ['C3'])
+        self.assertEqual(df_qc.set_index('well').loc['C2', 'flags'], 'blank')
+
+    def test_killed_wells_are_counted(self):
+        """High-dose columns the drug emptied are flagged blank but neither excluded nor rejected."""
+        killed = [(f'{row}{col}', 'blank') for row in 'BCDEFG' for col in range(6, 12)]
+        plate_dir = self.write_plate('potent', [f'{row}{col}' for row in 'BCDEFG' for col in range(2, 6)], killed)
+        image_qc = qc.ImageQC(mode='exclude')
+        df_qc = image_qc.score_plate(plate_dir)
+
+        self.assertEqual((df_qc['flags'] == 'blank').sum(), len(killed))  # 60% of the plate
+        self.assertFalse(df_qc['excluded'].any())
+        self.assertIsNone(image_qc.verdict(df_qc))
+
+    @patch('cellpyability.toolbox._ensure_cellprofiler_path', return_value='cellprofiler')
+    def test_reject_broken_plate(self, _):
+        plate_dir = self.write_plate('broken', ['B2'], [(f'C{col}', 'saturated') for col in range(2, 6)])
+        qc.configure(mode='flag')
+        with self.assertRaises(SystemExit):
+            tb.cellprofiler_command(plate_dir, output_dir=str(self.tmp / 'out'))
+
+        # A plate with no nuclei at all (e.g., unstained) is rejected too
+        empty_dir = self.write_plate('empty', [], [(f'C{col}', 'blank') for col in range(2, 6)])
+        self.assertEqual(qc.ImageQC().verdict(qc.ImageQC().score_plate(empty_dir)),
+                         'every well is blank (no nuclei above background)')
+        # The rejected run leaves no scratch directory behind
+        self.assertEqual(list((self.tmp / 'out').rglob(f'{tb.SCRATCH_PREFIX}*')), [])
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Test the CellProfiler scheduler without running CellProfiler.
+
+Slots live in a temporary directory so the tests never touch the machine-wide slot directory.
+"""
+
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import scheduler
+
+
+class TestCellProfilerScheduler(unittest.TestCase):
+    """Test slot admission, queuing, stale-slot recovery and process environments."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.slot_dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_scheduler(self, **kwargs):
+        return scheduler.CellProfilerScheduler(slot_dir=self.slot_dir, poll_interval=0.01, **kwargs)
+
+    def test_process_env_limits_threads_and_heap(self):
+        sched = self.make_scheduler(threads_per_process=2, jvm_heap_mb=2048)
+        env = sched.process_env({'JAVA_TOOL_OPTIONS': '-Dfoo=bar'})
+        for name in scheduler.THREAD_ENV_VARS:
+            self.assertEqual(env[name], '2')
+        self.assertEqual(env['JAVA_TOOL_OPTIONS'], '-Dfoo=bar -Xmx2048m')
+
+    def test_cap_queues_extra_runs(self):
+        """With one slot, a second run waits until the first releases it."""
+        sched = self.make_scheduler(max_processes=1)
+        peak = []
+        running = []
+        lock = threading.Lock()
+
+        def run():
+            with sched.slot('plate'):
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.05)
+                with lock:
+                    running.pop()
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(peak), 1)
+        self.assertEqual(sched.busy_slots(), 0)
+
+    def test_low_memory_admits_only_one_run(self):
+        """When memory is short, a run is admitted only if no other slot is busy."""
+        sched = self.make_scheduler(max_processes=4, memory_per_process_mb=4096)
+        with patch('cellpyability.scheduler.available_memory_mb', return_value=1024):
+            first = sched.acquire('first')
+            blocked = threading.Thread(target=sched.acquire, args=('second',), daemon=True)
+            blocked.start()
+            blocked.join(0.1)
+            self.assertTrue(blocked.is_alive())
+            sched.release(first)
+            blocked.join(1)
+            self.assertFalse(blocked.is_alive())
+
+    def test_stale_slot_is_reclaimed(self):
+        sched = self.make_scheduler(max_processes=1)
+        with patch('cellpyability.scheduler._pid_alive', return_value=False):
+            (self.slot_dir / 'slot-0.lock').write_text(f'{scheduler.socket.gethostname()} 999999\n')
+            index = sched.acquire('after crash')
+        self.assertEqual(index, 0)
+        sched.release(index)
+
+    def test_default_slot_dir_is_per_user(self):
+        with patch('cellpyability.scheduler.getpass.getuser', return_value='alice'):
+            self.assertEqual(scheduler.default_slot_dir().name, 'cellpyability_slots-alice')
+
+    def test_unwritable_slot_dir_runs_unscheduled(self):
+        """A slot directory owned by another user does not stop CellProfiler from running."""
+        sched = self.make_scheduler(max_processes=2)
+        with patch('cellpyability.scheduler.os.open', side_effect=PermissionError(13, 'Permission denied')), \
+                self.assertLogs('CellPyAbility', level='WARNING') as logs:
+            with sched.slot('plate') as env:
+                self.assertIn('OMP_NUM_THREADS', env)
+            with sched.slot('plate'):
+                pass
+        self.assertEqual(len(logs.records), 1)  # warned once
+        self.assertIn('not writable', logs.output[0])
+        self.assertEqual(sched.busy_slots(), 0)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Test the compound screen module: plate maps, control normalization and batched curve fits.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import screen, synthetic
+from cellpyability import toolbox as tb
+
+CONCENTRATIONS = tb.gen_dose_range(1e-5, 3, 10)
+
+
+def screen_plate(rng, plate_format, first_compound=0, noise_cv=0.03):
+    """
+    Plate map and counts of a screening plate: vehicle in the first column, positive controls
+    in the last, and compounds at ten concentrations across the rest of each row.
+    """
+    rows, columns = screen.PLATE_FORMATS[plate_format]
+    map_records, count_records, truth = [], [], {}
+    for i, row in enumerate(rows):
+        for j, column in enumerate(columns):
+            well = f'{row}{int(column):02d}'
+            if j == 0:
+                record, viability = (well, 'vehicle', None, None), 1.0
+            elif j == len(columns) - 1:
+                record, viability = (well, 'positive', None, None), 0.0
+            else:
+                index = i * (len(columns) - 2) + j - 1
+                compound = f'CPD{first_compound + index // 10:05d}'
+                if compound not in truth:
+                    truth[compound] = synthetic.random_curve(rng, CONCENTRATIONS, 'Hill')
+                concentration = CONCENTRATIONS[index % 10]
+                record, viability = (well, 'sample', compound, concentration), truth[compound].viability([concentration])[0]
+            map_records.append(record)
+            # 100 nuclei of background that the positive controls subtract
+            count_records.append((100 + 5000 * viability * (1 + noise_cv * rng.standard_normal()), f'{well}_-1_1_1.tif'))
+    df_map = pd.DataFrame(map_records, columns=['Well', 'Role', 'Compound', 'Concentration'])
+    df_cp = pd.DataFrame(count_records, columns=['Count_nuclei', 'FileName_images'])
+    df_cp['ImageNumber'] = np.arange(1, len(df_cp) + 1)
+    return df_map, df_cp, truth
+
+
+class TestBatchedFit(unittest.TestCase):
+    """Test the batched 4-parameter fit against known curves and curve_fit."""
+
+    def test_recovers_ic50(self):
+        rng = np.random.default_rng(0)
+        curves = [synthetic.random_curve(rng, CONCENTRATIONS, 'Hill') for _ in range(200)]
+        doses = np.tile(np.repeat(CONCENTRATIONS, 2), (len(curves), 1))
+        viability = np.array([curve.viability(row) for curve, row in zip(curves, doses)])
+        noisy = viability * (1 + 0.03 * rng.standard_normal(viability.shape))
+
+        exact = screen.fit_curves(doses, viability)
+        self.assertTrue(exact['converged'].all())
+        np.testing.assert_allclose(exact['ic50'], [curve.ic50 for curve in curves], rtol=1e-3)
+        np.testing.assert_allclose(exact['r2'], 1, atol=1e-6)
+
+        # With noise, within the spread of one curve_fit per curve
+        fits = screen.fit_curves(doses, noisy)
+        single = np.array([tb.fit_dose_response(x, y, 'curve').ic50 for x, y in zip(doses[:20], noisy[:20])])
+        np.testing.assert_allclose(fits['ic50'][:20], single, rtol=0.1)
+
+    def test_too_few_points(self):
+        doses = np.array([[1e-7, 1e-6, 1e-5, np.nan], [1e-6, 1e-6, 1e-6, 1e-6], [0, 1e-7, 1e-6, 1e-5]])
+        fits = screen.fit_curves(doses, np.full(doses.shape, 0.5))
+        self.assertTrue(np.isnan(fits['ic50']).all())
+        self.assertFalse(fits['converged'].any())
+
+
+class TestScreen(unittest.TestCase):
+    """Test plate maps, normalization and outputs of ScreenExperiment."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_384_well_screen(self):
+        df_map, df_cp, truth = screen_plate(self.rng, 384)
+        df_map.to_csv(self.tmp / 'map.csv', index=False)
+        df_cp.to_csv(self.tmp / 'counts.csv', index=False)
+
+        result = screen.run_screen('screen', str(self.tmp / 'map.csv'), str(self.tmp), counts_file=str(self.tmp / 'counts.csv'),
+                                   output_dir=str(self.tmp / 'out'))
+        self.assertEqual(result.plate_format, 384)
+        viability = result.viability.groupby('Role')['Viability'].mean()
+        self.assertAlmostEqual(viability['vehicle'], 1.0)
+        self.assertAlmostEqual(viability['positive'], 0.0)
+        self.assertGreater(result.plates["Z' Factor"].iloc[0], 0.5)
+
+        # 352 sample wells: 35 full compounds and one with two concentrations, too few to fit
+        df_ic50 = result.ic50.set_index('Compound')
+        self.assertEqual(len(df_ic50), 36)
+        fitted = df_ic50[df_ic50['Points'] == 10]
+        self.assertTrue(fitted['Converged'].all())
+        expected = fitted.index.map(lambda compound: truth[compound].ic50)
+        self.assertLess(np.median(np.abs(np.log10(fitted['IC50'] / expected))), 0.05)
+
+        for name in ('IC50', 'viability', 'plates', 'counts'):
+            self.assertTrue((self.tmp / 'out' / 'screen_output' / f'screen_screen_{name}.csv').exists())
+
+    def test_plates_by_directory_name(self):
+        maps, counts = [], {}
+        for number, name in enumerate(['barcode_a', 'barcode_b']):
+            df_map, df_cp, _ = screen_plate(self.rng, 96, first_compound=100 * number)
+            maps.append(df_map.assign(Plate=name))
+            counts[name] = df_cp
+        df_map = pd.concat(maps, ignore_index=True)
+
+        def fake_run_cellprofiler(image_dir, counts_file=None, output_dir=None):
+            return counts[Path(image_dir).name], None
+
+        image_dirs = [str(self.tmp / 'barcode_b'), str(self.tmp / 'barcode_a')]  # plate numbers follow this order
+        experiment = screen.ScreenExperiment('two', df_map, image_dir=image_dirs)
+        with patch.object(tb, 'run_cellprofiler', side_effect=fake_run_cellprofiler):
+            df_ic50 = experiment.ic50
+        self.assertEqual(experiment.plate_format, 96)
+        # Each plate holds 80 samples (eight compounds); every compound is normalized on its own plate
+        self.assertEqual(len(df_ic50), 16)
+        self.assertTrue(df_ic50['Converged'].all())
+        self.assertEqual(sorted(experiment.plates['Samples']), [80, 80])
+
+    def test_invalid_plate_maps(self):
+        df_map, _, _ = screen_plate(self.rng, 96)
+        with self.assertRaises(ValueError):
+            screen.read_plate_map(df_map.assign(Role=df_map['Role'].replace('positive', 'kill')))
+        with self.assertRaises(ValueError):
+            screen.read_plate_map(df_map[df_map['Role'] != 'vehicle'])
+        with self.assertRaises(ValueError):
+            screen.read_plate_map(pd.concat([df_map, df_map.head(1)]))
+        with self.assertRaises(ValueError):
+            screen.read_plate_map(df_map, plate_format=1536)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
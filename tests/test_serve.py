@@ -0,0 +1,132 @@
+"""
+Test the HTTP job service end to end on localhost.
+
+Jobs use pre-counted test files, so CellProfiler is never launched.
+"""
+
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+import zipfile
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import serve, workqueue
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+class TestJobService(unittest.TestCase):
+    """Test submitting, prioritizing, cancelling, polling and downloading jobs over HTTP."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue_dir = Path(self.tmpdir.name) / 'queue'
+        self.service = serve.JobService(self.queue_dir, workers=2, poll_interval=0.05,
+                                        allowed_roots=[TEST_DATA_DIR, '/tmp/dummy'])
+        self.server = serve.make_server(self.service, '127.0.0.1', 0)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.stop_workers(timeout=30)
+        self.tmpdir.cleanup()
+
+    def request(self, method, path, data=None):
+        """Send a request and return (status, body bytes)."""
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.url + path, data=body, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def submit(self, title, priority=5):
+        status, body = self.request('POST', '/jobs', {
+            'module': 'gda', 'dir': '/tmp/dummy', 'title': title, 'upper': 'Cell Line A', 'lower': 'Cell Line B',
+            'conc': 0.000001, 'dil': 3, 'counts': str(TEST_DATA_DIR / 'test_gda_counts.csv'), 'priority': priority,
+        })
+        self.assertEqual(status, 201, body)
+        return json.loads(body)['id']
+
+    def test_submit_poll_download(self):
+        overnight = self.submit('overnight', priority=1)
+        urgent = self.submit('urgent', priority=9)
+        cancelled = self.submit('cancelled')
+
+        # Urgent jobs are claimed ahead of earlier, lower priority jobs
+        pending = sorted(path.stem for path in (self.queue_dir / 'pending').glob('*.json'))
+        self.assertEqual(pending[0], urgent)
+
+        status, _ = self.request('DELETE', f'/jobs/{cancelled}')
+        self.assertEqual(status, 200)
+        status, _ = self.request('GET', f'/jobs/{overnight}/results')
+        self.assertEqual(status, 409)
+
+        self.service.start_workers()
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            states = {job['id']: job['state'] for job in json.loads(self.request('GET', '/jobs')[1])['jobs']}
+            if states[overnight] == 'done' and states[urgent] == 'done':
+                break
+            time.sleep(0.1)
+        self.assertEqual(states, {overnight: 'done', urgent: 'done', cancelled: 'failed'})
+
+        job = json.loads(self.request('GET', f'/jobs/{urgent}')[1])
+        self.assertEqual(job['result']['status'], 'success')
+        self.assertEqual(job['priority'], 9)
+
+        status, archive = self.request('GET', f'/jobs/{urgent}/results')
+        self.assertEqual(status, 200)
+        names = zipfile.ZipFile(io.BytesIO(archive)).namelist()
+        self.assertIn('urgent/gda_output/urgent_gda_Stats.csv', names)
+
+    def test_bad_requests(self):
+        status, body = self.request('POST', '/jobs', {'module': 'gda', 'dir': '/tmp/dummy', 'title': 'incomplete'})
+        self.assertEqual(status, 400)
+        self.assertIn('missing', json.loads(body)['error'])
+
+        status, _ = self.request('POST', '/jobs', {'module': 'simple', 'dir': '/tmp/dummy', 'title': '../escape'})
+        self.assertEqual(status, 400)
+        # Inputs must resolve inside the allowed roots, since their files end up in the results
+        for field, path in (('counts', '/etc/passwd'), ('counts', str(TEST_DATA_DIR / '..' / 'test_serve.py')),
+                            ('dir', '/tmp/dummy/../secret'), ('dir', 's3://bucket/plates')):
+            request = {'module': 'simple', 'dir': '/tmp/dummy', 'title': 'sneaky', field: path}
+            status, body = self.request('POST', '/jobs', request)
+            self.assertEqual(status, 400, path)
+            self.assertIn('outside', json.loads(body)['error'])
+
+        status, _ = self.request('GET', '/jobs/0-0000000000000-deadbeef')
+        self.assertEqual(status, 404)
+        status, _ = self.request('GET', '/nowhere')
+        self.assertEqual(status, 404)
+        self.assertEqual(workqueue.queue_status(self.queue_dir)['pending'], 0)
+
+    def test_url_outputs_not_archived(self):
+        service = serve.JobService(self.queue_dir, output_dir='s3://bucket/results', allowed_roots=[TEST_DATA_DIR])
+        job_id = service.submit({'module': 'simple', 'dir': str(TEST_DATA_DIR), 'title': 'plate'})
+        _, job = workqueue.find_job(self.queue_dir, job_id)
+        with self.assertRaisesRegex(ValueError, f's3://bucket/results/{job_id}/plate'):
+            service.results_archive(job)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
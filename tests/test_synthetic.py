@@ -0,0 +1,108 @@
+"""
+Test the synthetic plate generator: fitting recovers the true IC50s, Bliss scores recover the
+true interaction, the batch config runs, and rendered images hold exactly the written counts.
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import batch, synthetic
+from cellpyability.gda_analysis import GDAExperiment
+from cellpyability.synergy_analysis import SynergyExperiment
+
+
+class TestSynthetic(unittest.TestCase):
+    """Test synthetic counts against their known parameters."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_gda_ic50_recovery(self):
+        df_truth = synthetic.generate_plates(self.output_dir, n_plates=4, module='gda', seed=1, noise_cv=0.02)
+        df_config = pd.read_csv(self.output_dir / 'config.csv')
+        self.assertEqual(len(df_config), 4)
+
+        for row in df_config.itertuples():
+            counts = pd.read_csv(row.counts)
+            self.assertEqual(list(counts.columns), ['Count_nuclei', 'FileName_images', 'ImageNumber'])
+            self.assertEqual(len(counts), 60)
+
+            experiment = GDAExperiment(row.title, row.upper, row.lower, row.conc, row.dil, counts=counts)
+            truth = df_truth[df_truth['title'] == row.title].set_index('condition')['ic50']
+            for condition, ic50 in experiment.ic50.items():
+                # Within 25% of the true IC50 (about a quarter of one 3-fold dilution step)
+                self.assertAlmostEqual(np.log10(ic50), np.log10(truth[condition]), delta=np.log10(1.25))
+
+    def test_same_seed_same_plates(self):
+        synthetic.generate_plates(self.output_dir / 'a', module='simple', seed=7)
+        synthetic.generate_plates(self.output_dir / 'b', module='simple', seed=7)
+        counts_a = pd.read_csv(self.output_dir / 'a' / 'counts' / 'synthetic_simple_0001_counts.csv')
+        counts_b = pd.read_csv(self.output_dir / 'b' / 'counts' / 'synthetic_simple_0001_counts.csv')
+        pd.testing.assert_frame_equal(counts_a, counts_b)
+
+    def test_synergy_bliss_recovery(self):
+        x_curve = synthetic.Curve('Hill', (1.0, 1e-6, -1.0))
+        y_curve = synthetic.Curve('5PL', (1.0, 1.5, 1e-6, 0.1, 1.0))
+        counts = synthetic.synergy_plate(x_curve, y_curve, 0.0004, 4, 0.0001, 4, interaction=0.3, noise_cv=0.0,
+                                         rng=np.random.default_rng(0))
+        self.assertEqual(len(counts), 180)
+
+        experiment = SynergyExperiment('synthetic', 'Drug X', 0.0004, 4, 'Drug Y', 0.0001, 4, counts=counts)
+        x_viability = x_curve.viability(experiment.x_doses)
+        y_viability = y_curve.viability(experiment.y_doses)
+        expected = 0.3 * np.outer(y_viability, x_viability)
+        expected[0, :] = expected[:, 0] = 0
+        np.testing.assert_allclose(experiment.bliss_matrix.to_numpy(), expected, atol=0.01)
+
+    def test_edge_effect(self):
+        flat = synthetic.Curve('Hill', (1.0, 1.0, -1.0))  # IC50 far above the doses: near-vehicle counts
+        counts = synthetic.gda_plate(flat, flat, 1e-9, 3, noise_cv=0.0, edge_effect=0.5)
+        counts = counts.set_index(counts['FileName_images'].str.split('_').str[0])['Count_nuclei']
+        self.assertAlmostEqual(counts['B5'] / counts['C5'], 0.5, places=2)
+        self.assertAlmostEqual(counts['D11'] / counts['D10'], 0.5, places=2)
+
+    def test_batch_runs_generated_config(self):
+        synthetic.generate_plates(self.output_dir, n_plates=2, module='synergy', seed=3)
+        df_summary = batch.run_batch(self.output_dir / 'config.csv', jobs=1, output_dir=self.output_dir / 'out')
+        self.assertEqual(list(df_summary['status']), ['success', 'success'])
+
+    def test_rendered_images_match_counts(self):
+        synthetic.generate_plates(self.output_dir, module='gda', seed=5, vehicle_count=100, images=True,
+                                  image_size=128)
+        counts = pd.read_csv(self.output_dir / 'counts' / 'synthetic_gda_0001_counts.csv')
+        image_dir = self.output_dir / 'images' / 'synthetic_gda_0001'
+        self.assertEqual(len(list(image_dir.glob('*.tif'))), 60)
+
+        from PIL import Image
+        for row in counts.sample(10, random_state=0).itertuples():
+            image = np.asarray(Image.open(image_dir / row.FileName_images))
+            self.assertEqual(image.dtype, np.uint16)
+            self.assertEqual(ndimage.label(image > 1000)[1], row.Count_nuclei)
+
+        with self.assertRaises(ValueError):
+            synthetic.render_nuclei_image(10000, size=64)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
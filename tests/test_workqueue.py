@@ -0,0 +1,107 @@
+"""
+Test the shared-directory work queue with several local worker processes.
+
+Jobs use pre-counted test files, so CellProfiler is never launched.
+"""
+
+import json
+import multiprocessing
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from cellpyability import workqueue
+
+TEST_DATA_DIR = Path(__file__).parent / 'data'
+
+
+def make_experiment(title):
+    return {
+        'module': 'simple', 'title': title, 'image_dir': '/tmp/dummy',
+        'counts_file': str(TEST_DATA_DIR / 'test_gda_counts.csv'),
+    }
+
+
+def worker_process(queue_dir):
+    """Entry point of a worker process: run jobs until the queue is empty."""
+    import matplotlib
+    matplotlib.use('Agg')
+    workqueue.run_worker(queue_dir, poll_interval=0.05, exit_when_empty=True)
+
+
+class TestWorkQueue(unittest.TestCase):
+    """Test submission, atomic claiming by concurrent workers, and stale claim recovery."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue_dir = Path(self.tmpdir.name) / 'queue'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_workers_run_every_job_once(self):
+        titles = [f'plate{i}' for i in range(8)]
+        workqueue.submit_experiments(self.queue_dir, [make_experiment(title) for title in titles])
+
+        workers = [multiprocessing.Process(target=worker_process, args=(str(self.queue_dir),)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(worker.exitcode, 0)
+
+        self.assertEqual(workqueue.queue_status(self.queue_dir),
+                         {'pending': 0, 'claimed': 0, 'done': 8, 'failed': 0})
+        done = [json.loads(path.read_text()) for path in (self.queue_dir / 'done').glob('*.json')]
+        self.assertEqual(sorted(job['experiment']['title'] for job in done), titles)
+        self.assertTrue(all(job['result']['status'] == 'success' for job in done))
+        for title in titles:
+            matrix = self.queue_dir / 'results' / title / 'simple_output' / f'{title}_simple_CountMatrix.csv'
+            self.assertTrue(matrix.exists())
+
+    def test_submit_leaves_experiments_unchanged(self):
+        experiments = [make_experiment('local'), dict(make_experiment('remote'), image_dir='s3://bucket/plate',
+                                                      counts_file='counts.csv')]
+        originals = [dict(experiment) for experiment in experiments]
+        workqueue.submit_experiments(self.queue_dir, experiments)
+        self.assertEqual(experiments, originals)
+
+        queued = {job['experiment']['title']: job['experiment'] for _, job in workqueue.list_jobs(self.queue_dir)}
+        self.assertEqual(queued['remote']['image_dir'], 's3://bucket/plate')
+        self.assertEqual(queued['remote']['counts_file'], str(Path('counts.csv').resolve()))
+
+    def test_stale_claim_is_recovered(self):
+        workqueue.submit_experiments(self.queue_dir, [make_experiment('abandoned')])
+        job, claim_path = workqueue.claim_next_job(self.queue_dir, 'deadhost-1')
+        self.assertIsNotNone(job)
+
+        # A fresh claim is left alone
+        self.assertEqual(workqueue.recover_stale_claims(self.queue_dir, stale_timeout=60), [])
+
+        # A claim whose worker stopped heartbeating goes back to pending with one attempt recorded
+        time.sleep(0.05)
+        self.assertEqual(workqueue.recover_stale_claims(self.queue_dir, stale_timeout=0.01), [job['id']])
+        self.assertFalse(claim_path.exists())
+        pending = json.loads((self.queue_dir / 'pending' / f'{job["id"]}.json').read_text())
+        self.assertEqual(pending['attempts'], 1)
+
+    def test_job_abandoned_too_often_fails(self):
+        workqueue.submit_experiments(self.queue_dir, [make_experiment('cursed')])
+        job, _ = workqueue.claim_next_job(self.queue_dir, 'deadhost-1')
+        time.sleep(0.05)
+        workqueue.recover_stale_claims(self.queue_dir, stale_timeout=0.01, max_attempts=1)
+        self.assertEqual(workqueue.queue_status(self.queue_dir)['failed'], 1)
+
+
+def main():
+    """Run the tests."""
+    unittest.main(verbosity=2)
+
+
+if __name__ == '__main__':
+    main()
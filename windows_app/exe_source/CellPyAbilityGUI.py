@@ -1,3 +1,4 @@
+import multiprocessing
 import tkinter as tk
 from tkinter import messagebox
 from pathlib import Path
@@ -6,6 +7,7 @@ import sys
 import CellPyAbility_GDA_app
 import CellPyAbility_simple_app
 import CellPyAbility_synergy_app
+from CellPyAbility_jobs_app import JobList
 
 # Define temporary directory so logo can be accessed later
 if getattr(sys, 'frozen', False):
@@ -47,10 +49,10 @@ class ToolTip:
 
 def launch_gui():
     # Establish GUI window
-    global root
+    global root, jobs
     root = tk.Tk()
     root.title("CellPyAbility Analysis Menu")
-    root.geometry("500x700") # If it fits, it ships
+    root.geometry("500x800") # If it fits, it ships
 
     # Load logo bundled in application
     try:
@@ -81,35 +83,47 @@ def launch_gui():
     btn_simple.grid(row=0, column=2, padx=5, pady=5)
     ToolTip(btn_simple, "Raw nuclei count matrix")
 
-    btn_exit = tk.Button(root, text="Exit", command=root.quit)
-    ToolTip(btn_exit, "Close the program")
+    # Submitted analyses run in the background; the menu stays open to queue more plates
+    jobs = JobList(root)
+    jobs.pack(fill=tk.BOTH, expand=True, padx=10)
+
+    btn_exit = tk.Button(root, text="Exit", command=exit_gui)
+    ToolTip(btn_exit, "Close the program (cancels unfinished jobs)")
     btn_exit.pack(pady=10)
+    root.protocol("WM_DELETE_WINDOW", exit_gui)
 
     root.mainloop()
 
-# Runs script based on user input from GUI
+# Opens the input GUI of the selected script and queues its analysis as a background job
 def run_script(script_number):
-    global root
-    root.destroy() # Close window after choosing script
-    
+    global root, jobs
+
     if script_number == 1:
-        CellPyAbility_GDA_app.run()
+        module, gui_inputs = 'GDA', CellPyAbility_GDA_app.gda_gui(parent=root)
     elif script_number == 2:
-        CellPyAbility_synergy_app.run()
+        module, gui_inputs = 'synergy', CellPyAbility_synergy_app.synergy_gui(parent=root)
     elif script_number == 3:
-        CellPyAbility_simple_app.run()
+        module, gui_inputs = 'simple', CellPyAbility_simple_app.simple_gui(parent=root)
     else:
         print("Invalid script selection.") # Vestigial given the GUI but will leave it for now
-    
-    # Ask user if they wish to perform an additonal analysis
-    temp_root = tk.Tk()
-    temp_root.withdraw()
-    response = messagebox.askyesno("Would you like to perform another analysis?")
-    temp_root.destroy()
-
-    if response:
-        launch_gui() # If yes, re-launch GUI
-    else:
-        sys.exit() # Else, exit application
-    
-launch_gui()
\ No newline at end of file
+        return
+
+    # Closing the input window without submitting queues nothing
+    if gui_inputs:
+        jobs.submit(module, gui_inputs)
+
+# Asks before cancelling unfinished jobs, then closes the application
+def exit_gui():
+    global root, jobs
+    if jobs.busy and not messagebox.askyesno(
+        "Exit CellPyAbility", "Analyses are still queued or running. Cancel them and exit?"
+    ):
+        return
+    jobs.shutdown()
+    root.destroy()
+    sys.exit() # Exit application
+
+if __name__ == '__main__':
+    # Required for worker processes in the bundled .exe
+    multiprocessing.freeze_support()
+    launch_gui()
@@ -8,66 +8,70 @@ import tkinter as tk
 from tkinter import filedialog, ttk
 
 import CellPyAbility_toolbox_app as tb
+import matplotlib
+matplotlib.use('Agg')  # Plots are only saved, from worker processes without a window
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from scipy.optimize import curve_fit
 from scipy.optimize import root as scipy_root
 
-def run():
-    # Initialize toolbox
-    logger, base_dir = tb.logger, tb.base_dir
-
-    # Establish the GUI for experiment info
-    def gda_gui():
-        image_dir = ''
-        def select_image_dir():
-            nonlocal image_dir
-            image_dir = filedialog.askdirectory()
-
-        # Create main window
-        root = tk.Tk()
-        root.title('GDA input')
-
-        # Create entry fields for inputs
-        entries = {}
-        fields = [
-            ('title_name', 'Enter the title of the experiment:'),
-            ('upper_name', 'Enter the name for the upper cell condition (rows B-D):'),
-            ('lower_name', 'Enter the name for the lower cell condition (rows E-G):'),
-            ('top_conc', 'Enter the top concentration of drug used (column 11):'),
-            ('dilution', 'Enter the drug dilution factor (x-fold):'),
-        ]
-        for key, text in fields:
-            ttk.Label(root, text=text).pack()
-            entry = ttk.Entry(root)
-            entry.pack()
-            entries[key] = entry
-
-        # Adds button for image directory file select
-        image_dir_button = ttk.Button(root, text='Select Image Directory', command=select_image_dir)
-        image_dir_button.pack()
-
-        # This dictionary will hold the result
-        gui_inputs = {}
-
-        # Callback function to use when the form is submitted
-        def submit():
-            for key, entry in entries.items():
-                gui_inputs[key] = entry.get()
-            gui_inputs['image_dir'] = image_dir
-            root.destroy()
-
-        # Create button to submit form
-        submit_button = ttk.Button(root, text='Submit', command=submit)
-        submit_button.pack()
-
+# Establish the GUI for experiment info
+def gda_gui(parent=None):
+    image_dir = ''
+    def select_image_dir():
+        nonlocal image_dir
+        image_dir = filedialog.askdirectory(parent=root)
+
+    # Create main window (a dialog over the menu when launched from it)
+    root = tk.Toplevel(parent) if parent else tk.Tk()
+    root.title('GDA input')
+
+    # Create entry fields for inputs
+    entries = {}
+    fields = [
+        ('title_name', 'Enter the title of the experiment:'),
+        ('upper_name', 'Enter the name for the upper cell condition (rows B-D):'),
+        ('lower_name', 'Enter the name for the lower cell condition (rows E-G):'),
+        ('top_conc', 'Enter the top concentration of drug used (column 11):'),
+        ('dilution', 'Enter the drug dilution factor (x-fold):'),
+    ]
+    for key, text in fields:
+        ttk.Label(root, text=text).pack()
+        entry = ttk.Entry(root)
+        entry.pack()
+        entries[key] = entry
+
+    # Adds button for image directory file select
+    image_dir_button = ttk.Button(root, text='Select Image Directory', command=select_image_dir)
+    image_dir_button.pack()
+
+    # This dictionary will hold the result
+    gui_inputs = {}
+
+    # Callback function to use when the form is submitted
+    def submit():
+        for key, entry in entries.items():
+            gui_inputs[key] = entry.get()
+        gui_inputs['image_dir'] = image_dir
+        root.destroy()
+
+    # Create button to submit form
+    submit_button = ttk.Button(root, text='Submit', command=submit)
+    submit_button.pack()
+
+    if parent:
+        root.grab_set()
+        parent.wait_window(root)
+    else:
         root.mainloop()
-        logger.debug('GUI submitted.')
-        return gui_inputs
+    tb.logger.debug('GUI submitted.')
+    return gui_inputs
 
-    # Assign the gda_gui output to script variable
-    gui_inputs = gda_gui()
+# Runs the analysis for submitted GUI inputs; the job list runs this in a worker process
+def analyze(gui_inputs, progress=tb.no_progress, cancel=None, cp_output_dir=None):
+    # Initialize toolbox
+    logger, base_dir = tb.logger, tb.base_dir
 
     # Assign GUI inputs to script variables
     title_name = gui_inputs['title_name']
@@ -81,7 +85,9 @@ def run():
     doses = tb.dose_range_x(top_conc, dilution)
 
     # Run CellProfiler headless and return a DataFrame with the raw nuclei counts and the .csv path
-    df_cp, cp_csv = tb.run_cellprofiler(image_dir)
+    progress(0.05, 'Counting nuclei')
+    df_cp, cp_csv = tb.run_cellprofiler(image_dir, cp_output_dir, cancel)
+    progress(0.8, 'Analyzing')
 
     # Load the CellProfiler counts into a DataFrame
     df_cp.drop('ImageNumber', axis=1, inplace=True)
@@ -174,6 +180,7 @@ def run():
     logger.debug('Assigned doses and normalized means to x and y values via NumPy, respectively.')
 
     # Define non-linear regression for the xy-plot and estimate IC50s
+    progress(0.85, 'Fitting curves')
     # Define the 5PL function
     def fivePL(x, A, B, C, D, G):  # (x = doses, A = max y, B = Hill slope, C = inflection, D = min y, G = asymetry):
         return ((A - D) / (1.0 + (x / C) ** B) ** G) + D
@@ -321,6 +328,7 @@ def run():
     logger.info(f'{upper_name} IC50 / {lower_name} IC50 = {IC50_ratio}')
 
     # Plot the curves if 5PL fit, otherwise connecting points by line
+    progress(0.95, 'Plotting')
     plt.plot(x_plot_5PL_y1, y_plot_5PL_y1, 'b-')
     plt.plot(x_plot_5PL_y2, y_plot_5PL_y2, 'r-')
     logger.debug('Plotted data.')
@@ -366,5 +374,11 @@ def run():
     tb.rename_counts(cp_csv, counts_csv)
     logger.info(f'{title_name} raw counts saved to GDA_output.')
 
+def run():
+    # Assign the gda_gui output to script variable; closing the window skips the analysis
+    gui_inputs = gda_gui()
+    if gui_inputs:
+        analyze(gui_inputs)
+
 if __name__ == '__main__':
     run()
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+CellPyAbility_jobs_app.py runs analyses as background jobs so the GUI stays responsive while plates are counted.
+This script should remain in the same directory as the other CellPyAbility scripts.
+For more information, please see the README at https://github.com/bindralab/CellPyAbility.
+"""
+
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import time
+import tkinter as tk
+from tkinter import ttk
+
+import CellPyAbility_toolbox_app as tb
+
+# Jobs counting at the same time (each runs its own CellProfiler); later jobs wait in the queue
+MAX_WORKERS = 2
+
+# Seconds a cancelled job gets to stop CellProfiler and clean up before its worker is terminated
+CANCEL_GRACE = 5
+
+# How often (ms) the GUI checks the workers for progress
+POLL_MS = 200
+
+# Module names in the GUI and the scripts that analyze them
+MODULES = {
+    'GDA': 'CellPyAbility_GDA_app',
+    'synergy': 'CellPyAbility_synergy_app',
+    'simple': 'CellPyAbility_simple_app',
+}
+
+# Runs one job in a worker process and reports (job_id, state, fraction, message) to the GUI
+# state is 'running' until the last message, which is 'done', 'failed' or 'cancelled'
+def run_job(job_id, module, gui_inputs, events, cancel):
+    def progress(fraction, message):
+        if cancel.is_set():
+            raise tb.JobCancelled()
+        events.put((job_id, 'running', fraction, message))
+
+    # Each job counts into its own folder so concurrent CellProfiler runs do not collide
+    cp_output_dir = tb.base_dir / 'cp_output' / f'job_{os.getpid()}_{job_id}'
+    try:
+        app = importlib.import_module(MODULES[module])
+        app.analyze(gui_inputs, progress=progress, cancel=cancel, cp_output_dir=cp_output_dir)
+    except tb.JobCancelled:
+        events.put((job_id, 'cancelled', None, 'Cancelled'))
+    except BaseException as e:
+        # The toolbox exits on critical errors, so SystemExit is a failure too; details are in the log
+        tb.logger.exception(f'Job {job_id} ({module}) failed.')
+        message = 'see log.log' if isinstance(e, SystemExit) else (str(e) or type(e).__name__)
+        events.put((job_id, 'failed', None, message))
+    else:
+        events.put((job_id, 'done', 1.0, 'Done'))
+    finally:
+        tb.remove_job_output(cp_output_dir)
+
+class Job:
+    def __init__(self, job_id, module, gui_inputs):
+        self.id = job_id
+        self.module = module
+        self.gui_inputs = gui_inputs
+        self.title = gui_inputs.get('title_name', gui_inputs.get('title', ''))
+        self.status = 'Queued'
+        self.fraction = None
+        self.process = None
+        self.cancel = None
+        self.cancelled_at = None
+
+# Job list for the main window: queues submitted analyses, runs up to max_workers of them in
+# worker processes, and shows each job's status and progress with a button to cancel jobs
+class JobList(ttk.Frame):
+    def __init__(self, parent, max_workers=MAX_WORKERS):
+        super().__init__(parent)
+        self.max_workers = max_workers
+        # Spawned workers start clean rather than forking the tkinter process
+        self.context = mp.get_context('spawn')
+        self.events = self.context.Queue()
+        self.jobs = {}
+        self.pending = []
+        self.running = {}
+
+        columns = [('module', 'Module', 70), ('title', 'Title', 150), ('status', 'Status', 160), ('progress', 'Progress', 70)]
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show='headings', height=8)
+        for key, heading, width in columns:
+            self.tree.heading(key, text=heading)
+            self.tree.column(key, width=width, anchor=tk.W)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Button(self, text='Cancel selected', command=self.cancel_selected).pack(pady=5)
+        self.after(POLL_MS, self.poll)
+
+    @property
+    def busy(self):
+        return bool(self.pending or self.running)
+
+    def submit(self, module, gui_inputs):
+        job = Job(len(self.jobs) + 1, module, gui_inputs)
+        self.jobs[job.id] = job
+        self.pending.append(job)
+        self.tree.insert('', tk.END, iid=str(job.id))
+        self.show(job, 'Queued')
+        tb.logger.info(f'Job {job.id} ({module}, {job.title}) queued.')
+        self.start_pending()
+
+    # Starts queued jobs while worker slots are free
+    def start_pending(self):
+        while self.pending and len(self.running) < self.max_workers:
+            job = self.pending.pop(0)
+            job.cancel = self.context.Event()
+            job.process = self.context.Process(
+                target=run_job,
+                args=(job.id, job.module, job.gui_inputs, self.events, job.cancel),
+                daemon=True,
+            )
+            job.process.start()
+            self.running[job.id] = job
+            self.show(job, 'Starting', 0.0)
+
+    def show(self, job, status, fraction=None):
+        job.status = status
+        if fraction is not None:
+            job.fraction = fraction
+        progress = '' if job.fraction is None else f'{job.fraction:.0%}'
+        self.tree.item(str(job.id), values=(job.module, job.title, status, progress))
+
+    def finish(self, job, status, fraction=None):
+        self.running.pop(job.id, None)
+        job.process.join(timeout=1)
+        self.show(job, status, fraction)
+        tb.logger.info(f'Job {job.id} ({job.module}, {job.title}): {status}')
+        self.start_pending()
+
+    # Applies worker messages and frees the slots of workers that exited
+    def poll(self):
+        # Workers found dead before the queue is drained have already sent everything they will send
+        exited = [job for job in self.running.values() if not job.process.is_alive()]
+        while True:
+            try:
+                job_id, state, fraction, message = self.events.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs[job_id]
+            if job_id not in self.running:
+                continue
+            if state == 'running':
+                if not job.cancelled_at:
+                    self.show(job, message, fraction)
+            elif state == 'failed':
+                self.finish(job, f'Failed: {message}')
+            else:
+                self.finish(job, message, fraction)
+
+        for job in exited:
+            if job.id in self.running:
+                if job.cancelled_at:
+                    self.finish(job, 'Cancelled')
+                else:
+                    self.finish(job, f'Failed: worker exited with code {job.process.exitcode}')
+
+        # Terminate workers that did not stop within the grace period after cancelling
+        for job in self.running.values():
+            if job.cancelled_at and time.monotonic() - job.cancelled_at > CANCEL_GRACE:
+                job.process.terminate()
+
+        self.after(POLL_MS, self.poll)
+
+    def cancel(self, job):
+        if job in self.pending:
+            self.pending.remove(job)
+            self.show(job, 'Cancelled')
+            tb.logger.info(f'Job {job.id} ({job.module}, {job.title}) cancelled before it started.')
+        elif job.id in self.running and not job.cancelled_at:
+            job.cancel.set()
+            job.cancelled_at = time.monotonic()
+            self.show(job, 'Cancelling ...')
+
+    def cancel_selected(self):
+        for iid in self.tree.selection():
+            self.cancel(self.jobs[int(iid)])
+
+    # Cancels every job and waits for the workers to stop, e.g. when the application closes
+    def shutdown(self):
+        for job in list(self.pending) + list(self.running.values()):
+            self.cancel(job)
+        for job in list(self.running.values()):
+            job.process.join(timeout=CANCEL_GRACE)
+            if job.process.is_alive():
+                job.process.terminate()
+                job.process.join()
@@ -3,40 +3,47 @@ from tkinter import filedialog, ttk
 
 import CellPyAbility_toolbox_app as tb
 
-def run():
-    # Initialize toolbox
-    logger, base_dir = tb.logger, tb.base_dir
+# Establish the GUI for experiment info
+def simple_gui(parent=None):
+    # Create main window (a dialog over the menu when launched from it)
+    root = tk.Toplevel(parent) if parent else tk.Tk()
+    root.title('simple input')
 
-    # Establish the GUI for experiment info
-    def simple_gui():
-        root = tk.Tk()
-        root.title('GDA input')
+    ttk.Label(root, text='Experiment title:').pack()
+    title_entry = ttk.Entry(root); title_entry.pack()
 
-        ttk.Label(root, text='Experiment title:').pack()
-        title_entry = ttk.Entry(root); title_entry.pack()
+    image_dir = ''
+    def select_dir(): 
+        nonlocal image_dir
+        image_dir = filedialog.askdirectory(parent=root)
+    ttk.Button(root, text='Select images…', command=select_dir).pack()
 
-        image_dir = ''
-        def select_dir(): 
-            nonlocal image_dir
-            image_dir = filedialog.askdirectory()
-        ttk.Button(root, text='Select images…', command=select_dir).pack()
-
-        inputs = {}
-        def on_submit():
-            inputs['title'] = title_entry.get()
-            inputs['image_dir'] = image_dir
-            root.destroy()
-        ttk.Button(root, text='Submit', command=on_submit).pack()
+    inputs = {}
+    def on_submit():
+        inputs['title'] = title_entry.get()
+        inputs['image_dir'] = image_dir
+        root.destroy()
+    ttk.Button(root, text='Submit', command=on_submit).pack()
+    if parent:
+        root.grab_set()
+        parent.wait_window(root)
+    else:
         root.mainloop()
-        return inputs
+    return inputs
 
-    # Run the GUI and assign inputs to variables
-    gui = simple_gui()
+# Runs the analysis for submitted GUI inputs; the job list runs this in a worker process
+def analyze(gui, progress=tb.no_progress, cancel=None, cp_output_dir=None):
+    # Initialize toolbox
+    logger, base_dir = tb.logger, tb.base_dir
+
+    # Assign GUI inputs to variables
     title = gui['title']
     imgdir = gui['image_dir']
 
     # Run CellProfiler via the command line
-    df_cp, cp_csv = tb.run_cellprofiler(imgdir)
+    progress(0.05, 'Counting nuclei')
+    df_cp, cp_csv = tb.run_cellprofiler(imgdir, cp_output_dir, cancel)
+    progress(0.8, 'Building count matrix')
     df_cp.drop(columns='ImageNumber', inplace=True)
     df_cp.columns = ['nuclei','well']
 
@@ -61,5 +68,11 @@ def run():
     count_matrix.to_csv(outdir / f'{title}_simple_CountMatrix.csv')
     logger.info(f"Saved count matrix for '{title}' to {outdir}")
 
+def run():
+    # Run the GUI; closing the window skips the analysis
+    gui = simple_gui()
+    if gui:
+        analyze(gui)
+
 if __name__ == '__main__':
     run()
\ No newline at end of file
@@ -12,62 +12,64 @@ import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
-def run():
-    # Initialize toolbox
-    logger, base_dir = tb.logger, tb.base_dir
-
-    # Establish the GUI for experiment info
-    def synergy_gui():
-        image_dir = ''
-        def select_image_dir():
-            nonlocal image_dir
-            image_dir = filedialog.askdirectory()
-
-        # Create main window
-        root = tk.Tk()
-        root.title('synergy input')
-
-        # Create entry fields for inputs
-        entries = {}
-        fields = [
-            ('title_name', 'Enter the title of the experiment:'),
-            ('x_drug', 'Enter the drug name for the horizontal gradient:'),
-            ('x_top_conc', 'Enter the horizontal top concentration (M):'),
-            ('x_dilution', 'Enter the horizontal dilution factor (x-fold):'),
-            ('y_drug', 'Enter the drug name for the vertical gradient:'),
-            ('y_top_conc', 'Enter the vertical top concentration (M):'),
-            ('y_dilution', 'Enter the vertical dilution factor (x-fold):'),
-        ]
-        for key, text in fields:
-            ttk.Label(root, text=text).pack()
-            entry = ttk.Entry(root)
-            entry.pack()
-            entries[key] = entry
-
-        # Adds button for image directory file select
-        image_dir_button = ttk.Button(root, text='Select Image Directory', command=select_image_dir)
-        image_dir_button.pack()
-
-        # This dictionary will hold the result
-        gui_inputs = {}
-
-        # Callback function to use when the form is submitted
-        def submit():
-            for key, entry in entries.items():
-                gui_inputs[key] = entry.get()
-            gui_inputs['image_dir'] = image_dir
-            root.destroy()
-
-        # Create button to submit form
-        submit_button = ttk.Button(root, text='Submit', command=submit)
-        submit_button.pack()
-
+# Establish the GUI for experiment info
+def synergy_gui(parent=None):
+    image_dir = ''
+    def select_image_dir():
+        nonlocal image_dir
+        image_dir = filedialog.askdirectory(parent=root)
+
+    # Create main window (a dialog over the menu when launched from it)
+    root = tk.Toplevel(parent) if parent else tk.Tk()
+    root.title('synergy input')
+
+    # Create entry fields for inputs
+    entries = {}
+    fields = [
+        ('title_name', 'Enter the title of the experiment:'),
+        ('x_drug', 'Enter the drug name for the horizontal gradient:'),
+        ('x_top_conc', 'Enter the horizontal top concentration (M):'),
+        ('x_dilution', 'Enter the horizontal dilution factor (x-fold):'),
+        ('y_drug', 'Enter the drug name for the vertical gradient:'),
+        ('y_top_conc', 'Enter the vertical top concentration (M):'),
+        ('y_dilution', 'Enter the vertical dilution factor (x-fold):'),
+    ]
+    for key, text in fields:
+        ttk.Label(root, text=text).pack()
+        entry = ttk.Entry(root)
+        entry.pack()
+        entries[key] = entry
+
+    # Adds button for image directory file select
+    image_dir_button = ttk.Button(root, text='Select Image Directory', command=select_image_dir)
+    image_dir_button.pack()
+
+    # This dictionary will hold the result
+    gui_inputs = {}
+
+    # Callback function to use when the form is submitted
+    def submit():
+        for key, entry in entries.items():
+            gui_inputs[key] = entry.get()
+        gui_inputs['image_dir'] = image_dir
+        root.destroy()
+
+    # Create button to submit form
+    submit_button = ttk.Button(root, text='Submit', command=submit)
+    submit_button.pack()
+
+    if parent:
+        root.grab_set()
+        parent.wait_window(root)
+    else:
         root.mainloop()
-        logger.debug('GUI submitted.')
-        return gui_inputs
+    tb.logger.debug('GUI submitted.')
+    return gui_inputs
 
-    # Assign the synergy_gui output to script variable
-    gui_inputs = synergy_gui()
+# Runs the analysis for submitted GUI inputs; the job list runs this in a worker process
+def analyze(gui_inputs, progress=tb.no_progress, cancel=None, cp_output_dir=None):
+    # Initialize toolbox
+    logger, base_dir = tb.logger, tb.base_dir
 
     # Assign GUI inputs to script variables
     title_name = gui_inputs['title_name']
@@ -87,7 +89,9 @@ def run():
     logger.debug('y_doses gradient calculated.')
 
     # Run CellProfiler headless and return a DataFrame with the raw nuclei counts and the .csv path
-    df_cp, cp_csv = tb.run_cellprofiler(image_dir)
+    progress(0.05, 'Counting nuclei')
+    df_cp, cp_csv = tb.run_cellprofiler(image_dir, cp_output_dir, cancel)
+    progress(0.8, 'Analyzing')
 
     # Load the CellProfiler counts into a DataFrame and rename wells
     df_cp.drop('ImageNumber', axis=1, inplace=True)
@@ -155,6 +159,7 @@ def run():
     logger.info(f'{title_name} synergy stats saved to synergy_output')
 
     # Initialize a list to store Bliss independence results
+    progress(0.85, 'Scoring Bliss independence')
     bliss_results = []
 
     # Pull viability values from df_stats to calculate Bliss Independence
@@ -228,6 +233,7 @@ def run():
     logger.debug('Replaced zero with non-zero values a fixed log distance from the minimum concentrations.')
 
     # Create the 3D surface plot
+    progress(0.95, 'Plotting')
     fig = go.Figure(data=[go.Surface(z=cell_survival, x=x_values, y=y_values, surfacecolor=bliss_independence, colorscale='jet_r', cmin=-0.3, cmax=0.3, colorbar=dict(title='Bliss Independence'))])
     logger.debug('3D surface plot created.')
 
@@ -245,5 +251,11 @@ def run():
     fig.write_html(synergy_output_dir / f'{title_name}_synergy_plot.html')
     logger.info(f'{title_name} synergy plot saved to synergy_output.')
 
+def run():
+    # Assign the synergy_gui output to script variable; closing the window skips the analysis
+    gui_inputs = synergy_gui()
+    if gui_inputs:
+        analyze(gui_inputs)
+
 if __name__ == '__main__':
     run()
\ No newline at end of file
@@ -6,6 +6,7 @@ For more information, please see the README at https://github.com/bindralab/Cell
 
 import logging
 import os
+import shutil
 import subprocess
 import sys
 import tkinter as tk
@@ -170,28 +171,49 @@ def dose_range_y(dose_max, dilution):
     logger.debug('Concentration gradient array created.')
     return dose_array
 
+# Raised in a background job once the user cancels it
+class JobCancelled(Exception):
+    pass
+
+# Progress callback for analyses run outside the job list: (fraction done, status message)
+def no_progress(fraction, message):
+    pass
+
 # Runs CellProfiler from the command line with the path to the image directory as a parameter
 # When ready to run, write 'df_cp = run_cellprofiler()'
-def run_cellprofiler(image_dir):
+# Background jobs pass their own cp_output_dir, so concurrent runs do not overwrite each other's
+# CellPyAbilityImage.csv, and a multiprocessing.Event as cancel to stop CellProfiler mid-run
+def run_cellprofiler(image_dir, cp_output_dir=None, cancel=None):
     ## Define the path to the pipeline (.cppipe)
     cppipe_path = Path(sys._MEIPASS) / 'CellPyAbility.cppipe'
 
     ## Define the folder where CellProfiler will output the .csv results
-    cp_output_dir = base_dir / 'cp_output'
-    cp_output_dir.mkdir(exist_ok=True)
-    logger.debug('CellPyAbility/cp_output/ identified or created and identified.')
+    if cp_output_dir is None:
+        cp_output_dir = base_dir / 'cp_output'
+    cp_output_dir.mkdir(parents=True, exist_ok=True)
+    logger.debug(f'{cp_output_dir} identified or created and identified.')
 
     # Run CellProfiler from the command line
     logger.debug('Starting CellProfiler from command line ...')
-    subprocess.run([cp_path, '-c', '-r', '-p', cppipe_path, '-i', image_dir, '-o', cp_output_dir])
+    process = subprocess.Popen([cp_path, '-c', '-r', '-p', cppipe_path, '-i', image_dir, '-o', cp_output_dir])
+    while True:
+        try:
+            process.wait(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                process.kill()
+                process.wait()
+                logger.info(f'CellProfiler run on {image_dir} cancelled.')
+                raise JobCancelled()
     logger.info('CellProfiler nuclei counting complete.')
 
     # Define the path to the CellProfiler counting output
     cp_csv = cp_output_dir / 'CellPyAbilityImage.csv'
     if cp_csv.exists():
-        logger.debug('CellPyAbilityImage.csv exists in /cp_output/ ...')
+        logger.debug(f'CellPyAbilityImage.csv exists in {cp_output_dir} ...')
     else:
-        logger.critical('CellProfiler output CellPyAbilityImage.csv does not exist in /cp_output/')
+        logger.critical(f'CellProfiler output CellPyAbilityImage.csv does not exist in {cp_output_dir}')
         logger.info('If CellPyAbility.cppipe is modified, make sure the output is still named CellPyAbilityImage.csv')
         exit(1)
 
@@ -200,6 +222,11 @@ def run_cellprofiler(image_dir):
     
     return df_cp, cp_csv
 
+# Removes a background job's CellProfiler output folder once its counts are saved or it is cancelled
+def remove_job_output(cp_output_dir):
+    shutil.rmtree(cp_output_dir, ignore_errors=True)
+    logger.debug(f'{cp_output_dir} removed.')
+
 # Names of the inner 60 wells of a 96-well plate
 wells = [
     'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B9', 'B10', 'B11',